@@ -0,0 +1,68 @@
+# Файл: C:\desk_top\bench_crypto.py
+"""
+Микробенчмарк шифрования колонок: StringEncryptedType (AES-CBC, прежний тип) против
+AesGcmEncryptedType. Меряет bind (шифрование) и result (расшифровка) на типичных размерах
+значений: системный промпт, средняя и длинная история сессии.
+
+Запуск: python bench_crypto.py [--rounds N]
+"""
+
+import argparse
+import json
+import sys
+import timeit
+from pathlib import Path
+
+root_dir = Path(__file__).parent
+sys.path.append(str(root_dir))
+
+from sqlalchemy import Text
+from sqlalchemy.dialects import postgresql
+from sqlalchemy_utils import StringEncryptedType
+
+from src.db.crypto import AesGcmEncryptedType, Keyring
+
+KEY = "bench-key"
+SIZES = {"1KB": 1_000, "16KB": 16_000, "256KB": 256_000}
+
+
+def _payload(size: int) -> str:
+    msg = {"role": "user", "content": "Пример сообщения истории с кириллицей и code `x = 1`. "}
+    history = []
+    while len(json.dumps(history, ensure_ascii=False)) < size:
+        history.append(msg)
+    return json.dumps(history, ensure_ascii=False)
+
+
+def _bench(fn, rounds: int) -> float:
+    """Микросекунды на вызов (лучший из 5 повторов)."""
+    return min(timeit.repeat(fn, number=rounds, repeat=5)) / rounds * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Encrypted column type micro-benchmark")
+    parser.add_argument("--rounds", type=int, default=2000)
+    args = parser.parse_args()
+
+    dialect = postgresql.dialect()
+    legacy = StringEncryptedType(Text, KEY)
+    gcm = AesGcmEncryptedType(keyring=Keyring(KEY))
+
+    print(f"{'size':>6} | {'op':>7} | {'CBC us':>9} | {'GCM us':>9} | speedup")
+    for label, size in SIZES.items():
+        value = _payload(size)
+        rounds = max(10, args.rounds * 1_000 // size)
+        legacy_ct = legacy.process_bind_param(value, dialect)
+        gcm_ct = gcm.process_bind_param(value, dialect)
+        assert legacy.process_result_value(legacy_ct, dialect) == value
+        assert gcm.process_result_value(gcm_ct, dialect) == value
+        for op, cbc_fn, gcm_fn in (
+            ("encrypt", lambda: legacy.process_bind_param(value, dialect), lambda: gcm.process_bind_param(value, dialect)),
+            ("decrypt", lambda: legacy.process_result_value(legacy_ct, dialect), lambda: gcm.process_result_value(gcm_ct, dialect)),
+        ):
+            cbc_us, gcm_us = _bench(cbc_fn, rounds), _bench(gcm_fn, rounds)
+            print(f"{label:>6} | {op:>7} | {cbc_us:9.1f} | {gcm_us:9.1f} | x{cbc_us / gcm_us:.2f}")
+
+
+if __name__ == "__main__":
+    main()
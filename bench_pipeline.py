@@ -0,0 +1,690 @@
+# Файл: C:\desk_top\bench_pipeline.py
+"""
+Офлайн-бенчмарк конвейера текстового сообщения: handle_text_message целиком (квота, активная
+сессия с хвостом истории, prompt builder, RAG, стрим LLM, учёт usage, дозапись истории)
+на имитированных пользователях. Внешние сервисы заменены детерминированными:
+  - OpenAI: стрим ответа с настраиваемыми TTFT и задержкой на токен, эмбеддинги — хэш слов;
+  - Pinecone: векторный индекс в памяти (косинусная близость, фильтры user_id/project_id);
+  - Telegram: Bot/Message с настраиваемой задержкой ответа и редактирования.
+
+БД:
+  --db memory   (по умолчанию) репозитории в памяти с настоящими кодеком истории и шифрованием
+                колонки. Число SQL-выражений здесь синтетическое: каждый метод объявляет,
+                сколько выражений выполнил бы настоящий репозиторий (с --db-ms каждое «стоит»
+                задержку), поэтому новый запрос в настоящем репозитории этот режим не заметит.
+                SQLite вместо Postgres не подходит: в ходе выполняются Postgres-only выражения
+                (upsert через pg_insert в UsageRepository.record);
+  --db postgres настоящие репозитории на DATABASE_URL (нужен ENCRYPTION_KEY), выражения считает
+                instrument_engine — единственный режим, где число запросов к БД проверяемо. Пользователи бенчмарка — telegram_id от BENCH_USER_BASE,
+                после прогона их данные удаляются.
+
+Для каждой пары (длина истории, число одновременных пользователей) печатает p50/p95/p99
+латентности хода, ходов/с, SQL-выражений на ход и время стадий (metrics.STAGE_SECONDS) на ход.
+--json сохраняет результаты; --baseline сравнивает с сохранёнными и завершается с кодом 1
+при регрессии: латентность/пропускная способность хуже допуска или (только если оба прогона
+--db postgres) больше запросов к БД на ход.
+
+Запуск: python bench_pipeline.py [--db memory|postgres] [--history 0,200,2000] [--concurrency 1,8,32]
+        [--turns N] [--ttft-ms N] [--token-ms N] [--json out.json] [--baseline base.json]
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import math
+import random
+import sys
+import time
+import zlib
+from contextlib import asynccontextmanager, contextmanager
+from pathlib import Path
+from types import SimpleNamespace
+
+root_dir = Path(__file__).parent
+sys.path.append(str(root_dir))
+
+from src.config import (
+    LLM_BUDGET_RAG_TOKENS, RAG_MAX_CANDIDATES, RAG_MIN_TOP_K, RAG_CHUNK_NEIGHBORS, RAG_EMBEDDING_TIMEOUT_SECONDS,
+)
+from src.db.crypto import Keyring
+from src.handlers import session as session_handler
+from src.services import metrics
+from src.services import prompt_builder as prompt_builder_module
+from src.services.budget import BudgetAllocator
+from src.services.chunking import chunk_vector_id
+from src.services.history_codec import append_history, decode_history, encode_history
+from src.services.llm_client import LLMClient
+from src.services.model_router import MODEL_REGISTRY, ModelRouter
+from src.services.rag_client import RAGClient
+from src.services.retrieval_cache import RetrievalCache
+
+BENCH_USER_BASE = 9_000_000_000
+EMBEDDING_DIM = 256
+ERROR_TEXT = "Произошла непредвиденная ошибка."
+SYSTEM_PROMPT = "Ты — опытный инженер. Отвечай по делу, с примерами кода, кратко и без воды."
+VOCABULARY = (
+    "деплой сервис конфиг реплики образ лимиты память процессор очередь воркер кэш индекс запрос "
+    "миграция схема таблица транзакция блокировка ретрай таймаут латентность метрики логи алерт "
+    "kubernetes postgres redis pinecone openai aiogram asyncio sqlalchemy docker nginx webhook "
+    "пользователь проект режим сессия история итоги бюджет токены модель ответ ошибка релиз"
+).split()
+STAGES = ("db", "embedding", "vector_query", "vector_fetch", "llm_ttft", "llm_total", "telegram_edit")
+
+
+def _text(rng: random.Random, words: int) -> str:
+    return " ".join(rng.choice(VOCABULARY) for _ in range(words))
+
+
+def _history(rng: random.Random, n: int) -> list[dict]:
+    return [
+        {"role": "user", "content": _text(rng, 25)} if i % 2 == 0 else {"role": "assistant", "content": _text(rng, 120)}
+        for i in range(n)
+    ]
+
+
+def _embed(text: str) -> list[float]:
+    """Детерминированный эмбеддинг: мешок слов, захэшированный в EMBEDDING_DIM измерений."""
+    vec = [0.0] * EMBEDDING_DIM
+    for word in text.lower().split():
+        vec[zlib.crc32(word.encode("utf-8")) % EMBEDDING_DIM] += 1.0
+    norm = math.sqrt(sum(x * x for x in vec)) or 1.0
+    return [x / norm for x in vec]
+
+
+class WordEncoding:
+    """Замена tiktoken, когда кодировку нельзя скачать (офлайн): токен — слово."""
+
+    def encode(self, text: str) -> list[str]:
+        return text.split()
+
+    def decode(self, tokens: list[str]) -> str:
+        return " ".join(tokens)
+
+
+def load_encoding():
+    try:
+        import tiktoken
+        return tiktoken.get_encoding("cl100k_base")
+    except Exception as e:
+        print(f"tiktoken недоступен ({type(e).__name__}) — токены считаются по словам")
+        return WordEncoding()
+
+
+# ---- OpenAI / Pinecone / Telegram ----
+class FakeOpenAI:
+    """Детерминированный AsyncOpenAI: стрим chat.completions и embeddings с заданными задержками."""
+
+    def __init__(self, encoding, ttft: float, token_delay: float, embed_latency: float, reply_tokens: int):
+        self.encoding = encoding
+        self.ttft = ttft
+        self.token_delay = token_delay
+        self.embed_latency = embed_latency
+        self.reply_tokens = reply_tokens
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create_completion))
+        self.embeddings = SimpleNamespace(create=self._create_embedding)
+
+    def with_options(self, **kwargs):
+        return self
+
+    async def _create_completion(self, model: str, messages: list[dict], max_tokens: int | None = None, **kwargs):
+        prompt_tokens = sum(len(self.encoding.encode(m.get("content") or "")) for m in messages)
+        rng = random.Random(zlib.crc32(messages[-1]["content"].encode("utf-8")))
+        words = [rng.choice(VOCABULARY) for _ in range(min(self.reply_tokens, max_tokens or self.reply_tokens))]
+        return self._stream(words, prompt_tokens)
+
+    async def _stream(self, words: list[str], prompt_tokens: int):
+        await asyncio.sleep(self.ttft)
+        for i, word in enumerate(words):
+            if i and self.token_delay:
+                await asyncio.sleep(self.token_delay)
+            yield SimpleNamespace(usage=None, choices=[SimpleNamespace(delta=SimpleNamespace(content=word + " "))])
+        usage = SimpleNamespace(
+            prompt_tokens=prompt_tokens, completion_tokens=len(words),
+            total_tokens=prompt_tokens + len(words), prompt_tokens_details=None,
+        )
+        yield SimpleNamespace(usage=usage, choices=[])
+
+    async def _create_embedding(self, model: str, input):
+        await asyncio.sleep(self.embed_latency)
+        texts = [input] if isinstance(input, str) else input
+        return SimpleNamespace(data=[SimpleNamespace(index=i, embedding=_embed(t)) for i, t in enumerate(texts)])
+
+
+def _filter_matches(metadata: dict, flt: dict | None) -> bool:
+    for key, cond in (flt or {}).items():
+        value = metadata.get(key)
+        if isinstance(cond, dict) and "$in" in cond:
+            if value not in cond["$in"]:
+                return False
+        elif value != cond:
+            return False
+    return True
+
+
+class LocalVectorIndex:
+    """Векторный индекс в памяти с интерфейсом Pinecone Index (query/fetch)."""
+
+    def __init__(self):
+        self._by_user: dict[int, list[tuple[str, list[float], dict]]] = {}
+        self._by_id: dict[str, tuple[list[float], dict]] = {}
+
+    def upsert(self, vectors: list[dict]):
+        for v in vectors:
+            self._by_user.setdefault(v["metadata"]["user_id"], []).append((v["id"], v["values"], v["metadata"]))
+            self._by_id[v["id"]] = (v["values"], v["metadata"])
+
+    def query(self, vector, top_k: int, filter=None, include_metadata=True, include_values=False):
+        scored = []
+        for vid, values, md in self._by_user.get((filter or {}).get("user_id"), ()):
+            if _filter_matches(md, filter):
+                scored.append((sum(a * b for a, b in zip(vector, values)), vid, values, md))
+        scored.sort(key=lambda s: -s[0])
+        return {"matches": [
+            {"id": vid, "score": score, "metadata": md if include_metadata else None, "values": values if include_values else None}
+            for score, vid, values, md in scored[:top_k]
+        ]}
+
+    def fetch(self, ids: list[str]):
+        return {"vectors": {vid: {"id": vid, "metadata": self._by_id[vid][1]} for vid in ids if vid in self._by_id}}
+
+
+class FakeStatusMessage:
+    def __init__(self, chat_id: int, text: str, delay: float):
+        self.chat = SimpleNamespace(id=chat_id)
+        self.message_id = 1
+        self.text = text
+        self._delay = delay
+
+    async def edit_text(self, text: str):
+        await asyncio.sleep(self._delay)
+        self.text = text
+
+
+class FakeMessage:
+    def __init__(self, user_id: int, text: str, delay: float):
+        self.from_user = SimpleNamespace(id=user_id, username=f"bench{user_id}")
+        self.chat = SimpleNamespace(id=user_id)
+        self.text = text
+        self.status: FakeStatusMessage | None = None
+        self._delay = delay
+
+    async def answer(self, text: str, reply_markup=None):
+        await asyncio.sleep(self._delay)
+        self.status = FakeStatusMessage(self.chat.id, text, self._delay)
+        return self.status
+
+
+class FakeBot:
+    def __init__(self, delay: float):
+        self._delay = delay
+
+    async def send_message(self, chat_id: int, text: str, **kwargs):
+        await asyncio.sleep(self._delay)
+
+
+def build_llm_client(openai_client: FakeOpenAI, encoding) -> LLMClient:
+    """Настоящий LLMClient (роутинг, бюджеты, стрим, usage) поверх FakeOpenAI, без сети и ключей."""
+    llm = LLMClient.__new__(LLMClient)
+    llm.client = openai_client
+    llm.router = ModelRouter()
+    llm.allocator = BudgetAllocator()
+    llm._encodings = {spec.encoding: encoding for spec in MODEL_REGISTRY.values()}
+    llm._encodings.setdefault("cl100k_base", encoding)
+    llm.encoding = encoding
+    llm.MODEL_NAME = llm.router.default_model
+    llm.REQUEST_TIMEOUT = 30
+    llm.prompt_cache_stats = {"prompt_tokens": 0, "cached_tokens": 0}
+    return llm
+
+
+def build_rag_client(openai_client: FakeOpenAI, index: LocalVectorIndex, encoding) -> RAGClient:
+    """Настоящий RAGClient (отбор, MMR, соседние фрагменты, кэш выдачи) поверх локального индекса."""
+    rag = RAGClient.__new__(RAGClient)
+    rag.pinecone = None
+    rag.openai_client = openai_client
+    rag.index = index
+    rag.lexical_index = None
+    rag.retrieval_cache = RetrievalCache()
+    rag.encoding = encoding
+    rag.RAG_TOKEN_BUDGET = LLM_BUDGET_RAG_TOKENS
+    rag.MAX_CANDIDATES = RAG_MAX_CANDIDATES
+    rag.MIN_TOP_K = RAG_MIN_TOP_K
+    rag.CHUNK_NEIGHBORS = RAG_CHUNK_NEIGHBORS
+    rag.EMBEDDING_TIMEOUT = RAG_EMBEDDING_TIMEOUT_SECONDS
+    return rag
+
+
+def seed_vectors(index: LocalVectorIndex, rng: random.Random, user_id: int, project_id: int, sessions: int, chunks: int = 3):
+    """Итоги прошлых сессий пользователя: sessions сессий по chunks фрагментов."""
+    vectors = []
+    for s in range(sessions):
+        session_id = user_id * 1_000 + s
+        for c in range(chunks):
+            summary = _text(rng, 80)
+            vectors.append({
+                "id": chunk_vector_id(session_id, c),
+                "values": _embed(summary),
+                "metadata": {
+                    "user_id": user_id, "project_id": project_id, "session_id": session_id,
+                    "chunk_index": c, "chunk_count": chunks, "overlap": 0, "summary": summary,
+                },
+            })
+    index.upsert(vectors)
+
+
+# ---- БД в памяти ----
+class MemoryDB:
+    """Хранилище бенчмарка. Каждое SQL-выражение настоящего репозитория — вызов statement()."""
+
+    def __init__(self, latency: float, keyring: Keyring):
+        self.latency = latency
+        self.keyring = keyring
+        self.users: dict[int, SimpleNamespace] = {}
+        self.prompts: dict[tuple[int, str], str] = {}
+        self.projects: dict[int, SimpleNamespace] = {}
+        self.sessions: dict[int, SimpleNamespace] = {}
+        self.active: dict[int, int] = {}
+        self.ledger_rows = 0
+
+    async def statement(self, n: int = 1):
+        for _ in range(n):
+            with metrics.observe_stage("db"):
+                await asyncio.sleep(self.latency)
+
+
+class _AwaitableAttrs:
+    """Как AsyncAttrs.awaitable_attrs: чтение отложенной колонки — отдельный запрос."""
+
+    def __init__(self, db: MemoryDB, obj):
+        self._db = db
+        self._obj = obj
+
+    def __getattr__(self, name: str):
+        async def _load():
+            await self._db.statement()
+            return getattr(self._obj, name)
+        return _load()
+
+
+class MemoryUserRepository:
+    def __init__(self, db: MemoryDB):
+        self.db = db
+
+    async def get_or_create_user(self, telegram_id: int, username: str = None):
+        await self.db.statement()
+        return self.db.users.setdefault(telegram_id, SimpleNamespace(telegram_id=telegram_id, username=username, tokens_used_today=0))
+
+    async def reserve_tokens(self, telegram_id: int, tokens: int) -> int | None:
+        await self.db.statement()
+        user = self.db.users[telegram_id]
+        user.tokens_used_today += tokens
+        return user.tokens_used_today
+
+    async def settle_tokens(self, telegram_id: int, reserved: int, actual: int) -> int | None:
+        await self.db.statement()
+        user = self.db.users[telegram_id]
+        user.tokens_used_today = max(user.tokens_used_today + actual - reserved, 0)
+        return user.tokens_used_today
+
+
+class MemoryProjectRepository:
+    def __init__(self, db: MemoryDB):
+        self.db = db
+
+    async def get_project_by_id(self, project_id: int):
+        await self.db.statement()
+        row = self.db.projects.get(project_id)
+        if row is None:
+            return None
+        # system_prompt — отложенная колонка, как в models.Project
+        return SimpleNamespace(id=row.id, user_id=row.user_id, name=row.name, awaitable_attrs=_AwaitableAttrs(self.db, row))
+
+
+class MemoryPersonalizedPromptRepository:
+    def __init__(self, db: MemoryDB):
+        self.db = db
+
+    async def get_prompt(self, user_id: int, profile: str) -> str | None:
+        await self.db.statement()
+        return self.db.prompts.get((user_id, profile))
+
+
+class MemorySessionRepository:
+    """Хранит message_history так же, как колонка: компактный формат, зашифрованный AES-GCM."""
+
+    def __init__(self, db: MemoryDB):
+        self.db = db
+
+    async def get_active_session(self, user_id: int, with_history: bool = True, history_tail: int | None = None):
+        await self.db.statement()
+        row = self.db.sessions.get(self.db.active.get(user_id))
+        if row is None:
+            return None
+        session = SimpleNamespace(
+            id=row.id, user_id=row.user_id, project_id=row.project_id, mode_id=None,
+            active_profile=row.active_profile, context_mode=row.context_mode, status="active",
+        )
+        if with_history:
+            session.message_history = decode_history(self.db.keyring.decrypt(row.message_history), history_tail)
+        return session
+
+    async def get_context_mode(self, user_id: int) -> str:
+        s = await self.get_active_session(user_id, with_history=False)
+        return s.context_mode if s and s.context_mode else "project"
+
+    async def append_messages(self, session_id: int, messages: list[dict]):
+        await self.db.statement(2)
+        row = self.db.sessions[session_id]
+        stored = self.db.keyring.decrypt(row.message_history)
+        row.message_history = self.db.keyring.encrypt(append_history(stored, messages))
+
+
+class MemoryUsageRepository:
+    def __init__(self, db: MemoryDB):
+        self.db = db
+
+    async def record(self, user_id: int, records: list, project_id=None, session_id=None, mode_id=None, day=None):
+        if not records:
+            return
+        # INSERT в журнал + upsert дневного агрегата на каждую модель
+        await self.db.statement(1 + len({r.model for r in records}))
+        self.db.ledger_rows += len(records)
+
+
+class MemoryBackend:
+    name = "memory"
+
+    def __init__(self, latency: float):
+        self.db = MemoryDB(latency, Keyring("bench-key"))
+
+    async def open(self):
+        pass
+
+    async def close(self):
+        pass
+
+    @contextmanager
+    def patched(self):
+        """Подменяет репозитории в модулях, где их создаёт конвейер хода."""
+        targets = [
+            (session_handler, "UserRepository", MemoryUserRepository),
+            (session_handler, "SessionRepository", MemorySessionRepository),
+            (session_handler, "ProjectRepository", MemoryProjectRepository),
+            (session_handler, "PersonalizedPromptRepository", MemoryPersonalizedPromptRepository),
+            (session_handler, "UsageRepository", MemoryUsageRepository),
+            (prompt_builder_module, "PersonalizedPromptRepository", MemoryPersonalizedPromptRepository),
+        ]
+        saved = [(module, name, getattr(module, name)) for module, name, _ in targets]
+        try:
+            for module, name, repo in targets:
+                setattr(module, name, repo)
+            yield
+        finally:
+            for module, name, original in saved:
+                setattr(module, name, original)
+
+    @asynccontextmanager
+    async def session(self):
+        yield self.db
+
+    async def seed(self, user_ids: list[int], history: list[dict]) -> dict[int, int]:
+        projects = {}
+        for uid in user_ids:
+            self.db.users[uid] = SimpleNamespace(telegram_id=uid, username=f"bench{uid}", tokens_used_today=0)
+            self.db.prompts[(uid, "coder")] = SYSTEM_PROMPT
+            self.db.projects[uid] = SimpleNamespace(id=uid, user_id=uid, name="bench", system_prompt=SYSTEM_PROMPT)
+            self.db.sessions[uid] = SimpleNamespace(
+                id=uid, user_id=uid, project_id=uid, active_profile="coder", context_mode="project",
+                message_history=self.db.keyring.encrypt(encode_history(history)),
+            )
+            self.db.active[uid] = uid
+            projects[uid] = uid
+        return projects
+
+    async def cleanup(self, user_ids: list[int]):
+        for uid in user_ids:
+            for table in (self.db.users, self.db.projects, self.db.sessions, self.db.active):
+                table.pop(uid, None)
+            self.db.prompts.pop((uid, "coder"), None)
+
+
+# ---- Postgres ----
+class PostgresBackend:
+    name = "postgres"
+
+    async def open(self):
+        from src.db import repository
+        from src.db.session import db, db_init
+
+        await db_init()
+        self._db = db
+        # Суточная квота не должна обрывать прогон: резерв/расчёт по-прежнему выполняются
+        repository.DAILY_TOKEN_LIMIT = 10 ** 12
+
+    async def close(self):
+        await self._db.engine.dispose()
+
+    @contextmanager
+    def patched(self):
+        yield
+
+    def session(self):
+        # Как db_session_middleware: своя AsyncSession на каждый апдейт
+        return self._db.AsyncSessionLocal()
+
+    async def seed(self, user_ids: list[int], history: list[dict]) -> dict[int, int]:
+        from src.db.repository import UserRepository, PersonalizedPromptRepository, ProjectRepository, SessionRepository
+
+        projects = {}
+        async with self._db.AsyncSessionLocal() as s:
+            for uid in user_ids:
+                user = await UserRepository(s).get_or_create_user(uid, f"bench{uid}")
+                await PersonalizedPromptRepository(s).save_or_update_prompt(uid, "coder", SYSTEM_PROMPT)
+                project = await ProjectRepository(s).create_project(uid, "bench", system_prompt=SYSTEM_PROMPT)
+                session = await SessionRepository(s).start_new_session(user, "coder", project.id)
+                if history:
+                    await SessionRepository(s).append_messages(session.id, history)
+                projects[uid] = project.id
+        return projects
+
+    async def cleanup(self, user_ids: list[int]):
+        from src.db.repository import UserRepository
+
+        async with self._db.AsyncSessionLocal() as s:
+            for uid in user_ids:
+                await UserRepository(s).delete_all_user_data(uid)
+
+
+# ---- Прогон ----
+def _percentile(sorted_values: list[float], q: float) -> float:
+    """Перцентиль методом ближайшего ранга."""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(q / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def _stage_totals(before: dict, after: dict) -> dict[str, tuple[int, float]]:
+    """Прирост (count, sum) по стадиям, суммарно по моделям."""
+    totals: dict[str, list] = {}
+    for key, (count, total) in after.items():
+        prev_count, prev_total = before.get(key, (0, 0.0))
+        acc = totals.setdefault(key[0], [0, 0.0])
+        acc[0] += count - prev_count
+        acc[1] += total - prev_total
+    return {stage: (c, s) for stage, (c, s) in totals.items()}
+
+
+async def _run_user(backend, bot, llm, rag, user_id: int, turns: int, rng: random.Random, tg_delay: float, latencies: list | None, errors: list):
+    for _ in range(turns):
+        message = FakeMessage(user_id, _text(rng, rng.randint(8, 30)), tg_delay)
+        started = time.perf_counter()
+        async with backend.session() as session:
+            await session_handler.handle_text_message(message, session, bot, llm, rag)
+        elapsed = time.perf_counter() - started
+        status = message.status.text if message.status else ""
+        if status in (ERROR_TEXT, session_handler.LIMIT_EXCEEDED_TEXT) or not message.status:
+            errors.append(status)
+        elif latencies is not None:
+            latencies.append(elapsed)
+
+
+async def run_scenario(backend, llm, rag, index: LocalVectorIndex, history_len: int, concurrency: int, args, scenario_no: int) -> dict:
+    rng = random.Random(args.seed + scenario_no)
+    user_ids = [BENCH_USER_BASE + scenario_no * 100_000 + i for i in range(concurrency)]
+    projects = await backend.seed(user_ids, _history(rng, history_len))
+    for uid in user_ids:
+        seed_vectors(index, rng, uid, projects[uid], args.summaries)
+    bot = FakeBot(args.telegram_ms / 1000)
+    tg_delay = args.telegram_ms / 1000
+    errors: list = []
+    try:
+        # Прогрев: первый ход пользователя не меряем (кэши, JIT-пути SQLAlchemy, пул соединений)
+        await asyncio.gather(*(
+            _run_user(backend, bot, llm, rag, uid, args.warmup, random.Random(uid), tg_delay, None, errors) for uid in user_ids
+        ))
+        latencies: list[float] = []
+        before = metrics.STAGE_SECONDS.snapshot()
+        started = time.perf_counter()
+        await asyncio.gather(*(
+            _run_user(backend, bot, llm, rag, uid, args.turns, random.Random(uid + 1), tg_delay, latencies, errors) for uid in user_ids
+        ))
+        wall = time.perf_counter() - started
+        stages = _stage_totals(before, metrics.STAGE_SECONDS.snapshot())
+    finally:
+        await backend.cleanup(user_ids)
+
+    turns = concurrency * args.turns
+    latencies.sort()
+    db_count = stages.get("db", (0, 0.0))[0]
+    return {
+        "history": history_len,
+        "concurrency": concurrency,
+        "turns": turns,
+        "errors": len(errors),
+        "p50_ms": round(_percentile(latencies, 50) * 1000, 2),
+        "p95_ms": round(_percentile(latencies, 95) * 1000, 2),
+        "p99_ms": round(_percentile(latencies, 99) * 1000, 2),
+        "turns_per_sec": round(len(latencies) / wall, 2) if wall else 0.0,
+        "queries_per_turn": round(db_count / turns, 2) if turns else 0.0,
+        # В --db memory число запросов объявлено вручную в Memory*Repository, а не измерено
+        "queries_synthetic": backend.name == "memory",
+        "stages_ms_per_turn": {
+            stage: round(stages[stage][1] * 1000 / turns, 3) for stage in STAGES if stage in stages and turns
+        },
+    }
+
+
+def compare(results: list[dict], baseline: list[dict], tolerance: float, check_queries: bool = True) -> list[str]:
+    """Регрессии относительно сохранённого прогона: p95 и ходов/с — с допуском, запросы к БД — точно.
+
+    check_queries=False — число запросов не сравнивается (синтетический счёт --db memory).
+    """
+    base = {(r["history"], r["concurrency"]): r for r in baseline}
+    problems = []
+    for r in results:
+        b = base.get((r["history"], r["concurrency"]))
+        if b is None:
+            continue
+        case = f"history={r['history']} concurrency={r['concurrency']}"
+        if r["p95_ms"] > b["p95_ms"] * (1 + tolerance):
+            problems.append(f"{case}: p95 {b['p95_ms']} -> {r['p95_ms']} ms")
+        if r["turns_per_sec"] < b["turns_per_sec"] * (1 - tolerance):
+            problems.append(f"{case}: turns/s {b['turns_per_sec']} -> {r['turns_per_sec']}")
+        if check_queries and r["queries_per_turn"] > b["queries_per_turn"] + 0.01:
+            problems.append(f"{case}: queries/turn {b['queries_per_turn']} -> {r['queries_per_turn']}")
+    return problems
+
+
+def _print_report(results: list[dict]):
+    synthetic = any(r.get("queries_synthetic") for r in results)
+    db_label = "db/turn*" if synthetic else "db/turn"
+    print(f"{'history':>7} | {'users':>5} | {'turns':>5} | {'err':>3} | {'p50 ms':>8} | {'p95 ms':>8} | {'p99 ms':>8} | {'turns/s':>8} | {db_label:>8}")
+    for r in results:
+        print(
+            f"{r['history']:>7} | {r['concurrency']:>5} | {r['turns']:>5} | {r['errors']:>3} | {r['p50_ms']:8.1f} | "
+            f"{r['p95_ms']:8.1f} | {r['p99_ms']:8.1f} | {r['turns_per_sec']:8.1f} | {r['queries_per_turn']:8.2f}"
+        )
+    if synthetic:
+        print("* синтетический счёт (--db memory): запросы объявлены в Memory*Repository, не измерены; для проверки — --db postgres")
+    print("\nстадии, мс на ход:")
+    print(f"{'history':>7} | {'users':>5} | " + " | ".join(f"{s:>13}" for s in STAGES))
+    for r in results:
+        print(f"{r['history']:>7} | {r['concurrency']:>5} | " + " | ".join(
+            f"{r['stages_ms_per_turn'].get(s, 0.0):13.2f}" for s in STAGES
+        ))
+
+
+async def run(args) -> list[dict]:
+    encoding = load_encoding()
+    openai_client = FakeOpenAI(encoding, args.ttft_ms / 1000, args.token_ms / 1000, args.embed_ms / 1000, args.reply_tokens)
+    index = LocalVectorIndex()
+    llm = build_llm_client(openai_client, encoding)
+    rag = build_rag_client(openai_client, index, encoding)
+    backend = MemoryBackend(args.db_ms / 1000) if args.db == "memory" else PostgresBackend()
+
+    results = []
+    await backend.open()
+    try:
+        with backend.patched():
+            scenario_no = 0
+            for history_len in args.history:
+                for concurrency in args.concurrency:
+                    results.append(await run_scenario(backend, llm, rag, index, history_len, concurrency, args, scenario_no))
+                    scenario_no += 1
+    finally:
+        await backend.close()
+    return results
+
+
+def _int_list(value: str) -> list[int]:
+    return [int(v) for v in value.split(",") if v.strip()]
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Offline benchmark of the text-message pipeline")
+    parser.add_argument("--db", choices=("memory", "postgres"), default="memory")
+    parser.add_argument("--history", type=_int_list, default=[0, 200, 2000], help="history lengths, messages")
+    parser.add_argument("--concurrency", type=_int_list, default=[1, 8, 32], help="simultaneous users")
+    parser.add_argument("--turns", type=int, default=10, help="measured turns per user")
+    parser.add_argument("--warmup", type=int, default=1, help="unmeasured turns per user")
+    parser.add_argument("--summaries", type=int, default=20, help="past session summaries per user in the vector index")
+    parser.add_argument("--ttft-ms", type=float, default=0.0)
+    parser.add_argument("--token-ms", type=float, default=0.0)
+    parser.add_argument("--reply-tokens", type=int, default=150)
+    parser.add_argument("--embed-ms", type=float, default=0.0)
+    parser.add_argument("--telegram-ms", type=float, default=0.0)
+    parser.add_argument("--db-ms", type=float, default=0.0, help="simulated latency per SQL statement (memory db)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", dest="json_path", help="save results to a JSON file")
+    parser.add_argument("--baseline", help="compare with a saved JSON run, exit 1 on regression")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed p95/throughput regression")
+    return parser.parse_args(argv)
+
+
+def main():
+    args = parse_args()
+    # Конвейер логирует каждый ход на INFO — в бенчмарке это шум и лишняя работа
+    logging.basicConfig(level=logging.WARNING)
+    results = asyncio.run(run(args))
+    _print_report(results)
+
+    if args.json_path:
+        Path(args.json_path).write_text(json.dumps({"db": args.db, "results": results}, ensure_ascii=False, indent=2), encoding="utf-8")
+    if args.baseline:
+        baseline = json.loads(Path(args.baseline).read_text(encoding="utf-8"))
+        # Число запросов сравнимо, только если оба прогона измеряли настоящие репозитории
+        check_queries = args.db == "postgres" and baseline.get("db") == "postgres"
+        if not check_queries:
+            print("queries/turn не сравнивается: счёт синтетический (нужны оба прогона с --db postgres)")
+        problems = compare(results, baseline["results"], args.tolerance, check_queries=check_queries)
+        for p in problems:
+            print(f"REGRESSION {p}")
+        if problems:
+            sys.exit(1)
+        print("Регрессий относительно baseline нет")
+
+
+if __name__ == "__main__":
+    main()
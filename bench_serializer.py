@@ -0,0 +1,86 @@
+# Файл: C:\desk_top\bench_serializer.py
+"""
+Микробенчмарк JSON-бэкендов services/serializer.py: stdlib json против orjson на историях
+сессий реалистичного размера (чередование user/assistant, кириллица, блоки кода).
+
+Меряет loads/dumps истории целиком (str и bytes: orjson работает с UTF-8, поэтому на
+str с кириллицей платит за перекодирование), форматирование tools_config и экспорт с отступами.
+Запуск: python bench_serializer.py [--rounds N]
+"""
+
+import argparse
+import sys
+import timeit
+from pathlib import Path
+
+root_dir = Path(__file__).parent
+sys.path.append(str(root_dir))
+
+from src.services import serializer
+
+HISTORY_SIZES = (50, 500, 2000)
+TOOLS_CONFIG = {
+    "routing": {"policy": "quality", "models": ["gpt-4o", "gpt-4o-mini"]},
+    "budget": {"system": 3000, "rag": 5000, "history": 9000, "completion": 1200},
+    "tools": [{"name": f"tool_{i}", "description": "Описание инструмента " * 4} for i in range(10)],
+}
+
+
+def _history(n: int) -> list[dict]:
+    user = "Как настроить деплой сервиса? Вот конфиг:\n```yaml\nreplicas: 3\nimage: app:1.2\n```\n"
+    assistant = "Проверьте переменные окружения и лимиты ресурсов. " * 6 + "\n```bash\nkubectl rollout status deploy/app\n```"
+    return [{"role": "user" if i % 2 == 0 else "assistant", "content": user if i % 2 == 0 else assistant} for i in range(n)]
+
+
+def _bench(fn, rounds: int) -> float:
+    """Микросекунды на вызов (лучший из 5 повторов)."""
+    return min(timeit.repeat(fn, number=rounds, repeat=5)) / rounds * 1e6
+
+
+def _run_cases(rounds: int) -> dict[str, float]:
+    results = {}
+    for n in HISTORY_SIZES:
+        history = _history(n)
+        text = serializer.dumps(history)
+        raw = text.encode("utf-8")
+        r = max(5, rounds * 50 // n)
+        results[f"history[{n}] dumps"] = _bench(lambda: serializer.dumps(history), r)
+        results[f"history[{n}] dumps_bytes"] = _bench(lambda: serializer.dumps_bytes(history), r)
+        results[f"history[{n}] loads str"] = _bench(lambda: serializer.loads(text), r)
+        results[f"history[{n}] loads bytes"] = _bench(lambda: serializer.loads(raw), r)
+    tools_text = serializer.dumps(TOOLS_CONFIG)
+    results["tools_config format"] = _bench(lambda: serializer.dumps(serializer.loads(tools_text), indent=True), rounds)
+    export = {"sessions": [{"id": i, "message_history": _history(100)} for i in range(10)]}
+    results["export indent"] = _bench(lambda: serializer.dumps_bytes(export, indent=True), max(5, rounds // 20))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="JSON backend micro-benchmark")
+    parser.add_argument("--rounds", type=int, default=200)
+    args = parser.parse_args()
+
+    orjson_backend = serializer._orjson
+    backends = {"json": None}
+    if orjson_backend is not None:
+        backends["orjson"] = orjson_backend
+    else:
+        print("orjson не установлен — меряем только stdlib json")
+
+    table = {}
+    try:
+        for name, backend in backends.items():
+            serializer._orjson = backend
+            table[name] = _run_cases(args.rounds)
+    finally:
+        serializer._orjson = orjson_backend
+
+    print(f"{'case':<28} | " + " | ".join(f"{name + ' us':>11}" for name in backends) + " | speedup")
+    for case in table["json"]:
+        row = [table[name][case] for name in backends]
+        speedup = f"x{row[0] / row[-1]:.1f}" if len(row) > 1 else "-"
+        print(f"{case:<28} | " + " | ".join(f"{v:11.1f}" for v in row) + f" | {speedup}")
+
+
+if __name__ == "__main__":
+    main()
@@ -7,8 +7,10 @@ from pathlib import Path
 root_dir = Path(__file__).parent
 sys.path.append(str(root_dir))
 
+from sqlalchemy import text
 from sqlalchemy.ext.asyncio import create_async_engine
 from src.config import DATABASE_URL
+from src.services.name_normalization import normalize_name
 
 SQL = r"""
 -- Создание таблицы modes (если ее нет)
@@ -40,8 +42,105 @@ ALTER TABLE sessions ADD COLUMN IF NOT EXISTS context_mode VARCHAR;
 UPDATE sessions SET context_mode = 'project' WHERE context_mode IS NULL;
 ALTER TABLE sessions ALTER COLUMN context_mode SET NOT NULL;
 ALTER TABLE sessions ALTER COLUMN context_mode SET DEFAULT 'project';
+
+-- Общий стор FSM для нескольких воркеров (FSM_STORAGE=postgres)
+CREATE TABLE IF NOT EXISTS fsm_states (
+    key VARCHAR PRIMARY KEY,
+    state VARCHAR,
+    data TEXT,
+    updated_at TIMESTAMPTZ DEFAULT NOW()
+);
+
+-- Владелец FSM-состояния: удаление данных пользователя (/delete_data) чистит и fsm_states.
+-- Ключ: bot:chat:user:thread:business_connection:destiny — user_id старых строк берём из ключа
+ALTER TABLE fsm_states ADD COLUMN IF NOT EXISTS user_id BIGINT;
+UPDATE fsm_states SET user_id = split_part(key, ':', 3)::BIGINT
+    WHERE user_id IS NULL AND split_part(key, ':', 3) ~ '^-?[0-9]+$';
+CREATE INDEX IF NOT EXISTS ix_fsm_states_user_id ON fsm_states (user_id);
+
+-- Учёт фактического расхода OpenAI: журнал вызовов и дневные агрегаты
+CREATE TABLE IF NOT EXISTS usage_ledger (
+    id BIGSERIAL PRIMARY KEY,
+    user_id BIGINT NOT NULL,
+    project_id INTEGER,
+    session_id INTEGER,
+    mode_id INTEGER,
+    operation VARCHAR NOT NULL,
+    model VARCHAR NOT NULL,
+    prompt_tokens INTEGER NOT NULL DEFAULT 0,
+    completion_tokens INTEGER NOT NULL DEFAULT 0,
+    cached_tokens INTEGER NOT NULL DEFAULT 0,
+    cost_usd NUMERIC(12, 6) NOT NULL DEFAULT 0,
+    created_at TIMESTAMPTZ DEFAULT NOW()
+);
+CREATE INDEX IF NOT EXISTS ix_usage_ledger_user_created ON usage_ledger (user_id, created_at);
+
+CREATE TABLE IF NOT EXISTS usage_daily (
+    id SERIAL PRIMARY KEY,
+    user_id BIGINT NOT NULL,
+    project_id INTEGER NOT NULL DEFAULT 0,
+    day DATE NOT NULL,
+    model VARCHAR NOT NULL,
+    requests INTEGER NOT NULL DEFAULT 0,
+    prompt_tokens BIGINT NOT NULL DEFAULT 0,
+    completion_tokens BIGINT NOT NULL DEFAULT 0,
+    cached_tokens BIGINT NOT NULL DEFAULT 0,
+    cost_usd NUMERIC(14, 6) NOT NULL DEFAULT 0,
+    CONSTRAINT uq_usage_daily_key UNIQUE (user_id, project_id, day, model)
+);
+CREATE INDEX IF NOT EXISTS ix_usage_daily_user_day ON usage_daily (user_id, day);
+
+-- Полнотекстовый индекс фрагментов итогов (гибридный RAG: FTS + векторы)
+CREATE TABLE IF NOT EXISTS summary_chunks (
+    id BIGSERIAL PRIMARY KEY,
+    user_id BIGINT NOT NULL,
+    project_id INTEGER,
+    session_id INTEGER NOT NULL,
+    chunk_index INTEGER NOT NULL,
+    chunk_count INTEGER NOT NULL,
+    overlap INTEGER NOT NULL DEFAULT 0,
+    text TEXT NOT NULL,
+    tsv TSVECTOR NOT NULL,
+    created_at TIMESTAMPTZ DEFAULT NOW(),
+    CONSTRAINT uq_summary_chunk UNIQUE (session_id, chunk_index)
+);
+CREATE INDEX IF NOT EXISTS ix_summary_chunks_user_project ON summary_chunks (user_id, project_id);
+CREATE INDEX IF NOT EXISTS ix_summary_chunks_tsv ON summary_chunks USING GIN (tsv);
+
+-- Нормализованное имя проекта для индексного поиска (заполняется backfill_project_name_norm)
+ALTER TABLE projects ADD COLUMN IF NOT EXISTS name_norm VARCHAR;
+CREATE INDEX IF NOT EXISTS ix_projects_user_name_norm ON projects (user_id, name_norm);
+
+-- Политика хранения: персональный срок и индекс для пачечного удаления закрытых сессий
+ALTER TABLE users ADD COLUMN IF NOT EXISTS retention_days INTEGER;
+CREATE INDEX IF NOT EXISTS ix_sessions_closed_ended ON sessions (ended_at) WHERE status = 'closed';
+
+-- Архив историй закрытых сессий (сжатый зашифрованный JSON), в sessions остаётся заглушка
+ALTER TABLE sessions ADD COLUMN IF NOT EXISTS archived_at TIMESTAMPTZ;
+CREATE INDEX IF NOT EXISTS ix_sessions_unarchived_ended ON sessions (ended_at) WHERE status = 'closed' AND archived_at IS NULL;
+CREATE TABLE IF NOT EXISTS session_archives (
+    session_id INTEGER PRIMARY KEY,
+    user_id BIGINT NOT NULL,
+    codec VARCHAR NOT NULL,
+    payload TEXT NOT NULL,
+    raw_size INTEGER NOT NULL,
+    stored_size INTEGER NOT NULL,
+    message_count INTEGER NOT NULL,
+    archived_at TIMESTAMPTZ DEFAULT NOW()
+);
+CREATE INDEX IF NOT EXISTS ix_session_archives_user_id ON session_archives (user_id);
 """
 
+
+async def backfill_project_name_norm(conn):
+    """Заполняет projects.name_norm: нормализация (конфузаблы) есть только в Python, не в SQL."""
+    rows = (await conn.exec_driver_sql("SELECT id, name FROM projects WHERE name_norm IS NULL")).all()
+    params = [{"id": pid, "norm": normalize_name(name)} for pid, name in rows]
+    if params:
+        await conn.execute(text("UPDATE projects SET name_norm = :norm WHERE id = :id"), params)
+    print(f"Backfilled name_norm for {len(params)} projects.")
+
+
 async def main():
     if not DATABASE_URL or "None" in str(DATABASE_URL):
         print("ERROR: DATABASE_URL is not configured. Check your .env and src/config.py")
@@ -49,6 +148,7 @@ async def main():
     engine = create_async_engine(DATABASE_URL)
     async with engine.begin() as conn:
         await conn.exec_driver_sql(SQL)
+        await backfill_project_name_norm(conn)
     await engine.dispose()
     print("Migration completed successfully.")
 
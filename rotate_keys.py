@@ -0,0 +1,113 @@
+# Файл: C:\desk_top\rotate_keys.py
+"""
+Перешифровка зашифрованных колонок текущим ключом (ENCRYPTION_KEY) в формате ENCRYPTION_CIPHER.
+
+Порядок ротации ключа:
+  1) на всех инстансах: ENCRYPTION_KEY=<новый>, ENCRYPTION_KEYS_OLD=<старый> — читаются оба;
+  2) python rotate_keys.py — переписывает значения пачками по первичному ключу;
+  3) после прогона без остатка старый ключ из ENCRYPTION_KEYS_OLD можно убрать.
+Тот же прогон переводит старые значения AES-CBC (StringEncryptedType) в AES-GCM.
+
+Каждая пачка — отдельная транзакция, в памяти держится только одна пачка. UPDATE сверяет
+прежний шифротекст, поэтому строка, изменённая приложением во время прогона, не затирается
+(она уже записана текущим ключом).
+"""
+
+import argparse
+import asyncio
+import sys
+import time
+from pathlib import Path
+
+root_dir = Path(__file__).parent
+sys.path.append(str(root_dir))
+
+from sqlalchemy import Text, select, update, and_, bindparam, type_coerce
+from sqlalchemy.ext.asyncio import create_async_engine
+from src.config import DATABASE_URL
+from src.db.crypto import AesGcmEncryptedType, default_keyring
+from src.db.models import Base
+
+
+def encrypted_tables():
+    """[(table, pk_column, [encrypted columns])] по метаданным моделей."""
+    result = []
+    for table in Base.metadata.sorted_tables:
+        cols = [c for c in table.columns if isinstance(c.type, AesGcmEncryptedType)]
+        if cols:
+            pk, = table.primary_key.columns
+            result.append((table, pk, cols))
+    return result
+
+
+async def rotate_table(engine, keyring, table, pk, cols, batch_size: int, pause: float, dry_run: bool) -> tuple[int, int, int]:
+    """Возвращает (просмотрено строк, перешифровано значений, не расшифровано значений)."""
+    # «Сырые» шифротексты: type_coerce в Text отключает шифрование/расшифровку типом колонки
+    # и при чтении, и в параметрах UPDATE
+    raw_cols = [type_coerce(c, Text) for c in cols]
+    updates = [
+        update(table)
+        .where(and_(pk == bindparam("b_pk"), raw == bindparam("b_old", type_=Text)))
+        .values({c.name: bindparam("b_new", type_=Text)})
+        for c, raw in zip(cols, raw_cols)
+    ]
+    scanned = rewritten = failed = 0
+    last = None
+    while True:
+        stmt = select(pk, *raw_cols).order_by(pk).limit(batch_size)
+        if last is not None:
+            stmt = stmt.where(pk > last)
+        async with engine.begin() as conn:
+            rows = (await conn.execute(stmt)).all()
+            if not rows:
+                break
+            params = [[] for _ in cols]
+            for row in rows:
+                for i, old in enumerate(row[1:]):
+                    try:
+                        new = keyring.reencrypt(old)
+                    except Exception as e:
+                        failed += 1
+                        print(f"{table.name}.{cols[i].name} {pk.name}={row[0]}: cannot decrypt ({e.__class__.__name__})")
+                        continue
+                    if new is not None:
+                        params[i].append({"b_pk": row[0], "b_old": old, "b_new": new})
+            for stmt_update, batch in zip(updates, params):
+                rewritten += len(batch)
+                if batch and not dry_run:
+                    await conn.execute(stmt_update, batch)
+            scanned += len(rows)
+            last = rows[-1][0]
+        if len(rows) < batch_size:
+            break
+        await asyncio.sleep(pause)
+    return scanned, rewritten, failed
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Re-encrypt encrypted columns with the current key")
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--pause", type=float, default=0.1, help="seconds between batches")
+    parser.add_argument("--dry-run", action="store_true", help="only count values that need re-encryption")
+    args = parser.parse_args()
+
+    if not DATABASE_URL or "None" in str(DATABASE_URL):
+        print("ERROR: DATABASE_URL is not configured. Check your .env and src/config.py")
+        return
+    keyring = default_keyring()
+    engine = create_async_engine(DATABASE_URL)
+    try:
+        for table, pk, cols in encrypted_tables():
+            started = time.monotonic()
+            scanned, rewritten, failed = await rotate_table(
+                engine, keyring, table, pk, cols, max(1, args.batch_size), args.pause, args.dry_run
+            )
+            verb = "to re-encrypt" if args.dry_run else "re-encrypted"
+            print(f"{table.name}: scanned={scanned} {verb}={rewritten} failed={failed} ({time.monotonic() - started:.1f}s)")
+    finally:
+        await engine.dispose()
+    print("Key rotation completed.")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -11,7 +11,7 @@ sys.path.append(str(root_dir))
 from src.bot import main
 from src.db.session import db_init
 from src.logging_config import setup_logging
-from src.config import SENTRY_DSN
+from src.config import SENTRY_DSN, SENTRY_TRACES_SAMPLE_RATE, SENTRY_PROFILES_SAMPLE_RATE
 
 async def start():
     """Асинхронная функция запуска, которая теперь занимается только async-задачами."""
@@ -26,10 +26,10 @@ if __name__ == "__main__":
     if SENTRY_DSN:
         sentry_sdk.init(
             dsn=SENTRY_DSN,
-            traces_sample_rate=1.0,
-            profiles_sample_rate=1.0,
+            traces_sample_rate=SENTRY_TRACES_SAMPLE_RATE,
+            profiles_sample_rate=SENTRY_PROFILES_SAMPLE_RATE,
         )
-        logging.info("Sentry initialized successfully.")
+        logging.info(f"Sentry initialized successfully (traces_sample_rate={SENTRY_TRACES_SAMPLE_RATE}).")
     else:
         logging.warning("SENTRY_DSN not found. Sentry is not initialized.")
     
@@ -1,32 +1,55 @@
 # Файл: C:\desk_top\src\bot.py
+import asyncio
 import logging
+import signal
 from aiogram import Bot, Dispatcher
 from aiogram.types import Update, BotCommand
 from sqlalchemy.ext.asyncio import AsyncSession
 from aiogram.client.default import DefaultBotProperties
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 
-from src.config import TELEGRAM_TOKEN
+from src.config import (
+    TELEGRAM_TOKEN,
+    BOT_RUN_MODE,
+    WEBHOOK_BASE_URL,
+    WEBHOOK_PATH,
+    WEBHOOK_SECRET,
+    WEBHOOK_HOST,
+    WEBHOOK_PORT,
+    WEBHOOK_QUEUE_SIZE,
+    WEBHOOK_MAX_IN_FLIGHT,
+    WEBHOOK_DRAIN_TIMEOUT,
+    WORKER_URLS,
+    SCHEDULER_ENABLED,
+    RAG_LEXICAL_ENABLED,
+)
 from src.handlers import general, session as session_handlers, personalization, data_management
 from src.handlers import projects
 from src.handlers import modes
 from src.handlers import acl
 from src.handlers import context_mode
 from src.db.session import db
-from src.db.repository import SessionRepository
 from src.services.llm_client import LLMClient
 from src.services.rag_client import RAGClient
+from src.services.lexical_index import LexicalSummaryIndex
+from src.services.semantic_cache import SemanticResponseCache
 from src.services.commands import get_main_menu_commands
+from src.services.metrics import start_metrics_server
+from src.services.retention import RetentionWorker
+from src.services.fsm_storage import build_fsm_storage
+from src.services.turn_serializer import UserTurnSerializer
+from src.webhook import WebhookServer, WebhookGateway
 
 async def db_session_middleware(handler, event: Update, data: dict):
     async with db.AsyncSessionLocal() as session:
         data['session'] = session
         return await handler(event, data)
 
-async def scheduled_cleanup(session_maker):
-    async with session_maker() as session:
-        repo = SessionRepository(session)
-        await repo.delete_old_sessions()
+async def scheduled_cleanup(worker: RetentionWorker):
+    try:
+        await worker.run()
+    except Exception as e:
+        logging.error(f"Retention run failed: {e}")
 
 # --- НОВЫЙ КОД: Функция для установки меню команд ---
 async def set_main_menu(bot: Bot):
@@ -38,11 +61,25 @@ async def set_main_menu(bot: Bot):
 
 async def main():
     bot = Bot(token=TELEGRAM_TOKEN, default=DefaultBotProperties(parse_mode="HTML"))
-    
+    if BOT_RUN_MODE == "gateway":
+        # Входной узел не обрабатывает апдейты сам, только раздаёт их воркерам
+        try:
+            await run_gateway(bot)
+        finally:
+            await bot.session.close()
+        return
+
     llm_client = LLMClient()
-    rag_client = RAGClient()
+    rag_client = RAGClient(lexical_index=LexicalSummaryIndex(db.AsyncSessionLocal) if RAG_LEXICAL_ENABLED else None)
     await rag_client.initialize()
-    dp = Dispatcher(llm_client=llm_client, rag_client=rag_client)
+    response_cache = SemanticResponseCache()
+    # FSM в общем сторе (postgres), если бот запущен несколькими воркерами
+    dp = Dispatcher(
+        storage=build_fsm_storage(),
+        llm_client=llm_client,
+        rag_client=rag_client,
+        response_cache=response_cache,
+    )
 
     dp.update.middleware(db_session_middleware)
     
@@ -55,19 +92,92 @@ async def main():
     dp.include_router(modes.router)
     dp.include_router(context_mode.router)
     dp.include_router(session_handlers.router)
+    # Ходы диалога одного пользователя — строго по очереди (без гонок за message_history)
+    session_handlers.router.message.middleware(UserTurnSerializer())
 
     # --- НОВЫЙ КОД: Вызов функции установки меню ---
     await set_main_menu(bot)
     # --- КОНЕЦ НОВОГО КОДА ---
 
-    scheduler = AsyncIOScheduler(timezone="Europe/Moscow")
-    scheduler.add_job(scheduled_cleanup, trigger='interval', days=1, kwargs={'session_maker': db.AsyncSessionLocal})
-    scheduler.start()
+    # Периодические задачи; прогоны очистки на нескольких воркерах сериализует advisory lock (см. retention)
+    if SCHEDULER_ENABLED:
+        scheduler = AsyncIOScheduler(timezone="Europe/Moscow")
+        retention = RetentionWorker(db.AsyncSessionLocal, rag_client)
+        scheduler.add_job(scheduled_cleanup, trigger='interval', days=1, kwargs={'worker': retention})
+        scheduler.start()
+
+    metrics_runner = await start_metrics_server()
 
-    logging.info("Starting bot...")
+    logging.info(f"Starting bot (mode={BOT_RUN_MODE})...")
     try:
-        await bot.delete_webhook(drop_pending_updates=True)
-        await dp.start_polling(bot)
+        if BOT_RUN_MODE == "webhook":
+            await run_webhook(dp, bot)
+        else:
+            await bot.delete_webhook(drop_pending_updates=True)
+            await dp.start_polling(bot)
     finally:
+        if metrics_runner:
+            await metrics_runner.cleanup()
         await bot.session.close()
-        logging.info("Bot stopped.")
\ No newline at end of file
+        logging.info("Bot stopped.")
+
+
+async def run_webhook(dp: Dispatcher, bot: Bot):
+    """Webhook-режим: апдейты не теряются при рестарте (Telegram хранит их до доставки).
+
+    Без WEBHOOK_BASE_URL процесс работает как воркер за WebhookGateway и webhook у Telegram не регистрирует.
+    """
+    server = WebhookServer(
+        dp,
+        bot,
+        path=WEBHOOK_PATH,
+        secret=WEBHOOK_SECRET,
+        queue_size=WEBHOOK_QUEUE_SIZE,
+        max_in_flight=WEBHOOK_MAX_IN_FLIGHT,
+    )
+    await dp.emit_startup(bot=bot)
+    await server.start(WEBHOOK_HOST, WEBHOOK_PORT)
+    if WEBHOOK_BASE_URL:
+        await bot.set_webhook(
+            url=f"{WEBHOOK_BASE_URL.rstrip('/')}{WEBHOOK_PATH}",
+            secret_token=WEBHOOK_SECRET,
+            allowed_updates=dp.resolve_used_update_types(),
+            drop_pending_updates=False,
+        )
+    else:
+        logging.info("WEBHOOK_BASE_URL is empty: running as a worker behind the gateway.")
+    try:
+        await _wait_for_stop_signal()
+    finally:
+        # Сначала дорабатываем очередь апдейтов: shutdown диспетчера закрывает FSM-хранилище
+        await server.shutdown(drain_timeout=WEBHOOK_DRAIN_TIMEOUT)
+        await dp.emit_shutdown(bot=bot)
+
+
+async def run_gateway(bot: Bot):
+    """Режим gateway: принимает webhook и раскладывает апдейты по воркерам (WORKER_URLS) по user_id."""
+    if not WEBHOOK_BASE_URL:
+        raise RuntimeError("BOT_RUN_MODE=gateway requires WEBHOOK_BASE_URL")
+    gateway = WebhookGateway(WORKER_URLS, path=WEBHOOK_PATH, secret=WEBHOOK_SECRET)
+    await gateway.start(WEBHOOK_HOST, WEBHOOK_PORT)
+    await bot.set_webhook(
+        url=f"{WEBHOOK_BASE_URL.rstrip('/')}{WEBHOOK_PATH}",
+        secret_token=WEBHOOK_SECRET,
+        drop_pending_updates=False,
+    )
+    try:
+        await _wait_for_stop_signal()
+    finally:
+        await gateway.shutdown()
+
+
+async def _wait_for_stop_signal():
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop_event.set)
+        except (NotImplementedError, RuntimeError):
+            # Windows: сигналы через loop не поддерживаются, остановка по KeyboardInterrupt
+            pass
+    await stop_event.wait()
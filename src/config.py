@@ -24,6 +24,137 @@ DB_NAME = os.getenv("DB_NAME")
 
 DATABASE_URL = f"postgresql+asyncpg://{DB_USER}:{DB_PASS}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
 ENCRYPTION_KEY = os.getenv("ENCRYPTION_KEY")
+# Прежние ключи через запятую: только для расшифровки на время ротации (см. rotate_keys.py)
+ENCRYPTION_KEYS_OLD = tuple(k.strip() for k in os.getenv("ENCRYPTION_KEYS_OLD", "").split(",") if k.strip())
+# Формат записи: 'gcm' (AES-GCM) | 'cbc' (старый формат StringEncryptedType, для отката)
+ENCRYPTION_CIPHER = os.getenv("ENCRYPTION_CIPHER", "gcm").lower()
 DAILY_TOKEN_LIMIT = int(os.getenv("DAILY_TOKEN_LIMIT", "20000"))
 # Sentry DSN
-SENTRY_DSN = os.getenv("SENTRY_DSN")
\ No newline at end of file
+SENTRY_DSN = os.getenv("SENTRY_DSN")
+
+# LLM retry policy
+# Общий дедлайн на один пользовательский ход (все попытки LLM вместе), сек
+LLM_TURN_DEADLINE_SECONDS = float(os.getenv("LLM_TURN_DEADLINE_SECONDS", "45"))
+# Максимум попыток на один вызов OpenAI
+LLM_MAX_ATTEMPTS = int(os.getenv("LLM_MAX_ATTEMPTS", "3"))
+
+
+# LLM model routing
+# Основная модель, быстрая модель для коротких реплик и цепочка фолбэков (через запятую)
+LLM_DEFAULT_MODEL = os.getenv("LLM_DEFAULT_MODEL", "gpt-4o")
+LLM_FAST_MODEL = os.getenv("LLM_FAST_MODEL", "gpt-4o-mini")
+LLM_FALLBACK_MODELS = [m.strip() for m in os.getenv("LLM_FALLBACK_MODELS", "gpt-4o-mini").split(",") if m.strip()]
+LLM_SUMMARY_MODEL = os.getenv("LLM_SUMMARY_MODEL", "gpt-3.5-turbo")
+# Политика по умолчанию: fast | balanced | quality (переопределяется tools_config.routing)
+LLM_ROUTING_POLICY = os.getenv("LLM_ROUTING_POLICY", "balanced")
+# Сообщения не длиннее этого числа токенов без RAG-контекста считаем «болтовнёй»
+LLM_CHITCHAT_MAX_TOKENS = int(os.getenv("LLM_CHITCHAT_MAX_TOKENS", "24"))
+
+# Token budget per turn (переопределяется tools_config.budget мода)
+# Потолки: системный промпт, RAG-контекст, история диалога и ответ модели
+LLM_BUDGET_SYSTEM_TOKENS = int(os.getenv("LLM_BUDGET_SYSTEM_TOKENS", "4000"))
+LLM_BUDGET_RAG_TOKENS = int(os.getenv("LLM_BUDGET_RAG_TOKENS", "6000"))
+LLM_BUDGET_HISTORY_TOKENS = int(os.getenv("LLM_BUDGET_HISTORY_TOKENS", "8000"))
+LLM_BUDGET_COMPLETION_TOKENS = int(os.getenv("LLM_BUDGET_COMPLETION_TOKENS", "1024"))
+# Целевая латентность ответа, мс (0 — без цели); бюджеты урезаются, если оценка её превышает
+LLM_LATENCY_TARGET_MS = int(os.getenv("LLM_LATENCY_TARGET_MS", "0"))
+# Оценочная скорость модели для расчёта латентности: обработка промпта и генерация, токенов/сек
+LLM_PREFILL_TOKENS_PER_SEC = float(os.getenv("LLM_PREFILL_TOKENS_PER_SEC", "5000"))
+LLM_DECODE_TOKENS_PER_SEC = float(os.getenv("LLM_DECODE_TOKENS_PER_SEC", "60"))
+# Сколько кандидатов запрашивать у векторного индекса до обрезки по бюджету RAG
+RAG_MAX_CANDIDATES = int(os.getenv("RAG_MAX_CANDIDATES", "20"))
+RAG_MIN_TOP_K = int(os.getenv("RAG_MIN_TOP_K", "3"))
+# Отбор RAG-контекста: минимальный score, провал score между соседями, при котором хвост отбрасывается,
+# вес релевантности в MMR (1.0 — без диверсификации), квота итогов на проект (0 — поровну от top_k)
+RAG_MIN_SCORE = float(os.getenv("RAG_MIN_SCORE", "0.25"))
+RAG_SCORE_GAP = float(os.getenv("RAG_SCORE_GAP", "0.15"))
+RAG_MMR_LAMBDA = float(os.getenv("RAG_MMR_LAMBDA", "0.7"))
+RAG_PROJECT_QUOTA = int(os.getenv("RAG_PROJECT_QUOTA", "0"))
+# Итоги сессий хранятся фрагментами: размер фрагмента и перекрытие (токены),
+# сколько соседних фрагментов добирать к найденному при сборке контекста
+RAG_CHUNK_TOKENS = int(os.getenv("RAG_CHUNK_TOKENS", "400"))
+RAG_CHUNK_OVERLAP_TOKENS = int(os.getenv("RAG_CHUNK_OVERLAP_TOKENS", "60"))
+RAG_CHUNK_NEIGHBORS = int(os.getenv("RAG_CHUNK_NEIGHBORS", "1"))
+# Гибридный поиск: полнотекстовый индекс итогов в Postgres + векторы, слияние Reciprocal Rank Fusion.
+# Если эмбеддинг не получен за RAG_EMBEDDING_TIMEOUT_SECONDS, поиск идёт только по тексту
+RAG_LEXICAL_ENABLED = os.getenv("RAG_LEXICAL_ENABLED", "true").lower() in ("1", "true", "yes")
+RAG_RRF_K = int(os.getenv("RAG_RRF_K", "60"))
+RAG_EMBEDDING_TIMEOUT_SECONDS = float(os.getenv("RAG_EMBEDDING_TIMEOUT_SECONDS", "2.0"))
+# Кэш результатов поиска: TTL (0 — выключен), число записей, шаг квантования эмбеддинга запроса
+RAG_CACHE_TTL_SECONDS = float(os.getenv("RAG_CACHE_TTL_SECONDS", "120"))
+RAG_CACHE_MAX_ENTRIES = int(os.getenv("RAG_CACHE_MAX_ENTRIES", "1000"))
+RAG_CACHE_QUANT_STEP = float(os.getenv("RAG_CACHE_QUANT_STEP", "0.01"))
+# Кэш имён проектов для режима acl_mentions (страховочный TTL, сбрасывается и явно)
+PROJECT_INDEX_TTL_SECONDS = float(os.getenv("PROJECT_INDEX_TTL_SECONDS", "300"))
+# ACL-граф проектов: глубина транзитивных доступов (1 — только прямые), scope для подтягивания
+# итогов в RAG (read < summaries < all) и страховочный TTL кэша достижимости
+ACL_MAX_DEPTH = max(1, int(os.getenv("ACL_MAX_DEPTH", "1")))
+ACL_RAG_SCOPE = os.getenv("ACL_RAG_SCOPE", "read")
+ACL_CACHE_TTL_SECONDS = float(os.getenv("ACL_CACHE_TTL_SECONDS", "300"))
+
+# Semantic response cache (opt-in, можно включить на уровне мода: tools_config.semantic_cache)
+SEMANTIC_CACHE_ENABLED = os.getenv("SEMANTIC_CACHE_ENABLED", "false").lower() in ("1", "true", "yes")
+# Минимальная косинусная близость вопроса к сохранённому
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.95"))
+SEMANTIC_CACHE_TTL_SECONDS = float(os.getenv("SEMANTIC_CACHE_TTL_SECONDS", "3600"))
+SEMANTIC_CACHE_MAX_PER_KEY = int(os.getenv("SEMANTIC_CACHE_MAX_PER_KEY", "32"))
+SEMANTIC_CACHE_MAX_KEYS = int(os.getenv("SEMANTIC_CACHE_MAX_KEYS", "1000"))
+
+# Metrics / tracing
+# Локальный Prometheus-эндпоинт /metrics (METRICS_PORT=0 — выключен)
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9108"))
+# Доля трассировок/профилей, отправляемых в Sentry (0.0..1.0)
+SENTRY_TRACES_SAMPLE_RATE = float(os.getenv("SENTRY_TRACES_SAMPLE_RATE", "0.1"))
+SENTRY_PROFILES_SAMPLE_RATE = float(os.getenv("SENTRY_PROFILES_SAMPLE_RATE", "0.1"))
+
+# Runtime mode: polling | webhook | gateway (gateway раздаёт апдейты воркерам из WORKER_URLS)
+BOT_RUN_MODE = os.getenv("BOT_RUN_MODE", "polling").lower()
+# Публичный URL, на который Telegram шлёт апдейты (например, https://bot.example.com)
+WEBHOOK_BASE_URL = os.getenv("WEBHOOK_BASE_URL", "")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+# Ограничение очереди принятых, но ещё не обработанных апдейтов (backpressure)
+WEBHOOK_QUEUE_SIZE = int(os.getenv("WEBHOOK_QUEUE_SIZE", "1000"))
+# Сколько апдейтов обрабатывается одновременно (ходы одного пользователя всё равно идут по очереди)
+WEBHOOK_MAX_IN_FLIGHT = int(os.getenv("WEBHOOK_MAX_IN_FLIGHT", "64"))
+# Сколько секунд ждать дообработки очереди при остановке
+WEBHOOK_DRAIN_TIMEOUT = float(os.getenv("WEBHOOK_DRAIN_TIMEOUT", "30"))
+
+# Multi-worker
+# Адреса webhook-эндпоинтов воркеров (через запятую), используются в режиме gateway
+WORKER_URLS = [u.strip() for u in os.getenv("WORKER_URLS", "").split(",") if u.strip()]
+# FSM storage: memory | postgres | local (local — замена общего стора для тестов)
+FSM_STORAGE = os.getenv("FSM_STORAGE", "memory").lower()
+# Периодические задачи (очистка) — включать только на одном воркере
+SCHEDULER_ENABLED = os.getenv("SCHEDULER_ENABLED", "true").lower() in ("1", "true", "yes")
+# Хранение закрытых сессий: срок по умолчанию (пользователь меняет свой через /retention; 0 — бессрочно),
+# размер пачки DELETE, пауза между пачками и предел длительности одного прогона
+RETENTION_DAYS = int(os.getenv("RETENTION_DAYS", "30"))
+RETENTION_BATCH_SIZE = int(os.getenv("RETENTION_BATCH_SIZE", "500"))
+RETENTION_BATCH_PAUSE_SECONDS = float(os.getenv("RETENTION_BATCH_PAUSE_SECONDS", "0.5"))
+RETENTION_MAX_RUN_SECONDS = float(os.getenv("RETENTION_MAX_RUN_SECONDS", "600"))
+# Архив историй закрытых сессий: через сколько часов после закрытия история уходит из sessions
+# в сжатый зашифрованный архив (0 — архивирование выключено), кодек gzip | zstd (нужен zstandard)
+HISTORY_ARCHIVE_AFTER_HOURS = float(os.getenv("HISTORY_ARCHIVE_AFTER_HOURS", "24"))
+HISTORY_ARCHIVE_CODEC = os.getenv("HISTORY_ARCHIVE_CODEC", "gzip").lower()
+
+# Формат message_history: 'compact' (бинарные кадры, см. services/history_codec.py) | 'json' (прежний, для отката).
+# Старые JSON-строки читаются в любом режиме и переводятся в compact при следующей записи.
+HISTORY_FORMAT = os.getenv("HISTORY_FORMAT", "compact").lower()
+# Сжатие компактной истории перед шифрованием: none | zlib | zstd (zstd требует пакет zstandard).
+# Без сжатия новые сообщения дописываются без разбора истории.
+HISTORY_COMPRESSION = os.getenv("HISTORY_COMPRESSION", "none").lower()
+# Сколько последних сообщений декодировать на ход диалога (0 — всю историю); бюджет токенов режет дальше
+HISTORY_TURN_TAIL_MESSAGES = int(os.getenv("HISTORY_TURN_TAIL_MESSAGES", "200"))
+
+# JSON-бэкенд горячих путей (services/serializer.py): auto (orjson, если установлен) | orjson | json
+JSON_BACKEND = os.getenv("JSON_BACKEND", "auto").lower()
+
+# Per-user turn serialization
+# Окно склейки быстрых сообщений в один ход, сек (0 — не склеивать, только очередь)
+TURN_COALESCE_WINDOW_SECONDS = float(os.getenv("TURN_COALESCE_WINDOW_SECONDS", "0"))
+# Сколько сообщений пользователя может ждать своей очереди, остальные отклоняются
+TURN_MAX_PENDING = int(os.getenv("TURN_MAX_PENDING", "5"))
@@ -0,0 +1,161 @@
+# Файл: C:\desk_top\src\db\crypto.py
+import base64
+import hashlib
+import os
+
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from sqlalchemy import Text
+from sqlalchemy.types import TypeDecorator
+from sqlalchemy_utils.types.encrypted.encrypted_type import AesEngine
+
+from src.config import ENCRYPTION_KEY, ENCRYPTION_KEYS_OLD, ENCRYPTION_CIPHER
+
+# Формат шифротекста AES-GCM: "g1:<kid>:<base64(nonce || ciphertext || tag)>" для строк и
+# "g1b:<kid>:..." для бинарных значений (компактная история, см. services/history_codec.py).
+# Значения без префикса — старый формат StringEncryptedType (AES-CBC, base64).
+GCM_PREFIX = "g1:"
+GCM_BYTES_PREFIX = "g1b:"
+NONCE_SIZE = 12
+CIPHERS = ("gcm", "cbc")
+
+
+def derive_key(secret: str | bytes) -> bytes:
+    """256-битный ключ из секрета — та же производная, что и у sqlalchemy_utils (SHA256)."""
+    if isinstance(secret, str):
+        secret = secret.encode()
+    return hashlib.sha256(secret).digest()
+
+
+def key_id(key: bytes) -> str:
+    """Короткий отпечаток ключа: по нему при расшифровке выбирается ключ из связки."""
+    return hashlib.sha256(b"desk_top:kid:" + key).hexdigest()[:8]
+
+
+class _Key:
+    """Производный ключ и готовые объекты шифров — строятся один раз, а не на каждое значение."""
+
+    def __init__(self, secret: str):
+        self.key = derive_key(secret)
+        self.kid = key_id(self.key)
+        self.aead = AESGCM(self.key)
+        self.legacy = AesEngine()
+        self.legacy._set_padding_mechanism(None)
+        self.legacy._initialize_engine(self.key)
+
+
+class Keyring:
+    """Текущий ключ (им шифруем) и прежние ключи (ими только расшифровываем, на время ротации)."""
+
+    def __init__(self, current: str, old: tuple[str, ...] = (), cipher: str = "gcm"):
+        if not current:
+            raise RuntimeError("ENCRYPTION_KEY is not configured")
+        if cipher not in CIPHERS:
+            raise ValueError(f"Unknown ENCRYPTION_CIPHER '{cipher}'")
+        self.current = _Key(current)
+        self.cipher = cipher
+        self.keys = [self.current] + [_Key(s) for s in old if s and s != current]
+        self.by_kid = {k.kid: k for k in reversed(self.keys)}
+
+    def encrypt(self, value: str | bytes) -> str:
+        if isinstance(value, bytes):
+            # Бинарный формат появился вместе с AES-GCM, в старом формате его не записать
+            return self._seal(GCM_BYTES_PREFIX, value)
+        if self.cipher == "cbc":
+            # Откат: формат, который читают инстансы без поддержки AES-GCM
+            return self.current.legacy.encrypt(value)
+        return self._seal(GCM_PREFIX, value.encode("utf-8"))
+
+    def _seal(self, prefix: str, data: bytes) -> str:
+        nonce = os.urandom(NONCE_SIZE)
+        ct = self.current.aead.encrypt(nonce, data, None)
+        return f"{prefix}{self.current.kid}:{base64.b64encode(nonce + ct).decode('ascii')}"
+
+    def _open(self, payload: str) -> bytes:
+        kid, _, body = payload.partition(":")
+        key = self.by_kid.get(kid)
+        if key is None:
+            raise ValueError(f"Unknown encryption key id '{kid}'")
+        raw = memoryview(base64.b64decode(body))  # срезы без копирования буфера
+        return key.aead.decrypt(raw[:NONCE_SIZE], raw[NONCE_SIZE:], None)
+
+    def decrypt(self, value: str) -> str | bytes:
+        """Строка для значений, записанных строкой, bytes — для бинарных."""
+        if value.startswith(GCM_PREFIX):
+            return self._open(value[len(GCM_PREFIX):]).decode("utf-8")
+        if value.startswith(GCM_BYTES_PREFIX):
+            return self._open(value[len(GCM_BYTES_PREFIX):])
+        # Старый AES-CBC не аутентифицирован: неверный ключ обычно даёт мусор и ValueError
+        # при декодировании, поэтому пробуем ключи по очереди
+        error = None
+        for key in self.keys:
+            try:
+                return key.legacy.decrypt(value)
+            except ValueError as e:
+                error = e
+        raise ValueError("Invalid decryption key") from error
+
+    def is_current(self, value: str | None) -> bool:
+        """Значение уже зашифровано текущим ключом в текущем формате (ротация его пропускает)."""
+        if value is None:
+            return True
+        if value.startswith(GCM_BYTES_PREFIX):
+            return value.startswith(f"{GCM_BYTES_PREFIX}{self.current.kid}:")
+        if self.cipher == "cbc":
+            return not value.startswith(GCM_PREFIX) and self._legacy_current(value)
+        return value.startswith(f"{GCM_PREFIX}{self.current.kid}:")
+
+    def reencrypt(self, value: str | None) -> str | None:
+        """Шифротекст под текущим ключом или None, если значение уже актуально (для rotate_keys.py)."""
+        if self.is_current(value):
+            return None
+        return self.encrypt(self.decrypt(value))
+
+    def _legacy_current(self, value: str) -> bool:
+        try:
+            self.current.legacy.decrypt(value)
+            return True
+        except ValueError:
+            return False
+
+
+_default_keyring: Keyring | None = None
+
+
+def default_keyring() -> Keyring:
+    global _default_keyring
+    if _default_keyring is None:
+        _default_keyring = Keyring(ENCRYPTION_KEY, ENCRYPTION_KEYS_OLD, ENCRYPTION_CIPHER)
+    return _default_keyring
+
+
+class AesGcmEncryptedType(TypeDecorator):
+    """Зашифрованный Text: AES-256-GCM со случайным nonce, ключи из Keyring.
+
+    В отличие от StringEncryptedType, ключ не выводится заново на каждое значение, а шифротекст
+    аутентифицирован. Старые значения (AES-CBC) читаются прозрачно и переписываются в новый
+    формат при следующем сохранении или скриптом rotate_keys.py. Значения bytes шифруются
+    как бинарные и читаются обратно как bytes.
+    """
+
+    impl = Text
+    cache_ok = True
+
+    def __init__(self, keyring: Keyring | None = None, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._keyring = keyring
+
+    @property
+    def keyring(self) -> Keyring:
+        return self._keyring or default_keyring()
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        if not isinstance(value, (str, bytes)):
+            value = repr(value)
+        return self.keyring.encrypt(value)
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        return self.keyring.decrypt(value)
@@ -1,16 +1,26 @@
 # Файл: C:\desk_top\src\db\models.py
 from sqlalchemy import (
     Column, Integer, String, BigInteger,
-    DateTime, Text, ForeignKey, func, Date, UniqueConstraint
+    DateTime, Text, ForeignKey, func, Date, UniqueConstraint, Numeric, Index
 )
-from sqlalchemy.orm import relationship, declarative_base
-from sqlalchemy_utils import StringEncryptedType
-from src.config import ENCRYPTION_KEY
+from sqlalchemy.dialects.postgresql import TSVECTOR
+from sqlalchemy.ext.asyncio import AsyncAttrs
+from sqlalchemy.orm import relationship, declarative_base, validates, deferred
+from src.db.crypto import AesGcmEncryptedType
+from src.services.name_normalization import normalize_name
 
-class CacheableEncryptedType(StringEncryptedType):
-    cache_ok = True
+# Крупные зашифрованные колонки объявлены deferred: расшифровываются только при явной загрузке
+# (undefer(...) в запросе или load_deferred), а не при каждом чтении строки.
+# В async-коде неявный lazy-load недоступен, поэтому AsyncAttrs даёт obj.awaitable_attrs.
+Base = declarative_base(cls=AsyncAttrs)
 
-Base = declarative_base()
+
+async def load_deferred(obj, name: str):
+    """Значение отложенной колонки: из памяти, если уже загружена, иначе — отдельным запросом."""
+    attrs = getattr(obj, 'awaitable_attrs', None)
+    if attrs is None:
+        return getattr(obj, name, None)
+    return await getattr(attrs, name)
 
 class User(Base):
     __tablename__ = 'users'
@@ -20,6 +30,8 @@ class User(Base):
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     tokens_used_today = Column(Integer, default=0, nullable=False)
     last_request_date = Column(Date, default=func.current_date(), nullable=False)
+    # Срок хранения закрытых сессий в днях: NULL — RETENTION_DAYS, 0 — бессрочно
+    retention_days = Column(Integer, nullable=True)
     
     # Каскадное удаление настраивается здесь, на стороне "один"
     sessions = relationship("Session", back_populates="user", cascade="all, delete-orphan")
@@ -31,21 +43,29 @@ class Project(Base):
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(BigInteger, ForeignKey('users.telegram_id'), nullable=False, index=True)
     name = Column(String, nullable=False)
+    # Ключ сравнения имени (normalize_name), заполняется автоматически при присвоении name
+    name_norm = Column(String)
     goal = Column(Text)
     context = Column(Text)
     active_mode = Column(String)
-    system_prompt = Column(CacheableEncryptedType(Text, ENCRYPTION_KEY))
-    backlog = Column(CacheableEncryptedType(Text, ENCRYPTION_KEY))
+    system_prompt = deferred(Column(AesGcmEncryptedType()))
+    backlog = deferred(Column(AesGcmEncryptedType()))
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
     __table_args__ = (
         UniqueConstraint('user_id', 'name', name='uq_project_user_name'),
+        Index('ix_projects_user_name_norm', 'user_id', 'name_norm'),
     )
 
     user = relationship("User", back_populates="projects")
     sessions = relationship("Session", back_populates="project", cascade="all, delete-orphan")
     modes = relationship("Mode", back_populates="project", cascade="all, delete-orphan")
 
+    @validates('name')
+    def _sync_name_norm(self, key, value):
+        self.name_norm = normalize_name(value)
+        return value
+
 class Mode(Base):
     __tablename__ = 'modes'
     id = Column(Integer, primary_key=True, index=True)
@@ -53,9 +73,9 @@ class Mode(Base):
     # Человекочитаемое имя (например: 'coder', 'product_manager', 'assistant')
     name = Column(String, nullable=False)
     # Переопределение системного промпта на уровне мода (если None — использовать проектный)
-    system_prompt = Column(CacheableEncryptedType(Text, ENCRYPTION_KEY))
+    system_prompt = deferred(Column(AesGcmEncryptedType()))
     # Конфигурация инструментов/политик (JSON-текст, шифруется)
-    tools_config = Column(CacheableEncryptedType(Text, ENCRYPTION_KEY))
+    tools_config = deferred(Column(AesGcmEncryptedType()))
     # Параметры инференса (например, температура)
     temperature = Column(String)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
@@ -76,12 +96,20 @@ class Session(Base):
     active_profile = Column(String)
     initial_goal = Column(Text)
     final_summary_id = Column(String)
-    message_history = Column(CacheableEncryptedType(Text, ENCRYPTION_KEY))
+    message_history = deferred(Column(AesGcmEncryptedType()))
     thinking_log = Column(Text)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     ended_at = Column(DateTime(timezone=True))
     # Режим выбора контекста: 'project' | 'acl_mentions' | 'global'
     context_mode = Column(String, default='project', nullable=False)
+    # История перенесена в session_archives (message_history очищена), см. services/retention.py
+    archived_at = Column(DateTime(timezone=True))
+
+    __table_args__ = (
+        # Частичный индекс для пачечного удаления по сроку хранения (см. services/retention.py)
+        Index('ix_sessions_closed_ended', 'ended_at', postgresql_where=(status == 'closed')),
+        Index('ix_sessions_unarchived_ended', 'ended_at', postgresql_where=(status == 'closed') & archived_at.is_(None)),
+    )
     
     # --- ИСПРАВЛЕНИЕ: Убираем некорректный cascade ---
     user = relationship("User", back_populates="sessions")
@@ -93,7 +121,7 @@ class PersonalizedPrompt(Base):
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(BigInteger, ForeignKey('users.telegram_id'), nullable=False)
     profile = Column(String, nullable=False)
-    prompt_text = Column(CacheableEncryptedType(Text, ENCRYPTION_KEY), nullable=False)
+    prompt_text = Column(AesGcmEncryptedType(), nullable=False)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     
     # --- ИСПРАВЛЕНИЕ: Убираем некорректный cascade ---
@@ -106,10 +134,100 @@ class ProjectAccess(Base):
     owner_project_id = Column(Integer, ForeignKey('projects.id'), nullable=False, index=True)
     # Проект, к которому разрешён доступ (можно подтаскивать его контент)
     allowed_project_id = Column(Integer, ForeignKey('projects.id'), nullable=False, index=True)
-    # Область прав (например: 'read', 'summaries', 'all') — на будущее
+    # Область прав: 'read' < 'summaries' < 'all' (иерархия — см. services/acl_engine.py)
     scope = Column(String, default='read', nullable=False)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
     __table_args__ = (
         UniqueConstraint('owner_project_id', 'allowed_project_id', name='uq_owner_allowed'),
-    )
\ No newline at end of file
+    )
+
+class FSMStateRecord(Base):
+    """Состояние FSM aiogram в общей БД (для запуска нескольких воркеров бота)."""
+    __tablename__ = 'fsm_states'
+    # Ключ вида bot:chat:user:thread:business_connection:destiny
+    key = Column(String, primary_key=True)
+    # Владелец состояния (user из ключа) — чтобы /delete_data удалял и черновики FSM
+    user_id = Column(BigInteger, index=True)
+    state = Column(String)
+    # JSON-данные FSM (ответы анкеты, черновик мода) — шифруются
+    data = Column(AesGcmEncryptedType())
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+class UsageLedger(Base):
+    """Журнал фактического расхода OpenAI: одна строка на вызов модели (usage из ответа)."""
+    __tablename__ = 'usage_ledger'
+    id = Column(BigInteger, primary_key=True)
+    user_id = Column(BigInteger, nullable=False)
+    # Без внешних ключей: учёт расходов переживает удаление проекта/сессии
+    project_id = Column(Integer)
+    session_id = Column(Integer)
+    mode_id = Column(Integer)
+    operation = Column(String, nullable=False)  # 'get_response' | 'get_summary'
+    model = Column(String, nullable=False)
+    prompt_tokens = Column(Integer, default=0, nullable=False)
+    completion_tokens = Column(Integer, default=0, nullable=False)
+    cached_tokens = Column(Integer, default=0, nullable=False)
+    cost_usd = Column(Numeric(12, 6), default=0, nullable=False)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    __table_args__ = (
+        Index('ix_usage_ledger_user_created', 'user_id', 'created_at'),
+    )
+
+class UsageDaily(Base):
+    """Дневные агрегаты расхода по пользователю/проекту/модели (project_id=0 — вне проекта)."""
+    __tablename__ = 'usage_daily'
+    id = Column(Integer, primary_key=True)
+    user_id = Column(BigInteger, nullable=False)
+    project_id = Column(Integer, default=0, nullable=False)
+    day = Column(Date, nullable=False)
+    model = Column(String, nullable=False)
+    requests = Column(Integer, default=0, nullable=False)
+    prompt_tokens = Column(BigInteger, default=0, nullable=False)
+    completion_tokens = Column(BigInteger, default=0, nullable=False)
+    cached_tokens = Column(BigInteger, default=0, nullable=False)
+    cost_usd = Column(Numeric(14, 6), default=0, nullable=False)
+
+    __table_args__ = (
+        UniqueConstraint('user_id', 'project_id', 'day', 'model', name='uq_usage_daily_key'),
+        Index('ix_usage_daily_user_day', 'user_id', 'day'),
+    )
+
+class SummaryChunk(Base):
+    """Фрагмент итогов сессии для полнотекстового поиска (лексическая половина гибридного RAG).
+
+    Текст хранится зашифрованным, для поиска — только tsvector (лексемы, конфигурация 'simple',
+    чтобы идентификаторы и имена проектов не искажались стеммингом).
+    """
+    __tablename__ = 'summary_chunks'
+    id = Column(BigInteger, primary_key=True)
+    user_id = Column(BigInteger, nullable=False)
+    project_id = Column(Integer)
+    session_id = Column(Integer, nullable=False)
+    chunk_index = Column(Integer, nullable=False)
+    chunk_count = Column(Integer, nullable=False)
+    overlap = Column(Integer, default=0, nullable=False)
+    text = Column(AesGcmEncryptedType(), nullable=False)
+    tsv = Column(TSVECTOR, nullable=False)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    __table_args__ = (
+        UniqueConstraint('session_id', 'chunk_index', name='uq_summary_chunk'),
+        Index('ix_summary_chunks_user_project', 'user_id', 'project_id'),
+        Index('ix_summary_chunks_tsv', 'tsv', postgresql_using='gin'),
+    )
+
+
+class SessionArchive(Base):
+    """Холодное хранилище историй закрытых сессий: сжатый (gzip/zstd) и зашифрованный JSON."""
+    __tablename__ = 'session_archives'
+    session_id = Column(Integer, primary_key=True)
+    user_id = Column(BigInteger, nullable=False, index=True)
+    codec = Column(String, nullable=False)
+    # base64 от сжатой истории, шифруется как и message_history
+    payload = Column(AesGcmEncryptedType(), nullable=False)
+    raw_size = Column(Integer, nullable=False)
+    stored_size = Column(Integer, nullable=False)
+    message_count = Column(Integer, nullable=False)
+    archived_at = Column(DateTime(timezone=True), server_default=func.now())
@@ -1,12 +1,21 @@
 # Файл: C:/desk_top/src/db/repository.py
 import datetime
-import json
 import logging
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
-from sqlalchemy import delete
-from src.db.models import User, Session, PersonalizedPrompt, Project, ProjectAccess, Mode
+from sqlalchemy import delete, func, update, case, tuple_
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import undefer
+from sqlalchemy.orm.attributes import set_committed_value
+from src.db.models import (
+    User, Session, PersonalizedPrompt, Project, ProjectAccess, Mode, FSMStateRecord, UsageLedger, UsageDaily,
+    SummaryChunk, SessionArchive,
+)
 from src.config import DAILY_TOKEN_LIMIT
+from src.services.acl_engine import normalize_scope, scope_level
+from src.services.history_archive import ArchivedHistory, unpack_history
+from src.services.history_codec import append_history, decode_history, encode_history
+from src.services.name_normalization import normalize_name, suggest_names
 
 class UserRepository:
     def __init__(self, session: AsyncSession):
@@ -24,6 +33,11 @@ class UserRepository:
             return new_user
         return user
 
+    async def set_retention_days(self, telegram_id: int, days: int | None) -> None:
+        """Персональный срок хранения закрытых сессий: None — по умолчанию, 0 — бессрочно."""
+        await self.session.execute(update(User).where(User.telegram_id == telegram_id).values(retention_days=days))
+        await self.session.commit()
+
     async def delete_all_user_data(self, telegram_id: int):
         await self.session.execute(
             delete(PersonalizedPrompt).where(PersonalizedPrompt.user_id == telegram_id)
@@ -35,6 +49,22 @@ class UserRepository:
         await self.session.execute(
             delete(Project).where(Project.user_id == telegram_id)
         )
+        await self.session.execute(
+            delete(UsageLedger).where(UsageLedger.user_id == telegram_id)
+        )
+        await self.session.execute(
+            delete(UsageDaily).where(UsageDaily.user_id == telegram_id)
+        )
+        await self.session.execute(
+            delete(SummaryChunk).where(SummaryChunk.user_id == telegram_id)
+        )
+        await self.session.execute(
+            delete(SessionArchive).where(SessionArchive.user_id == telegram_id)
+        )
+        # Состояния FSM (ответы анкеты, черновики модов) — тоже данные пользователя
+        await self.session.execute(
+            delete(FSMStateRecord).where(FSMStateRecord.user_id == telegram_id)
+        )
         await self.session.execute(
             delete(User).where(User.telegram_id == telegram_id)
         )
@@ -42,17 +72,60 @@ class UserRepository:
         logging.info(f"All data for user {telegram_id} has been deleted.")
 
     async def check_and_update_limits(self, user: User, tokens_to_add: int) -> bool:
-        today = datetime.date.today()
-        if user.last_request_date != today:
-            user.tokens_used_today = 0
-            user.last_request_date = today
-        if user.tokens_used_today + tokens_to_add > DAILY_TOKEN_LIMIT:
-            logging.warning(f"User {user.telegram_id} has exceeded the daily token limit.")
+        """Списывает tokens_to_add, если хватает суточного лимита (атомарно, см. reserve_tokens)."""
+        used = await self.reserve_tokens(user.telegram_id, tokens_to_add)
+        if used is None:
             return False
-        user.tokens_used_today += tokens_to_add
-        await self.session.commit()
+        user.tokens_used_today = used
+        user.last_request_date = datetime.date.today()
         return True
 
+    async def reserve_tokens(self, telegram_id: int, tokens: int) -> int | None:
+        """Резервирует tokens из суточного лимита одним UPDATE ... RETURNING.
+
+        Смена дня обрабатывается в том же выражении (счётчик обнуляется через CASE),
+        поэтому параллельные запросы не могут вместе превысить лимит.
+        Возвращает новое значение tokens_used_today или None, если лимита не хватает.
+        """
+        today = datetime.date.today()
+        used = case((User.last_request_date == today, User.tokens_used_today), else_=0)
+        stmt = (
+            update(User)
+            .where(User.telegram_id == telegram_id, used + tokens <= DAILY_TOKEN_LIMIT)
+            .values(tokens_used_today=used + tokens, last_request_date=today)
+            .returning(User.tokens_used_today)
+            .execution_options(synchronize_session=False)
+        )
+        result = await self.session.execute(stmt)
+        row = result.first()
+        await self.session.commit()
+        if row is None:
+            logging.warning(f"User {telegram_id} has exceeded the daily token limit (requested {tokens}).")
+            return None
+        return row[0]
+
+    async def settle_tokens(self, telegram_id: int, reserved: int, actual: int) -> int | None:
+        """Заменяет резерв фактическим расходом (usage OpenAI): счётчик += actual - reserved.
+
+        Если резерв был сделан вчера, а день уже сменился, фактический расход списывается с нового дня.
+        """
+        today = datetime.date.today()
+        settled = case(
+            (User.last_request_date == today, func.greatest(User.tokens_used_today + (actual - reserved), 0)),
+            else_=actual,
+        )
+        stmt = (
+            update(User)
+            .where(User.telegram_id == telegram_id)
+            .values(tokens_used_today=settled, last_request_date=today)
+            .returning(User.tokens_used_today)
+            .execution_options(synchronize_session=False)
+        )
+        result = await self.session.execute(stmt)
+        row = result.first()
+        await self.session.commit()
+        return row[0] if row else None
+
 class ProjectRepository:
     def __init__(self, session: AsyncSession):
         self.session = session
@@ -62,6 +135,51 @@ class ProjectRepository:
         result = await self.session.execute(stmt)
         return result.scalar_one_or_none()
 
+    async def get_project_by_norm_name(self, user_id: int, name: str) -> Project | None:
+        """Проект по нормализованному имени (индекс ix_projects_user_name_norm).
+        При коллизии нормализованных имён возвращает самый новый проект.
+        """
+        stmt = (
+            select(Project)
+            .where(Project.user_id == user_id, Project.name_norm == normalize_name(name))
+            .order_by(Project.created_at.desc())
+            .limit(1)
+        )
+        result = await self.session.execute(stmt)
+        return result.scalar_one_or_none()
+
+    async def get_projects_by_names(self, user_id: int, names: list[str], ids: list[int] = ()) -> list[Project]:
+        """Проекты пользователя, совпадающие с любым из id, имён или нормализованных имён, одним запросом."""
+        if not names and not ids:
+            return []
+        norms = {normalize_name(n) for n in names}
+        stmt = (
+            select(Project)
+            .where(
+                Project.user_id == user_id,
+                Project.id.in_(set(ids)) | Project.name.in_(set(names)) | Project.name_norm.in_(norms),
+            )
+            .order_by(Project.created_at.desc())
+        )
+        result = await self.session.execute(stmt)
+        return result.scalars().all()
+
+    async def suggest_project_names(self, user_id: int, name: str, limit: int = 5) -> list[str]:
+        """Имена проектов, похожие на name: подстрока или опечатка (триграммы, см. suggest_names).
+
+        Проектов у пользователя немного, поэтому сравнение идёт в Python по (name, name_norm)
+        всех его проектов — без расширения pg_trgm в БД.
+        """
+        if not normalize_name(name):
+            return []
+        stmt = (
+            select(Project.name, Project.name_norm)
+            .where(Project.user_id == user_id)
+            .order_by(Project.created_at.desc())
+        )
+        result = await self.session.execute(stmt)
+        return suggest_names(name, [tuple(row) for row in result.all()], limit)
+
     async def get_project_by_id(self, project_id: int) -> Project | None:
         stmt = select(Project).where(Project.id == project_id)
         result = await self.session.execute(stmt)
@@ -105,7 +223,7 @@ class ProjectRepository:
         if not proj:
             return None
         for k, v in fields.items():
-            if hasattr(proj, k) and v is not None:
+            if hasattr(Project, k) and v is not None:
                 setattr(proj, k, v)
         await self.session.commit()
         await self.session.refresh(proj)
@@ -188,23 +306,24 @@ class SessionRepository:
     def __init__(self, session: AsyncSession):
         self.session = session
 
-    def _deserialize_history(self, session_obj: Session) -> Session:
+    def _deserialize_history(self, session_obj: Session, tail: int | None = None) -> Session:
         """
-        Приватный метод для десериализации истории из строки в список.
-        Теперь устойчив к некорректным JSON-данным.
+        Приватный метод для десериализации истории (компактный формат или JSON) в список.
+        Устойчив к некорректным данным. Список кладётся как «загруженное» значение,
+        а не как изменение: иначе любой commit переписал бы историю целиком.
+        tail — декодировать только последние tail сообщений.
         """
-        if session_obj and session_obj.message_history:
-            history_val = session_obj.message_history
-            try:
-                if isinstance(history_val, str):
-                    session_obj.message_history = json.loads(history_val)
-                elif isinstance(history_val, bytes):
-                    session_obj.message_history = json.loads(history_val.decode('utf-8'))
-            except json.JSONDecodeError:
-                logging.error(f"Failed to decode message_history for session_id={session_obj.id}. Treating as empty.")
-                session_obj.message_history = []
-        elif session_obj:
-            session_obj.message_history = []
+        if session_obj is None:
+            return session_obj
+        history_val = session_obj.message_history
+        if isinstance(history_val, list):
+            return session_obj
+        try:
+            history = decode_history(history_val, tail)
+        except ValueError:
+            logging.error(f"Failed to decode message_history for session_id={session_obj.id}. Treating as empty.")
+            history = []
+        set_committed_value(session_obj, 'message_history', history)
         return session_obj
 
     async def close_all_active_sessions(self, user_id: int):
@@ -238,68 +357,207 @@ class SessionRepository:
             active_profile=profile,
             project_id=project_id,
             mode_id=mode_id,
-            message_history=json.dumps([])
+            message_history=encode_history([])
         )
         self.session.add(new_session)
         await self.session.commit()
         await self.session.refresh(new_session)
-        return self._deserialize_history(new_session)
+        # refresh не загружает отложенные колонки: историю мы только что записали, расшифровывать незачем
+        set_committed_value(new_session, 'message_history', [])
+        return new_session
         
-    async def get_active_session(self, user_id: int) -> Session | None:
+    async def get_active_session(
+        self, user_id: int, with_history: bool = True, history_tail: int | None = None
+    ) -> Session | None:
+        """Активная сессия. with_history=False — без загрузки и расшифровки message_history
+        (колонка отложенная; обращение к ней после такого запроса недопустимо).
+        history_tail — в message_history только последние history_tail сообщений (только для чтения:
+        запись — через append_messages)."""
         stmt = select(Session).where(Session.user_id == user_id, Session.status == 'active')
+        if with_history:
+            stmt = stmt.options(undefer(Session.message_history))
         result = await self.session.execute(stmt)
         session = result.scalar_one_or_none()
-        return self._deserialize_history(session)
+        return self._deserialize_history(session, history_tail) if with_history else session
 
     async def get_context_mode(self, user_id: int) -> str:
         """Возвращает режим контекста активной сессии пользователя или 'project' по умолчанию."""
-        s = await self.get_active_session(user_id)
+        s = await self.get_active_session(user_id, with_history=False)
         if s and getattr(s, 'context_mode', None):
             return s.context_mode
         return 'project'
 
     async def set_context_mode(self, user_id: int, mode: str) -> bool:
         """Устанавливает режим контекста для активной сессии. Возвращает True при успехе."""
-        s = await self.get_active_session(user_id)
+        s = await self.get_active_session(user_id, with_history=False)
         if not s:
             return False
         s.context_mode = mode
         await self.session.commit()
         return True
 
-    async def list_sessions(self, user_id: int) -> list[Session]:
+    async def list_sessions(self, user_id: int, include_history: bool = True) -> list[Session]:
+        """Сессии пользователя. С include_history истории архивных сессий подтягиваются
+        из session_archives одним запросом; без него message_history не загружается вовсе.
+        """
         stmt = select(Session).where(Session.user_id == user_id).order_by(Session.created_at.desc())
+        if include_history:
+            stmt = stmt.options(undefer(Session.message_history))
         result = await self.session.execute(stmt)
         sessions = result.scalars().all()
-        return [self._deserialize_history(s) for s in sessions]
-
-    async def update_message_history(self, session_id: int, new_message: dict):
-        active_session = await self.session.get(Session, session_id)
-        if active_session:
-            history_val = active_session.message_history
-            if isinstance(history_val, list):
-                history_list = history_val
-            elif isinstance(history_val, str):
-                history_list = json.loads(history_val or '[]')
-            elif isinstance(history_val, bytes):
-                 history_list = json.loads(history_val.decode('utf-8') or '[]')
-            else:
-                history_list = []
-            history_list.append(new_message)
-            active_session.message_history = json.dumps(history_list, ensure_ascii=False)
-            await self.session.commit()
+        if not include_history:
+            return sessions
+        sessions = [self._deserialize_history(s) for s in sessions]
+        archived = await self.get_archived_histories([s.id for s in sessions if s.archived_at is not None])
+        for s in sessions:
+            if s.id in archived:
+                # Как в _deserialize_history: не изменение строки, иначе autoflush перезапишет колонку
+                set_committed_value(s, 'message_history', archived[s.id])
+        return sessions
+
+    async def get_history(self, session_id: int) -> list:
+        """История сессии: из sessions или, если сессия архивирована, из session_archives."""
+        s = await self.session.get(Session, session_id, options=[undefer(Session.message_history)])
+        if s is None:
+            return []
+        if s.archived_at is not None:
+            return (await self.get_archived_histories([session_id])).get(session_id, [])
+        # Объект мог уже быть в identity map без истории — тогда options не сработают
+        await s.awaitable_attrs.message_history
+        return self._deserialize_history(s).message_history
+
+    async def get_archived_histories(self, session_ids: list[int]) -> dict[int, list]:
+        if not session_ids:
+            return {}
+        stmt = select(SessionArchive).where(SessionArchive.session_id.in_(session_ids))
+        result = await self.session.execute(stmt)
+        histories = {}
+        for row in result.scalars().all():
+            try:
+                histories[row.session_id] = unpack_history(row.codec, row.payload)
+            except Exception as e:
+                logging.error(f"Failed to unpack archived history for session_id={row.session_id}: {e}")
+                histories[row.session_id] = []
+        return histories
+
+    async def lock_archivable_batch(self, after_hours: float, batch_size: int) -> list[tuple[Session, list]]:
+        """Блокирует до batch_size закрытых неархивированных сессий, закрытых более after_hours назад.
+        Возвращает пары (сессия, история). Транзакция остаётся открытой: перенос — archive_sessions
+        в той же сессии. Объекты не меняются, чтобы autoflush не переписал message_history перед переносом.
+        """
+        stmt = (
+            select(Session)
+            .options(undefer(Session.message_history))
+            .where(
+                Session.status == 'closed',
+                Session.archived_at.is_(None),
+                Session.ended_at < func.now() - func.make_interval(0, 0, 0, 0, 0, 0, after_hours * 3600),
+            )
+            .order_by(Session.ended_at)
+            .limit(batch_size)
+            .with_for_update(skip_locked=True)
+        )
+        result = await self.session.execute(stmt)
+        batch = []
+        for s in result.scalars().all():
+            try:
+                history = decode_history(s.message_history)
+            except (ValueError, TypeError):
+                # Повреждённую историю не архивируем, чтобы не потерять исходные данные
+                logging.error(f"Failed to decode message_history for session_id={s.id}. Leaving it unarchived.")
+                continue
+            batch.append((s, history))
+        return batch
+
+    async def archive_sessions(self, entries: list[tuple[Session, ArchivedHistory]]) -> int:
+        """Пишет архивы и оставляет в sessions заглушку (message_history=NULL, archived_at) одним коммитом."""
+        if not entries:
+            return 0
+        stmt = pg_insert(SessionArchive).values([
+            {
+                "session_id": s.id,
+                "user_id": s.user_id,
+                "codec": a.codec,
+                "payload": a.payload,
+                "raw_size": a.raw_size,
+                "stored_size": a.stored_size,
+                "message_count": a.message_count,
+            }
+            for s, a in entries
+        ])
+        stmt = stmt.on_conflict_do_nothing(index_elements=[SessionArchive.session_id])
+        await self.session.execute(stmt)
+        await self.session.execute(
+            update(Session)
+            .where(Session.id.in_([s.id for s, _ in entries]))
+            .values(message_history=None, archived_at=func.now())
+            .execution_options(synchronize_session=False)
+        )
+        await self.session.commit()
+        return len(entries)
 
-    async def delete_old_sessions(self, days: int = 30):
-        logging.info(f"Running scheduled job: Deleting sessions older than {days} days.")
-        cutoff_date = datetime.datetime.utcnow() - datetime.timedelta(days=days)
-        stmt = delete(Session).where(
-            Session.status == 'closed',
-            Session.ended_at < cutoff_date
+    async def append_messages(self, session_id: int, messages: list[dict]):
+        """Дописывает сообщения к сохранённой истории сессии одним UPDATE.
+
+        История читается из БД заново, а не из объекта: в объекте может лежать только хвост
+        (history_tail). В компактном формате без сжатия кадры дописываются без разбора истории.
+        """
+        result = await self.session.execute(select(Session.message_history).where(Session.id == session_id))
+        row = result.first()
+        if row is None:
+            return
+        try:
+            new_value = append_history(row[0], messages)
+        except ValueError:
+            logging.error(f"Failed to decode message_history for session_id={session_id}. Starting it anew.")
+            new_value = encode_history(messages)
+        await self.session.execute(update(Session).where(Session.id == session_id).values(message_history=new_value))
+        await self.session.commit()
+
+    async def lock_expired_batch(self, default_days: int, batch_size: int) -> list[tuple[int, int]]:
+        """Блокирует до batch_size закрытых сессий старше срока хранения их владельца
+        (users.retention_days, NULL — default_days, 0 — бессрочно) и возвращает пары (id, user_id).
+
+        Строки, уже заблокированные параллельной транзакцией, пропускаются (SKIP LOCKED).
+        Транзакция остаётся открытой: удаление — delete_sessions в той же сессии.
+        """
+        retention = func.coalesce(User.retention_days, default_days)
+        stmt = (
+            select(Session.id, Session.user_id)
+            .join(User, User.telegram_id == Session.user_id)
+            .where(
+                Session.status == 'closed',
+                retention > 0,
+                Session.ended_at < func.now() - func.make_interval(0, 0, 0, retention),
+            )
+            .order_by(Session.ended_at)
+            .limit(batch_size)
+            .with_for_update(of=Session, skip_locked=True)
+        )
+        result = await self.session.execute(stmt)
+        return [(row[0], row[1]) for row in result.all()]
+
+    async def summary_chunk_counts(self, session_ids: list[int]) -> dict[int, int]:
+        """Число фрагментов итогов по сессиям (по summary_chunks) — чтобы удалить их векторы по id."""
+        if not session_ids:
+            return {}
+        stmt = (
+            select(SummaryChunk.session_id, func.max(SummaryChunk.chunk_count))
+            .where(SummaryChunk.session_id.in_(session_ids))
+            .group_by(SummaryChunk.session_id)
         )
         result = await self.session.execute(stmt)
+        return {row[0]: row[1] for row in result.all()}
+
+    async def delete_sessions(self, session_ids: list[int]) -> int:
+        """Удаляет сессии, их архивы и фрагменты итогов одним коммитом. Возвращает число удалённых сессий."""
+        if not session_ids:
+            return 0
+        await self.session.execute(delete(SummaryChunk).where(SummaryChunk.session_id.in_(session_ids)))
+        await self.session.execute(delete(SessionArchive).where(SessionArchive.session_id.in_(session_ids)))
+        result = await self.session.execute(delete(Session).where(Session.id.in_(session_ids)))
         await self.session.commit()
-        if result.rowcount > 0:
-            logging.info(f"Deleted {result.rowcount} old sessions.")
+        return result.rowcount
 
 
 class ProjectAccessRepository:
@@ -310,6 +568,7 @@ class ProjectAccessRepository:
         """Выдаёт доступ owner_project -> allowed_project. Идемпотентно по паре id."""
         if owner_project_id == allowed_project_id:
             raise ValueError("Нельзя выдавать доступ проекту к самому себе")
+        scope = normalize_scope(scope)
         # Проверим существование (уникальный индекс на паре полей)
         stmt = select(ProjectAccess).where(
             ProjectAccess.owner_project_id == owner_project_id,
@@ -344,6 +603,50 @@ class ProjectAccessRepository:
         await self.session.commit()
         return True
 
+    async def grant_access_many(self, owner_project_id: int, allowed_project_ids: list[int], scope: str = 'read') -> int:
+        """Выдаёт доступ owner -> каждый из allowed одним INSERT ... ON CONFLICT (scope обновляется).
+        Возвращает число вставленных/обновлённых пар.
+        """
+        scope = normalize_scope(scope)
+        ids = sorted({pid for pid in allowed_project_ids if pid != owner_project_id})
+        if not ids:
+            return 0
+        stmt = pg_insert(ProjectAccess).values(
+            [{"owner_project_id": owner_project_id, "allowed_project_id": pid, "scope": scope} for pid in ids]
+        )
+        stmt = stmt.on_conflict_do_update(constraint='uq_owner_allowed', set_={"scope": stmt.excluded.scope})
+        result = await self.session.execute(stmt)
+        await self.session.commit()
+        return result.rowcount
+
+    async def revoke_access_many(self, owner_project_id: int, allowed_project_ids: list[int]) -> list[int]:
+        """Отзывает доступ owner -> allowed одним DELETE. Возвращает id проектов, доступ к которым был."""
+        if not allowed_project_ids:
+            return []
+        stmt = (
+            delete(ProjectAccess)
+            .where(
+                ProjectAccess.owner_project_id == owner_project_id,
+                ProjectAccess.allowed_project_id.in_(set(allowed_project_ids)),
+            )
+            .returning(ProjectAccess.allowed_project_id)
+        )
+        result = await self.session.execute(stmt)
+        removed = [row[0] for row in result.all()]
+        await self.session.commit()
+        return removed
+
+    async def list_access_named(self, owner_project_id: int) -> list[tuple[int, str, str]]:
+        """Доступы owner-проекта с именами проектов назначения одним JOIN: (allowed_id, name, scope)."""
+        stmt = (
+            select(ProjectAccess.allowed_project_id, Project.name, ProjectAccess.scope)
+            .join(Project, Project.id == ProjectAccess.allowed_project_id)
+            .where(ProjectAccess.owner_project_id == owner_project_id)
+            .order_by(ProjectAccess.created_at.desc())
+        )
+        result = await self.session.execute(stmt)
+        return [tuple(row) for row in result.all()]
+
     async def list_access(self, owner_project_id: int) -> list[ProjectAccess]:
         """Список доступов, выданных данным owner-проектом."""
         stmt = select(ProjectAccess).where(ProjectAccess.owner_project_id == owner_project_id).order_by(ProjectAccess.created_at.desc())
@@ -356,15 +659,27 @@ class ProjectAccessRepository:
         result = await self.session.execute(stmt)
         return [row[0] for row in result.all()]
 
+    async def list_user_edges(self, user_id: int) -> list[tuple[int, int, str]]:
+        """Все рёбра ACL между проектами пользователя одним запросом: (owner_id, allowed_id, scope)."""
+        stmt = (
+            select(ProjectAccess.owner_project_id, ProjectAccess.allowed_project_id, ProjectAccess.scope)
+            .join(Project, Project.id == ProjectAccess.owner_project_id)
+            .where(Project.user_id == user_id)
+        )
+        result = await self.session.execute(stmt)
+        return [tuple(row) for row in result.all()]
+
     async def is_allowed(self, owner_project_id: int, target_project_id: int, required_scope: str = 'read') -> bool:
-        """Проверяет наличие доступа. Пока scope — плоский, без иерархии."""
-        stmt = select(ProjectAccess).where(
+        """Проверяет прямой доступ с учётом иерархии scope (read < summaries < all).
+        Транзитивные доступы и кэш — в ACLEngine.
+        """
+        stmt = select(ProjectAccess.scope).where(
             ProjectAccess.owner_project_id == owner_project_id,
             ProjectAccess.allowed_project_id == target_project_id,
         )
         res = await self.session.execute(stmt)
-        pa = res.scalar_one_or_none()
-        return pa is not None
+        scope = res.scalar_one_or_none()
+        return scope is not None and scope_level(scope) >= scope_level(required_scope)
 
 
 def _normalize_temperature(value) -> str | None:
@@ -443,7 +758,7 @@ class ModeRepository:
         if not md:
             return None
         for k, v in fields.items():
-            if hasattr(md, k) and v is not None:
+            if hasattr(Mode, k) and v is not None:
                 if k == "temperature":
                     v = _normalize_temperature(v)
                 setattr(md, k, v)
@@ -457,4 +772,201 @@ class ModeRepository:
             return False
         await self.session.delete(md)
         await self.session.commit()
-        return True
\ No newline at end of file
+        return True
+
+
+class FSMStateRepository:
+    """Хранение состояний FSM в Postgres (общий стор для нескольких воркеров)."""
+
+    def __init__(self, session: AsyncSession):
+        self.session = session
+
+    async def get(self, key: str) -> FSMStateRecord | None:
+        result = await self.session.execute(select(FSMStateRecord).where(FSMStateRecord.key == key))
+        return result.scalar_one_or_none()
+
+    async def upsert(self, key: str, user_id: int | None = None, **fields):
+        """INSERT ... ON CONFLICT DO UPDATE только переданных полей (state и/или data).
+
+        user_id — владелец состояния (по нему delete_all_user_data удаляет данные FSM).
+        """
+        if user_id is not None:
+            fields["user_id"] = user_id
+        stmt = pg_insert(FSMStateRecord).values(key=key, **fields)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[FSMStateRecord.key],
+            set_={**fields, "updated_at": func.now()},
+        )
+        await self.session.execute(stmt)
+        await self.session.commit()
+
+    async def delete(self, key: str):
+        await self.session.execute(delete(FSMStateRecord).where(FSMStateRecord.key == key))
+        await self.session.commit()
+
+
+class UsageRepository:
+    """Журнал фактического расхода OpenAI и дневные агрегаты для отчётов /usage."""
+
+    def __init__(self, session: AsyncSession):
+        self.session = session
+
+    async def record(
+        self,
+        user_id: int,
+        records: list,
+        project_id: int | None = None,
+        session_id: int | None = None,
+        mode_id: int | None = None,
+        day: datetime.date | None = None,
+    ):
+        """Пишет вызовы модели (UsageRecord) в журнал и добавляет их к дневным агрегатам одним commit."""
+        if not records:
+            return
+        day = day or datetime.date.today()
+        self.session.add_all([
+            UsageLedger(
+                user_id=user_id,
+                project_id=project_id,
+                session_id=session_id,
+                mode_id=mode_id,
+                operation=r.operation,
+                model=r.model,
+                prompt_tokens=r.prompt_tokens,
+                completion_tokens=r.completion_tokens,
+                cached_tokens=r.cached_tokens,
+                cost_usd=round(r.cost_usd, 6),
+            )
+            for r in records
+        ])
+        by_model: dict[str, dict] = {}
+        for r in records:
+            agg = by_model.setdefault(r.model, {"requests": 0, "prompt_tokens": 0, "completion_tokens": 0, "cached_tokens": 0, "cost_usd": 0.0})
+            agg["requests"] += 1
+            agg["prompt_tokens"] += r.prompt_tokens
+            agg["completion_tokens"] += r.completion_tokens
+            agg["cached_tokens"] += r.cached_tokens
+            agg["cost_usd"] += r.cost_usd
+        for model, agg in by_model.items():
+            agg["cost_usd"] = round(agg["cost_usd"], 6)
+            stmt = pg_insert(UsageDaily).values(user_id=user_id, project_id=project_id or 0, day=day, model=model, **agg)
+            stmt = stmt.on_conflict_do_update(
+                constraint='uq_usage_daily_key',
+                set_={k: getattr(UsageDaily, k) + getattr(stmt.excluded, k) for k in agg},
+            )
+            await self.session.execute(stmt)
+        await self.session.commit()
+
+    async def project_rollup(self, user_id: int, since: datetime.date) -> list[dict]:
+        """Расход по проектам с даты since (включительно), по убыванию стоимости."""
+        cost = func.sum(UsageDaily.cost_usd)
+        stmt = (
+            select(
+                UsageDaily.project_id,
+                Project.name,
+                func.sum(UsageDaily.requests),
+                func.sum(UsageDaily.prompt_tokens),
+                func.sum(UsageDaily.completion_tokens),
+                func.sum(UsageDaily.cached_tokens),
+                cost,
+            )
+            .outerjoin(Project, Project.id == UsageDaily.project_id)
+            .where(UsageDaily.user_id == user_id, UsageDaily.day >= since)
+            .group_by(UsageDaily.project_id, Project.name)
+            .order_by(cost.desc())
+        )
+        result = await self.session.execute(stmt)
+        return [
+            {
+                "project_id": pid or None,
+                "project_name": name,
+                "requests": int(req or 0),
+                "prompt_tokens": int(prompt or 0),
+                "completion_tokens": int(completion or 0),
+                "cached_tokens": int(cached or 0),
+                "cost_usd": float(total or 0),
+            }
+            for pid, name, req, prompt, completion, cached, total in result.all()
+        ]
+
+    async def daily_totals(self, user_id: int, since: datetime.date) -> list[dict]:
+        """Расход по дням с даты since (включительно)."""
+        stmt = (
+            select(
+                UsageDaily.day,
+                func.sum(UsageDaily.prompt_tokens),
+                func.sum(UsageDaily.completion_tokens),
+                func.sum(UsageDaily.cost_usd),
+            )
+            .where(UsageDaily.user_id == user_id, UsageDaily.day >= since)
+            .group_by(UsageDaily.day)
+            .order_by(UsageDaily.day)
+        )
+        result = await self.session.execute(stmt)
+        return [
+            {"day": day, "prompt_tokens": int(p or 0), "completion_tokens": int(c or 0), "cost_usd": float(cost or 0)}
+            for day, p, c, cost in result.all()
+        ]
+
+
+class SummaryChunkRepository:
+    """Фрагменты итогов сессий с tsvector для полнотекстового поиска."""
+
+    # Конфигурация FTS без стемминга: имена проектов и идентификаторы ищутся как есть
+    TS_CONFIG = 'simple'
+
+    def __init__(self, session: AsyncSession):
+        self.session = session
+
+    async def replace_session(self, user_id: int, session_id: int, project_id: int | None, chunks: list):
+        """Заменяет фрагменты сессии (chunking.Chunk) одним commit — повторное сохранение итогов идемпотентно."""
+        await self.session.execute(delete(SummaryChunk).where(SummaryChunk.session_id == session_id))
+        if chunks:
+            self.session.add_all([
+                SummaryChunk(
+                    user_id=user_id,
+                    project_id=project_id,
+                    session_id=session_id,
+                    chunk_index=c.index,
+                    chunk_count=len(chunks),
+                    overlap=c.overlap,
+                    text=c.text,
+                    tsv=func.to_tsvector(self.TS_CONFIG, c.text),
+                )
+                for c in chunks
+            ])
+        await self.session.commit()
+
+    async def search(
+        self,
+        user_id: int,
+        tsquery: str,
+        project_id: int | None = None,
+        project_ids: list[int] | None = None,
+        limit: int = 20,
+    ) -> list[tuple[SummaryChunk, float]]:
+        """Полнотекстовый поиск: [(фрагмент, ts_rank_cd)] по убыванию ранга."""
+        query = func.to_tsquery(self.TS_CONFIG, tsquery)
+        rank = func.ts_rank_cd(SummaryChunk.tsv, query)
+        stmt = (
+            select(SummaryChunk, rank)
+            .where(SummaryChunk.user_id == user_id, SummaryChunk.tsv.op('@@')(query))
+            .order_by(rank.desc())
+            .limit(limit)
+        )
+        if project_ids is not None:
+            stmt = stmt.where(SummaryChunk.project_id.in_(project_ids))
+        elif project_id is not None:
+            stmt = stmt.where(SummaryChunk.project_id == project_id)
+        result = await self.session.execute(stmt)
+        return [(chunk, float(r or 0)) for chunk, r in result.all()]
+
+    async def get_chunks(self, keys: list[tuple[int, int]]) -> list[SummaryChunk]:
+        """Фрагменты по (session_id, chunk_index) — для добора соседей без похода в векторное хранилище."""
+        if not keys:
+            return []
+        stmt = select(SummaryChunk).where(
+            tuple_(SummaryChunk.session_id, SummaryChunk.chunk_index).in_(keys)
+        )
+        result = await self.session.execute(stmt)
+        return list(result.scalars().all())
@@ -4,6 +4,7 @@ from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from sqlalchemy.orm import sessionmaker
 from src.db.models import Base
 from src.config import DATABASE_URL
+from src.services.metrics import instrument_engine
 
 # Создаем "контейнер" для хранения подключения
 class Database:
@@ -16,6 +17,8 @@ db = Database()
 async def db_init():
     """Асинхронно инициализирует движок и фабрику сессий."""
     db.engine = create_async_engine(DATABASE_URL, echo=False)
+    # Латентность каждого SQL-запроса -> метрика стадии 'db'
+    instrument_engine(db.engine)
     db.AsyncSessionLocal = sessionmaker(
         bind=db.engine, class_=AsyncSession, expire_on_commit=False
     )
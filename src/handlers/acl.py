@@ -1,7 +1,6 @@
 # Файл: C:\desk_top\src\handlers\acl.py
 import logging
 import re
-import unicodedata
 from aiogram import Router
 from aiogram.filters import Command
 from aiogram.types import Message
@@ -13,18 +12,13 @@ from src.db.repository import (
     SessionRepository,
     ProjectAccessRepository,
 )
+from src.services.acl_engine import acl_engine, normalize_scope, SCOPE_LEVELS
+from src.services.name_normalization import normalize_name
 
 router = Router()
 logger = logging.getLogger(__name__)
 
 
-def _norm(s: str) -> str:
-    """Unicode-нормализация + casefold + trim для сравнения имён.
-    Не меняет исходные имена, только для поиска/сравнения.
-    """
-    return unicodedata.normalize("NFKC", (s or "").strip()).casefold()
-
-
 async def resolve_project(
     proj_repo: ProjectRepository,
     user_id: int,
@@ -33,7 +27,7 @@ async def resolve_project(
     """Резолвит проект пользователя по идентификатору:
     - "#123" или "123" -> по id
     - точное имя
-    - case-insensitive/Unicode-normalized совпадение среди проектов пользователя
+    - совпадение нормализованного имени (normalize_name, индексный запрос)
     Возвращает кортеж (project_or_none, suggestions_list).
     """
     ident = (ident or "").strip()
@@ -51,33 +45,134 @@ async def resolve_project(
     if p:
         return p, []
 
-    # 3) Нормализованный поиск среди всех проектов пользователя
-    projects = await proj_repo.list_projects(user_id)
-    ident_n = _norm(ident)
-    for pr in projects:
-        if _norm(pr.name) == ident_n:
-            return pr, []
+    # 3) Нормализованное равенство (индекс по projects.name_norm)
+    p = await proj_repo.get_project_by_norm_name(user_id, ident)
+    if p:
+        return p, []
 
     # 4) Предложить похожие (подстрока после нормализации)
-    sugg = [pr.name for pr in projects if ident_n and ident_n in _norm(pr.name)]
-    return None, sugg[:5]
+    return None, await proj_repo.suggest_project_names(user_id, ident)
+
+
+_ARG_TOKEN_RE = re.compile(r'"([^"]*)"?|(,)|(\s+)|([^\s,"]+)')
+
+
+def _parse_target_args(text: str, maxsplit: int) -> list[list[str]]:
+    """Аргументы команды со списками проектов.
+
+    '/grant_access А Б, "В, Г" read' -> [['/grant_access'], ['А'], ['Б', 'В, Г'], ['read']]
+
+    Пробелы разделяют аргументы (не больше maxsplit раз — последний аргумент забирает остаток строки
+    вместе с пробелами), запятая разделяет имена внутри аргумента, пробелы вокруг неё не важны.
+    Имя в двойных кавычках берётся как есть: так указываются проекты с запятой или пробелом в названии
+    (или по id: #12). Повторы имён в аргументе отбрасываются.
+    """
+    args: list[list[str]] = []
+    item: str | None = None
+    space = ""
+    after_comma = False
+    for quoted, comma, gap, word in _ARG_TOKEN_RE.findall(text or ""):
+        if gap:
+            space = gap
+            continue
+        if comma:
+            if not args:
+                args.append([])
+            if item is not None:
+                args[-1].append(item)
+            item, space, after_comma = None, "", True
+            continue
+        value = quoted if word == "" else word
+        if not args:
+            args.append([])
+        elif space and not after_comma and item is not None:
+            if len(args) <= maxsplit:
+                args[-1].append(item)
+                args.append([])
+                item = None
+            else:
+                item += space
+        item = value if item is None else item + value
+        space, after_comma = "", False
+    if item is not None:
+        args[-1].append(item)
+
+    result = []
+    for names in args:
+        unique: list[str] = []
+        for name in (n.strip() for n in names):
+            if name and name not in unique:
+                unique.append(name)
+        result.append(unique)
+    return result
+
+
+async def resolve_projects(
+    proj_repo: ProjectRepository,
+    user_id: int,
+    idents: list[str],
+):
+    """Пакетный вариант resolve_project: все идентификаторы одним запросом get_projects_by_names.
+    Возвращает (found: {ident: project}, missing: {ident: suggestions}); подсказки ищутся
+    только для ненайденных.
+    """
+    numeric = {i: int(i.lstrip('#')) for i in idents if re.fullmatch(r"#?\d+", i)}
+    names = [i for i in idents if i not in numeric]
+    projects = await proj_repo.get_projects_by_names(user_id, names, list(numeric.values()))
+    by_id = {p.id: p for p in projects}
+    by_name: dict = {}
+    by_norm: dict = {}
+    for p in projects:
+        by_name.setdefault(p.name, p)
+        # Проекты отсортированы от новых к старым: при коллизии нормализованных имён побеждает новый
+        by_norm.setdefault(normalize_name(p.name), p)
+
+    found, missing = {}, {}
+    for ident in idents:
+        if ident in numeric:
+            p = by_id.get(numeric[ident])
+        else:
+            p = by_name.get(ident) or by_norm.get(normalize_name(ident))
+        if p:
+            found[ident] = p
+        elif ident in numeric:
+            missing[ident] = []
+        else:
+            missing[ident] = await proj_repo.suggest_project_names(user_id, ident)
+    return found, missing
+
+
+def _missing_text(missing: dict) -> str:
+    lines = []
+    for name, sugg in missing.items():
+        hint = (" Возможные совпадения: " + ", ".join(sugg)) if sugg else ""
+        lines.append(f"Проект '{name}' не найден у вас.{hint}")
+    return "\n".join(lines)
 
 
 @router.message(Command("grant_access"))
 async def cmd_grant_access(message: Message, session: AsyncSession):
-    """Выдать межпроектный доступ: /grant_access OWNER_NAME ALLOWED_NAME [SCOPE]
-    Пример: /grant_access ПроектА ПроектБ read
-    По умолчанию scope=read.
+    """Выдать межпроектный доступ: /grant_access OWNER_NAME ALLOWED_NAME[,ALLOWED_NAME...] [SCOPE]
+    Пример: /grant_access ПроектА ПроектБ, "Заметки, 2024", #12 read
+    Имена с запятой или пробелом — в двойных кавычках или по id (#12).
+    По умолчанию scope=read; иерархия read < summaries < all.
+    Все пары записываются одним INSERT ... ON CONFLICT.
     """
-    text = (message.text or "").strip()
-    parts = text.split(maxsplit=3)
-    if len(parts) < 3:
-        await message.answer("Использование: /grant_access OWNER_NAME ALLOWED_NAME [SCOPE]")
+    args = _parse_target_args(message.text, maxsplit=3)
+    if len(args) < 3 or len(args[1]) != 1 or not args[2]:
+        await message.answer(
+            "Использование: /grant_access OWNER_NAME ALLOWED_NAME[,ALLOWED_NAME...] [SCOPE]\n"
+            'Имя с запятой или пробелом возьмите в кавычки ("Заметки, 2024") или укажите id (#12).'
+        )
         return
 
-    owner_name = parts[1].strip()
-    allowed_name = parts[2].strip()
-    scope = parts[3].strip() if len(parts) >= 4 else "read"
+    owner_name = args[1][0]
+    allowed_names = args[2]
+    try:
+        scope = normalize_scope(", ".join(args[3]) if len(args) >= 4 else None)
+    except ValueError:
+        await message.answer(f"Неизвестный scope. Допустимо: {', '.join(SCOPE_LEVELS)} (read < summaries < all)")
+        return
 
     user_repo = UserRepository(session)
     proj_repo = ProjectRepository(session)
@@ -85,26 +180,25 @@ async def cmd_grant_access(message: Message, session: AsyncSession):
 
     user = await user_repo.get_or_create_user(message.from_user.id, message.from_user.username)
 
-    if owner_name == allowed_name:
+    if owner_name in allowed_names:
         await message.answer("Нельзя выдавать доступ проекту к самому себе")
         return
 
-    owner, owner_sugg = await resolve_project(proj_repo, user.telegram_id, owner_name)
-    allowed, allowed_sugg = await resolve_project(proj_repo, user.telegram_id, allowed_name)
-    if not owner:
-        hint = ("\nВозможные совпадения: " + ", ".join(owner_sugg)) if owner_sugg else ""
-        await message.answer(f"Проект '{owner_name}' не найден у вас.{hint}")
+    found, missing = await resolve_projects(proj_repo, user.telegram_id, [owner_name, *allowed_names])
+    if missing:
+        await message.answer(_missing_text(missing))
         return
-    if not allowed:
-        hint = ("\nВозможные совпадения: " + ", ".join(allowed_sugg)) if allowed_sugg else ""
-        await message.answer(f"Проект '{allowed_name}' не найден у вас.{hint}")
+    owner = found[owner_name]
+    targets = {found[n].id: found[n] for n in allowed_names}
+    if owner.id in targets:
+        await message.answer("Нельзя выдавать доступ проекту к самому себе")
         return
 
     try:
-        pa = await acl_repo.grant_access(owner.id, allowed.id, scope=scope)
-        await message.answer(
-            f"Разрешён доступ: '{owner.name}' -> '{allowed.name}' (scope={pa.scope})."
-        )
+        await acl_repo.grant_access_many(owner.id, list(targets), scope=scope)
+        acl_engine.invalidate_user(user.telegram_id)
+        names = ", ".join(f"'{p.name}'" for p in targets.values())
+        await message.answer(f"Разрешён доступ: '{owner.name}' -> {names} (scope={scope}).")
     except Exception as e:
         logger.error(f"grant_access error: {e}")
         await message.answer("Не удалось выдать доступ. Проверьте параметры и повторите.")
@@ -112,15 +206,20 @@ async def cmd_grant_access(message: Message, session: AsyncSession):
 
 @router.message(Command("revoke_access"))
 async def cmd_revoke_access(message: Message, session: AsyncSession):
-    """Отозвать доступ: /revoke_access OWNER_NAME ALLOWED_NAME"""
-    text = (message.text or "").strip()
-    parts = text.split(maxsplit=2)
-    if len(parts) < 3:
-        await message.answer("Использование: /revoke_access OWNER_NAME ALLOWED_NAME")
+    """Отозвать доступ: /revoke_access OWNER_NAME ALLOWED_NAME[,ALLOWED_NAME...]
+    Имена с запятой — в двойных кавычках или по id (#12), как в /grant_access.
+    Все пары удаляются одним DELETE.
+    """
+    args = _parse_target_args(message.text, maxsplit=2)
+    if len(args) < 3 or len(args[1]) != 1 or not args[2]:
+        await message.answer(
+            "Использование: /revoke_access OWNER_NAME ALLOWED_NAME[,ALLOWED_NAME...]\n"
+            'Имя с запятой возьмите в кавычки ("Заметки, 2024") или укажите id (#12).'
+        )
         return
 
-    owner_name = parts[1].strip()
-    allowed_name = parts[2].strip()
+    owner_name = args[1][0]
+    allowed_names = args[2]
 
     user_repo = UserRepository(session)
     proj_repo = ProjectRepository(session)
@@ -128,22 +227,24 @@ async def cmd_revoke_access(message: Message, session: AsyncSession):
 
     user = await user_repo.get_or_create_user(message.from_user.id, message.from_user.username)
 
-    owner, owner_sugg = await resolve_project(proj_repo, user.telegram_id, owner_name)
-    allowed, allowed_sugg = await resolve_project(proj_repo, user.telegram_id, allowed_name)
-    if not owner:
-        hint = ("\nВозможные совпадения: " + ", ".join(owner_sugg)) if owner_sugg else ""
-        await message.answer(f"Проект '{owner_name}' не найден у вас.{hint}")
-        return
-    if not allowed:
-        hint = ("\nВозможные совпадения: " + ", ".join(allowed_sugg)) if allowed_sugg else ""
-        await message.answer(f"Проект '{allowed_name}' не найден у вас.{hint}")
+    found, missing = await resolve_projects(proj_repo, user.telegram_id, [owner_name, *allowed_names])
+    if missing:
+        await message.answer(_missing_text(missing))
         return
+    owner = found[owner_name]
+    targets = {found[n].id: found[n] for n in allowed_names}
 
-    ok = await acl_repo.revoke_access(owner.id, allowed.id)
-    if ok:
-        await message.answer(f"Доступ отозван: '{owner.name}' -X-> '{allowed.name}'.")
-    else:
+    removed = await acl_repo.revoke_access_many(owner.id, list(targets))
+    acl_engine.invalidate_user(user.telegram_id)
+    if not removed:
         await message.answer("Такого доступа не было.")
+        return
+    names = ", ".join(f"'{targets[pid].name}'" for pid in targets if pid in removed)
+    lines = [f"Доступ отозван: '{owner.name}' -X-> {names}."]
+    absent = [f"'{p.name}'" for pid, p in targets.items() if pid not in removed]
+    if absent:
+        lines.append(f"Доступа не было: {', '.join(absent)}.")
+    await message.answer("\n".join(lines))
 
 
 @router.message(Command("list_access"))
@@ -170,7 +271,7 @@ async def cmd_list_access(message: Message, session: AsyncSession):
             await message.answer(f"Проект '{owner_name}' не найден у вас.{hint}")
             return
     else:
-        active = await sess_repo.get_active_session(user.telegram_id)
+        active = await sess_repo.get_active_session(user.telegram_id, with_history=False)
         if not active or not active.project_id:
             await message.answer("Укажите OWNER_NAME: /list_access OWNER_NAME (нет активного проекта)")
             return
@@ -179,17 +280,15 @@ async def cmd_list_access(message: Message, session: AsyncSession):
             await message.answer("Активный проект не найден.")
             return
 
-    access_rows = await acl_repo.list_access(owner.id)
+    # Имена проектов назначения приходят тем же запросом (JOIN), без запроса на каждую строку
+    access_rows = await acl_repo.list_access_named(owner.id)
     if not access_rows:
         await message.answer(f"У проекта '{owner.name}' нет выданных доступов.")
         return
 
     lines = [f"Доступы, выданные проектом '{owner.name}':"]
-    # Для удобства — показать имена проектов назначения
-    for pa in access_rows:
-        target = await proj_repo.get_project_by_id(pa.allowed_project_id)
-        target_name = target.name if target else f"id={pa.allowed_project_id}"
-        lines.append(f"- {target_name} (scope={pa.scope})")
+    for _, target_name, scope in access_rows:
+        lines.append(f"- {target_name} (scope={scope})")
 
     await message.answer("\n".join(lines))
 
@@ -215,7 +314,7 @@ async def cmd_door_check(message: Message, session: AsyncSession):
     if len(parts) == 2:
         # без OWNER_NAME: только ALLOWED_NAME
         allowed_name = parts[1].strip()
-        active = await sess_repo.get_active_session(user.telegram_id)
+        active = await sess_repo.get_active_session(user.telegram_id, with_history=False)
         if not active or not active.project_id:
             await message.answer("Укажите OWNER_NAME: /door_check OWNER_NAME ALLOWED_NAME (нет активного проекта)")
             return
@@ -241,6 +340,7 @@ async def cmd_door_check(message: Message, session: AsyncSession):
         await message.answer(f"Проект '{allowed_name}' не найден у вас.{hint}")
         return
 
-    is_ok = await acl_repo.is_allowed(owner.id, allowed.id)
-    status = "allowed" if is_ok else "denied"
+    # Учитывает транзитивные доступы (ACL_MAX_DEPTH) и иерархию scope
+    scope = await acl_engine.effective_scope(acl_repo, user.telegram_id, owner.id, allowed.id)
+    status = f"allowed (scope={scope})" if scope else "denied"
     await message.answer(f"ACL door: '{owner.name}' -> '{allowed.name}' = {status}")
@@ -57,7 +57,7 @@ async def cmd_context_mode(message: Message, session: AsyncSession):
     warn = ""
     if desired == "acl_mentions":
         # Если нет активного проекта, предупредим (жёсткая изоляция в обработчике текста)
-        sess = await repo.get_active_session(message.from_user.id)
+        sess = await repo.get_active_session(message.from_user.id, with_history=False)
         if not sess or not getattr(sess, "project_id", None):
             warn = "\n\n<i>Внимание: для acl_mentions требуется активный проект. Без него RAG не выполняется.</i>"
 
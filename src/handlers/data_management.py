@@ -1,12 +1,18 @@
 # Файл: src/handlers/data_management.py
-import json
+import datetime
+import html
 import logging # <-- Добавьте импорт
 from aiogram import Router, Bot, F # <-- Добавьте F
 from aiogram.types import Message, BufferedInputFile, ReplyKeyboardRemove # <-- Добавьте ReplyKeyboardRemove
-from aiogram.filters import Command
+from aiogram.filters import Command, CommandObject
 from aiogram.fsm.context import FSMContext # <-- Добавьте FSMContext
 from sqlalchemy.ext.asyncio import AsyncSession
-from src.db.repository import UserRepository, SessionRepository, PersonalizedPromptRepository
+from src.db.repository import UserRepository, SessionRepository, PersonalizedPromptRepository, UsageRepository
+from src.config import DAILY_TOKEN_LIMIT, RETENTION_DAYS
+from src.services import serializer
+from src.services.acl_engine import acl_engine
+from src.services.project_index import project_index
+from src.services.rag_client import RAGClient
 from src.personalization.states import DataManagement # <-- Добавьте импорт
 from src.personalization.keyboards import confirm_deletion_keyboard # <-- Добавьте импорт
 
@@ -27,6 +33,7 @@ async def cmd_export_data(message: Message, session: AsyncSession):
 
     # 2. Получаем все данные пользователя
     user_data = await user_repo.get_or_create_user(telegram_id=user_id)
+    # Истории архивных сессий подтягиваются из session_archives прозрачно
     user_sessions = await session_repo.list_sessions(user_id)
     
     # Предполагаем, что профили хранятся под известными именами
@@ -59,7 +66,7 @@ async def cmd_export_data(message: Message, session: AsyncSession):
     }
 
     # 4. Преобразуем в JSON и отправляем файл
-    json_data = json.dumps(export_payload, indent=4, ensure_ascii=False).encode('utf-8')
+    json_data = serializer.dumps_bytes(export_payload, indent=True)
     
     input_file = BufferedInputFile(
         file=json_data,
@@ -86,13 +93,18 @@ async def cmd_delete_my_data(message: Message, state: FSMContext):
     )
 
 @router.message(DataManagement.confirming_deletion, F.text == "Да, удалить все мои данные")
-async def process_confirm_deletion(message: Message, state: FSMContext, session: AsyncSession):
+async def process_confirm_deletion(
+    message: Message, state: FSMContext, session: AsyncSession, rag_client: RAGClient
+):
     """
     Обрабатывает подтверждение и удаляет данные.
     """
     await state.clear()
     user_repo = UserRepository(session)
     await user_repo.delete_all_user_data(message.from_user.id)
+    project_index.invalidate_user(message.from_user.id)
+    acl_engine.invalidate_user(message.from_user.id)
+    rag_client.retrieval_cache.invalidate_user(message.from_user.id)
 
     await message.answer(
         "Все ваши данные были успешно удалены. Спасибо за использование.",
@@ -109,4 +121,91 @@ async def process_cancel_deletion(message: Message, state: FSMContext):
         "Действие отменено. Ваши данные в безопасности.",
         reply_markup=ReplyKeyboardRemove()
     )
-# --- КОНЕЦ НОВОГО КОДА ---
\ No newline at end of file
+# --- КОНЕЦ НОВОГО КОДА ---
+
+
+@router.message(Command("usage"))
+async def cmd_usage(message: Message, command: CommandObject, session: AsyncSession):
+    """
+    Показывает фактический расход токенов и стоимость: квота на сегодня,
+    итоги за период (по умолчанию 7 дней) и разбивка по проектам. Формат: /usage [дней]
+    """
+    user_id = message.from_user.id
+    try:
+        days = max(1, min(int((command.args or "7").strip()), 365))
+    except ValueError:
+        await message.answer("Использование: /usage [дней], например /usage 30")
+        return
+    today = datetime.date.today()
+    since = today - datetime.timedelta(days=days - 1)
+
+    user = await UserRepository(session).get_or_create_user(user_id, message.from_user.username)
+    used_today = user.tokens_used_today if user.last_request_date == today else 0
+
+    usage_repo = UsageRepository(session)
+    projects = await usage_repo.project_rollup(user_id, since)
+    daily = await usage_repo.daily_totals(user_id, since)
+
+    lines = [
+        "<b>📊 Расход токенов</b>",
+        f"Сегодня (квота): {used_today} / {DAILY_TOKEN_LIMIT}",
+    ]
+    if not projects:
+        lines.append(f"\nЗа {days} дн. запросов к модели не было.")
+        await message.answer("\n".join(lines))
+        return
+
+    requests = sum(p["requests"] for p in projects)
+    prompt = sum(p["prompt_tokens"] for p in projects)
+    cached = sum(p["cached_tokens"] for p in projects)
+    completion = sum(p["completion_tokens"] for p in projects)
+    cost = sum(p["cost_usd"] for p in projects)
+    lines.append(
+        f"\n<b>За {days} дн.:</b> {requests} запросов, prompt {prompt} (из кэша {cached}), "
+        f"completion {completion}, ≈ ${cost:.4f}"
+    )
+    lines.append("\n<b>По проектам:</b>")
+    for p in projects:
+        name = html.escape(p["project_name"]) if p["project_name"] else (
+            "без проекта" if p["project_id"] is None else f"удалённый проект #{p['project_id']}"
+        )
+        lines.append(f"• {name}: {p['prompt_tokens'] + p['completion_tokens']} ток., ≈ ${p['cost_usd']:.4f}")
+    if len(daily) > 1:
+        lines.append("\n<b>По дням:</b>")
+        for d in daily:
+            lines.append(f"{d['day'].strftime('%d.%m')}: {d['prompt_tokens'] + d['completion_tokens']} ток., ≈ ${d['cost_usd']:.4f}")
+    await message.answer("\n".join(lines))
+
+
+@router.message(Command("retention"))
+async def cmd_retention(message: Message, command: CommandObject, session: AsyncSession):
+    """
+    Срок хранения закрытых сессий: /retention — показать, /retention 90 — хранить 90 дней,
+    /retention 0 — бессрочно, /retention default — вернуть срок по умолчанию.
+    """
+    user_repo = UserRepository(session)
+    user = await user_repo.get_or_create_user(message.from_user.id, message.from_user.username)
+    arg = (command.args or "").strip().lower()
+    if not arg:
+        days = user.retention_days if user.retention_days is not None else RETENTION_DAYS
+        suffix = "" if user.retention_days is not None else " (по умолчанию)"
+        current = "бессрочно" if days == 0 else f"{days} дн."
+        await message.answer(f"Закрытые сессии хранятся: {current}{suffix}.\nИзменить: /retention ДНЕЙ | 0 | default")
+        return
+    if arg == "default":
+        days = None
+    else:
+        try:
+            days = int(arg)
+            if not 0 <= days <= 3650:
+                raise ValueError
+        except ValueError:
+            await message.answer("Использование: /retention [ДНЕЙ от 0 до 3650 | default]")
+            return
+    await user_repo.set_retention_days(user.telegram_id, days)
+    if days is None:
+        await message.answer(f"Срок хранения сброшен на значение по умолчанию: {RETENTION_DAYS} дн.")
+    elif days == 0:
+        await message.answer("Закрытые сессии будут храниться бессрочно.")
+    else:
+        await message.answer(f"Закрытые сессии старше {days} дн. будут удаляться автоматически.")
@@ -8,6 +8,7 @@ from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from src.db.models import load_deferred
 from src.db.repository import UserRepository, ProjectRepository, SessionRepository, ModeRepository
 
 router = Router()
@@ -28,7 +29,7 @@ async def _require_active_project(message: Message, session: AsyncSession):
     sess_repo = SessionRepository(session)
 
     user = await user_repo.get_or_create_user(message.from_user.id, message.from_user.username)
-    active = await sess_repo.get_active_session(user.telegram_id)
+    active = await sess_repo.get_active_session(user.telegram_id, with_history=False)
     if not active or not active.project_id:
         await message.answer("Нет активного проекта. Используйте /use_project или /new_project.")
         return None, None, None, None
@@ -270,7 +271,7 @@ async def mode_info(message: Message, session: AsyncSession):
     mode_repo = ModeRepository(session)
 
     user = await user_repo.get_or_create_user(message.from_user.id, message.from_user.username)
-    active = await sess_repo.get_active_session(user.telegram_id)
+    active = await sess_repo.get_active_session(user.telegram_id, with_history=False)
     if not active:
         await message.answer("Нет активной сессии. Используйте /start_session.")
         return
@@ -289,13 +290,14 @@ async def mode_info(message: Message, session: AsyncSession):
         if md:
             t = f", t={md.temperature}" if md.temperature not in (None, "") else ""
             sess_mode_line = f"сессия-мод: {md.name}{t} (id={md.id})"
-            # покажем tools_config коротко
-            if md.tools_config:
+            # покажем tools_config коротко (колонка отложенная — грузим явно)
+            tools_config = await load_deferred(md, 'tools_config')
+            if tools_config:
                 try:
-                    parsed = json.loads(md.tools_config)
+                    parsed = json.loads(tools_config)
                     preview = json.dumps(parsed, ensure_ascii=False)[:400]
                 except Exception:
-                    preview = (md.tools_config or "")[:400]
+                    preview = tools_config[:400]
                 sess_mode_line += f"\ntools: {preview}..."
 
     await message.answer("\n".join([
@@ -314,7 +316,7 @@ async def mode_unset(message: Message, session: AsyncSession):
     sess_repo = SessionRepository(session)
 
     user = await user_repo.get_or_create_user(message.from_user.id, message.from_user.username)
-    active = await sess_repo.get_active_session(user.telegram_id)
+    active = await sess_repo.get_active_session(user.telegram_id, with_history=False)
     if not active:
         await message.answer("Нет активной сессии. Используйте /start_session.")
         return
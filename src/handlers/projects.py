@@ -15,6 +15,8 @@ from src.personalization.keyboards import (
 )
 from src.db.repository import UserRepository, ProjectRepository, SessionRepository
 from src.services.llm_client import LLMClient
+from src.services.acl_engine import acl_engine
+from src.services.project_index import project_index
 
 router = Router()
 logger = logging.getLogger(__name__)
@@ -28,52 +30,6 @@ PROFILE_MAP_RU_TO_KEY = {
 # --- Helpers ---
 
 import re
-import unicodedata
-
-def _norm(s: str) -> str:
-    """Unicode NFKC + casefold + trim + упрощённая латинизация конфузаблов.
-    Важно: делаем только безопасные подстановки визуально-сходных символов
-    в ASCII, чтобы улучшить поиск по имени между кириллицей/греческими буквами.
-    Не влияет на исходные данные в БД, используется только для сравнения/поиска.
-    """
-    base = unicodedata.normalize("NFKC", (s or "").strip()).casefold()
-    # Частые конфузаблы: кириллические и греческие буквы, похожие на латиницу
-    confusables = {
-        # Cyrillic -> Latin
-        "а": "a",  # U+0430
-        "е": "e",  # U+0435
-        "о": "o",  # U+043E
-        "р": "r",  # U+0440
-        "с": "c",  # U+0441
-        "у": "y",  # U+0443
-        "х": "x",  # U+0445
-        "к": "k",  # U+043A
-        "т": "t",  # U+0442
-        "в": "v",  # U+0432
-        "м": "m",  # U+043C
-        "н": "n",  # U+043D
-        # Greek -> Latin (минимально необходимое)
-        "α": "a",  # alpha
-        "β": "b",
-        "γ": "g",
-        "δ": "d",
-        "ε": "e",
-        "η": "h",
-        "ι": "i",
-        "κ": "k",
-        "λ": "l",
-        "μ": "m",
-        "ν": "n",
-        "ο": "o",
-        "π": "p",
-        "ρ": "r",
-        "τ": "t",
-        "υ": "y",
-        "χ": "x",
-        "ο": "o",
-    }
-    # Применяем замену посимвольно
-    return "".join(confusables.get(ch, ch) for ch in base)
 
 def _build_system_prompt(name: str, goal: str | None, context: str | None, mode_key: str) -> str:
     role_map = {
@@ -212,6 +168,7 @@ async def new_project_confirm(message: Message, state: FSMContext, session: Asyn
             system_prompt=system_prompt,
             backlog=backlog,
         )
+        project_index.invalidate_user(user.telegram_id)
     except ValueError as e:
         await message.answer(str(e))
         return
@@ -244,7 +201,7 @@ async def list_projects(message: Message, session: AsyncSession):
 
     user = await user_repo.get_or_create_user(message.from_user.id, message.from_user.username)
     projects = await proj_repo.list_projects(user.telegram_id)
-    active = await sess_repo.get_active_session(user.telegram_id)
+    active = await sess_repo.get_active_session(user.telegram_id, with_history=False)
     active_project_id = active.project_id if active else None
 
     if not projects:
@@ -290,19 +247,12 @@ async def use_project(message: Message, session: AsyncSession):
     # 2) Точное имя
     if not project:
         project = await proj_repo.get_project_by_name(user.telegram_id, target_name)
-    # 3) Нормализованное равенство среди проектов пользователя
+    # 3) Нормализованное равенство (индекс по projects.name_norm)
     if not project:
-        all_projects = await proj_repo.list_projects(user.telegram_id)
-        tgt_n = _norm(target_name)
-        for p in all_projects:
-            if _norm(p.name) == tgt_n:
-                project = p
-                break
+        project = await proj_repo.get_project_by_norm_name(user.telegram_id, target_name)
     if not project:
         # 4) Предложить похожие по подстроке после нормализации
-        all_projects = all_projects if 'all_projects' in locals() else await proj_repo.list_projects(user.telegram_id)
-        tgt_n = _norm(target_name)
-        suggestions = [p.name for p in all_projects if tgt_n and tgt_n in _norm(p.name)]
+        suggestions = await proj_repo.suggest_project_names(user.telegram_id, target_name)
         hint = ("\nВозможные совпадения: " + ", ".join(suggestions[:5])) if suggestions else ""
         await message.answer("Проект не найден. Проверьте имя или вызовите /projects для списка." + hint)
         return
@@ -366,6 +316,7 @@ async def rename_project(message: Message, session: AsyncSession):
     except ValueError as e:
         await message.answer(str(e))
         return
+    project_index.invalidate_user(user.telegram_id)
 
     await message.answer(f"Проект переименован: '{old_name}' → '{proj.name}' (id={proj.id}).")
 
@@ -395,7 +346,7 @@ async def delete_project(message: Message, session: AsyncSession):
     user = await user_repo.get_or_create_user(message.from_user.id, message.from_user.username)
 
     # Если удаляется активный проект — закрываем активную сессию (она удалится каскадом, но статус завершим явно)
-    active = await sess_repo.get_active_session(user.telegram_id)
+    active = await sess_repo.get_active_session(user.telegram_id, with_history=False)
     if active and active.project_id:
         proj = await proj_repo.get_project_by_id(active.project_id)
         if proj and proj.name == name:
@@ -405,4 +356,6 @@ async def delete_project(message: Message, session: AsyncSession):
     if not ok:
         await message.answer("Проект не найден.")
         return
+    project_index.invalidate_user(user.telegram_id)
+    acl_engine.invalidate_user(user.telegram_id)
     await message.answer(f"Проект '{name}' удалён.")
@@ -3,13 +3,13 @@ import logging
 import json
 import asyncio
 import re  # <-- 1. Импортируем модуль для регулярных выражений
-import unicodedata
 from aiogram import Router, F, Bot
 from aiogram.enums import ChatAction
 from aiogram.types import Message, ReplyKeyboardMarkup, KeyboardButton, ReplyKeyboardRemove
 from aiogram.filters import Command, StateFilter
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
+from src.config import HISTORY_TURN_TAIL_MESSAGES
 from src.db.models import Mode
 from src.db.repository import (
     UserRepository,
@@ -17,10 +17,16 @@ from src.db.repository import (
     PersonalizedPromptRepository,
     ProjectRepository,
     ProjectAccessRepository,
+    UsageRepository,
 )
-from src.services.llm_client import LLMClient
+from src.services.llm_client import LLMClient, LLMResult, UsageTotals, track_usage
 from src.services.rag_client import RAGClient
+from src.services.rag_selection import RAGMatch
+from src.services.project_index import project_index, extract_mentions
 from src.services.prompt_builder import build_prompt
+from src.services.retry_policy import turn_deadline
+from src.services.semantic_cache import SemanticResponseCache
+from src.services.metrics import observe_stage, set_turn_labels, reset_turn_labels
 
 router = Router()
 logger = logging.getLogger(__name__)
@@ -36,19 +42,13 @@ def clean_html(raw_html: str) -> str:
     cleantext = re.sub(cleanr, '', raw_html)
     return cleantext
 
-# --- Нормализация имён проектов для устойчивого сравнения ---
-def _norm(s: str) -> str:
-    """Unicode NFKC + casefold + trim для сравнения имён (не меняет исходные).
-    Совместимо с handlers/acl.py._norm.
-    """
-    return unicodedata.normalize("NFKC", (s or "").strip()).casefold()
-
 # --- Безопасное редактирование: если нельзя отредактировать, отправляем новое сообщение ---
 async def safe_edit_or_send(bot: Bot, status_message: Message, text: str):
-    try:
-        await status_message.edit_text(text)
-    except Exception:
-        await bot.send_message(chat_id=status_message.chat.id, text=text)
+    with observe_stage("telegram_edit"):
+        try:
+            await status_message.edit_text(text)
+        except Exception:
+            await bot.send_message(chat_id=status_message.chat.id, text=text)
 
 # --- ОБРАБОТЧИКИ КОМАНД (без изменений) ---
 @router.message(Command("start_session"))
@@ -76,7 +76,15 @@ async def cmd_end_session(message: Message, session: AsyncSession, llm_client: L
     await message.answer("Подвожу итоги сессии...")
     history = active_session.message_history
     if history:
-        summary = await llm_client.get_summary(history)
+        with track_usage() as usage:
+            summary = await llm_client.get_summary(history)
+        # Итоги сессии обязательны, поэтому без резерва: списываем фактический расход после вызова
+        await UserRepository(session).settle_tokens(message.from_user.id, 0, usage.total_tokens)
+        await _record_usage(
+            UsageRepository(session), message.from_user.id, usage,
+            project_id=active_session.project_id, session_id=active_session.id,
+            mode_id=getattr(active_session, 'mode_id', None),
+        )
         await rag_client.save_summary(
             active_session.id,
             message.from_user.id,
@@ -90,13 +98,14 @@ async def cmd_end_session(message: Message, session: AsyncSession, llm_client: L
 @router.message(Command("list_sessions"))
 async def cmd_list_sessions(message: Message, session: AsyncSession):
     repo = SessionRepository(session)
-    user_sessions = await repo.list_sessions(message.from_user.id)
+    # Для списка история не нужна: не читаем message_history и архив
+    user_sessions = await repo.list_sessions(message.from_user.id, include_history=False)
     if not user_sessions:
         await message.answer("У вас еще нет ни одной сессии.")
         return
     response_text = "Ваши сессии:\n\n"
     for s in user_sessions:
-        status_emoji = "🟢" if s.status == 'active' else "🔴"
+        status_emoji = "🟢" if s.status == 'active' else ("🗄" if s.archived_at else "🔴")
         response_text += f"{status_emoji} Сессия #{s.id} от {s.created_at.strftime('%Y-%m-%d %H:%M')}\n"
     await message.answer(response_text)
 
@@ -106,7 +115,7 @@ async def cmd_current(message: Message, session: AsyncSession):
     sess_repo = SessionRepository(session)
     proj_repo = ProjectRepository(session)
 
-    active = await sess_repo.get_active_session(message.from_user.id)
+    active = await sess_repo.get_active_session(message.from_user.id, with_history=False)
     if not active:
         await message.answer(
             "Активной сессии нет. Используйте /start_session для начала или /projects для выбора проекта."
@@ -156,7 +165,7 @@ async def pin_status(message: Message, session: AsyncSession, bot: Bot):
     proj_repo = ProjectRepository(session)
 
     user = await user_repo.get_or_create_user(message.from_user.id, message.from_user.username)
-    active = await sess_repo.get_active_session(user.telegram_id)
+    active = await sess_repo.get_active_session(user.telegram_id, with_history=False)
     if not active:
         await message.answer("Нет активной сессии. Используйте /start_session или /projects.")
         return
@@ -198,21 +207,94 @@ async def pin_status(message: Message, session: AsyncSession, bot: Bot):
         # Нет прав или закрепление запрещено — просто оставляем сообщение
         pass
 
+LIMIT_EXCEEDED_TEXT = "Вы превысили суточный лимит использования токенов. Попробуйте снова завтра."
+
+
+async def _record_usage(
+    usage_repo: UsageRepository,
+    user_id: int,
+    usage: UsageTotals | None,
+    project_id: int | None = None,
+    session_id: int | None = None,
+    mode_id: int | None = None,
+):
+    """Пишет фактический usage хода в журнал расходов; сбой учёта не должен ломать ответ пользователю."""
+    if not usage or not usage.records:
+        return
+    try:
+        await usage_repo.record(user_id, usage.records, project_id=project_id, session_id=session_id, mode_id=mode_id)
+    except Exception as e:
+        logger.error(f"Failed to record usage for user {user_id}: {e}", exc_info=True)
+
+
+async def _settle_quota(user_repo: UserRepository, user_id: int, reserved: int, actual: int):
+    """Списывает фактический расход вместо резерва; сбой не должен подменять ошибку LLM или ломать ответ."""
+    try:
+        await user_repo.settle_tokens(user_id, reserved, actual)
+    except Exception as e:
+        logger.error(
+            f"Failed to settle quota for user {user_id} (reserved={reserved}, actual={actual}): {e}", exc_info=True
+        )
+
+
+async def _get_response_within_quota(
+    user_repo: UserRepository,
+    usage_repo: UsageRepository,
+    llm_client: LLMClient,
+    user_id: int,
+    system_prompt: str,
+    history: list,
+    user_text: str,
+    rag_context: list[RAGMatch] | None,
+    temperature: float | None = None,
+    tools_config: dict | None = None,
+    project_id: int | None = None,
+    session_id: int | None = None,
+    mode_id: int | None = None,
+) -> LLMResult | None:
+    """Резервирует оценку токенов, вызывает LLM и списывает фактический usage. None — лимит исчерпан."""
+    estimate = llm_client.estimate_tokens(system_prompt, history, user_text, rag_context, tools_config)
+    if await user_repo.reserve_tokens(user_id, estimate) is None:
+        return None
+    usage = None
+    try:
+        # Общий дедлайн на все попытки LLM в рамках хода: неповторяемые ошибки не ждём
+        with turn_deadline(), track_usage() as usage:
+            return await llm_client.get_response(
+                system_prompt, history, user_text, rag_context=rag_context,
+                temperature=temperature, tools_config=tools_config,
+            )
+    finally:
+        # Квота — по реальному usage (system + история + RAG + ответ); при ошибке — только потраченное
+        await _settle_quota(user_repo, user_id, estimate, usage.total_tokens if usage else 0)
+        await _record_usage(usage_repo, user_id, usage, project_id, session_id, mode_id)
+
+
 # --- ОБЩИЙ ОБРАБОТЧИК ТЕКСТА (исключаем команды и любые активные FSM состояния) ---
-@router.message(F.content_type.in_({'text'}), ~F.text.regexp(r'^/'), StateFilter(None))
-async def handle_text_message(message: Message, session: AsyncSession, bot: Bot, llm_client: LLMClient, rag_client: RAGClient):
+# flags.coalesce: быстрые серии сообщений склеиваются в один ход (см. UserTurnSerializer)
+@router.message(F.content_type.in_({'text'}), ~F.text.regexp(r'^/'), StateFilter(None), flags={"coalesce": True})
+async def handle_text_message(
+    message: Message,
+    session: AsyncSession,
+    bot: Bot,
+    llm_client: LLMClient,
+    rag_client: RAGClient,
+    response_cache: SemanticResponseCache | None = None,
+    coalesced_text: str | None = None,
+):
     user_id = message.from_user.id
+    # Текст хода: одно сообщение или склеенная серия быстрых сообщений
+    user_text = coalesced_text or message.text
     user_repo = UserRepository(session)
+    usage_repo = UsageRepository(session)
     session_repo = SessionRepository(session)
     project_repo = ProjectRepository(session)
     
-    user = await user_repo.get_or_create_user(user_id, message.from_user.username)
-    request_tokens = llm_client.count_tokens(message.text)
-    if not await user_repo.check_and_update_limits(user, request_tokens):
-        await message.answer("Вы превысили суточный лимит использования токенов. Попробуйте снова завтра.")
-        return
+    # Квота списывается атомарно: резерв перед вызовом LLM, расчёт по фактическому usage после
+    await user_repo.get_or_create_user(user_id, message.from_user.username)
 
-    active_session = await session_repo.get_active_session(user_id)
+    # Для хода нужен только хвост истории: бюджет токенов всё равно берёт последние сообщения
+    active_session = await session_repo.get_active_session(user_id, history_tail=HISTORY_TURN_TAIL_MESSAGES or None)
     if not active_session:
         # Неблокирующий режим: пробуем ответить эпизодически без сохранения истории.
         # 1) Предложим быстрые действия
@@ -244,20 +326,23 @@ async def handle_text_message(message: Message, session: AsyncSession, bot: Bot,
 
             # Эфемерный режим: строгая изоляция — без межпроектного доступа.
             await safe_edit_or_send(bot, status_message, "<i>Анализирую запрос...\nИщу релевантную информацию в долгосрочной памяти...</i>")
-            relevant_summaries = await rag_client.find_relevant_summaries(user_id, message.text, project_id=None)
+            allocation = llm_client.plan_budget(user_text)
+            relevant_summaries = await rag_client.find_relevant_summaries(
+                user_id, user_text, top_k=allocation.rag_candidates, project_id=None, token_budget=allocation.rag
+            )
             cross_info = ""
             await safe_edit_or_send(bot, status_message, (
                 f"<i>Анализирую запрос...\nИщу релевантную информацию в долгосрочной памяти... ✓\n"
                 f"Найдено {len(relevant_summaries)} итогов{cross_info}.\nФормирую запрос к AI...</i>"
             ))
 
-            response_text_raw = await llm_client.get_response(
-                system_prompt, history, message.text, rag_context=relevant_summaries
+            result = await _get_response_within_quota(
+                user_repo, usage_repo, llm_client, user_id, system_prompt, history, user_text, relevant_summaries
             )
-            response_text = clean_html(response_text_raw)
-
-            response_tokens = llm_client.count_tokens(response_text)
-            await user_repo.check_and_update_limits(user, response_tokens)
+            if result is None:
+                await safe_edit_or_send(bot, status_message, LIMIT_EXCEEDED_TEXT)
+                return
+            response_text = clean_html(result.text)
 
             await safe_edit_or_send(bot, status_message, response_text + "\n\n--- \n<i>Эфемерный ответ (без активной сессии). Используйте /start_session для контекстного диалога.</i>")
         except Exception as e:
@@ -266,6 +351,8 @@ async def handle_text_message(message: Message, session: AsyncSession, bot: Bot,
         return
 
     status_message = await message.answer("<i>Анализирую запрос...</i>")
+    # Метки хода для счётчиков токенов (user/project/mode)
+    labels_token = set_turn_labels(user_id, active_session.project_id, getattr(active_session, 'mode_id', None))
     try:
         # 1) Определяем активный проект и строим system_prompt через Prompt Builder
         active_project = None
@@ -273,7 +360,7 @@ async def handle_text_message(message: Message, session: AsyncSession, bot: Bot,
             active_project = await project_repo.get_project_by_id(active_session.project_id)
 
         try:
-            system_prompt, mode_temperature = await build_prompt(session, user_id, active_session, active_project)
+            system_prompt, mode_temperature, tools_config = await build_prompt(session, user_id, active_session, active_project)
         except ValueError as e:
             await safe_edit_or_send(bot, status_message, str(e))
             return
@@ -285,19 +372,29 @@ async def handle_text_message(message: Message, session: AsyncSession, bot: Bot,
         session_repo = SessionRepository(session)
         context_mode = await session_repo.get_context_mode(user_id)
 
-        relevant_summaries: list[str] = []
+        # Бюджет хода (system/RAG/история/ответ) из настроек и tools_config.budget мода
+        allocation = llm_client.plan_budget(user_text, tools_config)
+        logger.info(f"Turn budget user={user_id}: {allocation.describe()}")
+
+        # Семантический кэш (opt-in): эмбеддинг вопроса считаем один раз и переиспользуем в RAG
+        cache_enabled = response_cache is not None and response_cache.enabled_for(tools_config)
+        query_embedding = await rag_client.embed_query(user_text) if cache_enabled else None
+
+        relevant_summaries: list[RAGMatch] = []
         cross_info = ""
 
         if context_mode == 'global':
             # Полностью глобальный поиск без проектного фильтра
             relevant_summaries = await rag_client.find_relevant_summaries(
-                user_id, message.text, project_id=None, project_ids=None
+                user_id, user_text, top_k=allocation.rag_candidates, project_id=None, project_ids=None,
+                query_embedding=query_embedding, token_budget=allocation.rag,
             )
         elif context_mode == 'project':
             # Только текущий проект (если он задан), иначе глобально
             pid = active_project.id if active_project else None
             relevant_summaries = await rag_client.find_relevant_summaries(
-                user_id, message.text, project_id=pid, project_ids=None
+                user_id, user_text, top_k=allocation.rag_candidates, project_id=pid, project_ids=None,
+                query_embedding=query_embedding, token_budget=allocation.rag,
             )
         else:
             # acl_mentions: текущий проект + упомянутые @[Project] по ACL
@@ -309,42 +406,21 @@ async def handle_text_message(message: Message, session: AsyncSession, bot: Bot,
             else:
                 project_ids.append(active_project.id)
 
-                mentions = re.findall(r"@\[([^\]]+)\]", message.text or "")
-                unique_mentions: list[str] = []
-                for name in mentions:
-                    n = name.strip()
-                    if n and n not in unique_mentions:
-                        unique_mentions.append(n)
-
-                ignored_missing: list[str] = []   # не найден проект у пользователя
-                ignored_denied: list[str] = []    # нет ACL-доступа
-
-                if unique_mentions:
-                    acl_repo = ProjectAccessRepository(session)
-                    # Предзагрузим список проектов пользователя для нормализованного поиска
-                    user_projects = await project_repo.list_projects(user_id)
-                    for proj_name in unique_mentions:
-                        # 1) Пытаемся точным именем
-                        other_proj = await project_repo.get_project_by_name(user_id, proj_name)
-                        # 2) Если не нашли — пробуем нормализованное сравнение среди проектов пользователя
-                        if not other_proj and user_projects:
-                            target_norm = _norm(proj_name)
-                            for p in user_projects:
-                                if _norm(getattr(p, 'name', '')) == target_norm:
-                                    other_proj = p
-                                    break
-                        if not other_proj:
-                            ignored_missing.append(proj_name)
-                            continue
-                        if await acl_repo.is_allowed(active_project.id, other_proj.id):
-                            project_ids.append(other_proj.id)
-                        else:
-                            ignored_denied.append(proj_name)
+                # Все упоминания резолвятся по кэшированным индексу имён и ACL-графу (см. project_index, acl_engine)
+                resolution = await project_index.resolve_mentions(
+                    project_repo, ProjectAccessRepository(session), user_id, active_project.id, extract_mentions(user_text)
+                )
+                project_ids.extend(resolution.project_ids)
+                ignored_missing = resolution.missing   # не найден проект у пользователя
+                ignored_denied = resolution.denied     # нет ACL-доступа
 
                 relevant_summaries = await rag_client.find_relevant_summaries(
-                    user_id, message.text,
+                    user_id, user_text,
+                    top_k=allocation.rag_candidates,
                     project_id=None if project_ids else (active_project.id if active_project else None),
                     project_ids=project_ids if project_ids else None,
+                    query_embedding=query_embedding,
+                    token_budget=allocation.rag,
                 )
 
                 if project_ids and len(project_ids) > 1:
@@ -366,29 +442,55 @@ async def handle_text_message(message: Message, session: AsyncSession, bot: Bot,
         )
         await safe_edit_or_send(bot, status_message, log_text)
 
-        response_text_raw = await llm_client.get_response(
-            system_prompt, history, message.text, rag_context=relevant_summaries, temperature=mode_temperature
-        )
+        cache_key = (user_id, active_session.project_id, getattr(active_session, 'mode_id', None))
+        turn_note = ""
+        cache_fingerprint = None
+        cached_answer = None
+        if cache_enabled and query_embedding:
+            cache_fingerprint = response_cache.fingerprint(system_prompt, relevant_summaries)
+            cached_answer = response_cache.lookup(cache_key, query_embedding, cache_fingerprint)
+
+        if cached_answer is not None:
+            # Ответ из кэша не тратит токены модели — квоту не резервируем
+            response_text_raw = cached_answer
+        else:
+            result = await _get_response_within_quota(
+                user_repo, usage_repo, llm_client, user_id, system_prompt, history, user_text, relevant_summaries,
+                temperature=mode_temperature, tools_config=tools_config,
+                project_id=active_session.project_id, session_id=active_session.id,
+                mode_id=getattr(active_session, 'mode_id', None),
+            )
+            if result is None:
+                await safe_edit_or_send(bot, status_message, LIMIT_EXCEEDED_TEXT)
+                return
+            response_text_raw = result.text
+            turn_note = f" · {result.model}, {result.usage.total_tokens} ток."
+            if cache_fingerprint is not None:
+                response_cache.store(cache_key, query_embedding, cache_fingerprint, response_text_raw)
 
         # --- 3. ПРИМЕНЯЕМ ОЧИСТКУ ---
         response_text = clean_html(response_text_raw)
 
-        response_tokens = llm_client.count_tokens(response_text)
-        await user_repo.check_and_update_limits(user, response_tokens)
-
         current_history_text = " ".join([msg['content'] for msg in history])
         token_count = llm_client.count_tokens(current_history_text)
-        CONTEXT_WINDOW = 16000 
+        # Сколько истории поместится в промпт — бюджет истории модели, ответившей на ход
+        if cached_answer is None and result.allocation is not None:
+            allocation = result.allocation
+        cache_note = " · ответ из кэша" if cached_answer is not None else turn_note
         response_with_context = (
             f"{response_text}\n\n"
             f"--- \n"
-            f"<i>Контекст сессии: {token_count} / {CONTEXT_WINDOW} токенов</i>"
+            f"<i>Контекст сессии: {token_count} / {allocation.history} токенов{cache_note}</i>"
         )
         
         await safe_edit_or_send(bot, status_message, response_with_context)
         
-        await session_repo.update_message_history(active_session.id, {"role": "user", "content": message.text})
-        await session_repo.update_message_history(active_session.id, {"role": "assistant", "content": response_text})
+        await session_repo.append_messages(active_session.id, [
+            {"role": "user", "content": user_text},
+            {"role": "assistant", "content": response_text},
+        ])
     except Exception as e:
         logger.error(f"Error in handle_text_message: {e}", exc_info=True)
-        await safe_edit_or_send(bot, status_message, "Произошла непредвиденная ошибка.")
\ No newline at end of file
+        await safe_edit_or_send(bot, status_message, "Произошла непредвиденная ошибка.")
+    finally:
+        reset_turn_labels(labels_token)
\ No newline at end of file
@@ -0,0 +1,135 @@
+# Файл: C:\desk_top\src\services\acl_engine.py
+import logging
+import time
+from dataclasses import dataclass, field
+
+from src.config import ACL_MAX_DEPTH, ACL_RAG_SCOPE, ACL_CACHE_TTL_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# Иерархия областей прав: более широкий scope включает более узкие
+SCOPE_LEVELS = {"read": 1, "summaries": 2, "all": 3}
+DEFAULT_SCOPE = "read"
+
+
+def normalize_scope(scope: str | None) -> str:
+    """Проверяет scope из пользовательского ввода. ValueError для неизвестных значений."""
+    value = (scope or DEFAULT_SCOPE).strip().lower()
+    if value not in SCOPE_LEVELS:
+        raise ValueError(f"Неизвестный scope '{scope}'. Допустимо: {', '.join(SCOPE_LEVELS)}")
+    return value
+
+
+def scope_level(scope: str | None) -> int:
+    """Уровень scope. Неизвестные значения из старых записей трактуются как read:
+    до введения иерархии любая запись давала доступ на чтение."""
+    return SCOPE_LEVELS.get((scope or "").strip().lower(), SCOPE_LEVELS[DEFAULT_SCOPE])
+
+
+def scope_name(level: int) -> str:
+    for name, lvl in SCOPE_LEVELS.items():
+        if lvl == level:
+            return name
+    return DEFAULT_SCOPE
+
+
+@dataclass
+class _UserGraph:
+    # owner_project_id -> {allowed_project_id: уровень scope}
+    edges: dict[int, dict[int, int]]
+    loaded_at: float
+    # (owner_project_id, max_depth) -> {project_id: эффективный уровень}
+    reach: dict[tuple[int, int], dict[int, int]] = field(default_factory=dict)
+
+
+def compute_reachability(edges: dict[int, dict[int, int]], owner_project_id: int, max_depth: int) -> dict[int, int]:
+    """Проекты, достижимые из owner за не более чем max_depth переходов, с эффективным уровнем scope.
+
+    Уровень пути — минимум по его рёбрам (транзитивный доступ не шире любого звена), уровень
+    проекта — максимум по путям. Считается по шагам Беллмана-Форда: после k-го шага best содержит
+    лучший уровень среди путей длиной не более k.
+    """
+    best: dict[int, int] = {owner_project_id: max(SCOPE_LEVELS.values())}
+    for _ in range(max(1, max_depth)):
+        updated = dict(best)
+        for src, level in best.items():
+            for dst, edge_level in edges.get(src, {}).items():
+                candidate = min(level, edge_level)
+                if candidate > updated.get(dst, 0):
+                    updated[dst] = candidate
+        if updated == best:
+            break
+        best = updated
+    best.pop(owner_project_id, None)
+    return best
+
+
+class ACLEngine:
+    """Граф межпроектных доступов пользователя с кэшем достижимости.
+
+    Все рёбра ACL пользователя загружаются одним запросом (ProjectAccessRepository.list_user_edges),
+    достижимость owner-проекта считается один раз на (owner, глубина) и переиспользуется для любых
+    проверок scope. grant/revoke и удаление проектов сбрасывают граф пользователя; TTL страхует от
+    изменений в обход хендлеров. Пользователь закреплён за одним воркером (см. webhook.partition_for).
+    """
+
+    def __init__(self, ttl_seconds: float = ACL_CACHE_TTL_SECONDS, max_depth: int = ACL_MAX_DEPTH):
+        self.ttl_seconds = ttl_seconds
+        self.max_depth = max_depth
+        self._graphs: dict[int, _UserGraph] = {}
+        self.hits = 0
+        self.misses = 0
+
+    async def _graph(self, acl_repo, user_id: int) -> _UserGraph:
+        graph = self._graphs.get(user_id)
+        if graph and time.monotonic() - graph.loaded_at <= self.ttl_seconds:
+            return graph
+        edges: dict[int, dict[int, int]] = {}
+        for owner, allowed, scope in await acl_repo.list_user_edges(user_id):
+            edges.setdefault(owner, {})[allowed] = scope_level(scope)
+        graph = _UserGraph(edges, time.monotonic())
+        self._graphs[user_id] = graph
+        return graph
+
+    async def reachable(self, acl_repo, user_id: int, owner_project_id: int) -> dict[int, int]:
+        """{project_id: эффективный уровень scope} для owner-проекта."""
+        graph = await self._graph(acl_repo, user_id)
+        key = (owner_project_id, self.max_depth)
+        reach = graph.reach.get(key)
+        if reach is not None:
+            self.hits += 1
+            return reach
+        self.misses += 1
+        reach = compute_reachability(graph.edges, owner_project_id, self.max_depth)
+        graph.reach[key] = reach
+        return reach
+
+    async def allowed_projects(
+        self, acl_repo, user_id: int, owner_project_id: int, required_scope: str = ACL_RAG_SCOPE
+    ) -> frozenset[int]:
+        """Проекты, доступные owner-проекту как минимум с required_scope."""
+        need = scope_level(required_scope)
+        reach = await self.reachable(acl_repo, user_id, owner_project_id)
+        return frozenset(pid for pid, level in reach.items() if level >= need)
+
+    async def effective_scope(self, acl_repo, user_id: int, owner_project_id: int, target_project_id: int) -> str | None:
+        """Имя эффективного scope owner -> target или None, если доступа нет."""
+        level = (await self.reachable(acl_repo, user_id, owner_project_id)).get(target_project_id)
+        return scope_name(level) if level else None
+
+    async def is_allowed(
+        self, acl_repo, user_id: int, owner_project_id: int, target_project_id: int, required_scope: str = DEFAULT_SCOPE
+    ) -> bool:
+        level = (await self.reachable(acl_repo, user_id, owner_project_id)).get(target_project_id, 0)
+        return level >= scope_level(required_scope)
+
+    def invalidate_user(self, user_id: int):
+        """Изменились доступы или проекты пользователя (grant/revoke, удаление проекта)."""
+        self._graphs.pop(user_id, None)
+
+    def clear(self):
+        self._graphs.clear()
+
+
+# Общий экземпляр процесса (ACL-хендлеры, индекс упоминаний и сессии работают с одним кэшем)
+acl_engine = ACLEngine()
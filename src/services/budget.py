@@ -0,0 +1,156 @@
+# Файл: C:\desk_top\src\services\budget.py
+import logging
+from dataclasses import dataclass, replace
+
+from src.config import (
+    LLM_BUDGET_SYSTEM_TOKENS,
+    LLM_BUDGET_RAG_TOKENS,
+    LLM_BUDGET_HISTORY_TOKENS,
+    LLM_BUDGET_COMPLETION_TOKENS,
+    LLM_LATENCY_TARGET_MS,
+    LLM_PREFILL_TOKENS_PER_SEC,
+    LLM_DECODE_TOKENS_PER_SEC,
+    RAG_MAX_CANDIDATES,
+    RAG_MIN_TOP_K,
+)
+from src.services.model_router import ModelSpec
+
+logger = logging.getLogger(__name__)
+
+# Ниже этих значений бюджет не опускается даже под жёсткий latency target
+MIN_COMPLETION_TOKENS = 256
+MIN_SCALE = 0.1
+# Фиксированные накладные расходы запроса (сеть, очередь провайдера), мс
+BASE_LATENCY_MS = 400
+
+
+@dataclass(frozen=True)
+class BudgetAllocation:
+    """Распределение токенов на один ход: потолки частей промпта и ответа для конкретной модели."""
+    model: str
+    system: int
+    rag: int
+    history: int
+    completion: int
+    rag_candidates: int
+    latency_target_ms: int = 0
+    # Во сколько раз бюджеты RAG/истории/ответа урезаны ради latency target (1.0 — не урезаны)
+    scale: float = 1.0
+    source: str = "default"  # 'default' | 'tools_config'
+
+    @property
+    def prompt(self) -> int:
+        return self.system + self.rag + self.history
+
+    def estimated_latency_ms(self, prefill_tps: float, decode_tps: float) -> int:
+        return int(BASE_LATENCY_MS + self.prompt / prefill_tps * 1000 + self.completion / decode_tps * 1000)
+
+    def describe(self) -> str:
+        parts = [
+            f"model={self.model}",
+            f"system={self.system}",
+            f"rag={self.rag}",
+            f"history={self.history}",
+            f"completion={self.completion}",
+            f"candidates={self.rag_candidates}",
+            f"source={self.source}",
+        ]
+        if self.latency_target_ms:
+            parts.append(f"latency_target={self.latency_target_ms}ms, scale={self.scale:.2f}")
+        return ", ".join(parts)
+
+
+def _positive_int(value, default: int) -> int:
+    try:
+        v = int(value)
+    except (TypeError, ValueError):
+        return default
+    return v if v > 0 else default
+
+
+class BudgetAllocator:
+    """Считает бюджет токенов хода по настройкам по умолчанию и ключу tools_config.budget мода.
+
+    Пример tools_config мода:
+      {"budget": {"system": 2000, "rag": 4000, "history": 6000, "completion": 800,
+                  "rag_candidates": 10, "latency_target_ms": 4000}}
+    Потолки не выходят за окно контекста модели. Если задан latency target, бюджеты RAG,
+    истории и ответа пропорционально уменьшаются, пока оценка латентности не уложится в цель.
+    """
+
+    def __init__(
+        self,
+        system: int = LLM_BUDGET_SYSTEM_TOKENS,
+        rag: int = LLM_BUDGET_RAG_TOKENS,
+        history: int = LLM_BUDGET_HISTORY_TOKENS,
+        completion: int = LLM_BUDGET_COMPLETION_TOKENS,
+        rag_candidates: int = RAG_MAX_CANDIDATES,
+        latency_target_ms: int = LLM_LATENCY_TARGET_MS,
+        prefill_tps: float = LLM_PREFILL_TOKENS_PER_SEC,
+        decode_tps: float = LLM_DECODE_TOKENS_PER_SEC,
+    ):
+        self.defaults = {
+            "system": system,
+            "rag": rag,
+            "history": history,
+            "completion": completion,
+            "rag_candidates": rag_candidates,
+            "latency_target_ms": latency_target_ms,
+        }
+        self.prefill_tps = max(float(prefill_tps), 1.0)
+        self.decode_tps = max(float(decode_tps), 1.0)
+
+    def allocate(self, spec: ModelSpec, tools_config: dict | None = None) -> BudgetAllocation:
+        cfg = (tools_config or {}).get("budget")
+        cfg = cfg if isinstance(cfg, dict) else {}
+        values = {k: _positive_int(cfg.get(k), v) for k, v in self.defaults.items() if k != "latency_target_ms"}
+        # latency_target_ms: 0 в моде явно выключает цель, заданную глобально
+        target = cfg.get("latency_target_ms", self.defaults["latency_target_ms"])
+        try:
+            target = max(int(target or 0), 0)
+        except (TypeError, ValueError):
+            target = self.defaults["latency_target_ms"]
+
+        allocation = BudgetAllocation(
+            model=spec.name,
+            system=values["system"],
+            rag=values["rag"],
+            history=values["history"],
+            completion=min(values["completion"], spec.max_completion_tokens),
+            rag_candidates=max(values["rag_candidates"], RAG_MIN_TOP_K),
+            latency_target_ms=target,
+            source="tools_config" if cfg else "default",
+        )
+        allocation = self._fit_window(allocation, spec)
+        if target:
+            allocation = self._fit_latency(allocation)
+        return allocation
+
+    @staticmethod
+    def _fit_window(allocation: BudgetAllocation, spec: ModelSpec) -> BudgetAllocation:
+        """Урезает RAG и историю пропорционально, если сумма потолков не помещается в окно модели."""
+        room = spec.context_window - allocation.completion - allocation.system
+        flexible = allocation.rag + allocation.history
+        if flexible <= room:
+            return allocation
+        ratio = max(room, 0) / flexible if flexible else 0.0
+        logger.info(f"Budget exceeds {spec.name} window, scaling rag/history by {ratio:.2f}")
+        return replace(allocation, rag=int(allocation.rag * ratio), history=int(allocation.history * ratio))
+
+    def _fit_latency(self, allocation: BudgetAllocation) -> BudgetAllocation:
+        estimated = allocation.estimated_latency_ms(self.prefill_tps, self.decode_tps)
+        if estimated <= allocation.latency_target_ms:
+            return allocation
+        # Время на системный промпт и накладные расходы не сокращается — масштабируем остальное
+        fixed = BASE_LATENCY_MS + allocation.system / self.prefill_tps * 1000
+        flexible = estimated - fixed
+        available = allocation.latency_target_ms - fixed
+        scale = min(max(available / flexible if flexible > 0 else MIN_SCALE, MIN_SCALE), 1.0)
+        return replace(
+            allocation,
+            rag=int(allocation.rag * scale),
+            history=int(allocation.history * scale),
+            completion=max(int(allocation.completion * scale), min(MIN_COMPLETION_TOKENS, allocation.completion)),
+            rag_candidates=max(int(allocation.rag_candidates * scale), RAG_MIN_TOP_K),
+            scale=scale,
+        )
@@ -0,0 +1,117 @@
+# Файл: C:\desk_top\src\services\chunking.py
+import re
+from dataclasses import dataclass
+
+from src.config import RAG_CHUNK_TOKENS, RAG_CHUNK_OVERLAP_TOKENS
+
+PARAGRAPH_SEP = "\n\n"
+SENTENCE_SEP = " "
+# Между несмежными фрагментами одной сессии при сборке контекста
+GAP_MARKER = "\n…\n"
+
+_PARAGRAPH_RE = re.compile(r"\n\s*\n")
+_SENTENCE_RE = re.compile(r"(?<=[.!?…])\s+")
+
+
+@dataclass(frozen=True)
+class Chunk:
+    """Фрагмент итогов сессии.
+
+    overlap — длина (в символах) начала text, повторяющего конец предыдущего фрагмента;
+    при склейке соседних фрагментов этот префикс отбрасывается.
+    """
+    index: int
+    text: str
+    overlap: int = 0
+
+
+def chunk_vector_id(session_id: int, index: int) -> str:
+    return f"session-{session_id}-chunk-{index}"
+
+
+def _units(text: str, encoding, max_tokens: int) -> list[tuple[str, str, int]]:
+    """Режет текст на единицы не длиннее max_tokens: абзацы, при необходимости — предложения и окна токенов.
+
+    Возвращает [(separator_before, text, tokens)].
+    """
+    units = []
+    for paragraph in _PARAGRAPH_RE.split(text):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        tokens = len(encoding.encode(paragraph))
+        if tokens <= max_tokens:
+            units.append((PARAGRAPH_SEP, paragraph, tokens))
+            continue
+        sep = PARAGRAPH_SEP
+        for sentence in _SENTENCE_RE.split(paragraph):
+            ids = encoding.encode(sentence)
+            # Сверхдлинное «предложение» (код, список без точек) режем окнами токенов
+            for start in range(0, len(ids), max_tokens):
+                piece = encoding.decode(ids[start:start + max_tokens]) if len(ids) > max_tokens else sentence
+                units.append((sep, piece, min(len(ids) - start, max_tokens)))
+                sep = SENTENCE_SEP
+    return units
+
+
+def split_into_chunks(
+    text: str,
+    encoding,
+    max_tokens: int = RAG_CHUNK_TOKENS,
+    overlap_tokens: int = RAG_CHUNK_OVERLAP_TOKENS,
+) -> list[Chunk]:
+    """Делит итоги на фрагменты до max_tokens токенов с перекрытием до overlap_tokens.
+
+    Границы проходят по абзацам (длинные абзацы — по предложениям), перекрытие — целыми
+    единицами с конца предыдущего фрагмента, поэтому фрагменты читаются самостоятельно.
+    """
+    max_tokens = max(int(max_tokens), 1)
+    overlap_tokens = max(min(int(overlap_tokens), max_tokens // 2), 0)
+    units = _units(text or "", encoding, max_tokens)
+    if not units:
+        return []
+
+    chunks: list[Chunk] = []
+    current: list[tuple[str, str, int]] = []
+    carried = 0  # сколько единиц в начале current перенесено из предыдущего фрагмента
+    used = 0
+
+    def flush():
+        prefix = _join(current[:carried])
+        chunks.append(Chunk(index=len(chunks), text=_join(current), overlap=len(prefix)))
+
+    for unit in units:
+        if current and used + unit[2] > max_tokens and len(current) > carried:
+            flush()
+            # Хвост предыдущего фрагмента в пределах overlap_tokens переносим в начало следующего
+            tail, tail_tokens = [], 0
+            for u in reversed(current):
+                if tail_tokens + u[2] > overlap_tokens or tail_tokens + u[2] + unit[2] > max_tokens:
+                    break
+                tail.insert(0, u)
+                tail_tokens += u[2]
+            current, carried, used = tail, len(tail), tail_tokens
+        current.append(unit)
+        used += unit[2]
+    if len(current) > carried:
+        flush()
+    return chunks
+
+
+def _join(units: list[tuple[str, str, int]]) -> str:
+    return "".join((sep if i else "") + text for i, (sep, text, _) in enumerate(units))
+
+
+def assemble_chunks(chunks: list[Chunk]) -> str:
+    """Склеивает фрагменты одной сессии в порядке index: смежные — без повтора перекрытия, несмежные — через GAP_MARKER."""
+    parts: list[str] = []
+    prev_index = None
+    for chunk in sorted(chunks, key=lambda c: c.index):
+        if prev_index is None:
+            parts.append(chunk.text)
+        elif chunk.index == prev_index + 1:
+            parts.append(chunk.text[chunk.overlap:] if chunk.overlap else PARAGRAPH_SEP + chunk.text)
+        else:
+            parts.append(GAP_MARKER + chunk.text)
+        prev_index = chunk.index
+    return "".join(parts)
@@ -21,12 +21,14 @@ def get_main_menu_commands() -> list[BotCommand]:
         BotCommand(command='rename_project', description='✏️ Переименовать проект'),
         BotCommand(command='delete_project', description='🗑️ Удалить проект (--force)'),
         BotCommand(command='context_mode', description='🎛️ Режим контекста: project|acl_mentions|global'),
-        BotCommand(command='grant_access', description='🔐 Выдать доступ: OWNER ALLOWED [SCOPE]'),
-        BotCommand(command='revoke_access', description='🔒 Отозвать доступ: OWNER ALLOWED'),
+        BotCommand(command='grant_access', description='🔐 Выдать доступ: OWNER ALLOWED[,ALLOWED...] [SCOPE]'),
+        BotCommand(command='revoke_access', description='🔒 Отозвать доступ: OWNER ALLOWED[,ALLOWED...]'),
         BotCommand(command='list_access', description='📜 Список доступов: [OWNER]'),
         BotCommand(command='start_session', description='🚀 Начать новую сессию'),
         BotCommand(command='end_session', description='🛑 Завершить текущую сессию'),
         BotCommand(command='list_sessions', description='📋 Показать историю сессий'),
+        BotCommand(command='usage', description='📊 Расход токенов и стоимость: [дней]'),
         BotCommand(command='export_data', description='📥 Скачать свои данные'),
         BotCommand(command='delete_my_data', description='🗑️ Удалить все свои данные'),
+        BotCommand(command='retention', description='⏳ Срок хранения сессий: [дней|0|default]'),
     ]
@@ -0,0 +1,120 @@
+# Файл: C:\desk_top\src\services\fsm_storage.py
+import logging
+from typing import Any, Dict, Optional
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+
+from src.config import FSM_STORAGE
+from src.db.repository import FSMStateRepository
+from src.db.session import db
+from src.services import serializer
+
+logger = logging.getLogger(__name__)
+
+
+def storage_key_str(key: StorageKey) -> str:
+    """Плоский строковый ключ FSM: bot:chat:user:thread:business_connection:destiny."""
+    return ":".join(
+        str(part) if part is not None else ""
+        for part in (key.bot_id, key.chat_id, key.user_id, key.thread_id, key.business_connection_id, key.destiny)
+    )
+
+
+def _state_str(state: StateType = None) -> Optional[str]:
+    return state.state if isinstance(state, State) else state
+
+
+class LocalSharedStorage(BaseStorage):
+    """Локальная замена общего стора (Postgres) для тестов и разработки.
+
+    Экземпляры с одинаковым namespace в одном процессе делят состояние, как воркеры
+    делят таблицу fsm_states. Данные хранятся сериализованными в JSON — так же, как в реальных бэкендах,
+    поэтому несериализуемые значения ловятся уже на этапе тестов.
+    """
+
+    _namespaces: Dict[str, Dict[str, Dict[str, Any]]] = {}
+
+    def __init__(self, namespace: str = "default"):
+        self._store = self._namespaces.setdefault(namespace, {})
+
+    @classmethod
+    def reset(cls, namespace: str | None = None):
+        if namespace is None:
+            cls._namespaces.clear()
+        else:
+            cls._namespaces.pop(namespace, None)
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        record = self._store.setdefault(storage_key_str(key), {"state": None, "data": "{}"})
+        record["state"] = _state_str(state)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        record = self._store.get(storage_key_str(key))
+        return record["state"] if record else None
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        record = self._store.setdefault(storage_key_str(key), {"state": None, "data": "{}"})
+        record["data"] = serializer.dumps(data)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        record = self._store.get(storage_key_str(key))
+        return serializer.loads(record["data"]) if record else {}
+
+    async def close(self) -> None:
+        pass
+
+
+class PostgresFSMStorage(BaseStorage):
+    """FSM-стор в таблице fsm_states (см. FSMStateRepository). Каждое изменение — отдельный UPSERT."""
+
+    def __init__(self, session_maker):
+        self.session_maker = session_maker
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        async with self.session_maker() as session:
+            await FSMStateRepository(session).upsert(storage_key_str(key), user_id=key.user_id, state=_state_str(state))
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        async with self.session_maker() as session:
+            record = await FSMStateRepository(session).get(storage_key_str(key))
+            return record.state if record else None
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        async with self.session_maker() as session:
+            repo = FSMStateRepository(session)
+            await repo.upsert(storage_key_str(key), user_id=key.user_id, data=serializer.dumps(data))
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        async with self.session_maker() as session:
+            record = await FSMStateRepository(session).get(storage_key_str(key))
+        if not record or not record.data:
+            return {}
+        try:
+            return serializer.loads(record.data)
+        except (TypeError, ValueError):
+            logger.warning(f"FSM: corrupted data for key {storage_key_str(key)}, resetting")
+            return {}
+
+    async def close(self) -> None:
+        pass
+
+
+def build_fsm_storage(kind: str = FSM_STORAGE, session_maker=None) -> BaseStorage:
+    """Создаёт FSM-стор по конфигу: memory | local | postgres.
+
+    memory — стандартный MemoryStorage (только один процесс);
+    postgres — общий стор для нескольких воркеров; local — его локальная замена.
+    Redis не поддерживается: состояния в нём не удаляются вместе с данными пользователя (/delete_my_data).
+    """
+    kind = (kind or "memory").lower()
+    if kind == "memory":
+        return MemoryStorage()
+    if kind == "local":
+        return LocalSharedStorage()
+    if kind == "postgres":
+        if session_maker is None:
+            session_maker = db.AsyncSessionLocal
+        return PostgresFSMStorage(session_maker)
+    raise ValueError(f"Unknown FSM_STORAGE: {kind}")
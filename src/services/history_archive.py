@@ -0,0 +1,64 @@
+# Файл: C:\desk_top\src\services\history_archive.py
+import base64
+import gzip
+from dataclasses import dataclass
+
+from src.config import HISTORY_ARCHIVE_CODEC
+from src.services import serializer
+
+# gzip — всегда доступен; zstd — быстрее и плотнее, но требует пакет zstandard
+CODECS = ("gzip", "zstd")
+
+
+@dataclass(frozen=True)
+class ArchivedHistory:
+    codec: str
+    payload: str        # base64 от сжатого JSON (шифруется колонкой session_archives.payload)
+    raw_size: int       # байт JSON до сжатия
+    stored_size: int    # байт после сжатия (до base64)
+    message_count: int
+
+
+def zstd_module():
+    """Ленивый импорт zstandard (кодек zstd — опциональный, см. также history_codec)."""
+    try:
+        import zstandard
+    except ImportError as e:
+        raise RuntimeError("zstd codec requires the 'zstandard' package (pip install zstandard)") from e
+    return zstandard
+
+
+def _compress(data: bytes, codec: str) -> bytes:
+    if codec == "gzip":
+        return gzip.compress(data, compresslevel=6)
+    if codec == "zstd":
+        return zstd_module().ZstdCompressor(level=10).compress(data)
+    raise ValueError(f"Unknown archive codec '{codec}'")
+
+
+def _decompress(data: bytes, codec: str) -> bytes:
+    if codec == "gzip":
+        return gzip.decompress(data)
+    if codec == "zstd":
+        return zstd_module().ZstdDecompressor().decompress(data)
+    raise ValueError(f"Unknown archive codec '{codec}'")
+
+
+def pack_history(history: list, codec: str = HISTORY_ARCHIVE_CODEC) -> ArchivedHistory:
+    """Сжимает историю сообщений для холодного хранения.
+
+    Сжатие — до шифрования: зашифрованные данные уже не сжимаются.
+    """
+    raw = serializer.dumps_bytes(history or [])
+    packed = _compress(raw, codec)
+    return ArchivedHistory(
+        codec=codec,
+        payload=base64.b64encode(packed).decode("ascii"),
+        raw_size=len(raw),
+        stored_size=len(packed),
+        message_count=len(history or []),
+    )
+
+
+def unpack_history(codec: str, payload: str) -> list:
+    return serializer.loads(_decompress(base64.b64decode(payload), codec))
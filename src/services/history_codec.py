@@ -0,0 +1,156 @@
+# Файл: C:\desk_top\src\services\history_codec.py
+import struct
+import zlib
+
+from src.config import HISTORY_FORMAT, HISTORY_COMPRESSION
+from src.services import serializer
+from src.services.history_archive import zstd_module
+
+# Компактный формат message_history (v1), до шифрования колонкой:
+#   заголовок: b"MH" | версия (1 байт) | сжатие (1 байт)
+#   тело (после распаковки): кадры сообщений | смещения кадров uint32[n] | n uint32
+#   кадр: код роли (1 байт) | вид (1 байт) | длина uint32 | данные
+# Вид KIND_TEXT — сообщение {"role", "content": str}, данные — content в UTF-8 без JSON-экранирования;
+# KIND_JSON — любой другой dict целиком в JSON. Таблица смещений в конце позволяет читать
+# последние N сообщений и дописывать новые, не разбирая всю историю.
+MAGIC = b"MH"
+VERSION = 1
+FORMATS = ("compact", "json")
+COMPRESSION = {"none": 0, "zlib": 1, "zstd": 2}
+ROLE_CODES = {"system": 0, "user": 1, "assistant": 2, "tool": 3}
+ROLES = {code: role for role, code in ROLE_CODES.items()}
+ROLE_OTHER = 255
+KIND_TEXT = 0
+KIND_JSON = 1
+
+_HEADER = struct.Struct("<2sBB")
+_FRAME = struct.Struct("<BBI")
+_COUNT = struct.Struct("<I")
+
+
+def _compress(body: bytes, compression: int) -> bytes:
+    if compression == 0:
+        return body
+    if compression == 1:
+        return zlib.compress(body, 6)
+    if compression == 2:
+        return zstd_module().ZstdCompressor(level=3).compress(body)
+    raise ValueError(f"Unknown history compression id {compression}")
+
+
+def _decompress(data: memoryview, compression: int) -> memoryview:
+    if compression == 0:
+        return data
+    if compression == 1:
+        return memoryview(zlib.decompress(data))
+    if compression == 2:
+        return memoryview(zstd_module().ZstdDecompressor().decompress(data))
+    raise ValueError(f"Unknown history compression id {compression}")
+
+
+def _frame(message: dict) -> bytes:
+    role = message.get("role")
+    content = message.get("content")
+    if role in ROLE_CODES and isinstance(content, str) and len(message) == 2:
+        data = content.encode("utf-8")
+        return _FRAME.pack(ROLE_CODES[role], KIND_TEXT, len(data)) + data
+    data = serializer.dumps_bytes(message)
+    return _FRAME.pack(ROLE_CODES.get(role, ROLE_OTHER), KIND_JSON, len(data)) + data
+
+
+def _pack(frames: bytes, offsets: list[int], compression: str) -> bytes:
+    if compression not in COMPRESSION:
+        raise ValueError(f"Unknown HISTORY_COMPRESSION '{compression}'")
+    body = frames + struct.pack(f"<{len(offsets)}I", *offsets) + _COUNT.pack(len(offsets))
+    code = COMPRESSION[compression]
+    return _HEADER.pack(MAGIC, VERSION, code) + _compress(body, code)
+
+
+def _unpack(blob: bytes) -> tuple[memoryview, int, int]:
+    """(тело, позиция таблицы смещений, число сообщений)."""
+    magic, version, compression = _HEADER.unpack_from(blob)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError(f"Unsupported history format {magic!r} v{version}")
+    body = _decompress(memoryview(blob)[_HEADER.size:], compression)
+    (count,) = _COUNT.unpack_from(body, len(body) - _COUNT.size)
+    table = len(body) - _COUNT.size - 4 * count
+    if table < 0:
+        raise ValueError("Corrupted history: bad frame table")
+    return body, table, count
+
+
+def is_compact(value) -> bool:
+    return isinstance(value, bytes) and value[:2] == MAGIC
+
+
+def encode_history(history: list, fmt: str = HISTORY_FORMAT, compression: str = HISTORY_COMPRESSION) -> str | bytes:
+    """Сериализует историю для колонки message_history: bytes (compact) или JSON-строка (json)."""
+    if fmt == "json":
+        return serializer.dumps(history or [])
+    if fmt != "compact":
+        raise ValueError(f"Unknown HISTORY_FORMAT '{fmt}'")
+    frames = []
+    offsets = []
+    pos = 0
+    for message in history or []:
+        frame = _frame(message)
+        offsets.append(pos)
+        frames.append(frame)
+        pos += len(frame)
+    return _pack(b"".join(frames), offsets, compression)
+
+
+def decode_history(value, tail: int | None = None) -> list:
+    """История из значения колонки: компактный формат, JSON-строка или JSON в bytes.
+
+    tail — вернуть только последние tail сообщений; в компактном формате остальные
+    кадры не разбираются. ValueError для повреждённых данных.
+    """
+    if not value:
+        return []
+    if not is_compact(value):
+        history = serializer.loads(value)
+        return history[-tail:] if tail else history
+    try:
+        return _decode_frames(value, tail)
+    except (struct.error, KeyError, zlib.error) as e:
+        raise ValueError(f"Corrupted history: {e!r}") from e
+
+
+def _decode_frames(blob: bytes, tail: int | None) -> list:
+    body, table, count = _unpack(blob)
+    first = max(0, count - tail) if tail else 0
+    offsets = struct.unpack_from(f"<{count - first}I", body, table + 4 * first)
+    history = []
+    append = history.append
+    unpack_frame = _FRAME.unpack_from
+    head = _FRAME.size
+    for offset in offsets:
+        role, kind, length = unpack_frame(body, offset)
+        start = offset + head
+        if kind == KIND_TEXT:
+            append({"role": ROLES[role], "content": str(body[start:start + length], "utf-8")})
+        else:
+            append(serializer.loads(body[start:start + length]))
+    return history
+
+
+def append_history(value, messages: list[dict], fmt: str = HISTORY_FORMAT, compression: str = HISTORY_COMPRESSION):
+    """Дописывает сообщения к сохранённой истории.
+
+    Несжатая компактная история дописывается без разбора: новые кадры вставляются перед
+    таблицей смещений. В остальных случаях (JSON, сжатие, смена формата) история
+    декодируется целиком и кодируется заново в текущем формате.
+    """
+    if fmt == "compact" and compression == "none" and is_compact(value) and value[3] == COMPRESSION["none"]:
+        body, table, count = _unpack(value)
+        offsets = list(struct.unpack_from(f"<{count}I", body, table))
+        frames = [bytes(body[:table])]
+        pos = table
+        for message in messages:
+            frame = _frame(message)
+            offsets.append(pos)
+            frames.append(frame)
+            pos += len(frame)
+        return _pack(b"".join(frames), offsets, compression)
+    return encode_history(decode_history(value) + list(messages), fmt, compression)
@@ -0,0 +1,87 @@
+# Файл: C:\desk_top\src\services\lexical_index.py
+import logging
+import re
+
+from src.db.repository import SummaryChunkRepository
+from src.services.chunking import Chunk, chunk_vector_id
+from src.services.metrics import observe_stage
+from src.services.rag_selection import RAGMatch
+
+logger = logging.getLogger(__name__)
+
+# Слова короче — в основном предлоги и союзы: в OR-запросе они совпадают почти со всем
+MIN_TERM_LENGTH = 3
+MAX_TERMS = 32
+
+_TERM_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def build_tsquery(text: str) -> str | None:
+    """OR-запрос to_tsquery из слов текста: 'ProjectX | get_user | deploy'.
+
+    Берутся только \\w-последовательности, поэтому спецсимволы синтаксиса tsquery в запрос не попадают.
+    """
+    terms = []
+    seen = set()
+    for term in _TERM_RE.findall((text or "").lower()):
+        if len(term) < MIN_TERM_LENGTH or term in seen:
+            continue
+        seen.add(term)
+        terms.append(term)
+        if len(terms) >= MAX_TERMS:
+            break
+    return " | ".join(terms) or None
+
+
+class LexicalSummaryIndex:
+    """Полнотекстовый индекс фрагментов итогов в Postgres (таблица summary_chunks).
+
+    Дополняет векторный поиск там, где эмбеддинги слабы (имена проектов, функции, идентификаторы),
+    и работает без вызова API эмбеддингов. Каждая операция открывает свою сессию БД.
+    """
+
+    def __init__(self, session_maker):
+        self.session_maker = session_maker
+
+    async def index_session(self, user_id: int, session_id: int, project_id: int | None, chunks: list[Chunk]):
+        with observe_stage("lexical_upsert"):
+            async with self.session_maker() as session:
+                await SummaryChunkRepository(session).replace_session(user_id, session_id, project_id, chunks)
+
+    async def search(
+        self,
+        user_id: int,
+        query_text: str,
+        project_id: int | None = None,
+        project_ids: list[int] | None = None,
+        limit: int = 20,
+    ) -> list[RAGMatch]:
+        tsquery = build_tsquery(query_text)
+        if not tsquery:
+            return []
+        with observe_stage("lexical_query"):
+            async with self.session_maker() as session:
+                rows = await SummaryChunkRepository(session).search(
+                    user_id, tsquery, project_id=project_id, project_ids=project_ids, limit=limit
+                )
+        return [
+            RAGMatch(
+                text=chunk.text,
+                score=rank,
+                project_id=chunk.project_id,
+                vector_id=chunk_vector_id(chunk.session_id, chunk.chunk_index),
+                session_id=chunk.session_id,
+                chunk_index=chunk.chunk_index,
+                chunk_count=chunk.chunk_count,
+                overlap=chunk.overlap,
+            )
+            for chunk, rank in rows
+        ]
+
+    async def fetch_chunks(self, keys: list[tuple[int, int]]) -> dict[tuple[int, int], Chunk]:
+        """Фрагменты по (session_id, chunk_index)."""
+        if not keys:
+            return {}
+        async with self.session_maker() as session:
+            rows = await SummaryChunkRepository(session).get_chunks(keys)
+        return {(r.session_id, r.chunk_index): Chunk(index=r.chunk_index, text=r.text, overlap=r.overlap) for r in rows}
@@ -1,37 +1,138 @@
 # Файл: C:\desk_top\src\services\llm_client.py
 import logging
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from types import SimpleNamespace
 import tiktoken
-from openai import AsyncOpenAI, RateLimitError, APITimeoutError, APIConnectionError, APIStatusError
-from tenacity import retry, stop_after_attempt, wait_exponential, retry_if_exception, retry_if_exception_type
+from openai import AsyncOpenAI, RateLimitError, APITimeoutError
 from src.config import OPENAI_API_KEY
+from src.services.retry_policy import openai_retry, effective_timeout
+from src.services.model_router import ModelRouter, ModelSpec, get_model_spec
+from src.services.budget import BudgetAllocator, BudgetAllocation
+from src.services.prompt_builder import TOOLS_BLOCK_HEADER
+from src.services.rag_selection import match_text
+from src.services import metrics
 
 logger = logging.getLogger(__name__)
 
-# Определяем, какие ошибки считать временными и требующими повторной попытки
-RETRYABLE_OPENAI_ERRORS = (RateLimitError, APITimeoutError, APIConnectionError, APIStatusError)
+# Ошибки, при которых не повторяем ту же модель, а переходим к следующей в цепочке
+FALLBACK_OPENAI_ERRORS = (RateLimitError, APITimeoutError)
+
+
+@dataclass
+class _Completion:
+    """Собранный из стрима ответ модели."""
+    content: str
+    usage: object | None
+    ttft: float | None
+
+
+@dataclass(frozen=True)
+class UsageRecord:
+    """usage одного вызова модели (как его вернул OpenAI)."""
+    operation: str
+    model: str
+    prompt_tokens: int
+    completion_tokens: int
+    cached_tokens: int = 0
+
+    @property
+    def total_tokens(self) -> int:
+        return self.prompt_tokens + self.completion_tokens
+
+    @property
+    def cost_usd(self) -> float:
+        return get_model_spec(self.model).cost_usd(self.prompt_tokens, self.completion_tokens, self.cached_tokens)
+
+
+@dataclass
+class UsageTotals:
+    """Фактический расход токенов по всем вызовам модели внутри блока track_usage()."""
+    records: list[UsageRecord] = field(default_factory=list)
+
+    def add(self, record: UsageRecord):
+        self.records.append(record)
+
+    @property
+    def prompt_tokens(self) -> int:
+        return sum(r.prompt_tokens for r in self.records)
+
+    @property
+    def completion_tokens(self) -> int:
+        return sum(r.completion_tokens for r in self.records)
+
+    @property
+    def cached_tokens(self) -> int:
+        return sum(r.cached_tokens for r in self.records)
+
+    @property
+    def total_tokens(self) -> int:
+        return self.prompt_tokens + self.completion_tokens
+
+    @property
+    def calls(self) -> int:
+        return len(self.records)
+
+    @property
+    def cost_usd(self) -> float:
+        return sum(r.cost_usd for r in self.records)
+
+
+@dataclass
+class LLMResult:
+    """Ответ get_response: текст, модель, ответившая последней, и фактический usage запроса."""
+    text: str
+    model: str
+    usage: UsageTotals
+    ttft: float | None = None
+    # Бюджет токенов, с которым собран промпт ответившей модели
+    allocation: BudgetAllocation | None = None
+
+
+# Активные трекеры usage (вложенные track_usage() получают usage все сразу)
+_usage_trackers: ContextVar[tuple[UsageTotals, ...]] = ContextVar("llm_usage_trackers", default=())
+
+
+@contextmanager
+def track_usage():
+    """Собирает usage всех вызовов LLM в блоке (включая фолбэки) — для квоты и учёта расходов."""
+    totals = UsageTotals()
+    token = _usage_trackers.set(_usage_trackers.get() + (totals,))
+    try:
+        yield totals
+    finally:
+        _usage_trackers.reset(token)
 
 class LLMClient:
-    def __init__(self):
+    def __init__(self, router: ModelRouter | None = None, allocator: BudgetAllocator | None = None):
         self.client = AsyncOpenAI(api_key=OPENAI_API_KEY)
-        try:
-            self.encoding = tiktoken.encoding_for_model("gpt-4o")
-        except Exception as e:
-            logger.warning(f"Could not get encoding for gpt-4o, falling back to cl100k_base. Error: {e}")
-            self.encoding = tiktoken.get_encoding("cl100k_base")
+        self.router = router or ModelRouter()
+        # Бюджеты system/RAG/истории/ответа (по умолчанию из конфига, переопределяются tools_config.budget)
+        self.allocator = allocator or BudgetAllocator()
+        # Токенайзеры по имени кодировки (у каждой модели свой), загружаются лениво
+        self._encodings: dict[str, tiktoken.Encoding] = {}
+        self.encoding = self._get_encoding(get_model_spec(self.router.default_model))
         logger.info("LLMClient initialized.")
 
-        # Мягкие лимиты под 128k контекст моделей семейства gpt-4o
-        self.MODEL_NAME = "gpt-4o"
-        # Окно контекста модели (приблизительно). Держим запас под completion
-        self.MODEL_CONTEXT_WINDOW = 128_000
-        # Максимум токенов на completion
-        self.MAX_COMPLETION_TOKENS = 2_048
-        # Бюджет на prompt (system+history+user+RAG), оставляем запас под completion
-        self.MAX_PROMPT_TOKENS = max(self.MODEL_CONTEXT_WINDOW - self.MAX_COMPLETION_TOKENS, 80_000)
-        # Доли распределения бюджета между RAG и историей
-        self.RAG_BUDGET_RATIO = 0.6  # 60% RAG, 40% история
+        # Модель по умолчанию (конкретная модель выбирается роутером на каждый запрос)
+        self.MODEL_NAME = self.router.default_model
         # Таймаут запроса к OpenAI, сек
         self.REQUEST_TIMEOUT = 30
+        # Накопленная статистика prompt caching провайдера (для оценки экономии)
+        self.prompt_cache_stats = {"prompt_tokens": 0, "cached_tokens": 0}
+
+    def _get_encoding(self, spec: ModelSpec) -> tiktoken.Encoding:
+        enc = self._encodings.get(spec.encoding)
+        if enc is None:
+            try:
+                enc = tiktoken.get_encoding(spec.encoding)
+            except Exception as e:
+                logger.warning(f"Could not get encoding {spec.encoding} for {spec.name}, falling back to cl100k_base. Error: {e}")
+                enc = tiktoken.get_encoding("cl100k_base")
+            self._encodings[spec.encoding] = enc
+        return enc
 
     def _clamp_temperature(self, temperature: float | None) -> float | None:
         if temperature is None:
@@ -47,29 +148,35 @@ class LLMClient:
             t = 2.0
         return t
 
-    def count_tokens(self, text: str) -> int:
-        """Подсчитывает количество токенов в строке."""
+    def count_tokens(self, text: str, model: str | None = None) -> int:
+        """Подсчитывает количество токенов в строке (токенайзером указанной модели)."""
         if not text:
             return 0
-        return len(self.encoding.encode(text))
+        encoding = self._get_encoding(get_model_spec(model)) if model else self.encoding
+        return len(encoding.encode(text))
+
+    def _fit_rag_context(self, items: list, token_budget: int, model: str | None = None) -> list[str]:
+        """Возвращает тексты items, укладывающиеся в token_budget.
 
-    def _fit_rag_context(self, items: list[str], token_budget: int) -> list[str]:
-        """Возвращает подмножество items, укладывающееся в token_budget (с начала списка)."""
+        items (строки или RAGMatch) идут по убыванию ценности: берём по порядку, а элемент,
+        который не влезает, пропускаем — следующий, более короткий, ещё может поместиться.
+        """
         if not items or token_budget <= 0:
             return []
         selected = []
         used = 0
-        sep_tokens = self.count_tokens("\n\n")
-        for i, s in enumerate(items):
-            t = self.count_tokens(s)
-            add = t if i == 0 else t + sep_tokens
+        sep_tokens = self.count_tokens("\n\n", model)
+        for item in items:
+            text = match_text(item)
+            t = self.count_tokens(text, model)
+            add = t if not selected else t + sep_tokens
             if used + add > token_budget:
-                break
-            selected.append(s)
+                continue
+            selected.append(text)
             used += add
         return selected
 
-    def _fit_history_tail(self, history: list[dict], token_budget: int) -> list[dict]:
+    def _fit_history_tail(self, history: list[dict], token_budget: int, model: str | None = None) -> list[dict]:
         """Берем последние сообщения истории (с конца), пока укладываемся в token_budget."""
         if not history or token_budget <= 0:
             return []
@@ -78,7 +185,7 @@ class LLMClient:
         # идем с конца — недавние сообщения важнее
         for msg in reversed(history):
             content = msg.get("content", "")
-            t = self.count_tokens(content)
+            t = self.count_tokens(content, model)
             if used + t > token_budget:
                 break
             acc.append(msg)
@@ -86,85 +193,297 @@ class LLMClient:
         acc.reverse()
         return acc
 
-    @retry(
-        stop=stop_after_attempt(3),
-        wait=wait_exponential(multiplier=1, min=2, max=10),
-        retry=retry_if_exception(lambda e: isinstance(e, RETRYABLE_OPENAI_ERRORS) and getattr(getattr(e, 'status', None), '__int__', lambda: None)() in (None, 429, 500, 502, 503, 504))
-    )
-    async def get_response(
-        self, system_prompt: str, message_history: list, user_message: str, rag_context: list[str] = None, temperature: float | None = None
-    ) -> str:
+    def _trim_system_prompt(self, system_prompt: str, token_budget: int, model: str) -> str:
+        """Обрезает системный промпт до потолка бюджета, чтобы не вытеснить вопрос и контекст.
+
+        Блок tools_config мода (в конце промпта, см. prompt_builder) сохраняется: обрезается конец
+        базового промпта (проект/бэклог/профиль) перед ним. Сам блок обрезается, только если
+        он один не влезает в бюджет.
+        """
+        encoding = self._get_encoding(get_model_spec(model))
+        tokens = encoding.encode(system_prompt or "")
+        if len(tokens) <= token_budget:
+            return system_prompt
+        cut = system_prompt.rfind(TOOLS_BLOCK_HEADER)
+        base, tools = (system_prompt[:cut], system_prompt[cut:]) if cut >= 0 else (system_prompt, "")
+        tools_tokens = encoding.encode(tools) if tools else []
+        if len(tools_tokens) >= token_budget:
+            logger.warning(
+                f"System prompt ({len(tokens)} tokens) exceeds budget {token_budget}: tools block alone has "
+                f"{len(tools_tokens)} tokens, dropped base prompt and trimmed tools block"
+            )
+            return encoding.decode(tools_tokens[:token_budget])
+        base_tokens = encoding.encode(base)
+        keep = token_budget - len(tools_tokens)
+        logger.warning(
+            f"System prompt ({len(tokens)} tokens) exceeds budget {token_budget}: dropped last "
+            f"{len(base_tokens) - keep} of {len(base_tokens)} base prompt tokens, kept tools block ({len(tools_tokens)} tokens)"
+        )
+        return encoding.decode(base_tokens[:keep]) + tools
+
+    def plan_budget(self, user_message: str, tools_config: dict | None = None) -> BudgetAllocation:
+        """Бюджет хода для основной модели маршрута — нужен до RAG-поиска (сколько контекста искать)."""
+        route = self.router.route(
+            user_message,
+            user_tokens=self.count_tokens(user_message),
+            prompt_tokens=0,
+            has_context=True,
+            tools_config=tools_config,
+        )
+        return self.allocator.allocate(route.primary, tools_config)
+
+    def _build_messages(
+        self,
+        spec: ModelSpec,
+        system_prompt: str,
+        message_history: list,
+        user_message: str,
+        rag_context: list[str] | None,
+        allocation: BudgetAllocation | None = None,
+    ) -> list[dict]:
+        """Собирает сообщения, укладывая system, RAG и историю в бюджет хода и окно конкретной модели."""
+        model = spec.name
+        allocation = allocation or self.allocator.allocate(spec)
+        system_prompt = self._trim_system_prompt(system_prompt, allocation.system, model)
         # Подсчет базовых токенов без истории и RAG
-        user_tokens = self.count_tokens(user_message)
-        system_base_tokens = self.count_tokens(system_prompt)
+        user_tokens = self.count_tokens(user_message, model)
+        system_base_tokens = self.count_tokens(system_prompt, model)
 
-        # Бюджет под RAG и историю
-        remain = max(self.MAX_PROMPT_TOKENS - (system_base_tokens + user_tokens), 0)
+        # Что осталось от окна модели (длинный вопрос может съесть часть бюджета)
+        remain = max(spec.max_prompt_tokens - (system_base_tokens + user_tokens), 0)
         rag_selected: list[str] = []
-        history_selected: list[dict] = []
 
-        # Сначала RAG (важнее для фактов), затем история
+        # Сначала RAG (важнее для фактов), затем история — каждая часть в пределах своего потолка
         if rag_context:
-            rag_budget = int(remain * self.RAG_BUDGET_RATIO)
-            rag_selected = self._fit_rag_context(rag_context, rag_budget)
-            rag_tokens = self.count_tokens("\n\n".join(rag_selected))
+            rag_selected = self._fit_rag_context(rag_context, min(allocation.rag, remain), model)
+            rag_tokens = self.count_tokens("\n\n".join(rag_selected), model)
         else:
             rag_tokens = 0
 
-        remain_after_rag = max(remain - rag_tokens, 0)
-        history_selected = self._fit_history_tail(message_history or [], remain_after_rag)
+        history_budget = min(allocation.history, max(remain - rag_tokens, 0))
+        history_selected = self._fit_history_tail(message_history or [], history_budget, model)
+        logger.info(
+            f"Budget used ({model}): system={system_base_tokens}/{allocation.system}, "
+            f"rag={rag_tokens}/{allocation.rag} ({len(rag_selected)}/{len(rag_context or [])} items), "
+            f"history={len(history_selected)}/{len(message_history or [])} msgs within {allocation.history}, "
+            f"user={user_tokens}"
+        )
 
-        # Собираем финальный system с включенным RAG
+        # Порядок сообщений рассчитан на prompt caching провайдера (кэшируется общий префикс):
+        # стабильный system (базовый промпт + tools) -> история -> изменчивый RAG -> вопрос.
+        # Поэтому RAG не вклеиваем в system: иначе префикс меняется при каждом новом поиске.
+        messages = [{"role": "system", "content": system_prompt}]
+        messages.extend(history_selected)
         if rag_selected:
             rag_info = "\n\n".join(rag_selected)
-            system_prompt_with_rag = (
-                f"{system_prompt}\n\n"
-                f"Для ответа на текущий вопрос пользователя ты ДОЛЖЕН использовать следующий контекст из вашей с ним прошлой беседы. "
-                f"Это твоя долгосрочная память. Ссылайся на нее, как будто вы только что это обсуждали.\n"
-                f"--- КОНТЕКСТ ИЗ ПАМЯТИ ---\n"
-                f"{rag_info}\n"
-                f"--- КОНЕЦ КОНТЕКСТА ---\n"
-            )
-        else:
-            system_prompt_with_rag = system_prompt
-
-        messages = [{"role": "system", "content": system_prompt_with_rag}]
-        messages.extend(history_selected)
+            messages.append({
+                "role": "system",
+                "content": (
+                    f"Для ответа на текущий вопрос пользователя ты ДОЛЖЕН использовать следующий контекст из вашей с ним прошлой беседы. "
+                    f"Это твоя долгосрочная память. Ссылайся на нее, как будто вы только что это обсуждали.\n"
+                    f"--- КОНТЕКСТ ИЗ ПАМЯТИ ---\n"
+                    f"{rag_info}\n"
+                    f"--- КОНЕЦ КОНТЕКСТА ---\n"
+                ),
+            })
         messages.append({"role": "user", "content": user_message})
+        return messages
 
-        try:
+    @staticmethod
+    def _cached_tokens(usage) -> int:
+        """Сколько токенов промпта провайдер взял из своего кэша префиксов."""
+        details = getattr(usage, "prompt_tokens_details", None)
+        if details is None:
+            return 0
+        if isinstance(details, dict):
+            return int(details.get("cached_tokens") or 0)
+        return int(getattr(details, "cached_tokens", 0) or 0)
+
+    def _record_usage(self, operation: str, model: str, usage):
+        """Логирует usage ответа и накапливает статистику prompt caching."""
+        cached = self._cached_tokens(usage)
+        self.prompt_cache_stats["prompt_tokens"] += usage.prompt_tokens or 0
+        self.prompt_cache_stats["cached_tokens"] += cached
+        total_prompt = self.prompt_cache_stats["prompt_tokens"]
+        ratio = self.prompt_cache_stats["cached_tokens"] / total_prompt if total_prompt else 0.0
+        metrics.record_tokens(model, usage.prompt_tokens, usage.completion_tokens, cached)
+        record = UsageRecord(operation, model, usage.prompt_tokens or 0, usage.completion_tokens or 0, cached)
+        for tracker in _usage_trackers.get():
+            tracker.add(record)
+        logger.info(
+            f"OpenAI API Call ({operation}): "
+            f"Model={model}, "
+            f"Prompt Tokens={usage.prompt_tokens}, "
+            f"Cached Prompt Tokens={cached}, "
+            f"Completion Tokens={usage.completion_tokens}, "
+            f"Total Tokens={usage.total_tokens}, "
+            f"Cache Ratio (cumulative)={ratio:.2%}"
+        )
+
+    async def _create_completion(
+        self,
+        operation: str,
+        spec: ModelSpec,
+        messages: list[dict],
+        temperature: float | None = None,
+        last: bool = True,
+        max_tokens: int | None = None,
+    ):
+        """Один вызов модели с политикой повторов; для не последней модели цепочки таймаут/429 — сразу фолбэк."""
+        fallback_on = () if last else FALLBACK_OPENAI_ERRORS
+
+        @openai_retry(f"{operation}:{spec.name}", fallback_on=fallback_on)
+        async def _call():
+            # Таймаут запроса не выходит за общий дедлайн хода
+            timeout = effective_timeout(self.REQUEST_TIMEOUT)
             kwargs = {
-                "model": self.MODEL_NAME,
+                "model": spec.name,
                 "messages": messages,
-                "max_tokens": self.MAX_COMPLETION_TOKENS,
-                "timeout": self.REQUEST_TIMEOUT,
+                "max_tokens": min(max_tokens or spec.max_completion_tokens, spec.max_completion_tokens),
+                "timeout": timeout,
             }
             t = self._clamp_temperature(temperature)
             if t is not None:
                 kwargs["temperature"] = t
+            # Стримим ответ, чтобы измерить время до первого токена; usage приходит последним чанком
+            kwargs["stream"] = True
+            kwargs["stream_options"] = {"include_usage": True}
             # В некоторых версиях SDK timeout задается через with_options
-            client = self.client.with_options(timeout=self.REQUEST_TIMEOUT)
-            response = await client.chat.completions.create(**kwargs)
-            
-            usage = response.usage
-            if usage:
-                logger.info(
-                    f"OpenAI API Call (get_response): "
-                    f"Prompt Tokens={usage.prompt_tokens}, "
-                    f"Completion Tokens={usage.completion_tokens}, "
-                    f"Total Tokens={usage.total_tokens}"
+            client = self.client.with_options(timeout=timeout)
+            started = time.perf_counter()
+            ttft = None
+            parts: list[str] = []
+            usage = None
+            stream = await client.chat.completions.create(**kwargs)
+            async for chunk in stream:
+                if chunk.usage is not None:
+                    usage = chunk.usage
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    if ttft is None:
+                        ttft = time.perf_counter() - started
+                        metrics.observe("llm_ttft", ttft, spec.name)
+                    parts.append(delta)
+            metrics.observe("llm_total", time.perf_counter() - started, spec.name)
+            return _Completion(content="".join(parts), usage=usage, ttft=ttft)
+
+        return await _call()
+
+    async def _complete_with_fallback(self, operation: str, route, build_messages, temperature: float | None = None, completion_budget=None):
+        """Проходит по цепочке моделей, пока одна не ответит. Возвращает (_Completion, spec).
+
+        completion_budget(spec) -> max_tokens ответа для модели (None — лимит модели).
+        """
+        last_error: Exception | None = None
+        for i, spec in enumerate(route.chain):
+            is_last = i == len(route.chain) - 1
+            try:
+                max_tokens = completion_budget(spec) if completion_budget else None
+                response = await self._create_completion(
+                    operation, spec, build_messages(spec), temperature, last=is_last, max_tokens=max_tokens
                 )
-            
-            return response.choices[0].message.content
+                return response, spec
+            except FALLBACK_OPENAI_ERRORS as e:
+                last_error = e
+                if is_last:
+                    break
+                logger.warning(f"{operation}: model {spec.name} unavailable ({type(e).__name__}), falling back to {route.chain[i + 1].name}")
+        raise last_error
+
+    def _route_request(self, system_prompt: str, message_history: list, user_message: str, rag_context: list[str] | None, tools_config: dict | None):
+        """Оценивает размер промпта до обрезки и выбирает модель. Возвращает (route, prompt_estimate)."""
+        user_tokens = self.count_tokens(user_message)
+        history_tokens = sum(self.count_tokens(m.get("content", "")) for m in (message_history or []))
+        prompt_estimate = (
+            self.count_tokens(system_prompt)
+            + user_tokens
+            + history_tokens
+            + sum(self.count_tokens(match_text(s)) for s in (rag_context or []))
+        )
+        route = self.router.route(
+            user_message,
+            user_tokens=user_tokens,
+            prompt_tokens=prompt_estimate,
+            has_context=bool(rag_context),
+            tools_config=tools_config,
+            history_tokens=history_tokens,
+        )
+        return route, prompt_estimate
+
+    def estimate_tokens(
+        self,
+        system_prompt: str,
+        message_history: list,
+        user_message: str,
+        rag_context: list[str] | None = None,
+        tools_config: dict | None = None,
+    ) -> int:
+        """Верхняя оценка расхода на запрос (промпт в пределах бюджета + потолок ответа) — для резерва квоты."""
+        route, prompt_estimate = self._route_request(system_prompt, message_history, user_message, rag_context, tools_config)
+        spec = route.primary
+        allocation = self.allocator.allocate(spec, tools_config)
+        prompt_cap = min(allocation.prompt + self.count_tokens(user_message), spec.max_prompt_tokens)
+        return min(prompt_estimate, prompt_cap) + allocation.completion
+
+    async def get_response(
+        self,
+        system_prompt: str,
+        message_history: list,
+        user_message: str,
+        rag_context: list[str] = None,
+        temperature: float | None = None,
+        tools_config: dict | None = None,
+    ) -> LLMResult:
+        """Ответ модели с фактическим usage (промпт целиком: system, история, RAG) и именем модели."""
+        # Оценка размера промпта до обрезки — для выбора модели
+        route, prompt_estimate = self._route_request(system_prompt, message_history, user_message, rag_context, tools_config)
+        logger.info(f"LLM route (get_response): {route.describe()}, prompt_estimate={prompt_estimate}")
+
+        # Бюджет считается для каждой модели цепочки отдельно (у фолбэка может быть меньше окно)
+        allocations: dict[str, BudgetAllocation] = {}
+
+        def _allocation(spec: ModelSpec) -> BudgetAllocation:
+            if spec.name not in allocations:
+                allocations[spec.name] = self.allocator.allocate(spec, tools_config)
+                logger.info(f"Budget allocation (get_response): {allocations[spec.name].describe()}")
+            return allocations[spec.name]
+
+        try:
+            with track_usage() as usage_totals:
+                response, spec = await self._complete_with_fallback(
+                    "get_response",
+                    route,
+                    lambda s: self._build_messages(s, system_prompt, message_history, user_message, rag_context, _allocation(s)),
+                    temperature,
+                    completion_budget=lambda s: _allocation(s).completion,
+                )
+
+                usage = response.usage
+                if usage:
+                    self._record_usage("get_response", spec.name, usage)
+                else:
+                    # Стрим без usage (прокси/старый API) — учитываем по оценке токенайзером
+                    logger.warning(f"get_response: no usage in stream from {spec.name}, using tokenizer estimate")
+                    self._record_usage("get_response", spec.name, SimpleNamespace(
+                        prompt_tokens=min(
+                            prompt_estimate,
+                            _allocation(spec).prompt + self.count_tokens(user_message, spec.name),
+                            spec.max_prompt_tokens,
+                        ),
+                        completion_tokens=self.count_tokens(response.content, spec.name),
+                        total_tokens=None,
+                        prompt_tokens_details=None,
+                    ))
+
+            return LLMResult(
+                text=response.content, model=spec.name, usage=usage_totals, ttft=response.ttft, allocation=_allocation(spec),
+            )
         except Exception as e:
             logger.error(f"Error communicating with OpenAI: {e}")
-            raise # Перевыбрасываем ошибку, чтобы tenacity мог ее поймать
+            raise
 
-    @retry(
-        stop=stop_after_attempt(3),
-        wait=wait_exponential(multiplier=1, min=2, max=10),
-        retry=retry_if_exception_type(RETRYABLE_OPENAI_ERRORS)
-    )
     async def get_summary(self, message_history: list) -> str:
         summary_prompt = (
             "Подведи краткие, но емкие итоги этого диалога для "
@@ -172,22 +491,18 @@ class LLMClient:
             "решениях и выводах. Текст должен быть в формате markdown."
         )
         messages = message_history + [{"role": "user", "content": summary_prompt}]
+        prompt_estimate = sum(self.count_tokens(m.get("content", "")) for m in messages)
+        route = self.router.route_summary(prompt_estimate)
+        logger.info(f"LLM route (get_summary): {route.describe()}, prompt_estimate={prompt_estimate}")
 
         try:
-            response = await self.client.chat.completions.create(
-                model="gpt-3.5-turbo", messages=messages
-            )
-            
+            response, spec = await self._complete_with_fallback("get_summary", route, lambda s: messages)
+
             usage = response.usage
             if usage:
-                logger.info(
-                    f"OpenAI API Call (get_summary): "
-                    f"Prompt Tokens={usage.prompt_tokens}, "
-                    f"Completion Tokens={usage.completion_tokens}, "
-                    f"Total Tokens={usage.total_tokens}"
-                )
-            
-            return response.choices[0].message.content
+                self._record_usage("get_summary", spec.name, usage)
+
+            return response.content
         except Exception as e:
             logger.error(f"Error creating summary: {e}")
-            raise # Перевыбрасываем ошибку, чтобы tenacity мог ее поймать
\ No newline at end of file
+            raise
@@ -0,0 +1,258 @@
+# Файл: C:\desk_top\src\services\metrics.py
+import bisect
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from aiohttp import web
+
+from src.config import METRICS_HOST, METRICS_PORT
+
+logger = logging.getLogger(__name__)
+
+# Границы бакетов латентности, сек (от быстрых SQL до долгих ответов LLM)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: tuple[str, ...], values: tuple, extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Counter:
+    """Монотонный счётчик с метками (Prometheus counter)."""
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = tuple(labels.get(n, "") for n in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(tuple(labels.get(n, "") for n in self.labelnames), 0.0)
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        for key, val in sorted(self._values.items()):
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {val}")
+        return lines
+
+
+class Gauge:
+    """Значение, которое может расти и убывать (Prometheus gauge)."""
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def set(self, value: float, **labels):
+        key = tuple(labels.get(n, "") for n in self.labelnames)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = tuple(labels.get(n, "") for n in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels):
+        self.inc(-amount, **labels)
+
+    def value(self, **labels) -> float:
+        return self._values.get(tuple(labels.get(n, "") for n in self.labelnames), 0.0)
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} gauge"]
+        for key, val in sorted(self._values.items()):
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {val}")
+        return lines
+
+
+class Histogram:
+    """Гистограмма с кумулятивными бакетами (Prometheus histogram)."""
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = (), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # key -> [counts по бакетам..., count, sum]
+        self._values: dict[tuple, list[float]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(labels.get(n, "") for n in self.labelnames)
+        idx = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            row = self._values.get(key)
+            if row is None:
+                row = [0.0] * (len(self.buckets) + 2)
+                self._values[key] = row
+            if idx < len(self.buckets):
+                row[idx] += 1
+            row[-2] += 1
+            row[-1] += value
+
+    def count(self, **labels) -> int:
+        row = self._values.get(tuple(labels.get(n, "") for n in self.labelnames))
+        return int(row[-2]) if row else 0
+
+    def snapshot(self) -> dict[tuple, tuple[int, float]]:
+        """Текущие (count, sum) по наборам меток — для замеров «до/после» (см. bench_pipeline.py)."""
+        with self._lock:
+            return {key: (int(row[-2]), row[-1]) for key, row in self._values.items()}
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        for key, row in sorted(self._values.items()):
+            cumulative = 0.0
+            for bound, n in zip(self.buckets, row):
+                cumulative += n
+                labels = _format_labels(self.labelnames, key, 'le="%s"' % bound)
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            inf_labels = _format_labels(self.labelnames, key, 'le="+Inf"')
+            plain_labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_bucket{inf_labels} {row[-2]}")
+            lines.append(f"{self.name}_count{plain_labels} {row[-2]}")
+            lines.append(f"{self.name}_sum{plain_labels} {row[-1]}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: dict[str, Counter | Gauge | Histogram] = {}
+
+    def register(self, metric):
+        self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        lines: list[str] = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+# Латентность стадий обработки хода: db, embedding, vector_query, llm_ttft, llm_total, telegram_edit
+STAGE_SECONDS = REGISTRY.register(Histogram(
+    "desk_top_stage_seconds", "Latency of pipeline stages in seconds", ("stage", "model"),
+))
+# Токены OpenAI по пользователю/проекту/режиму: kind = prompt | completion | cached
+LLM_TOKENS = REGISTRY.register(Counter(
+    "desk_top_llm_tokens_total", "OpenAI tokens by user, project and mode", ("user", "project", "mode", "model", "kind"),
+))
+# Повторы/отказы политики повторов (см. retry_policy)
+LLM_RETRIES = REGISTRY.register(Counter(
+    "desk_top_llm_retries_total", "OpenAI retry policy outcomes", ("operation", "outcome"),
+))
+# Очередь ходов пользователей (см. turn_serializer): ожидающие ходы и склеенные сообщения
+USER_TURNS_WAITING = REGISTRY.register(Gauge(
+    "desk_top_user_turns_waiting", "Conversational turns waiting for the per-user lock",
+))
+USER_TURNS = REGISTRY.register(Counter(
+    "desk_top_user_turns_total", "Per-user turn serializer outcomes", ("outcome",),
+))
+# Очистка по сроку хранения (см. retention): удалённые сессии/векторы и скорость последнего прогона
+RETENTION_DELETED = REGISTRY.register(Counter(
+    "desk_top_retention_deleted_total", "Rows and vectors removed by the retention worker", ("kind",),
+))
+RETENTION_ROWS_PER_SECOND = REGISTRY.register(Gauge(
+    "desk_top_retention_rows_per_second", "Session delete throughput of the last retention run",
+))
+
+# Метки текущего хода (user/project/mode) — проставляются обработчиком текста
+_turn_labels: ContextVar[dict | None] = ContextVar("metrics_turn_labels", default=None)
+
+
+def set_turn_labels(user_id=None, project_id=None, mode_id=None):
+    """Задаёт метки хода для счётчиков токенов. Возвращает токен для reset_turn_labels."""
+    return _turn_labels.set({
+        "user": "" if user_id is None else str(user_id),
+        "project": "" if project_id is None else str(project_id),
+        "mode": "" if mode_id is None else str(mode_id),
+    })
+
+
+def reset_turn_labels(token):
+    _turn_labels.reset(token)
+
+
+def turn_labels() -> dict:
+    return _turn_labels.get() or {"user": "", "project": "", "mode": ""}
+
+
+def observe(stage: str, seconds: float, model: str = ""):
+    STAGE_SECONDS.observe(seconds, stage=stage, model=model)
+
+
+@contextmanager
+def observe_stage(stage: str, model: str = ""):
+    """Замеряет длительность блока и пишет в гистограмму стадий (работает и вокруг await)."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(stage, time.perf_counter() - started, model)
+
+
+def record_tokens(model: str, prompt_tokens: int, completion_tokens: int, cached_tokens: int = 0):
+    labels = turn_labels()
+    LLM_TOKENS.inc(prompt_tokens or 0, model=model, kind="prompt", **labels)
+    LLM_TOKENS.inc(completion_tokens or 0, model=model, kind="completion", **labels)
+    if cached_tokens:
+        LLM_TOKENS.inc(cached_tokens, model=model, kind="cached", **labels)
+
+
+def instrument_engine(engine):
+    """Подписывается на события SQLAlchemy и пишет длительность каждого SQL в стадию 'db'."""
+    from sqlalchemy import event
+
+    sync_engine = getattr(engine, "sync_engine", engine)
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("metrics_query_start", []).append(time.perf_counter())
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        starts = conn.info.get("metrics_query_start")
+        if starts:
+            observe("db", time.perf_counter() - starts.pop())
+
+
+async def _metrics_handler(request: web.Request) -> web.Response:
+    return web.Response(text=REGISTRY.render(), content_type="text/plain", charset="utf-8")
+
+
+async def start_metrics_server(host: str = METRICS_HOST, port: int = METRICS_PORT) -> web.AppRunner | None:
+    """Поднимает локальный HTTP-эндпоинт /metrics в формате Prometheus. port=0 — выключено."""
+    if not port:
+        logger.info("Metrics endpoint disabled (METRICS_PORT=0).")
+        return None
+    app = web.Application()
+    app.router.add_get("/metrics", _metrics_handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    logger.info(f"Metrics endpoint listening on http://{host}:{port}/metrics")
+    return runner
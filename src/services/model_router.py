@@ -0,0 +1,178 @@
+# Файл: C:\desk_top\src\services\model_router.py
+import logging
+from dataclasses import dataclass, field
+
+from src.config import (
+    LLM_DEFAULT_MODEL,
+    LLM_FAST_MODEL,
+    LLM_FALLBACK_MODELS,
+    LLM_SUMMARY_MODEL,
+    LLM_ROUTING_POLICY,
+    LLM_CHITCHAT_MAX_TOKENS,
+)
+
+logger = logging.getLogger(__name__)
+
+VALID_POLICIES = {"fast", "balanced", "quality"}
+
+
+@dataclass(frozen=True)
+class ModelSpec:
+    """Параметры модели: окно контекста, лимит completion, токенайзер и цены (USD за 1M токенов)."""
+    name: str
+    context_window: int
+    max_completion_tokens: int
+    encoding: str
+    tier: str = "quality"  # 'fast' | 'quality'
+    input_price: float = 0.0
+    output_price: float = 0.0
+    # Цена промпт-токенов из кэша провайдера (None — как обычный вход)
+    cached_input_price: float | None = None
+
+    @property
+    def max_prompt_tokens(self) -> int:
+        return max(self.context_window - self.max_completion_tokens, 0)
+
+    def cost_usd(self, prompt_tokens: int, completion_tokens: int, cached_tokens: int = 0) -> float:
+        """Стоимость вызова по фактическому usage (cached_tokens входят в prompt_tokens)."""
+        cached = min(cached_tokens or 0, prompt_tokens or 0)
+        cached_price = self.input_price if self.cached_input_price is None else self.cached_input_price
+        return (
+            ((prompt_tokens or 0) - cached) * self.input_price
+            + cached * cached_price
+            + (completion_tokens or 0) * self.output_price
+        ) / 1_000_000
+
+
+MODEL_REGISTRY: dict[str, ModelSpec] = {
+    "gpt-4o": ModelSpec("gpt-4o", 128_000, 2_048, "o200k_base", "quality", 2.50, 10.00, 1.25),
+    "gpt-4o-mini": ModelSpec("gpt-4o-mini", 128_000, 2_048, "o200k_base", "fast", 0.15, 0.60, 0.075),
+    "gpt-4-turbo": ModelSpec("gpt-4-turbo", 128_000, 2_048, "cl100k_base", "quality", 10.00, 30.00),
+    "gpt-3.5-turbo": ModelSpec("gpt-3.5-turbo", 16_385, 1_024, "cl100k_base", "fast", 0.50, 1.50),
+}
+
+
+def get_model_spec(name: str) -> ModelSpec:
+    """Возвращает спецификацию модели; для неизвестных имён — консервативные значения по умолчанию."""
+    spec = MODEL_REGISTRY.get(name)
+    if spec is None:
+        logger.warning(f"Unknown model '{name}', using default limits (128k context, cl100k_base).")
+        spec = ModelSpec(name, 128_000, 2_048, "cl100k_base", "quality")
+    return spec
+
+
+@dataclass
+class RouteDecision:
+    """Итог маршрутизации: упорядоченная цепочка моделей (первая — основная) и причина выбора."""
+    chain: list[ModelSpec]
+    policy: str
+    reason: str
+    skipped: list[str] = field(default_factory=list)
+
+    @property
+    def primary(self) -> ModelSpec:
+        return self.chain[0]
+
+    def describe(self) -> str:
+        parts = [
+            f"model={self.primary.name}",
+            f"fallbacks=[{', '.join(s.name for s in self.chain[1:])}]",
+            f"policy={self.policy}",
+            f"reason={self.reason}",
+        ]
+        if self.skipped:
+            parts.append(f"skipped(context)=[{', '.join(self.skipped)}]")
+        return ", ".join(parts)
+
+
+class ModelRouter:
+    """Выбирает модель на запрос по tools_config мода, размеру промпта и политике latency/cost.
+
+    Поддерживаемые ключи tools_config:
+      - "model": явная основная модель
+      - "fallback_models": список фолбэков (по умолчанию LLM_FALLBACK_MODELS)
+      - "routing": "fast" | "balanced" | "quality"
+    """
+
+    def __init__(
+        self,
+        default_model: str = LLM_DEFAULT_MODEL,
+        fast_model: str = LLM_FAST_MODEL,
+        fallback_models: list[str] | None = None,
+        summary_model: str = LLM_SUMMARY_MODEL,
+        policy: str = LLM_ROUTING_POLICY,
+        chitchat_max_tokens: int = LLM_CHITCHAT_MAX_TOKENS,
+    ):
+        self.default_model = default_model
+        self.fast_model = fast_model
+        self.fallback_models = list(LLM_FALLBACK_MODELS if fallback_models is None else fallback_models)
+        self.summary_model = summary_model
+        self.policy = policy if policy in VALID_POLICIES else "balanced"
+        self.chitchat_max_tokens = chitchat_max_tokens
+
+    def is_chitchat(self, user_tokens: int, user_message: str, has_context: bool, history_tokens: int = 0) -> bool:
+        """Короткая реплика без кода, без найденного контекста и без истории сессии — можно отдать быстрой модели.
+
+        Непустая история — тоже контекст: короткое «ок, теперь добавь тесты» продолжает длинный разговор.
+        """
+        if has_context or history_tokens > 0 or user_tokens > self.chitchat_max_tokens:
+            return False
+        text = user_message or ""
+        return "```" not in text and "\n" not in text.strip()
+
+    def _build_chain(self, primary: str, fallbacks: list[str], prompt_tokens: int) -> tuple[list[ModelSpec], list[str]]:
+        chain: list[ModelSpec] = []
+        skipped: list[str] = []
+        seen: set[str] = set()
+        for name in [primary, *fallbacks, self.default_model]:
+            if not name or name in seen:
+                continue
+            seen.add(name)
+            spec = get_model_spec(name)
+            # Модель с окном меньше промпта пропускаем — обрезка истории/RAG ухудшит ответ сильнее
+            if prompt_tokens > spec.max_prompt_tokens:
+                skipped.append(name)
+                continue
+            chain.append(spec)
+        if not chain:
+            # Ничего не вмещает промпт целиком — берём модель с самым большим окном, обрежем контекст
+            chain = [max((get_model_spec(n) for n in seen), key=lambda s: s.context_window)]
+        return chain, skipped
+
+    def route(
+        self,
+        user_message: str,
+        user_tokens: int,
+        prompt_tokens: int,
+        has_context: bool = False,
+        tools_config: dict | None = None,
+        history_tokens: int = 0,
+    ) -> RouteDecision:
+        cfg = tools_config or {}
+        policy = cfg.get("routing") if cfg.get("routing") in VALID_POLICIES else self.policy
+        fallbacks = cfg.get("fallback_models")
+        if not isinstance(fallbacks, list):
+            fallbacks = self.fallback_models
+        fallbacks = [str(m) for m in fallbacks]
+
+        explicit = cfg.get("model")
+        if isinstance(explicit, str) and explicit.strip():
+            primary, reason = explicit.strip(), "mode_override"
+        elif policy == "fast":
+            primary, reason = self.fast_model, "policy_fast"
+        elif policy == "quality":
+            primary, reason = self.default_model, "policy_quality"
+        elif self.is_chitchat(user_tokens, user_message, has_context, history_tokens):
+            primary, reason = self.fast_model, "chitchat"
+        else:
+            primary, reason = self.default_model, "default"
+
+        chain, skipped = self._build_chain(primary, fallbacks, prompt_tokens)
+        if skipped and chain[0].name != primary:
+            reason = f"{reason}+context_overflow"
+        return RouteDecision(chain=chain, policy=policy, reason=reason, skipped=skipped)
+
+    def route_summary(self, prompt_tokens: int) -> RouteDecision:
+        """Модель для итогов сессии: дешёвая, но с окном, вмещающим историю."""
+        chain, skipped = self._build_chain(self.summary_model, self.fallback_models, prompt_tokens)
+        return RouteDecision(chain=chain, policy="summary", reason="summary", skipped=skipped)
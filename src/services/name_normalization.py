@@ -0,0 +1,72 @@
+# Файл: C:\desk_top\src\services\name_normalization.py
+import unicodedata
+from functools import lru_cache
+
+# Частые конфузаблы: кириллические и греческие буквы, похожие на латиницу.
+# Таблица строится один раз при импорте; str.translate работает на уровне C без цикла по символам.
+_CONFUSABLES = str.maketrans({
+    # Cyrillic -> Latin
+    "а": "a", "е": "e", "о": "o", "р": "r", "с": "c", "у": "y", "х": "x",
+    "к": "k", "т": "t", "в": "v", "м": "m", "н": "n",
+    # Greek -> Latin (минимально необходимое)
+    "α": "a", "β": "b", "γ": "g", "δ": "d", "ε": "e", "η": "h", "ι": "i", "κ": "k",
+    "λ": "l", "μ": "m", "ν": "n", "ο": "o", "π": "p", "ρ": "r", "τ": "t", "υ": "y", "χ": "x",
+})
+
+NORMALIZE_CACHE_SIZE = 4096
+
+
+@lru_cache(maxsize=NORMALIZE_CACHE_SIZE)
+def normalize_name(s: str | None) -> str:
+    """Ключ сравнения имён проектов: Unicode NFKC + casefold + trim + латинизация конфузаблов.
+
+    Делаем только безопасные подстановки визуально-сходных символов в ASCII, чтобы имя,
+    набранное в другой раскладке, находилось. Исходные имена не меняются; тот же ключ
+    хранится в projects.name_norm для индексного поиска в БД.
+    """
+    base = unicodedata.normalize("NFKC", (s or "").strip()).casefold()
+    return base.translate(_CONFUSABLES)
+
+
+# Порог похожести для подсказок имён (как pg_trgm.similarity_threshold по умолчанию)
+SUGGEST_MIN_SIMILARITY = 0.3
+
+
+def _trigrams(s: str) -> set[str]:
+    """Триграммы слов в стиле pg_trgm: каждое слово дополняется двумя пробелами слева и одним справа."""
+    grams = set()
+    for word in s.split():
+        padded = f"  {word} "
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+def name_similarity(query_norm: str, name_norm: str) -> float:
+    """Похожесть нормализованных имён 0..1: подстрока — 1.0, иначе лучшая доля общих триграмм
+    с именем целиком или с одним его словом (опечатки: «dataa» ~ «my data»)."""
+    if not query_norm or not name_norm:
+        return 0.0
+    if query_norm in name_norm:
+        return 1.0
+    query = _trigrams(query_norm)
+    best = 0.0
+    for part in (name_norm, *name_norm.split()):
+        grams = _trigrams(part)
+        if query and grams:
+            best = max(best, len(query & grams) / len(query | grams))
+    return best
+
+
+def suggest_names(query: str, candidates: list[tuple[str, str | None]], limit: int = 5) -> list[str]:
+    """Имена из candidates [(name, name_norm)], похожие на query, по убыванию похожести
+    (при равенстве — в исходном порядке)."""
+    norm = normalize_name(query)
+    if not norm:
+        return []
+    scored = []
+    for name, name_norm in candidates:
+        score = name_similarity(norm, name_norm or normalize_name(name))
+        if score >= SUGGEST_MIN_SIMILARITY:
+            scored.append((score, name))
+    scored.sort(key=lambda item: -item[0])
+    return [name for _, name in scored[:limit]]
@@ -0,0 +1,115 @@
+# Файл: C:\desk_top\src\services\project_index.py
+import logging
+import re
+import time
+from dataclasses import dataclass, field
+
+from src.config import PROJECT_INDEX_TTL_SECONDS
+from src.services.acl_engine import ACLEngine, acl_engine
+from src.services.name_normalization import normalize_name
+
+logger = logging.getLogger(__name__)
+
+MENTION_RE = re.compile(r"@\[([^\]]+)\]")
+
+
+def extract_mentions(text: str) -> list[str]:
+    """Уникальные упоминания @[Имя] в порядке появления."""
+    seen: list[str] = []
+    for name in MENTION_RE.findall(text or ""):
+        n = name.strip()
+        if n and n not in seen:
+            seen.append(n)
+    return seen
+
+
+@dataclass
+class _UserProjects:
+    by_name: dict[str, int]
+    by_norm: dict[str, int]
+    loaded_at: float
+
+
+@dataclass
+class MentionResolution:
+    project_ids: list[int] = field(default_factory=list)  # разрешённые по ACL, без владельца
+    missing: list[str] = field(default_factory=list)      # не найден проект у пользователя
+    denied: list[str] = field(default_factory=list)       # нет ACL-доступа
+
+
+class ProjectMentionIndex:
+    """Кэш для режима acl_mentions: индекс имён проектов пользователя + доступы из ACLEngine.
+
+    Индекс имён строится одним запросом list_projects (ключ — normalize_name имени), доступные
+    owner-проекту проекты — одним кэшированным обращением к ACL-графу; дальше все упоминания
+    сообщения резолвятся поиском в словарях. Индекс имён сбрасывается при создании/переименовании/
+    удалении проекта, ACL-граф — при grant/revoke (см. ACLEngine); TTL страхует от изменений
+    в обход хендлеров. Пользователь закреплён за одним воркером (см. webhook.partition_for),
+    поэтому кэша процесса достаточно.
+    """
+
+    def __init__(self, ttl_seconds: float = PROJECT_INDEX_TTL_SECONDS, acl: ACLEngine | None = None):
+        self.ttl_seconds = ttl_seconds
+        self.acl = acl or acl_engine
+        self._users: dict[int, _UserProjects] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def _fresh(self, loaded_at: float) -> bool:
+        return time.monotonic() - loaded_at <= self.ttl_seconds
+
+    async def _user_projects(self, project_repo, user_id: int) -> _UserProjects:
+        entry = self._users.get(user_id)
+        if entry and self._fresh(entry.loaded_at):
+            self.hits += 1
+            return entry
+        self.misses += 1
+        by_name: dict[str, int] = {}
+        by_norm: dict[str, int] = {}
+        for p in await project_repo.list_projects(user_id):
+            by_name.setdefault(p.name, p.id)
+            # list_projects отсортирован от новых к старым: при коллизии нормализованных имён побеждает новый
+            by_norm.setdefault(normalize_name(p.name), p.id)
+        entry = _UserProjects(by_name, by_norm, time.monotonic())
+        self._users[user_id] = entry
+        return entry
+
+    async def resolve_mentions(
+        self,
+        project_repo,
+        acl_repo,
+        user_id: int,
+        owner_project_id: int,
+        names: list[str],
+    ) -> MentionResolution:
+        """Резолвит упоминания: точное имя, затем нормализованное; доступ — по ACL-графу owner-проекта."""
+        result = MentionResolution()
+        if not names:
+            return result
+        projects = await self._user_projects(project_repo, user_id)
+        allowed = await self.acl.allowed_projects(acl_repo, user_id, owner_project_id)
+        for name in names:
+            pid = projects.by_name.get(name)
+            if pid is None:
+                pid = projects.by_norm.get(normalize_name(name))
+            if pid is None:
+                result.missing.append(name)
+            elif pid == owner_project_id:
+                continue
+            elif pid in allowed:
+                if pid not in result.project_ids:
+                    result.project_ids.append(pid)
+            else:
+                result.denied.append(name)
+        return result
+
+    def invalidate_user(self, user_id: int):
+        """Проекты пользователя изменились (создание, переименование, удаление)."""
+        self._users.pop(user_id, None)
+
+    def clear(self):
+        self._users.clear()
+
+
+# Общий экземпляр процесса (хендлеры сессии и проектов работают с одним кэшем)
+project_index = ProjectMentionIndex()
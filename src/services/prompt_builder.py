@@ -1,11 +1,15 @@
 # Файл: C:\desk_top\src\services\prompt_builder.py
-import json
 from typing import Tuple, Optional
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
+from sqlalchemy.orm import undefer
 
-from src.db.models import Mode, Project, Session as DbSession
+from src.db.models import Mode, Project, Session as DbSession, load_deferred
 from src.db.repository import PersonalizedPromptRepository
+from src.services import serializer
+
+# Заголовок блока tools_config мода; блок всегда в конце system_prompt (см. LLMClient._trim_system_prompt)
+TOOLS_BLOCK_HEADER = "\n\n[Tools Configuration]\n"
 
 
 async def _format_tools_block(tools_config: Optional[str]) -> str:
@@ -13,10 +17,21 @@ async def _format_tools_block(tools_config: Optional[str]) -> str:
         return ""
     block = tools_config
     try:
-        block = json.dumps(json.loads(tools_config), ensure_ascii=False, indent=2)
+        block = serializer.dumps(serializer.loads(tools_config), indent=True)
     except Exception:
         pass
-    return f"\n\n[Tools Configuration]\n{block}"
+    return f"{TOOLS_BLOCK_HEADER}{block}"
+
+
+def parse_tools_config(tools_config: Optional[str]) -> dict:
+    """Разбирает tools_config мода в dict (пустой dict, если не задан или не JSON-объект)."""
+    if not tools_config:
+        return {}
+    try:
+        parsed = serializer.loads(tools_config)
+    except Exception:
+        return {}
+    return parsed if isinstance(parsed, dict) else {}
 
 
 async def build_prompt(
@@ -24,18 +39,20 @@ async def build_prompt(
     user_id: int,
     active_session: DbSession,
     active_project: Optional[Project],
-) -> Tuple[str, Optional[float]]:
+) -> Tuple[str, Optional[float], dict]:
     """
-    Строит system_prompt и возвращает (prompt, temperature).
+    Строит system_prompt и возвращает (prompt, temperature, tools_config).
     Приоритет источников:
       1) Mode (из Session.mode_id): переопределяет system_prompt, добавляет tools_config, задаёт temperature
       2) Project.system_prompt
       3) PersonalizedPrompt по active_profile
+    tools_config — разобранный JSON мода (используется роутингом модели), {} если мода нет.
     Все операции асинхронные, без блокировок.
     """
     # 1) Базовый system_prompt: Project.system_prompt или PersonalizedPrompt
-    if active_project and getattr(active_project, 'system_prompt', None):
-        system_prompt: str = active_project.system_prompt
+    project_prompt = await load_deferred(active_project, 'system_prompt') if active_project else None
+    if project_prompt:
+        system_prompt: str = project_prompt
     else:
         prompt_repo = PersonalizedPromptRepository(db)
         system_prompt = await prompt_repo.get_prompt(user_id, active_session.active_profile)
@@ -43,16 +60,20 @@ async def build_prompt(
             raise ValueError("Профиль не настроен. Начните с /personalize")
 
     temperature: Optional[float] = None
+    tools_config: dict = {}
 
     # 2) Если выбран Mode на сессии — применяем
     try:
         m_id = getattr(active_session, 'mode_id', None)
         if m_id:
-            res = await db.execute(select(Mode).where(Mode.id == m_id))
+            res = await db.execute(
+                select(Mode).options(undefer(Mode.system_prompt), undefer(Mode.tools_config)).where(Mode.id == m_id)
+            )
             mode = res.scalar_one_or_none()
             if mode:
                 if getattr(mode, 'system_prompt', None):
                     system_prompt = mode.system_prompt
+                tools_config = parse_tools_config(getattr(mode, 'tools_config', None))
                 tools_block = await _format_tools_block(getattr(mode, 'tools_config', None))
                 if tools_block:
                     system_prompt = f"{system_prompt}{tools_block}"
@@ -66,4 +87,4 @@ async def build_prompt(
         # Не блокируем диалог при проблемах с Mode
         pass
 
-    return system_prompt, temperature
+    return system_prompt, temperature, tools_config
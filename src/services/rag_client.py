@@ -1,21 +1,47 @@
 # Файл: C:\desk_top\src\services\rag_client.py
+import asyncio
 import logging
+from dataclasses import replace
 import tiktoken
 from pinecone import Pinecone, PodSpec
 from openai import AsyncOpenAI
-from src.config import PINECONE_API_KEY, OPENAI_API_KEY
+from src.config import (
+    PINECONE_API_KEY,
+    OPENAI_API_KEY,
+    LLM_BUDGET_RAG_TOKENS,
+    RAG_MAX_CANDIDATES,
+    RAG_MIN_TOP_K,
+    RAG_CHUNK_NEIGHBORS,
+    RAG_EMBEDDING_TIMEOUT_SECONDS,
+)
+from src.services.metrics import observe_stage
+from src.services.rag_selection import (
+    RAGMatch,
+    select_matches,
+    project_quota_for,
+    reciprocal_rank_fusion,
+    apply_project_quota,
+)
+from src.services.chunking import Chunk, split_into_chunks, assemble_chunks, chunk_vector_id
+from src.services.lexical_index import build_tsquery
+from src.services.retrieval_cache import RetrievalCache
 
 PINECONE_INDEX_NAME = "desk-top-agent"
 EMBEDDING_DIMENSION = 1536
+# Предел id в одном запросе fetch/delete Pinecone
+VECTOR_IDS_PER_REQUEST = 1000
 
 class RAGClient:
-    def __init__(self):
+    def __init__(self, lexical_index=None, retrieval_cache: RetrievalCache | None = None):
+        """lexical_index — LexicalSummaryIndex для гибридного поиска (None — только векторы)."""
         if not PINECONE_API_KEY or not OPENAI_API_KEY:
             raise ValueError("Pinecone or OpenAI API key not found in .env file.")
         
         self.pinecone = Pinecone(api_key=PINECONE_API_KEY)
         self.openai_client = AsyncOpenAI(api_key=OPENAI_API_KEY)
         self.index = None
+        self.lexical_index = lexical_index
+        self.retrieval_cache = retrieval_cache if retrieval_cache is not None else RetrievalCache()
         logging.info("RAGClient instance created.")
 
         # Настройка токенайзера для оценки бюджета RAG
@@ -25,31 +51,36 @@ class RAGClient:
             logging.warning(f"Could not get encoding for gpt-4o in RAGClient, fallback to cl100k_base. Error: {e}")
             self.encoding = tiktoken.get_encoding("cl100k_base")
 
-        # Бюджет токенов под RAG-контекст (соответствует ~60% от 100k из LLMClient)
-        self.RAG_TOKEN_BUDGET = 60_000
+        # Бюджет токенов под RAG-контекст по умолчанию (на ход задаётся BudgetAllocation)
+        self.RAG_TOKEN_BUDGET = LLM_BUDGET_RAG_TOKENS
         # Верхняя граница, сколько кандидатов запрашивать у Pinecone до обрезки по токенам
-        self.MAX_CANDIDATES = 20
-        self.MIN_TOP_K = 3
+        self.MAX_CANDIDATES = RAG_MAX_CANDIDATES
+        self.MIN_TOP_K = RAG_MIN_TOP_K
+        self.CHUNK_NEIGHBORS = RAG_CHUNK_NEIGHBORS
+        self.EMBEDDING_TIMEOUT = RAG_EMBEDDING_TIMEOUT_SECONDS
 
     def _count_tokens(self, text: str) -> int:
         if not text:
             return 0
         return len(self.encoding.encode(text))
 
-    def _trim_summaries_by_budget(self, summaries: list[str], budget_tokens: int) -> list[str]:
-        if budget_tokens <= 0 or not summaries:
-            return []
+    def _pack_counted(self, counted: list[tuple], budget_tokens: int) -> tuple[list[tuple], int]:
+        """Набирает [(элемент, токены)] в порядке ранжирования в пределах бюджета.
+
+        Не влезающий элемент пропускается, а не обрывает отбор. Возвращает (отобранные, занято токенов).
+        """
+        if budget_tokens <= 0 or not counted:
+            return [], 0
         selected = []
         used = 0
         sep_tokens = self._count_tokens("\n\n")
-        for i, s in enumerate(summaries):
-            t = self._count_tokens(s)
-            add = t if i == 0 else t + sep_tokens
+        for item, t in counted:
+            add = t if not selected else t + sep_tokens
             if used + add > budget_tokens:
-                break
-            selected.append(s)
+                continue
+            selected.append((item, t))
             used += add
-        return selected
+        return selected, used
 
     async def initialize(self):
         """Проверяет, существует ли индекс, создает его, если нет, и подключается."""
@@ -72,34 +103,275 @@ class RAGClient:
 
     async def get_embedding(self, text: str) -> list[float]:
         try:
-            response = await self.openai_client.embeddings.create(
-                model="text-embedding-3-small", input=text
-            )
+            with observe_stage("embedding"):
+                response = await self.openai_client.embeddings.create(
+                    model="text-embedding-3-small", input=text
+                )
             return response.data[0].embedding
         except Exception as e:
             logging.error(f"Failed to create embedding: {e}")
             return []
 
+    async def get_embeddings(self, texts: list[str]) -> list[list[float]]:
+        """Эмбеддинги для нескольких текстов одним запросом к API (порядок сохраняется)."""
+        if not texts:
+            return []
+        try:
+            with observe_stage("embedding"):
+                response = await self.openai_client.embeddings.create(
+                    model="text-embedding-3-small", input=texts
+                )
+            return [d.embedding for d in sorted(response.data, key=lambda d: d.index)]
+        except Exception as e:
+            logging.error(f"Failed to create embeddings: {e}")
+            return []
+
     async def save_summary(self, session_id: int, user_id: int, summary_text: str, project_id: int | None = None):
+        """Сохраняет итоги сессии фрагментами: вектор `session-{id}-chunk-{n}` на каждый фрагмент.
+
+        Те же фрагменты пишутся в полнотекстовый индекс — он не зависит от API эмбеддингов и Pinecone.
+        Закэшированные выдачи, в которые могли попасть новые итоги, сбрасываются.
+        """
+        try:
+            await self._save_summary_chunks(session_id, user_id, summary_text, project_id)
+        finally:
+            self.retrieval_cache.invalidate(user_id, project_id)
+
+    async def _save_summary_chunks(self, session_id: int, user_id: int, summary_text: str, project_id: int | None):
+        chunks = split_into_chunks(summary_text, self.encoding)
+        if not chunks:
+            return
+        if self.lexical_index:
+            try:
+                await self.lexical_index.index_session(user_id, session_id, project_id, chunks)
+            except Exception as e:
+                logging.error(f"Failed to index summary for session {session_id} lexically: {e}")
+
         if not self.index:
             logging.error("Cannot save summary: Pinecone index is not initialized.")
             return
-
-        embedding = await self.get_embedding(summary_text)
-        if not embedding:
+        embeddings = await self.get_embeddings([c.text for c in chunks])
+        if len(embeddings) != len(chunks):
             return
 
-        vector_id = f"session-{session_id}"
-        metadata = {"user_id": user_id, "summary": summary_text}
-        if project_id is not None:
-            metadata["project_id"] = project_id
-        
+        vectors = []
+        for chunk, embedding in zip(chunks, embeddings):
+            metadata = {
+                "user_id": user_id,
+                "session_id": session_id,
+                "chunk_index": chunk.index,
+                "chunk_count": len(chunks),
+                "overlap": chunk.overlap,
+                "summary": chunk.text,
+            }
+            if project_id is not None:
+                metadata["project_id"] = project_id
+            vectors.append((chunk_vector_id(session_id, chunk.index), embedding, metadata))
+
         try:
-            self.index.upsert(vectors=[(vector_id, embedding, metadata)])
-            logging.info(f"Summary for session {session_id} saved to RAG.")
+            with observe_stage("vector_upsert"):
+                self.index.upsert(vectors=vectors)
+            logging.info(f"Summary for session {session_id} saved to RAG ({len(chunks)} chunks).")
         except Exception as e:
             logging.error(f"Failed to upsert summary for session {session_id}: {e}")
 
+    async def delete_session_vectors(
+        self, session_ids: list[int], user_ids=(), chunk_counts: dict[int, int] | None = None
+    ) -> bool:
+        """Удаляет векторы итогов сессий по id: фрагменты `session-{id}-chunk-{n}` и старые `session-{id}`.
+
+        Удаление по фильтру метаданных starter/serverless-индексы Pinecone не поддерживают, поэтому id
+        фрагментов строятся из числа фрагментов сессии: chunk_counts (из summary_chunks), а для сессий
+        без него — из метаданных фрагмента 0 в Pinecone.
+        False, если индекс недоступен или удаление не прошло (тогда строки сессий удалять нельзя,
+        иначе в поиске останутся итоги уже удалённых сессий).
+        Закэшированные выдачи владельцев сессий (user_ids) сбрасываются в любом случае.
+        """
+        if not session_ids:
+            return True
+        try:
+            return await self._delete_session_vectors(session_ids, chunk_counts or {})
+        finally:
+            for user_id in user_ids:
+                self.retrieval_cache.invalidate_user(user_id)
+
+    async def _delete_session_vectors(self, session_ids: list[int], chunk_counts: dict[int, int]) -> bool:
+        if not self.index:
+            logging.error("Cannot delete summary vectors: Pinecone index is not initialized.")
+            return False
+        try:
+            counts = await self._session_chunk_counts(session_ids, chunk_counts)
+            ids = [f"session-{sid}" for sid in session_ids]
+            for sid in session_ids:
+                ids.extend(chunk_vector_id(sid, n) for n in range(counts.get(sid, 0)))
+            with observe_stage("vector_delete"):
+                for start in range(0, len(ids), VECTOR_IDS_PER_REQUEST):
+                    self.index.delete(ids=ids[start:start + VECTOR_IDS_PER_REQUEST])
+        except Exception as e:
+            logging.error(f"Failed to delete vectors for {len(session_ids)} sessions: {e}")
+            return False
+        return True
+
+    async def _session_chunk_counts(self, session_ids: list[int], known: dict[int, int]) -> dict[int, int]:
+        """Число фрагментов по сессиям: известные берутся как есть, остальные — из chunk_count фрагмента 0."""
+        counts = {sid: known[sid] for sid in session_ids if sid in known}
+        missing = [chunk_vector_id(sid, 0) for sid in session_ids if sid not in counts]
+        for start in range(0, len(missing), VECTOR_IDS_PER_REQUEST):
+            with observe_stage("vector_fetch"):
+                response = self.index.fetch(ids=missing[start:start + VECTOR_IDS_PER_REQUEST])
+            for md in self._fetched_metadata(response):
+                if md.get('session_id') is not None and md.get('chunk_count') is not None:
+                    counts[int(md['session_id'])] = int(md['chunk_count'])
+        return counts
+
+    @staticmethod
+    def _fetched_metadata(response) -> list[dict]:
+        """Метаданные векторов из ответа fetch Pinecone (dict или объект SDK)."""
+        vectors = response.get('vectors', {}) if isinstance(response, dict) else getattr(response, 'vectors', {})
+        result = []
+        for v in (vectors or {}).values():
+            md = v.get('metadata') if isinstance(v, dict) else getattr(v, 'metadata', None)
+            if md:
+                result.append(md)
+        return result
+
+    async def _fetch_chunks(self, keys: list[tuple[int, int]]) -> dict[tuple[int, int], Chunk]:
+        """Достаёт фрагменты по (session_id, chunk_index) для добора соседей.
+
+        Сначала из полнотекстового индекса (локальная БД), недостающие — из Pinecone.
+        Ошибка не ломает поиск — соседей просто не будет.
+        """
+        result: dict[tuple[int, int], Chunk] = {}
+        if not keys:
+            return result
+        if self.lexical_index:
+            try:
+                result.update(await self.lexical_index.fetch_chunks(keys))
+            except Exception as e:
+                logging.warning(f"Failed to fetch neighbor chunks from lexical index: {e}")
+        missing = [chunk_vector_id(sid, idx) for sid, idx in keys if (sid, idx) not in result]
+        if not missing or not self.index:
+            return result
+        try:
+            with observe_stage("vector_fetch"):
+                response = self.index.fetch(ids=missing)
+        except Exception as e:
+            logging.warning(f"Failed to fetch neighbor chunks: {e}")
+            return result
+        for md in self._fetched_metadata(response):
+            if md.get('chunk_index') is None or not md.get('summary'):
+                continue
+            sid, idx = int(md['session_id']), int(md['chunk_index'])
+            result[(sid, idx)] = Chunk(index=idx, text=md['summary'], overlap=int(md.get('overlap') or 0))
+        return result
+
+    async def _expand_neighbors(self, ranked: list[RAGMatch]) -> list[RAGMatch]:
+        """Склеивает отобранные фрагменты по сессиям, добирая соседние (±CHUNK_NEIGHBORS).
+
+        Сессия занимает место своего лучшего фрагмента в ранжировании и получает его score.
+        Legacy-векторы (целые итоги без chunk_index) проходят как есть.
+        """
+        groups: dict[int, list[RAGMatch]] = {}
+        order: list = []
+        for m in ranked:
+            if m.session_id is None or m.chunk_index is None:
+                order.append(m)
+                continue
+            if m.session_id not in groups:
+                groups[m.session_id] = []
+                order.append(m.session_id)
+            groups[m.session_id].append(m)
+
+        wanted = []
+        for sid, items in groups.items():
+            have = {m.chunk_index for m in items}
+            count = items[0].chunk_count
+            for m in items:
+                for d in range(1, self.CHUNK_NEIGHBORS + 1):
+                    for idx in (m.chunk_index - d, m.chunk_index + d):
+                        if idx >= 0 and (count is None or idx < count) and idx not in have:
+                            have.add(idx)
+                            wanted.append((sid, idx))
+        fetched = await self._fetch_chunks(wanted)
+
+        result = []
+        for item in order:
+            if isinstance(item, RAGMatch):
+                result.append(item)
+                continue
+            items = groups[item]
+            chunks = [Chunk(index=m.chunk_index, text=m.text, overlap=m.overlap) for m in items]
+            chunks += [c for (sid, _), c in fetched.items() if sid == item]
+            result.append(replace(items[0], text=assemble_chunks(chunks), values=None))
+        return result
+
+    @staticmethod
+    def _to_matches(matches) -> list[RAGMatch]:
+        """Матчи Pinecone (dict или объекты SDK) -> RAGMatch."""
+        result = []
+        for m in matches:
+            if isinstance(m, dict):
+                md, score, vid, values = m.get('metadata') or {}, m.get('score'), m.get('id'), m.get('values')
+            else:
+                md = getattr(m, 'metadata', None) or {}
+                score, vid, values = getattr(m, 'score', 0), getattr(m, 'id', None), getattr(m, 'values', None)
+            summary = md.get('summary') if isinstance(md, dict) else None
+            if not summary:
+                continue
+            chunk_index = md.get('chunk_index')
+            result.append(RAGMatch(
+                text=summary,
+                score=float(score or 0),
+                project_id=md.get('project_id'),
+                vector_id=vid,
+                values=tuple(values) if values else None,
+                session_id=int(md['session_id']) if md.get('session_id') is not None else None,
+                chunk_index=int(chunk_index) if chunk_index is not None else None,
+                chunk_count=int(md['chunk_count']) if md.get('chunk_count') is not None else None,
+                overlap=int(md.get('overlap') or 0),
+            ))
+        return result
+
+    async def embed_query(self, query_text: str) -> list[float]:
+        """Эмбеддинг запроса. При наличии полнотекстового индекса ждём не дольше EMBEDDING_TIMEOUT —
+        медленный или недоступный API эмбеддингов не должен задерживать ход."""
+        if not self.lexical_index:
+            return await self.get_embedding(query_text)
+        try:
+            return await asyncio.wait_for(self.get_embedding(query_text), timeout=self.EMBEDDING_TIMEOUT)
+        except asyncio.TimeoutError:
+            logging.warning(f"Embedding timed out after {self.EMBEDDING_TIMEOUT}s, using lexical retrieval only")
+            return []
+
+    async def _vector_search(self, query_embedding: list[float], flt: dict, top_k: int) -> list[RAGMatch] | None:
+        """Кандидаты из Pinecone; None — векторный поиск недоступен."""
+        if not self.index or not query_embedding:
+            return None
+        try:
+            with observe_stage("vector_query"):
+                results = self.index.query(
+                    vector=query_embedding,
+                    top_k=top_k,
+                    filter=flt,
+                    include_metadata=True,
+                    # Векторы нужны для MMR (сходство кандидатов между собой)
+                    include_values=True,
+                )
+        except Exception as e:
+            logging.error(f"Error querying Pinecone: {e}")
+            return None
+        matches = results.get('matches', []) if isinstance(results, dict) else getattr(results, 'matches', [])
+        return self._to_matches(matches)
+
+    async def _lexical_search(self, user_id: int, query_text: str, project_id, project_ids, limit: int) -> list[RAGMatch]:
+        if not self.lexical_index:
+            return []
+        try:
+            return await self.lexical_index.search(user_id, query_text, project_id=project_id, project_ids=project_ids, limit=limit)
+        except Exception as e:
+            logging.error(f"Error querying lexical index: {e}")
+            return []
+
     async def find_relevant_summaries(
         self,
         user_id: int,
@@ -107,57 +379,86 @@ class RAGClient:
         top_k: int = 3,
         project_id: int | None = None,
         project_ids: list[int] | None = None,
-    ) -> list[str]:
-        if not self.index:
+        query_embedding: list[float] | None = None,
+        token_budget: int | None = None,
+    ) -> list[RAGMatch]:
+        """Ищет релевантные итоги. query_embedding можно передать, если он уже посчитан (без повторного вызова API).
+
+        top_k и token_budget задаются бюджетом хода (BudgetAllocation.rag_candidates / .rag).
+        Возвращает RAGMatch (текст + score) по убыванию ценности: после порога релевантности,
+        обрезки по провалу score, MMR-диверсификации и квот проектов (см. rag_selection).
+        Фрагменты одной сессии склеиваются с соседними в один элемент (см. chunking).
+
+        С полнотекстовым индексом поиск гибридный: лексические и векторные кандидаты ищутся параллельно
+        и сливаются по RRF (score результата — RRF). Если эмбеддинг или Pinecone недоступны — только лексический.
+        """
+        if not self.index and not self.lexical_index:
             logging.error("Cannot find summaries: Pinecone index is not initialized.")
             return []
-            
-        query_embedding = await self.get_embedding(query_text)
-        if not query_embedding:
-            return []
 
+        flt = {"user_id": user_id}
+        # Приоритет: явный список project_ids, затем одиночный project_id, иначе — глобально по user_id
+        if project_ids is not None:
+            if len(project_ids) == 0:
+                return []
+            # Pinecone metadata filter: { field: {"$in": [...] } }
+            flt["project_id"] = {"$in": project_ids}
+        elif project_id is not None:
+            flt["project_id"] = project_id
+        # Динамический запрос: запрашиваем максимум кандидатов, затем обрезаем по бюджету
+        effective_k = max(self.MIN_TOP_K, min(self.MAX_CANDIDATES, int(top_k) if isinstance(top_k, int) else self.MIN_TOP_K))
+        quota = project_quota_for(project_ids, effective_k)
+
+        budget = self.RAG_TOKEN_BUDGET if token_budget is None else token_budget
+
+        lexical_task = asyncio.create_task(self._lexical_search(user_id, query_text, project_id, project_ids, effective_k))
         try:
-            flt = {"user_id": user_id}
-            # Приоритет: явный список project_ids, затем одиночный project_id, иначе — глобально по user_id
-            if project_ids is not None:
-                if len(project_ids) == 0:
-                    return []
-                # Pinecone metadata filter: { field: {"$in": [...] } }
-                flt["project_id"] = {"$in": project_ids}
-            elif project_id is not None:
-                flt["project_id"] = project_id
-            # Динамический запрос: запрашиваем максимум кандидатов, затем обрезаем по бюджету
-            effective_k = max(self.MIN_TOP_K, min(self.MAX_CANDIDATES, int(top_k) if isinstance(top_k, int) else self.MIN_TOP_K))
-            results = self.index.query(
-                vector=query_embedding,
-                top_k=effective_k,
-                filter=flt,
-                include_metadata=True
-            )
-            matches = results.get('matches', []) if isinstance(results, dict) else getattr(results, 'matches', [])
-            # Преобразуем в [(summary, score)] и отсортируем по score убыв.
-            pairs = []
-            for m in matches:
-                md = m.get('metadata', {}) if isinstance(m, dict) else getattr(m, 'metadata', {})
-                summary = md.get('summary') if isinstance(md, dict) else None
-                score = m.get('score') if isinstance(m, dict) else getattr(m, 'score', 0)
-                if summary:
-                    pairs.append((summary, score))
-            pairs.sort(key=lambda x: x[1], reverse=True)
-
-            candidates = [s for s, _ in pairs]
-            selected = self._trim_summaries_by_budget(candidates, self.RAG_TOKEN_BUDGET)
-
-            # Метрики
-            total_candidates = len(candidates)
-            selected_tokens = self._count_tokens("\n\n".join(selected)) if selected else 0
-            logging.info(
-                f"RAG query user={user_id}, proj={project_id or project_ids}, "
-                f"effective_k={effective_k}, candidates={total_candidates}, selected={len(selected)}, "
-                f"selected_tokens={selected_tokens}/{self.RAG_TOKEN_BUDGET}"
-            )
-
-            return selected
-        except Exception as e:
-            logging.error(f"Error querying Pinecone: {e}")
-            return []
\ No newline at end of file
+            if not query_embedding and self.index:
+                query_embedding = await self.embed_query(query_text)
+            cache_key = None
+            if self.retrieval_cache.enabled and query_embedding:
+                # Лексическая выдача зависит от слов запроса — они входят в ключ в том же виде, что и в tsquery
+                lexical_query = (build_tsquery(query_text) or "") if self.lexical_index else ""
+                cache_key = self.retrieval_cache.key(
+                    user_id, query_embedding, effective_k, project_id, project_ids, query_text=lexical_query,
+                )
+                cached = self.retrieval_cache.get(cache_key)
+                if cached is not None:
+                    lexical_task.cancel()
+                    picked, used = self._pack_counted(cached, budget)
+                    logging.info(
+                        f"RAG query user={user_id}, proj={project_id or project_ids}, mode=cache, "
+                        f"selected={len(picked)}/{len(cached)}, selected_tokens={used}/{budget}, "
+                        f"cache_hit_rate={self.retrieval_cache.hit_rate:.2%}"
+                    )
+                    return [m for m, _ in picked]
+            candidates = await self._vector_search(query_embedding, flt, effective_k)
+        except BaseException:
+            lexical_task.cancel()
+            raise
+        lexical = await lexical_task
+
+        vector_ranked = select_matches(candidates, project_quota=quota) if candidates else []
+        if lexical:
+            ranked = apply_project_quota(reciprocal_rank_fusion([vector_ranked, lexical]), quota)
+            mode = "hybrid" if candidates is not None else "lexical"
+        else:
+            ranked = vector_ranked
+            mode = "vector"
+        # В промпт идут только релевантные фрагменты сессии и их непосредственные соседи
+        ranked = await self._expand_neighbors(ranked)
+        counted = [(replace(m, values=None), self._count_tokens(m.text)) for m in ranked]
+        if cache_key is not None:
+            self.retrieval_cache.put(cache_key, counted)
+        picked, selected_tokens = self._pack_counted(counted, budget)
+        selected = [m for m, _ in picked]
+
+        # Метрики
+        total_candidates = len(candidates or []) + len(lexical)
+        scores = ", ".join(f"{m.score:.3f}" for m in selected)
+        logging.info(
+            f"RAG query user={user_id}, proj={project_id or project_ids}, mode={mode}, "
+            f"effective_k={effective_k}, candidates={total_candidates} (lexical={len(lexical)}), relevant={len(ranked)}, "
+            f"selected={len(selected)} [{scores}], selected_tokens={selected_tokens}/{budget}"
+        )
+        return selected
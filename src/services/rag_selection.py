@@ -0,0 +1,142 @@
+# Файл: C:\desk_top\src\services\rag_selection.py
+import math
+import operator
+from dataclasses import dataclass, field, replace
+
+from src.config import RAG_MIN_SCORE, RAG_SCORE_GAP, RAG_MMR_LAMBDA, RAG_PROJECT_QUOTA, RAG_RRF_K
+
+
+@dataclass(frozen=True)
+class RAGMatch:
+    """Найденный фрагмент памяти вместе с его релевантностью.
+
+    str(match) — текст, поэтому списки RAGMatch можно передавать туда, где ожидаются строки.
+    """
+    text: str
+    score: float
+    project_id: int | None = None
+    vector_id: str | None = None
+    values: tuple[float, ...] | None = field(default=None, repr=False, compare=False)
+    # Для фрагментов итогов (см. chunking); у legacy-векторов `session-{id}` — None
+    session_id: int | None = None
+    chunk_index: int | None = None
+    chunk_count: int | None = None
+    overlap: int = 0
+
+    def __str__(self) -> str:
+        return self.text
+
+
+def match_text(item) -> str:
+    """Текст элемента RAG-контекста (RAGMatch или обычная строка)."""
+    return item.text if isinstance(item, RAGMatch) else str(item)
+
+
+def apply_min_score(matches: list[RAGMatch], min_score: float) -> list[RAGMatch]:
+    return [m for m in matches if m.score >= min_score]
+
+
+def apply_score_gap(matches: list[RAGMatch], max_gap: float) -> list[RAGMatch]:
+    """Обрезает хвост на первом резком провале релевантности между соседними (по убыванию score) матчами."""
+    if not matches or max_gap <= 0:
+        return matches
+    kept = [matches[0]]
+    for prev, cur in zip(matches, matches[1:]):
+        if prev.score - cur.score > max_gap:
+            break
+        kept.append(cur)
+    return kept
+
+
+def apply_project_quota(matches: list[RAGMatch], quota: int) -> list[RAGMatch]:
+    """Не больше quota матчей на проект — один «шумный» проект не вытесняет остальные."""
+    if quota <= 0:
+        return matches
+    taken: dict[int | None, int] = {}
+    kept = []
+    for m in matches:
+        n = taken.get(m.project_id, 0)
+        if n < quota:
+            kept.append(m)
+            taken[m.project_id] = n + 1
+    return kept
+
+
+def _unit(values) -> list[float] | None:
+    if not values:
+        return None
+    norm = math.sqrt(sum(x * x for x in values))
+    return [x / norm for x in values] if norm else None
+
+
+def mmr_rerank(matches: list[RAGMatch], lambda_: float) -> list[RAGMatch]:
+    """Maximal Marginal Relevance: релевантность минус сходство с уже выбранным.
+
+    lambda_=1.0 — чистая релевантность (порядок не меняется). Матчи без векторов
+    считаются непохожими ни на что.
+    """
+    if lambda_ >= 1.0 or len(matches) < 3:
+        return matches
+    units = [_unit(m.values) for m in matches]
+    n = len(matches)
+    # Попарные косинусы считаем один раз (n <= число кандидатов, обычно ~20)
+    sim = [[0.0] * n for _ in range(n)]
+    for i in range(n):
+        if units[i] is None:
+            continue
+        for j in range(i + 1, n):
+            if units[j] is not None:
+                sim[i][j] = sim[j][i] = sum(map(operator.mul, units[i], units[j]))
+
+    selected = [0]
+    remaining = list(range(1, n))
+    while remaining:
+        best = max(
+            remaining,
+            key=lambda i: lambda_ * matches[i].score - (1 - lambda_) * max(sim[i][j] for j in selected),
+        )
+        selected.append(best)
+        remaining.remove(best)
+    return [matches[i] for i in selected]
+
+
+def select_matches(
+    matches: list[RAGMatch],
+    min_score: float = RAG_MIN_SCORE,
+    max_gap: float = RAG_SCORE_GAP,
+    mmr_lambda: float = RAG_MMR_LAMBDA,
+    project_quota: int = 0,
+) -> list[RAGMatch]:
+    """Порог релевантности -> обрезка по провалу score -> MMR-разнообразие -> квоты проектов."""
+    ranked = sorted(matches, key=lambda m: m.score, reverse=True)
+    ranked = apply_min_score(ranked, min_score)
+    ranked = apply_score_gap(ranked, max_gap)
+    ranked = mmr_rerank(ranked, mmr_lambda)
+    return apply_project_quota(ranked, project_quota)
+
+
+def reciprocal_rank_fusion(rankings: list[list[RAGMatch]], k: int = RAG_RRF_K) -> list[RAGMatch]:
+    """Сливает ранжирования (векторное, лексическое) по RRF: score = sum(1 / (k + rank)).
+
+    Шкалы исходных score несравнимы (косинус и ts_rank), поэтому учитываются только позиции.
+    Один и тот же фрагмент узнаётся по vector_id; у результата score — итоговый RRF.
+    """
+    fused: dict[str, float] = {}
+    best: dict[str, RAGMatch] = {}
+    for ranking in rankings:
+        for rank, m in enumerate(ranking, start=1):
+            key = m.vector_id or m.text
+            fused[key] = fused.get(key, 0.0) + 1.0 / (k + rank)
+            if key not in best or (best[key].values is None and m.values is not None):
+                best[key] = m
+    ordered = sorted(fused, key=fused.get, reverse=True)
+    return [replace(best[key], score=round(fused[key], 6)) for key in ordered]
+
+
+def project_quota_for(project_ids: list[int] | None, top_k: int, configured: int = RAG_PROJECT_QUOTA) -> int:
+    """Квота на проект для многопроектного запроса: из конфига или поровну от top_k."""
+    if not project_ids or len(project_ids) < 2:
+        return 0
+    if configured > 0:
+        return configured
+    return max(1, math.ceil(top_k / len(project_ids)))
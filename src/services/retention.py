@@ -0,0 +1,165 @@
+# Файл: C:\desk_top\src\services\retention.py
+import asyncio
+import logging
+import time
+import zlib
+from dataclasses import dataclass
+
+from sqlalchemy import func, select
+
+from src.config import (
+    RETENTION_DAYS,
+    RETENTION_BATCH_SIZE,
+    RETENTION_BATCH_PAUSE_SECONDS,
+    RETENTION_MAX_RUN_SECONDS,
+    HISTORY_ARCHIVE_AFTER_HOURS,
+    HISTORY_ARCHIVE_CODEC,
+)
+from src.db.repository import SessionRepository
+from src.services.history_archive import pack_history
+from src.services.metrics import RETENTION_DELETED, RETENTION_ROWS_PER_SECOND
+
+logger = logging.getLogger(__name__)
+
+# Ключ pg_advisory_lock: один прогон очистки на весь кластер, сколько бы инстансов ни запускало планировщик
+RETENTION_LOCK_KEY = zlib.crc32(b"desk_top:retention")
+
+
+@dataclass
+class RetentionReport:
+    sessions: int = 0
+    batches: int = 0
+    seconds: float = 0.0
+    archived: int = 0          # историй перенесено в session_archives
+    archived_raw_bytes: int = 0
+    archived_stored_bytes: int = 0
+    skipped: bool = False      # блокировку держит другой инстанс
+    interrupted: bool = False  # остановлен по ошибке удаления векторов или по RETENTION_MAX_RUN_SECONDS
+
+    @property
+    def rows_per_second(self) -> float:
+        return (self.sessions + self.archived) / self.seconds if self.seconds > 0 else 0.0
+
+    def describe(self) -> str:
+        if self.skipped:
+            return "skipped (lock held by another instance)"
+        ratio = self.archived_stored_bytes / self.archived_raw_bytes if self.archived_raw_bytes else 0.0
+        return (
+            f"deleted={self.sessions} archived={self.archived} (ratio {ratio:.2f}) batches={self.batches} "
+            f"time={self.seconds:.1f}s rate={self.rows_per_second:.1f} rows/s{' interrupted' if self.interrupted else ''}"
+        )
+
+
+class RetentionWorker:
+    """Двухуровневое хранение закрытых сессий, короткими пачками.
+
+    1) Удаление по сроку хранения: каждая пачка — отдельная транзакция: SELECT ... FOR UPDATE
+       SKIP LOCKED, удаление векторов итогов в Pinecone, затем DELETE сессий, архивов и фрагментов
+       итогов. Если векторы удалить не удалось, пачка откатывается и прогон останавливается до
+       следующего запуска — иначе в поиске остались бы итоги уже удалённых сессий.
+    2) Архивирование: истории сессий, закрытых более HISTORY_ARCHIVE_AFTER_HOURS назад, сжимаются
+       (gzip/zstd), шифруются и переносятся в session_archives; в sessions остаётся заглушка.
+    Между пачками — пауза, чтобы не держать нагрузку на БД и WAL. Прогоны нескольких инстансов
+    сериализуются сессионной блокировкой pg_try_advisory_lock.
+    """
+
+    def __init__(
+        self,
+        session_maker,
+        rag_client=None,
+        default_days: int = RETENTION_DAYS,
+        batch_size: int = RETENTION_BATCH_SIZE,
+        pause_seconds: float = RETENTION_BATCH_PAUSE_SECONDS,
+        max_run_seconds: float = RETENTION_MAX_RUN_SECONDS,
+        archive_after_hours: float = HISTORY_ARCHIVE_AFTER_HOURS,
+        archive_codec: str = HISTORY_ARCHIVE_CODEC,
+    ):
+        self.session_maker = session_maker
+        self.rag_client = rag_client
+        self.default_days = default_days
+        self.batch_size = max(1, batch_size)
+        self.pause_seconds = pause_seconds
+        self.max_run_seconds = max_run_seconds
+        self.archive_after_hours = archive_after_hours
+        self.archive_codec = archive_codec
+
+    async def run(self) -> RetentionReport:
+        report = RetentionReport()
+        # Блокировка живёт на соединении lock_session до явного unlock (или до обрыва соединения)
+        async with self.session_maker() as lock_session:
+            locked = (await lock_session.execute(select(func.pg_try_advisory_lock(RETENTION_LOCK_KEY)))).scalar()
+            if not locked:
+                report.skipped = True
+                logger.info(f"Retention: {report.describe()}")
+                return report
+            try:
+                await self._run_batches(report)
+            finally:
+                await lock_session.execute(select(func.pg_advisory_unlock(RETENTION_LOCK_KEY)))
+                await lock_session.commit()
+        RETENTION_ROWS_PER_SECOND.set(report.rows_per_second)
+        logger.info(f"Retention: {report.describe()}")
+        return report
+
+    async def _run_batches(self, report: RetentionReport):
+        started = time.monotonic()
+        try:
+            if await self._run_phase(report, started, self._delete_batch, "sessions"):
+                if self.archive_after_hours > 0:
+                    await self._run_phase(report, started, lambda: self._archive_batch(report), "archived")
+        finally:
+            report.seconds = time.monotonic() - started
+
+    async def _run_phase(self, report: RetentionReport, started: float, batch, kind: str) -> bool:
+        """Гоняет пачки до исчерпания. False — прогон прерван (ошибка или предел времени)."""
+        while True:
+            done = await batch()
+            if done is None:
+                report.interrupted = True
+                return False
+            if done:
+                report.batches += 1
+                RETENTION_DELETED.inc(done, kind=kind)
+                if kind == "sessions":
+                    report.sessions += done
+            if done < self.batch_size:
+                return True
+            if time.monotonic() - started >= self.max_run_seconds:
+                report.interrupted = True
+                return False
+            await asyncio.sleep(self.pause_seconds)
+
+    async def _delete_batch(self) -> int | None:
+        """Одна пачка. None — векторы не удалены, пачка откачена."""
+        async with self.session_maker() as session:
+            repo = SessionRepository(session)
+            batch = await repo.lock_expired_batch(self.default_days, self.batch_size)
+            if not batch:
+                await session.rollback()
+                return 0
+            ids = [sid for sid, _ in batch]
+            if self.rag_client is not None:
+                deleted = await self.rag_client.delete_session_vectors(
+                    ids,
+                    user_ids={uid for _, uid in batch},
+                    chunk_counts=await repo.summary_chunk_counts(ids),
+                )
+                if not deleted:
+                    await session.rollback()
+                    return None
+                RETENTION_DELETED.inc(len(ids), kind="vector_sessions")
+            return await repo.delete_sessions(ids)
+
+    async def _archive_batch(self, report: RetentionReport) -> int:
+        async with self.session_maker() as session:
+            repo = SessionRepository(session)
+            batch = await repo.lock_archivable_batch(self.archive_after_hours, self.batch_size)
+            if not batch:
+                await session.rollback()
+                return 0
+            entries = [(s, pack_history(history, self.archive_codec)) for s, history in batch]
+            archived = await repo.archive_sessions(entries)
+        report.archived += archived
+        report.archived_raw_bytes += sum(a.raw_size for _, a in entries)
+        report.archived_stored_bytes += sum(a.stored_size for _, a in entries)
+        return archived
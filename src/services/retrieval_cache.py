@@ -0,0 +1,152 @@
+# Файл: C:\desk_top\src\services\retrieval_cache.py
+import hashlib
+import logging
+import math
+import struct
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+
+from src.config import RAG_CACHE_TTL_SECONDS, RAG_CACHE_MAX_ENTRIES, RAG_CACHE_QUANT_STEP
+from src.services.rag_selection import RAGMatch
+
+logger = logging.getLogger(__name__)
+
+# Фильтр проектов запроса: ('all',) | ('project', id) | ('projects', (id, ...))
+FilterKey = tuple
+# (user_id, фильтр, число кандидатов, хэш квантованного эмбеддинга, нормализованный текст запроса)
+RetrievalKey = tuple[int, FilterKey, int, str, str]
+
+
+@dataclass
+class _Entry:
+    # Ранжированные (до обрезки по бюджету) результаты и их размер в токенах
+    matches: list[tuple[RAGMatch, int]]
+    created_at: float
+
+
+def filter_key(project_id: int | None = None, project_ids: list[int] | None = None) -> FilterKey:
+    if project_ids is not None:
+        return ("projects", tuple(sorted(set(project_ids))))
+    if project_id is not None:
+        return ("project", project_id)
+    return ("all",)
+
+
+def quantize_embedding(embedding: list[float], step: float) -> str:
+    """Хэш эмбеддинга, округлённого с шагом step после нормировки: почти одинаковые запросы дают один ключ."""
+    norm = math.sqrt(sum(x * x for x in embedding)) or 1.0
+    levels = [round(x / norm / step) for x in embedding]
+    packed = struct.pack(f"{len(levels)}i", *levels)
+    return hashlib.blake2b(packed, digest_size=16).hexdigest()
+
+
+def _filter_covers(flt: FilterKey, project_id: int | None) -> bool:
+    """Может ли итог с данным project_id попасть в выдачу запроса с фильтром flt."""
+    if flt[0] == "all":
+        return True
+    if project_id is None:
+        return False
+    if flt[0] == "project":
+        return flt[1] == project_id
+    return project_id in flt[1]
+
+
+class RetrievalCache:
+    """Короткоживущий in-memory кэш результатов поиска итогов.
+
+    Ключ — (user_id, фильтр проектов, число кандидатов, квантованный эмбеддинг запроса,
+    нормализованный текст запроса). Текст нужен гибридному поиску: лексическая половина зависит
+    от слов запроса, а не от эмбеддинга; без полнотекстового индекса его не передают.
+    Хранит ранжированные результаты вместе с числом токенов, поэтому попадание не требует
+    ни запроса к хранилищам, ни повторной токенизации — остаётся только обрезка по бюджету.
+    Запись итогов (save_summary) сбрасывает записи пользователя, в выдачу которых они могли попасть;
+    удаление итогов (очистка по сроку хранения, /delete_my_data) — все записи пользователя.
+    Пользователь закреплён за одним воркером (см. webhook.partition_for), поэтому кэша процесса достаточно.
+    """
+
+    def __init__(
+        self,
+        ttl_seconds: float = RAG_CACHE_TTL_SECONDS,
+        max_entries: int = RAG_CACHE_MAX_ENTRIES,
+        quant_step: float = RAG_CACHE_QUANT_STEP,
+    ):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.quant_step = quant_step
+        self._entries: OrderedDict[RetrievalKey, _Entry] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl_seconds > 0 and self.max_entries > 0
+
+    def key(
+        self,
+        user_id: int,
+        embedding: list[float],
+        top_k: int,
+        project_id: int | None = None,
+        project_ids: list[int] | None = None,
+        query_text: str = "",
+    ) -> RetrievalKey:
+        return (
+            user_id,
+            filter_key(project_id, project_ids),
+            top_k,
+            quantize_embedding(embedding, self.quant_step),
+            query_text,
+        )
+
+    def get(self, key: RetrievalKey) -> list[tuple[RAGMatch, int]] | None:
+        entry = self._entries.get(key)
+        if entry is None or time.monotonic() - entry.created_at > self.ttl_seconds:
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return entry.matches
+
+    def put(self, key: RetrievalKey, matches: list[tuple[RAGMatch, int]]):
+        self._entries[key] = _Entry(matches, time.monotonic())
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, user_id: int, project_id: int | None = None) -> int:
+        """Сбрасывает записи пользователя, в выдачу которых может попасть новый итог проекта project_id."""
+        stale = [k for k in self._entries if k[0] == user_id and _filter_covers(k[1], project_id)]
+        for k in stale:
+            del self._entries[k]
+        self.invalidations += len(stale)
+        if stale:
+            logger.info(f"Retrieval cache: dropped {len(stale)} entries of user {user_id} (project={project_id})")
+        return len(stale)
+
+    def invalidate_user(self, user_id: int) -> int:
+        """Сбрасывает все записи пользователя (его итоги удалены)."""
+        stale = [k for k in self._entries if k[0] == user_id]
+        for k in stale:
+            del self._entries[k]
+        self.invalidations += len(stale)
+        if stale:
+            logger.info(f"Retrieval cache: dropped all {len(stale)} entries of user {user_id}")
+        return len(stale)
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "invalidations": self.invalidations,
+            "hit_rate": round(self.hit_rate, 4),
+        }
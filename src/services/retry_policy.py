@@ -0,0 +1,175 @@
+# Файл: C:\desk_top\src\services\retry_policy.py
+import logging
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from email.utils import parsedate_to_datetime
+
+from openai import APIConnectionError, APIStatusError
+from tenacity import RetryCallState, retry, wait_exponential
+
+from src.config import LLM_MAX_ATTEMPTS, LLM_TURN_DEADLINE_SECONDS
+from src.services import metrics
+
+logger = logging.getLogger(__name__)
+
+# HTTP-статусы, которые считаем временными (остальные 4xx — ошибка запроса, повтор бессмысленен)
+RETRYABLE_STATUS_CODES = frozenset({408, 409, 429, 500, 502, 503, 504})
+# Коды ошибок OpenAI, которые приходят с 429, но повтором не лечатся
+NON_RETRYABLE_ERROR_CODES = frozenset({"insufficient_quota", "billing_hard_limit_reached"})
+# Экспоненциальная пауза между попытками, если сервер не подсказал свою
+BACKOFF_MIN_SECONDS = 2
+BACKOFF_MAX_SECONDS = 10
+# Не ждём дольше этого, даже если сервер просит (Retry-After)
+MAX_RETRY_AFTER_SECONDS = 30
+
+# Дедлайн текущего пользовательского хода (time.monotonic), None — без ограничения
+_turn_deadline: ContextVar[float | None] = ContextVar("llm_turn_deadline", default=None)
+
+# Счётчики повторов: (operation, outcome) -> count
+RETRY_COUNTERS: Counter = Counter()
+
+_default_wait = wait_exponential(multiplier=1, min=BACKOFF_MIN_SECONDS, max=BACKOFF_MAX_SECONDS)
+
+
+@contextmanager
+def turn_deadline(seconds: float | None = None):
+    """Задаёт общий дедлайн на все LLM-вызовы внутри пользовательского хода."""
+    seconds = LLM_TURN_DEADLINE_SECONDS if seconds is None else seconds
+    token = _turn_deadline.set(time.monotonic() + seconds if seconds and seconds > 0 else None)
+    try:
+        yield
+    finally:
+        _turn_deadline.reset(token)
+
+
+def remaining_time() -> float | None:
+    """Сколько секунд осталось до дедлайна хода (None — дедлайна нет)."""
+    deadline = _turn_deadline.get()
+    if deadline is None:
+        return None
+    return max(deadline - time.monotonic(), 0.0)
+
+
+def effective_timeout(default: float) -> float:
+    """Таймаут одного запроса с учётом оставшегося времени хода."""
+    left = remaining_time()
+    if left is None:
+        return default
+    return max(min(default, left), 1.0)
+
+
+def _error_code(exc: APIStatusError) -> str | None:
+    body = getattr(exc, "body", None)
+    if isinstance(body, dict):
+        err = body.get("error", body)
+        if isinstance(err, dict):
+            return err.get("code") or err.get("type")
+    return getattr(exc, "code", None)
+
+
+def is_retryable(exc: BaseException) -> bool:
+    """Классифицирует ошибку OpenAI: True — временная, имеет смысл повторить."""
+    # APITimeoutError — подкласс APIConnectionError
+    if isinstance(exc, APIConnectionError):
+        return True
+    if isinstance(exc, APIStatusError):
+        if exc.status_code not in RETRYABLE_STATUS_CODES:
+            return False
+        return _error_code(exc) not in NON_RETRYABLE_ERROR_CODES
+    return False
+
+
+def retry_after_seconds(exc: BaseException) -> float | None:
+    """Извлекает подсказку сервера о паузе (retry-after-ms / Retry-After), если она есть."""
+    response = getattr(exc, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    raw_ms = headers.get("retry-after-ms")
+    if raw_ms:
+        try:
+            return max(float(raw_ms) / 1000.0, 0.0)
+        except ValueError:
+            pass
+    raw = headers.get("retry-after")
+    if not raw:
+        return None
+    try:
+        return max(float(raw), 0.0)
+    except ValueError:
+        pass
+    try:
+        dt = parsedate_to_datetime(raw)
+        return max(dt.timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+def _next_wait(retry_state: RetryCallState) -> float:
+    exc = retry_state.outcome.exception() if retry_state.outcome else None
+    hint = retry_after_seconds(exc) if exc else None
+    if hint is not None:
+        return min(hint, MAX_RETRY_AFTER_SECONDS)
+    return _default_wait(retry_state)
+
+
+def _record(operation: str, outcome: str):
+    RETRY_COUNTERS[(operation, outcome)] += 1
+    metrics.LLM_RETRIES.inc(operation=operation, outcome=outcome)
+
+
+def retry_stats() -> dict[str, int]:
+    """Снимок счётчиков повторов в виде {'operation:outcome': count}."""
+    return {f"{op}:{outcome}": n for (op, outcome), n in RETRY_COUNTERS.items()}
+
+
+def openai_retry(operation: str, max_attempts: int | None = None, fallback_on: tuple = ()):
+    """Декоратор повторов для вызовов OpenAI.
+
+    Повторяет только временные ошибки, учитывает Retry-After и дедлайн хода;
+    неповторяемые ошибки пробрасываются сразу, без ожидания.
+    Ошибки из fallback_on тоже пробрасываются сразу — вызывающий переключится на другую модель.
+    """
+    attempts_limit = max_attempts or LLM_MAX_ATTEMPTS
+
+    def _should_retry(retry_state: RetryCallState) -> bool:
+        exc = retry_state.outcome.exception()
+        if exc is None:
+            return False
+        if fallback_on and isinstance(exc, fallback_on):
+            _record(operation, "fallback")
+            return False
+        if not is_retryable(exc):
+            _record(operation, "non_retryable")
+            logger.warning(f"{operation}: non-retryable error {type(exc).__name__}: {exc}")
+            return False
+        return True
+
+    def _stop(retry_state: RetryCallState) -> bool:
+        if retry_state.attempt_number >= attempts_limit:
+            _record(operation, "exhausted")
+            return True
+        left = remaining_time()
+        if left is not None and _next_wait(retry_state) >= left:
+            _record(operation, "deadline")
+            logger.warning(f"{operation}: turn deadline reached, giving up after {retry_state.attempt_number} attempt(s)")
+            return True
+        return False
+
+    def _before_sleep(retry_state: RetryCallState):
+        _record(operation, "retry")
+        exc = retry_state.outcome.exception()
+        logger.warning(
+            f"{operation}: retry #{retry_state.attempt_number} in {retry_state.next_action.sleep:.1f}s "
+            f"after {type(exc).__name__}: {exc}"
+        )
+
+    return retry(
+        retry=_should_retry,
+        stop=_stop,
+        wait=_next_wait,
+        before_sleep=_before_sleep,
+        reraise=True,
+    )
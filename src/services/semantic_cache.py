@@ -0,0 +1,146 @@
+# Файл: C:\desk_top\src\services\semantic_cache.py
+import hashlib
+import logging
+import math
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+
+from src.config import (
+    SEMANTIC_CACHE_ENABLED,
+    SEMANTIC_CACHE_THRESHOLD,
+    SEMANTIC_CACHE_TTL_SECONDS,
+    SEMANTIC_CACHE_MAX_PER_KEY,
+    SEMANTIC_CACHE_MAX_KEYS,
+)
+
+logger = logging.getLogger(__name__)
+
+# Ключ кэша: (user_id, project_id, mode_id)
+CacheKey = tuple[int, int | None, int | None]
+
+
+@dataclass
+class _Entry:
+    embedding: list[float]  # уже нормирован (|v| = 1), косинус = скалярное произведение
+    fingerprint: str
+    answer: str
+    created_at: float
+
+
+def _normalize(vec: list[float]) -> list[float]:
+    norm = math.sqrt(sum(x * x for x in vec))
+    if norm == 0:
+        return []
+    return [x / norm for x in vec]
+
+
+def _dot(a: list[float], b: list[float]) -> float:
+    return sum(x * y for x, y in zip(a, b))
+
+
+class SemanticResponseCache:
+    """In-memory кэш ответов на близкие по смыслу вопросы.
+
+    Ответ отдаётся из кэша, только если косинусная близость вопроса не ниже порога
+    и отпечаток system prompt + RAG-контекста совпадает с сохранённым.
+    Вытеснение: TTL, лимит записей на ключ и LRU по ключам.
+    """
+
+    def __init__(
+        self,
+        enabled: bool = SEMANTIC_CACHE_ENABLED,
+        threshold: float = SEMANTIC_CACHE_THRESHOLD,
+        ttl_seconds: float = SEMANTIC_CACHE_TTL_SECONDS,
+        max_entries_per_key: int = SEMANTIC_CACHE_MAX_PER_KEY,
+        max_keys: int = SEMANTIC_CACHE_MAX_KEYS,
+    ):
+        self.enabled = enabled
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries_per_key = max_entries_per_key
+        self.max_keys = max_keys
+        self._entries: OrderedDict[CacheKey, list[_Entry]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def enabled_for(self, tools_config: dict | None) -> bool:
+        """Opt-in: глобальный флаг, переопределяемый ключом tools_config.semantic_cache мода."""
+        flag = (tools_config or {}).get("semantic_cache")
+        if isinstance(flag, bool):
+            return flag
+        return self.enabled
+
+    @staticmethod
+    def fingerprint(system_prompt: str, rag_context: list[str] | None) -> str:
+        h = hashlib.sha256()
+        h.update((system_prompt or "").encode("utf-8"))
+        for item in rag_context or []:
+            h.update(b"\x00")
+            h.update(str(item).encode("utf-8"))
+        return h.hexdigest()
+
+    def _prune(self, key: CacheKey, now: float) -> list[_Entry]:
+        entries = self._entries.get(key, [])
+        fresh = [e for e in entries if now - e.created_at <= self.ttl_seconds]
+        if len(fresh) != len(entries):
+            self.evictions += len(entries) - len(fresh)
+            if fresh:
+                self._entries[key] = fresh
+            else:
+                self._entries.pop(key, None)
+        return fresh
+
+    def lookup(self, key: CacheKey, embedding: list[float], fingerprint: str) -> str | None:
+        """Возвращает ближайший сохранённый ответ выше порога или None."""
+        if not embedding:
+            return None
+        now = time.monotonic()
+        entries = self._prune(key, now)
+        query = _normalize(embedding)
+        best: _Entry | None = None
+        best_score = self.threshold
+        for e in entries:
+            if e.fingerprint != fingerprint:
+                continue
+            score = _dot(query, e.embedding)
+            if score >= best_score:
+                best, best_score = e, score
+        if best is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._entries.move_to_end(key)
+        logger.info(f"Semantic cache hit key={key}, similarity={best_score:.4f}, hit_rate={self.hit_rate:.2%}")
+        return best.answer
+
+    def store(self, key: CacheKey, embedding: list[float], fingerprint: str, answer: str):
+        if not embedding or not answer:
+            return
+        now = time.monotonic()
+        entries = self._prune(key, now)
+        entries.append(_Entry(_normalize(embedding), fingerprint, answer, now))
+        if len(entries) > self.max_entries_per_key:
+            self.evictions += len(entries) - self.max_entries_per_key
+            entries = entries[-self.max_entries_per_key:]
+        self._entries[key] = entries
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_keys:
+            _, dropped = self._entries.popitem(last=False)
+            self.evictions += len(dropped)
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hit_rate, 4),
+            "keys": len(self._entries),
+            "entries": sum(len(v) for v in self._entries.values()),
+            "evictions": self.evictions,
+        }
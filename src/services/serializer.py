@@ -0,0 +1,55 @@
+# Файл: C:\desk_top\src\services\serializer.py
+import json
+
+from src.config import JSON_BACKEND
+
+# Единая точка JSON-сериализации горячих путей (история сессий, tools_config, экспорт).
+# orjson (C/Rust) — если установлен, иначе stdlib json. Выход одинаковый по смыслу:
+# UTF-8 без \u-экранирования, компактные разделители; indent — только 2 пробела (ограничение orjson).
+
+
+def _load_backend(name: str):
+    if name not in ("auto", "orjson", "json"):
+        raise ValueError(f"Unknown JSON_BACKEND '{name}'")
+    if name == "json":
+        return None
+    try:
+        import orjson
+    except ImportError as e:
+        if name == "orjson":
+            raise RuntimeError("JSON_BACKEND=orjson requires the 'orjson' package (pip install orjson)") from e
+        return None
+    return orjson
+
+
+_orjson = _load_backend(JSON_BACKEND)
+BACKEND = "orjson" if _orjson else "json"
+
+
+def dumps_bytes(obj, indent: bool = False) -> bytes:
+    """JSON в UTF-8 bytes."""
+    if _orjson:
+        return _orjson.dumps(obj, option=_orjson.OPT_INDENT_2 if indent else 0)
+    return _json_dumps(obj, indent).encode("utf-8")
+
+
+def dumps(obj, indent: bool = False) -> str:
+    """JSON-строка."""
+    if _orjson:
+        return _orjson.dumps(obj, option=_orjson.OPT_INDENT_2 if indent else 0).decode("utf-8")
+    return _json_dumps(obj, indent)
+
+
+def loads(data: str | bytes | memoryview):
+    """Разбор JSON из str/bytes/memoryview. Ошибки — ValueError (как json.JSONDecodeError)."""
+    if _orjson:
+        return _orjson.loads(data)
+    if isinstance(data, memoryview):
+        data = bytes(data)
+    return json.loads(data)
+
+
+def _json_dumps(obj, indent: bool) -> str:
+    if indent:
+        return json.dumps(obj, ensure_ascii=False, indent=2)
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"))
@@ -0,0 +1,130 @@
+# Файл: C:\desk_top\src\services\turn_serializer.py
+import asyncio
+import logging
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.dispatcher.flags import get_flag
+from aiogram.types import Message, TelegramObject
+
+from src.config import TURN_COALESCE_WINDOW_SECONDS, TURN_MAX_PENDING
+from src.services import metrics
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class _UserQueue:
+    lock: asyncio.Lock = field(default_factory=asyncio.Lock)
+    # Ходы пользователя в работе + ожидающие блокировку
+    depth: int = 0
+    # Сообщения, ожидающие склейки: (seq, text)
+    buffer: list[tuple[int, str]] = field(default_factory=list)
+    seq: int = 0
+
+
+class UserTurnSerializer(BaseMiddleware):
+    """Inner-middleware: ходы одного пользователя выполняются строго по очереди.
+
+    Пока обрабатывается сообщение, следующие сообщения того же пользователя ждут:
+    так каждый ход видит историю, уже дополненную предыдущим ответом.
+    Для хендлеров с флагом `coalesce` быстрые серии сообщений склеиваются в один запрос к LLM:
+    сообщение ждёт coalesce_window секунд, и если за ним пришло следующее — поглощается им.
+    Склеенный текст передаётся хендлеру в data['coalesced_text'].
+
+    В webhook-режиме ходы пользователя уже идут по очереди (см. webhook.WebhookServer), и следующие
+    сообщения серии ждут в его очереди, а не здесь: после окна склейки они забираются оттуда
+    через data['take_pending_texts'].
+
+    Блокировки живут в памяти процесса; в multi-worker режиме пользователь закреплён
+    за одним воркером (см. webhook.partition_for), поэтому этого достаточно.
+    """
+
+    def __init__(self, coalesce_window: float = TURN_COALESCE_WINDOW_SECONDS, max_pending: int = TURN_MAX_PENDING):
+        self.coalesce_window = max(float(coalesce_window or 0), 0.0)
+        self.max_pending = max(int(max_pending), 0)
+        self._queues: dict[int, _UserQueue] = {}
+        self._waiting = 0
+        self.counters = {"turns": 0, "coalesced": 0, "rejected": 0}
+
+    def queue_depth(self, user_id: int) -> int:
+        uq = self._queues.get(user_id)
+        return uq.depth if uq else 0
+
+    def stats(self) -> dict:
+        depths = [uq.depth for uq in self._queues.values()]
+        return {
+            "users": len(self._queues),
+            "running": sum(1 for uq in self._queues.values() if uq.lock.locked()),
+            "waiting": self._waiting,
+            "max_depth": max(depths, default=0),
+            **self.counters,
+        }
+
+    def _set_waiting(self, delta: int):
+        self._waiting += delta
+        metrics.USER_TURNS_WAITING.set(self._waiting)
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        user = data.get("event_from_user")
+        if not isinstance(event, Message) or user is None:
+            return await handler(event, data)
+
+        uq = self._queues.setdefault(user.id, _UserQueue())
+        if uq.depth > self.max_pending:
+            self.counters["rejected"] += 1
+            metrics.USER_TURNS.inc(outcome="rejected")
+            logger.warning(f"Turn queue for user {user.id} is full (depth={uq.depth}), message dropped")
+            await event.answer("<i>Предыдущие сообщения ещё обрабатываются, подождите ответа.</i>")
+            return None
+
+        coalesce = bool(self.coalesce_window and event.text and get_flag(data, "coalesce"))
+        take_pending_texts = data.get("take_pending_texts")
+        texts = [event.text]
+        uq.depth += 1
+        self._set_waiting(+1)
+        waiting = True
+        try:
+            if coalesce and take_pending_texts is not None:
+                await asyncio.sleep(self.coalesce_window)
+                texts.extend(take_pending_texts())
+            elif coalesce:
+                uq.seq += 1
+                seq = uq.seq
+                uq.buffer.append((seq, event.text))
+                await asyncio.sleep(self.coalesce_window)
+                # За нами пришло ещё сообщение — оно заберёт наш текст
+                if uq.buffer and uq.buffer[-1][0] != seq and any(s == seq for s, _ in uq.buffer):
+                    metrics.USER_TURNS.inc(outcome="absorbed")
+                    return None
+
+            async with uq.lock:
+                self._set_waiting(-1)
+                waiting = False
+                if coalesce and take_pending_texts is None:
+                    if not any(s == seq for s, _ in uq.buffer):
+                        # Текст уже ушёл в ход, начатый более ранним сообщением серии
+                        metrics.USER_TURNS.inc(outcome="absorbed")
+                        return None
+                    texts = [t for _, t in uq.buffer]
+                    uq.buffer.clear()
+                if len(texts) > 1:
+                    data["coalesced_text"] = "\n\n".join(texts)
+                    self.counters["coalesced"] += len(texts) - 1
+                    metrics.USER_TURNS.inc(len(texts) - 1, outcome="coalesced")
+                    logger.info(f"Coalesced {len(texts)} messages of user {user.id} into one turn")
+                self.counters["turns"] += 1
+                metrics.USER_TURNS.inc(outcome="turn")
+                return await handler(event, data)
+        finally:
+            if waiting:
+                self._set_waiting(-1)
+            uq.depth -= 1
+            if uq.depth == 0 and not uq.buffer:
+                self._queues.pop(user.id, None)
@@ -0,0 +1,278 @@
+# Файл: C:\desk_top\src\webhook.py
+import asyncio
+import hmac
+import logging
+import time
+from collections import deque
+from functools import partial
+
+import aiohttp
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+
+from src.services.metrics import observe
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+def payload_user_id(payload: dict) -> int | None:
+    """user_id отправителя из сырого апдейта Telegram (message.from, callback_query.from, ...)."""
+    for name, value in payload.items():
+        if name == "update_id" or not isinstance(value, dict):
+            continue
+        sender = value.get("from") or value.get("user")
+        if isinstance(sender, dict) and "id" in sender:
+            return int(sender["id"])
+    return None
+
+
+def update_user_id(update: Update) -> int | None:
+    try:
+        event = update.event
+    except Exception:
+        return None
+    sender = getattr(event, "from_user", None) or getattr(event, "user", None)
+    return sender.id if sender else None
+
+
+def partition_for(user_id: int | None, partitions: int, fallback: int = 0) -> int:
+    """Стабильный номер воркера для пользователя: gateway всегда шлёт его апдейты одному и тому же."""
+    if partitions <= 1:
+        return 0
+    return (user_id if user_id is not None else fallback) % partitions
+
+
+class WebhookServer:
+    """Webhook-рантайм: aiohttp-сервер принимает апдейты и раскладывает их по очередям пользователей.
+
+    - У каждого пользователя своя очередь и своя цепочка обработки: его сообщения обрабатываются
+      строго по порядку, а долгий ход одного пользователя не задерживает остальных.
+    - Одновременно обрабатывается не больше max_in_flight апдейтов (общий семафор).
+    - Ожидающих апдейтов не больше queue_size на весь процесс: при переполнении отвечаем 503,
+      Telegram повторит доставку позже.
+    - При остановке новые апдейты не принимаются, а уже принятые дообрабатываются (drain).
+    """
+
+    def __init__(
+        self,
+        dp: Dispatcher,
+        bot: Bot,
+        path: str = "/telegram/webhook",
+        secret: str | None = None,
+        queue_size: int = 1000,
+        max_in_flight: int = 64,
+    ):
+        self.dp = dp
+        self.bot = bot
+        self.path = path
+        self.secret = secret
+        self.queue_size = max(int(queue_size), 1)
+        self.max_in_flight = max(int(max_in_flight), 1)
+        self._slots = asyncio.Semaphore(self.max_in_flight)
+        # Ключ цепочки (user_id или апдейт без отправителя) -> ожидающие (update, enqueued_at)
+        self._pending: dict[object, deque] = {}
+        self._chains: dict[object, asyncio.Task] = {}
+        self._queued = 0
+        self._in_flight = 0
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self.app = web.Application()
+        self.app.router.add_post(self.path, self._handle_update)
+        self.app.router.add_get("/healthz", self._handle_health)
+        self._runner: web.AppRunner | None = None
+        self._accepting = False
+        self.stats = {
+            "accepted": 0, "rejected_full": 0, "rejected_auth": 0, "processed": 0, "failed": 0, "coalesced": 0,
+        }
+
+    @property
+    def queue_depth(self) -> int:
+        return self._queued
+
+    # --- HTTP ---
+    async def _handle_health(self, request: web.Request) -> web.Response:
+        return web.json_response({
+            "accepting": self._accepting,
+            "queue_depth": self.queue_depth,
+            "in_flight": self._in_flight,
+            "users": len(self._chains),
+            **self.stats,
+        })
+
+    async def _handle_update(self, request: web.Request) -> web.Response:
+        if self.secret and not hmac.compare_digest(request.headers.get(SECRET_HEADER, ""), self.secret):
+            self.stats["rejected_auth"] += 1
+            return web.Response(status=401)
+        if not self._accepting:
+            return web.Response(status=503, text="shutting down")
+        try:
+            payload = await request.json()
+            update = Update.model_validate(payload, context={"bot": self.bot})
+        except Exception as e:
+            logger.warning(f"Webhook: malformed update dropped: {e}")
+            # 200, чтобы Telegram не пытался доставить битый апдейт повторно
+            return web.Response(status=200)
+        if self._queued >= self.queue_size:
+            self.stats["rejected_full"] += 1
+            logger.warning(f"Webhook: update queue is full ({self.queue_size}), update {update.update_id} rejected")
+            return web.Response(status=503, text="busy")
+        self._enqueue(update)
+        self.stats["accepted"] += 1
+        return web.Response(status=200)
+
+    # --- Очереди пользователей ---
+    def _enqueue(self, update: Update):
+        user_id = update_user_id(update)
+        # Апдейты без отправителя ни с чем не упорядочиваем — у каждого своя цепочка
+        key = user_id if user_id is not None else ("update", update.update_id)
+        self._pending.setdefault(key, deque()).append((update, time.perf_counter()))
+        self._queued += 1
+        if key not in self._chains:
+            self._idle.clear()
+            self._chains[key] = asyncio.create_task(self._run_chain(key))
+
+    def take_pending_texts(self, key) -> list[str]:
+        """Забирает из очереди пользователя идущие подряд обычные текстовые сообщения.
+
+        Вызывается UserTurnSerializer при склейке серии (data['take_pending_texts']): в webhook-режиме
+        следующие сообщения пользователя ждут здесь, а не в middleware. Команды и прочие апдейты
+        остаются в очереди и обрабатываются как обычно.
+        """
+        queue = self._pending.get(key)
+        texts: list[str] = []
+        while queue:
+            message = queue[0][0].message
+            if message is None or not message.text or message.text.startswith("/"):
+                break
+            queue.popleft()
+            self._queued -= 1
+            self.stats["coalesced"] += 1
+            texts.append(message.text)
+        return texts
+
+    async def _process(self, update: Update, enqueued_at: float, key):
+        observe("webhook_queue_wait", time.perf_counter() - enqueued_at)
+        try:
+            await self.dp.feed_update(self.bot, update, take_pending_texts=partial(self.take_pending_texts, key))
+            self.stats["processed"] += 1
+        except Exception as e:
+            self.stats["failed"] += 1
+            logger.error(f"Webhook: error while processing update {update.update_id}: {e}", exc_info=True)
+
+    async def _run_chain(self, key):
+        """Обрабатывает очередь одного пользователя по порядку; завершается, когда очередь пуста."""
+        queue = self._pending[key]
+        try:
+            while queue:
+                async with self._slots:
+                    update, enqueued_at = queue.popleft()
+                    self._queued -= 1
+                    self._in_flight += 1
+                    try:
+                        await self._process(update, enqueued_at, key)
+                    finally:
+                        self._in_flight -= 1
+        finally:
+            self._pending.pop(key, None)
+            self._chains.pop(key, None)
+            if not self._chains:
+                self._idle.set()
+
+    # --- Lifecycle ---
+    async def start(self, host: str = "0.0.0.0", port: int = 8080):
+        self._runner = web.AppRunner(self.app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        self._accepting = True
+        logger.info(
+            f"Webhook server listening on http://{host}:{port}{self.path} "
+            f"(max in flight={self.max_in_flight}, queue size={self.queue_size})"
+        )
+
+    async def shutdown(self, drain_timeout: float = 30.0):
+        """Прекращает приём апдейтов и дожидается обработки уже принятых (не дольше drain_timeout)."""
+        self._accepting = False
+        pending = self.queue_depth + self._in_flight
+        if pending:
+            logger.info(f"Webhook: draining {pending} accepted update(s)...")
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout=drain_timeout)
+        except asyncio.TimeoutError:
+            logger.warning(
+                f"Webhook: drain timeout, {self.queue_depth + self._in_flight} update(s) left unprocessed"
+            )
+        chains = list(self._chains.values())
+        for task in chains:
+            task.cancel()
+        await asyncio.gather(*chains, return_exceptions=True)
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
+        logger.info(f"Webhook server stopped. Stats: {self.stats}")
+
+
+class WebhookGateway:
+    """Входной узел для нескольких процессов-воркеров бота.
+
+    Принимает webhook Telegram и пересылает апдейт воркеру, выбранному по user_id
+    (та же функция partition_for), поэтому пользователь «закреплён» за одним воркером
+    и его сообщения обрабатываются по порядку. Статус воркера возвращается Telegram как есть:
+    503 от перегруженного или недоступного воркера приводит к повторной доставке.
+    """
+
+    def __init__(self, worker_urls: list[str], path: str = "/telegram/webhook", secret: str | None = None, timeout: float = 10.0):
+        if not worker_urls:
+            raise ValueError("WebhookGateway requires at least one worker URL")
+        self.worker_urls = list(worker_urls)
+        self.path = path
+        self.secret = secret
+        self.timeout = timeout
+        self.app = web.Application()
+        self.app.router.add_post(self.path, self._handle_update)
+        self._runner: web.AppRunner | None = None
+        self._http: aiohttp.ClientSession | None = None
+        self.stats = {"forwarded": 0, "rejected_auth": 0, "worker_errors": 0}
+
+    def worker_for(self, payload: dict) -> str:
+        idx = partition_for(payload_user_id(payload), len(self.worker_urls), int(payload.get("update_id") or 0))
+        return self.worker_urls[idx]
+
+    async def _handle_update(self, request: web.Request) -> web.Response:
+        if self.secret and not hmac.compare_digest(request.headers.get(SECRET_HEADER, ""), self.secret):
+            self.stats["rejected_auth"] += 1
+            return web.Response(status=401)
+        try:
+            payload = await request.json()
+        except Exception as e:
+            logger.warning(f"Gateway: malformed update dropped: {e}")
+            return web.Response(status=200)
+        url = self.worker_for(payload)
+        headers = {SECRET_HEADER: self.secret} if self.secret else {}
+        try:
+            async with self._http.post(url, json=payload, headers=headers) as resp:
+                self.stats["forwarded"] += 1
+                return web.Response(status=resp.status)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            self.stats["worker_errors"] += 1
+            logger.warning(f"Gateway: worker {url} unavailable: {e}")
+            return web.Response(status=503, text="worker unavailable")
+
+    async def start(self, host: str = "0.0.0.0", port: int = 8080):
+        self._http = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=self.timeout))
+        self._runner = web.AppRunner(self.app)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+        logger.info(f"Webhook gateway listening on http://{host}:{port}{self.path}, workers={self.worker_urls}")
+
+    async def shutdown(self):
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
+        if self._http:
+            await self._http.close()
+            self._http = None
+        logger.info(f"Webhook gateway stopped. Stats: {self.stats}")
@@ -0,0 +1,43 @@
+# Файл: C:\desk_top\tests\telegram_fakes.py
+import socket
+import time
+
+import aiohttp
+
+from src.webhook import SECRET_HEADER
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class FakeTelegramSender:
+    """Локальная замена Telegram: отправляет апдейты в webhook так же, как это делает Bot API."""
+
+    def __init__(self, url: str, secret: str | None = None):
+        self.url = url
+        self.secret = secret
+        self._update_id = 0
+
+    def build_text_update(self, user_id: int, text: str, chat_id: int | None = None) -> dict:
+        self._update_id += 1
+        return {
+            "update_id": self._update_id,
+            "message": {
+                "message_id": self._update_id,
+                "date": int(time.time()),
+                "chat": {"id": chat_id or user_id, "type": "private"},
+                "from": {"id": user_id, "is_bot": False, "first_name": f"user{user_id}"},
+                "text": text,
+            },
+        }
+
+    async def send(self, session: aiohttp.ClientSession, update: dict) -> int:
+        headers = {SECRET_HEADER: self.secret} if self.secret else {}
+        async with session.post(self.url, json=update, headers=headers) as resp:
+            return resp.status
+
+    async def send_text(self, session: aiohttp.ClientSession, user_id: int, text: str) -> int:
+        return await self.send(session, self.build_text_update(user_id, text))
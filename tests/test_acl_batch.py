@@ -0,0 +1,150 @@
+# Файл: C:\desk_top\tests\test_acl_batch.py
+import asyncio
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+
+# Добавляем корень проекта в sys.path для импорта src.*
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from src.handlers import acl as acl_handler
+from src.services.name_normalization import normalize_name
+
+
+class FakeMessage:
+    def __init__(self, user_id: int, text: str):
+        self.from_user = SimpleNamespace(id=user_id, username=None)
+        self.text = text
+        self._answers: list[str] = []
+
+    async def answer(self, text: str, reply_markup=None):
+        self._answers.append(text)
+
+
+class FakeUserRepo:
+    def __init__(self, _):
+        pass
+
+    async def get_or_create_user(self, telegram_id: int, username: str | None = None):
+        return SimpleNamespace(telegram_id=telegram_id)
+
+
+class FakeProjectRepo:
+    """Считает запросы: проекты должны резолвиться одним get_projects_by_names на команду."""
+
+    def __init__(self, projects):
+        self.projects = projects
+        self.calls = 0
+
+    async def get_projects_by_names(self, user_id, names, ids=()):
+        self.calls += 1
+        norms = {normalize_name(n) for n in names}
+        return [p for p in self.projects if p.id in ids or p.name in names or normalize_name(p.name) in norms]
+
+    async def suggest_project_names(self, user_id, name, limit=5):
+        return [p.name for p in self.projects if normalize_name(name) in normalize_name(p.name)][:limit]
+
+    async def get_project_by_name(self, user_id, name):
+        return next((p for p in self.projects if p.name == name), None)
+
+    async def get_project_by_id(self, pid):
+        return next((p for p in self.projects if p.id == pid), None)
+
+
+class FakeAccessRepo:
+    def __init__(self):
+        self.rows: dict[tuple[int, int], str] = {}
+        self.calls = 0
+
+    async def grant_access_many(self, owner_id, allowed_ids, scope="read"):
+        self.calls += 1
+        for pid in allowed_ids:
+            self.rows[(owner_id, pid)] = scope
+        return len(allowed_ids)
+
+    async def revoke_access_many(self, owner_id, allowed_ids):
+        self.calls += 1
+        return [pid for pid in allowed_ids if self.rows.pop((owner_id, pid), None)]
+
+    async def list_access_named(self, owner_id):
+        self.calls += 1
+        names = {1: "Main", 2: "Api", 3: "Web", 4: "Docs", 5: "Notes, 2024"}
+        return [(pid, names[pid], scope) for (o, pid), scope in self.rows.items() if o == owner_id]
+
+
+def _setup():
+    projects = FakeProjectRepo([SimpleNamespace(id=i, name=n) for i, n in [(1, "Main"), (2, "Api"), (3, "Web"), (4, "Docs"), (5, "Notes, 2024")]])
+    access = FakeAccessRepo()
+    acl_handler.UserRepository = FakeUserRepo
+    acl_handler.ProjectRepository = lambda db: projects
+    acl_handler.ProjectAccessRepository = lambda db: access
+    return projects, access
+
+
+async def run_case_batch_grant_revoke_and_list():
+    projects, access = _setup()
+
+    msg = FakeMessage(1, "/grant_access Main Api, web,#4 summaries")
+    await acl_handler.cmd_grant_access(msg, session=None)
+    assert access.rows == {(1, 2): "summaries", (1, 3): "summaries", (1, 4): "summaries"}
+    assert "'Api', 'Web', 'Docs'" in msg._answers[-1]
+    assert projects.calls == 1 and access.calls == 1
+
+    msg = FakeMessage(1, "/revoke_access Main Api,Docs")
+    await acl_handler.cmd_revoke_access(msg, session=None)
+    assert set(access.rows) == {(1, 3)}
+
+    msg = FakeMessage(1, "/list_access Main")
+    await acl_handler.cmd_list_access(msg, session=None)
+    assert msg._answers[-1].splitlines()[1:] == ["- Web (scope=summaries)"]
+
+
+async def run_case_batch_grant_rejects_unknown_names():
+    _, access = _setup()
+    msg = FakeMessage(1, "/grant_access Main Api,Docz")
+    await acl_handler.cmd_grant_access(msg, session=None)
+    assert access.rows == {}
+    assert msg._answers[-1] == "Проект 'Docz' не найден у вас."
+
+
+async def run_case_names_with_commas_are_quoted():
+    _, access = _setup()
+    msg = FakeMessage(1, '/grant_access Main "Notes, 2024", Api read')
+    await acl_handler.cmd_grant_access(msg, session=None)
+    assert access.rows == {(1, 5): "read", (1, 2): "read"}
+    assert "'Notes, 2024', 'Api'" in msg._answers[-1]
+
+    # Проект с запятой может быть и владельцем
+    msg = FakeMessage(1, '/grant_access "Notes, 2024" Web')
+    await acl_handler.cmd_grant_access(msg, session=None)
+    assert access.rows[(5, 3)] == "read"
+
+    msg = FakeMessage(1, '/revoke_access Main "Notes, 2024"')
+    await acl_handler.cmd_revoke_access(msg, session=None)
+    assert (1, 5) not in access.rows and (1, 2) in access.rows
+
+    # Без кавычек запятая разделяет имена; по id проект находится всегда
+    msg = FakeMessage(1, "/grant_access Main Notes, 2024")
+    await acl_handler.cmd_grant_access(msg, session=None)
+    assert msg._answers[-1].startswith("Проект 'Notes' не найден у вас.")
+    msg = FakeMessage(1, "/revoke_access Main #5, Api")
+    await acl_handler.cmd_revoke_access(msg, session=None)
+    assert (1, 2) not in access.rows
+
+    msg = FakeMessage(1, "/grant_access Main,Api Web")
+    await acl_handler.cmd_grant_access(msg, session=None)
+    assert msg._answers[-1].startswith("Использование: /grant_access")
+
+
+def test_batch_grant_revoke_and_list():
+    asyncio.run(run_case_batch_grant_revoke_and_list())
+
+
+def test_batch_grant_rejects_unknown_names():
+    asyncio.run(run_case_batch_grant_rejects_unknown_names())
+
+
+def test_names_with_commas_are_quoted():
+    asyncio.run(run_case_names_with_commas_are_quoted())
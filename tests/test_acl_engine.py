@@ -0,0 +1,68 @@
+# Файл: C:\desk_top\tests\test_acl_engine.py
+import asyncio
+import sys
+from pathlib import Path
+
+import pytest
+
+# Добавляем корень проекта в sys.path для импорта src.*
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from src.services.acl_engine import ACLEngine, compute_reachability, normalize_scope, SCOPE_LEVELS
+
+
+class CountingAccessRepo:
+    def __init__(self, edges):
+        self.edges = list(edges)
+        self.calls = 0
+
+    async def list_user_edges(self, user_id: int):
+        self.calls += 1
+        return list(self.edges)
+
+
+READ, SUMMARIES, ALL = SCOPE_LEVELS["read"], SCOPE_LEVELS["summaries"], SCOPE_LEVELS["all"]
+
+
+def test_scope_validation():
+    assert normalize_scope(None) == "read"
+    assert normalize_scope(" ALL ") == "all"
+    with pytest.raises(ValueError):
+        normalize_scope("write")
+
+
+def test_reachability_respects_depth_and_weakest_link():
+    # 1 -all-> 2 -read-> 3 -all-> 4, плюс короткий, но узкий путь 1 -read-> 4
+    edges = {1: {2: ALL, 4: READ}, 2: {3: READ}, 3: {4: ALL}}
+    assert compute_reachability(edges, 1, 1) == {2: ALL, 4: READ}
+    assert compute_reachability(edges, 1, 2) == {2: ALL, 4: READ, 3: READ}
+    # Цикл не зацикливает и не даёт владельцу доступ к самому себе
+    assert compute_reachability({1: {2: ALL}, 2: {1: ALL}}, 1, 5) == {2: ALL}
+
+
+def test_reachability_prefers_widest_path_within_depth():
+    edges = {1: {2: READ, 3: ALL}, 3: {2: SUMMARIES}}
+    assert compute_reachability(edges, 1, 1)[2] == READ
+    assert compute_reachability(edges, 1, 2)[2] == SUMMARIES
+
+
+async def run_case_engine_caches_graph_until_invalidated():
+    repo = CountingAccessRepo([(1, 2, "summaries"), (2, 3, "all"), (5, 6, "read")])
+    engine = ACLEngine(ttl_seconds=60, max_depth=2)
+
+    assert await engine.allowed_projects(repo, 7, 1) == frozenset({2, 3})
+    assert await engine.allowed_projects(repo, 7, 1, required_scope="all") == frozenset()
+    assert await engine.is_allowed(repo, 7, 1, 3, required_scope="summaries")
+    assert await engine.effective_scope(repo, 7, 5, 6) == "read"
+    assert repo.calls == 1
+
+    repo.edges.remove((1, 2, "summaries"))
+    engine.invalidate_user(7)
+    assert await engine.allowed_projects(repo, 7, 1) == frozenset()
+    assert repo.calls == 2
+
+
+def test_engine_caches_graph_until_invalidated():
+    asyncio.run(run_case_engine_caches_graph_until_invalidated())
@@ -12,6 +12,10 @@ if str(ROOT) not in sys.path:
 # Импортируем модуль обработчика, затем будем монкипатчить его зависимости
 from src.handlers import session as session_handler
 from src.services import prompt_builder as prompt_builder_module
+from src.services.llm_client import LLMResult, UsageTotals
+from src.services.acl_engine import acl_engine
+from src.services.budget import BudgetAllocator
+from src.services.model_router import get_model_spec
 
 
 # ---- Моки окружения ----
@@ -54,15 +58,21 @@ class FakeLLMClient:
     def count_tokens(self, text: str) -> int:
         return max(1, len(text.split()))
 
-    async def get_response(self, system_prompt, history, user_message, rag_context=None, temperature=None):
-        return f"RESP::{len(rag_context or [])}::TEMP={temperature}"
+    def estimate_tokens(self, system_prompt, history, user_message, rag_context=None, tools_config=None) -> int:
+        return self.count_tokens(user_message)
+
+    def plan_budget(self, user_message, tools_config=None):
+        return BudgetAllocator().allocate(get_model_spec("gpt-4o"), tools_config)
+
+    async def get_response(self, system_prompt, history, user_message, rag_context=None, temperature=None, tools_config=None):
+        return LLMResult(text=f"RESP::{len(rag_context or [])}::TEMP={temperature}", model="fake", usage=UsageTotals())
 
 
 class FakeRAGClient:
     def __init__(self):
         self.calls = []
 
-    async def find_relevant_summaries(self, user_id: int, query: str, project_id=None, project_ids=None):
+    async def find_relevant_summaries(self, user_id: int, query: str, top_k=3, project_id=None, project_ids=None, query_embedding=None, token_budget=None):
         self.calls.append({
             'user_id': user_id,
             'project_id': project_id,
@@ -96,7 +106,7 @@ class FakeSessionRepository:
     def __init__(self, _):
         self._active = None
 
-    async def get_active_session(self, user_id: int):
+    async def get_active_session(self, user_id: int, with_history: bool = True, history_tail: int | None = None):
         return self._active
 
     async def set_active(self, s: _FakeSessionObj):
@@ -105,7 +115,7 @@ class FakeSessionRepository:
     async def get_context_mode(self, user_id: int) -> str:
         return self._active.context_mode if self._active else 'project'
 
-    async def update_message_history(self, session_id: int, new_message: dict):
+    async def append_messages(self, session_id: int, messages: list[dict]):
         # для теста не требуется сохранять
         pass
 
@@ -133,6 +143,9 @@ class FakeProjectRepository:
     async def get_project_by_name(self, user_id: int, name: str):
         return self._by_name.get(name)
 
+    async def list_projects(self, user_id: int):
+        return list(self._by_id.values())
+
 
 class FakeProjectAccessRepository:
     def __init__(self, _):
@@ -144,6 +157,9 @@ class FakeProjectAccessRepository:
     async def is_allowed(self, owner_project_id: int, target_project_id: int, required_scope: str = 'read') -> bool:
         return (owner_project_id, target_project_id) in self._allowed
 
+    async def list_user_edges(self, user_id: int) -> list[tuple[int, int, str]]:
+        return [(owner, allowed, "read") for owner, allowed in self._allowed]
+
 
 class FakeUserRepository:
     def __init__(self, _):
@@ -155,6 +171,12 @@ class FakeUserRepository:
     async def check_and_update_limits(self, user, tokens_to_add: int) -> bool:
         return True
 
+    async def reserve_tokens(self, telegram_id: int, tokens: int) -> int | None:
+        return tokens
+
+    async def settle_tokens(self, telegram_id: int, reserved: int, actual: int) -> int | None:
+        return actual
+
 
 class FakePromptRepo:
     def __init__(self, _):
@@ -172,6 +194,9 @@ async def run_case_no_active_project():
     session_handler.ProjectAccessRepository = FakeProjectAccessRepository
     session_handler.PersonalizedPromptRepository = FakePromptRepo
     prompt_builder_module.PersonalizedPromptRepository = FakePromptRepo
+    # Кэш имён/ACL общий на процесс — между кейсами сбрасываем
+    session_handler.project_index.clear()
+    acl_engine.clear()
 
     # Контекст: acl_mentions, НЕТ активного проекта
     sess_repo = FakeSessionRepository(None)
@@ -201,6 +226,9 @@ async def run_case_mentions_without_acl():
     session_handler.ProjectAccessRepository = FakeProjectAccessRepository
     session_handler.PersonalizedPromptRepository = FakePromptRepo
     prompt_builder_module.PersonalizedPromptRepository = FakePromptRepo
+    # Кэш имён/ACL общий на процесс — между кейсами сбрасываем
+    session_handler.project_index.clear()
+    acl_engine.clear()
 
     # Активный проект P1, контекст acl_mentions. В базе есть проект Other, но ACL нет.
     sess_repo = FakeSessionRepository(None)
@@ -235,6 +263,9 @@ async def run_case_mentions_with_acl():
     session_handler.ProjectAccessRepository = FakeProjectAccessRepository
     session_handler.PersonalizedPromptRepository = FakePromptRepo
     prompt_builder_module.PersonalizedPromptRepository = FakePromptRepo
+    # Кэш имён/ACL общий на процесс — между кейсами сбрасываем
+    session_handler.project_index.clear()
+    acl_engine.clear()
 
     # Активный проект P1, есть Other и Third. ACL выдан к Other, к Third — нет.
     sess_repo = FakeSessionRepository(None)
@@ -261,6 +292,18 @@ async def run_case_mentions_with_acl():
     assert call['project_ids'] == [1, 2], f"Expected [1,2], got {call['project_ids']}"
 
 
+def test_acl_mentions_no_active_project():
+    asyncio.run(run_case_no_active_project())
+
+
+def test_acl_mentions_without_acl():
+    asyncio.run(run_case_mentions_without_acl())
+
+
+def test_acl_mentions_with_acl():
+    asyncio.run(run_case_mentions_with_acl())
+
+
 async def main():
     await run_case_no_active_project()
     await run_case_mentions_without_acl()
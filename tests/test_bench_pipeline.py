@@ -0,0 +1,43 @@
+# Файл: C:\desk_top\tests\test_bench_pipeline.py
+import asyncio
+import sys
+from pathlib import Path
+
+# Добавляем корень проекта в sys.path для импорта src.* и скриптов из корня
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+import bench_pipeline
+from src.handlers import session as session_handler
+
+
+async def run_case_memory_pipeline():
+    original = session_handler.SessionRepository
+    args = bench_pipeline.parse_args(["--history", "0,50", "--concurrency", "1,3", "--turns", "2", "--summaries", "3"])
+    results = await bench_pipeline.run(args)
+    assert [(r["history"], r["concurrency"]) for r in results] == [(0, 1), (0, 3), (50, 1), (50, 3)]
+    for r in results:
+        assert r["errors"] == 0
+        assert r["turns"] == r["concurrency"] * 2
+        assert 0 < r["p50_ms"] <= r["p95_ms"] <= r["p99_ms"]
+        assert r["turns_per_sec"] > 0
+        assert r["queries_per_turn"] > 0
+        assert r["stages_ms_per_turn"]["llm_total"] > 0
+        assert r["queries_synthetic"] is True
+    # Подмена репозиториев снимается после прогона
+    assert session_handler.SessionRepository is original
+
+
+def test_memory_pipeline_reports_all_scenarios():
+    asyncio.run(run_case_memory_pipeline())
+
+
+def test_compare_flags_regressions():
+    base = [{"history": 0, "concurrency": 1, "p95_ms": 10.0, "turns_per_sec": 100.0, "queries_per_turn": 11.0}]
+    same = [dict(base[0], p95_ms=11.0, turns_per_sec=90.0)]
+    worse = [dict(base[0], p95_ms=20.0, turns_per_sec=50.0, queries_per_turn=12.0)]
+    assert bench_pipeline.compare(same, base, tolerance=0.2) == []
+    assert len(bench_pipeline.compare(worse, base, tolerance=0.2)) == 3
+    # Синтетический счёт запросов (--db memory) не сравнивается
+    assert len(bench_pipeline.compare(worse, base, tolerance=0.2, check_queries=False)) == 2
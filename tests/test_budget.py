@@ -0,0 +1,95 @@
+# Файл: C:\desk_top\tests\test_budget.py
+import sys
+from pathlib import Path
+
+# Добавляем корень проекта в sys.path для импорта src.*
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from src.services.budget import BudgetAllocator, MIN_COMPLETION_TOKENS
+from src.services.llm_client import LLMClient
+from src.services.model_router import get_model_spec
+from src.services.prompt_builder import TOOLS_BLOCK_HEADER
+
+
+def _allocator(**overrides) -> BudgetAllocator:
+    params = dict(
+        system=4000, rag=6000, history=8000, completion=1024, rag_candidates=20,
+        latency_target_ms=0, prefill_tps=5000, decode_tps=60,
+    )
+    params.update(overrides)
+    return BudgetAllocator(**params)
+
+
+def test_defaults_without_tools_config():
+    a = _allocator().allocate(get_model_spec("gpt-4o"))
+    assert (a.system, a.rag, a.history, a.completion, a.rag_candidates) == (4000, 6000, 8000, 1024, 20)
+    assert a.source == "default" and a.scale == 1.0
+
+
+def test_tools_config_overrides_caps():
+    cfg = {"budget": {"rag": 2000, "history": "3000", "completion": 500, "rag_candidates": 5, "system": "bad"}}
+    a = _allocator().allocate(get_model_spec("gpt-4o"), cfg)
+    assert (a.rag, a.history, a.completion, a.rag_candidates) == (2000, 3000, 500, 5)
+    # Некорректное значение игнорируется — остаётся значение по умолчанию
+    assert a.system == 4000
+    assert a.source == "tools_config"
+
+
+def test_budget_fits_model_window():
+    a = _allocator(rag=60_000, history=60_000).allocate(get_model_spec("gpt-3.5-turbo"))
+    spec = get_model_spec("gpt-3.5-turbo")
+    assert a.completion <= spec.max_completion_tokens
+    assert a.system + a.rag + a.history + a.completion <= spec.context_window
+    assert a.rag == a.history  # урезаны пропорционально
+
+
+def test_latency_target_scales_budgets_down():
+    allocator = _allocator()
+    spec = get_model_spec("gpt-4o")
+    full = allocator.allocate(spec)
+    fast = allocator.allocate(spec, {"budget": {"latency_target_ms": 10_000}})
+    assert fast.scale < 1.0
+    assert fast.rag < full.rag and fast.history < full.history and fast.completion < full.completion
+    assert fast.completion >= MIN_COMPLETION_TOKENS
+    assert fast.system == full.system
+    assert fast.estimated_latency_ms(allocator.prefill_tps, allocator.decode_tps) <= 10_000
+    assert "latency_target=10000ms" in fast.describe()
+
+
+def test_mode_can_disable_global_latency_target():
+    allocator = _allocator(latency_target_ms=3000)
+    spec = get_model_spec("gpt-4o")
+    assert allocator.allocate(spec).scale < 1.0
+    assert allocator.allocate(spec, {"budget": {"latency_target_ms": 0}}).scale == 1.0
+
+
+class _CharEncoding:
+    """Токен — символ: обрезка без потерь на границах токенов."""
+
+    def encode(self, text):
+        return list(text)
+
+    def decode(self, tokens):
+        return "".join(tokens)
+
+
+def _llm_with_char_encoding() -> LLMClient:
+    llm = LLMClient.__new__(LLMClient)
+    llm._encodings = {get_model_spec("gpt-4o").encoding: _CharEncoding()}
+    return llm
+
+
+def test_trim_system_prompt_keeps_tools_block():
+    tools = f'{TOOLS_BLOCK_HEADER}{{"routing": "quality"}}'
+    prompt = "проект " * 50 + tools
+    trimmed = _llm_with_char_encoding()._trim_system_prompt(prompt, 100, "gpt-4o")
+    assert len(trimmed) == 100
+    assert trimmed.endswith(tools)
+    assert trimmed.startswith("проект ")
+
+
+def test_trim_system_prompt_without_tools_keeps_head():
+    trimmed = _llm_with_char_encoding()._trim_system_prompt("abcdef", 4, "gpt-4o")
+    assert trimmed == "abcd"
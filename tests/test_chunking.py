@@ -0,0 +1,136 @@
+# Файл: C:\desk_top\tests\test_chunking.py
+import asyncio
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+
+# Добавляем корень проекта в sys.path для импорта src.*
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from src.services.chunking import GAP_MARKER, assemble_chunks, split_into_chunks
+from src.services.rag_client import RAGClient
+from src.services.retrieval_cache import RetrievalCache
+
+# Токен = слово: размеры фрагментов легко посчитать руками
+WORDS = SimpleNamespace(encode=lambda text: text.split(), decode=lambda ids: " ".join(ids))
+
+
+def _paragraphs(*sizes: int) -> str:
+    return "\n\n".join(" ".join(f"p{i}w{j}" for j in range(n)) for i, n in enumerate(sizes))
+
+
+def test_chunks_are_bounded_and_overlapping():
+    text = _paragraphs(2, 3, 2, 4, 3, 2, 3)
+    chunks = split_into_chunks(text, WORDS, max_tokens=8, overlap_tokens=4)
+    assert len(chunks) == 4
+    assert all(len(c.text.split()) <= 8 for c in chunks)
+    # Начало следующего фрагмента повторяет конец предыдущего
+    assert chunks[1].text[:chunks[1].overlap] == "p2w0 p2w1"
+    assert chunks[0].text.endswith("p2w0 p2w1")
+    # Склейка всех фрагментов восстанавливает исходный текст без повторов
+    assert assemble_chunks(chunks) == text
+    assert GAP_MARKER in assemble_chunks([chunks[0], chunks[2]])
+
+
+def test_long_paragraph_is_split_by_tokens():
+    text = " ".join(f"w{i}" for i in range(25))
+    chunks = split_into_chunks(text, WORDS, max_tokens=10, overlap_tokens=0)
+    assert [len(c.text.split()) for c in chunks] == [10, 10, 5]
+
+
+class _FakeIndex:
+    def __init__(self):
+        self.vectors = {}
+        self.fetched = []
+
+    def upsert(self, vectors):
+        for vid, values, metadata in vectors:
+            self.vectors[vid] = {"id": vid, "values": values, "metadata": metadata}
+
+    def fetch(self, ids):
+        self.fetched.extend(ids)
+        return {"vectors": {i: self.vectors[i] for i in ids if i in self.vectors}}
+
+    def delete(self, ids=None, filter=None):
+        # Как starter/serverless-индексы Pinecone: удаление по метаданным не поддерживается
+        if filter is not None:
+            raise ValueError("Deleting by metadata is not supported by this index")
+        for vid in ids:
+            self.vectors.pop(vid, None)
+
+    def query(self, vector, top_k, filter, include_metadata, include_values):
+        # Ищем по совпадению маркера запроса в тексте фрагмента; legacy-вектор всегда релевантен
+        hits = []
+        for v in self.vectors.values():
+            md = v["metadata"]
+            if md["user_id"] != filter["user_id"]:
+                continue
+            score = 0.9 if self.needle in md["summary"] else (0.8 if "chunk" not in v["id"] else 0.1)
+            hits.append({**v, "score": score})
+        return {"matches": sorted(hits, key=lambda h: -h["score"])[:top_k]}
+
+
+class _FakeEmbeddings:
+    async def create(self, model, input):
+        texts = input if isinstance(input, list) else [input]
+        return SimpleNamespace(data=[SimpleNamespace(index=i, embedding=[1.0, float(i)]) for i, _ in enumerate(texts)])
+
+
+def _client(index) -> RAGClient:
+    client = RAGClient.__new__(RAGClient)
+    client.encoding = WORDS
+    client.openai_client = SimpleNamespace(embeddings=_FakeEmbeddings())
+    client.index = index
+    client.RAG_TOKEN_BUDGET = 1000
+    client.MAX_CANDIDATES = 20
+    client.MIN_TOP_K = 3
+    client.lexical_index = None
+    client.retrieval_cache = RetrievalCache(ttl_seconds=0)
+    client.CHUNK_NEIGHBORS = 1
+    return client
+
+
+async def run_case_save_and_expand_neighbors():
+    index = _FakeIndex()
+    client = _client(index)
+    summary = "\n\n".join(" ".join(f"s{i}w{j}" for j in range(300)) for i in range(4))
+    await client.save_summary(7, 1, summary, project_id=3)
+    assert sorted(index.vectors) == [f"session-7-chunk-{n}" for n in range(4)]
+    md = index.vectors["session-7-chunk-2"]["metadata"]
+    assert (md["session_id"], md["chunk_index"], md["chunk_count"], md["project_id"]) == (7, 2, 4, 3)
+
+    # Legacy-вектор целой сессии продолжает находиться
+    index.vectors["session-1"] = {"id": "session-1", "values": [0.0, 1.0], "metadata": {"user_id": 1, "summary": "old summary"}}
+
+    index.needle = "s2w5 "
+    found = await client.find_relevant_summaries(1, "q", top_k=10, query_embedding=[1.0, 0.0])
+    assert [m.session_id for m in found] == [7, None]
+    # Найден фрагмент 2: к нему добавлены соседи 1 и 3, но не далёкий 0
+    text = found[0].text
+    assert "s1w0" in text and "s2w5" in text and "s3w0" in text and "s0w0" not in text
+    assert found[0].score == 0.9
+    assert found[1].text == "old summary"
+
+
+def test_save_and_expand_neighbors():
+    asyncio.run(run_case_save_and_expand_neighbors())
+
+
+async def run_case_delete_session_vectors_by_ids():
+    index = _FakeIndex()
+    client = _client(index)
+    long_summary = "\n\n".join(" ".join(f"s{i}w{j}" for j in range(300)) for i in range(4))
+    for sid in (7, 8, 9):
+        await client.save_summary(sid, 1, long_summary)
+    index.vectors["session-1"] = {"id": "session-1", "values": [0.0, 1.0], "metadata": {"user_id": 1, "summary": "old"}}
+
+    # Число фрагментов сессии 7 известно из summary_chunks, сессии 8 — читается из фрагмента 0
+    assert await client.delete_session_vectors([7, 8, 1], chunk_counts={7: 4})
+    assert index.fetched == ["session-8-chunk-0", "session-1-chunk-0"]
+    assert sorted(index.vectors) == [f"session-9-chunk-{n}" for n in range(4)]
+
+
+def test_delete_session_vectors_by_ids():
+    asyncio.run(run_case_delete_session_vectors_by_ids())
@@ -48,7 +48,7 @@ class FakeSessionRepository:
         self._mode = mode
         return True
 
-    async def get_active_session(self, user_id: int):
+    async def get_active_session(self, user_id: int, with_history: bool = True):
         return self._active_session
 
 
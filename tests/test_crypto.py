@@ -0,0 +1,89 @@
+# Файл: C:\desk_top\tests\test_crypto.py
+import asyncio
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+from cryptography.exceptions import InvalidTag
+from sqlalchemy import Text, inspect
+from sqlalchemy.dialects import postgresql
+from sqlalchemy_utils import StringEncryptedType
+
+# Добавляем корень проекта в sys.path для импорта src.*
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from src.db.crypto import AesGcmEncryptedType, Keyring, GCM_PREFIX
+from src.db.models import Mode, Project, Session, load_deferred
+
+DIALECT = postgresql.dialect()
+
+
+def test_gcm_roundtrip_and_random_nonce():
+    col = AesGcmEncryptedType(keyring=Keyring("k1"))
+    a = col.process_bind_param("история 🙂", DIALECT)
+    b = col.process_bind_param("история 🙂", DIALECT)
+    assert a.startswith(GCM_PREFIX) and a != b
+    assert col.process_result_value(a, DIALECT) == "история 🙂"
+    assert col.process_bind_param(None, DIALECT) is None
+
+
+def test_bytes_values_roundtrip_as_bytes():
+    col = AesGcmEncryptedType(keyring=Keyring("k1", cipher="cbc"))
+    ct = col.process_bind_param(b"MH\x01\x00\xff", DIALECT)
+    assert col.process_result_value(ct, DIALECT) == b"MH\x01\x00\xff"
+    assert Keyring("k2", old=("k1",)).reencrypt(ct) is not None
+
+
+def test_reads_legacy_string_encrypted_type_values():
+    legacy = StringEncryptedType(Text, "k1").process_bind_param('[{"role": "user"}]', DIALECT)
+    assert Keyring("k1").decrypt(legacy) == '[{"role": "user"}]'
+    # старый ключ в связке: значение всё ещё читается после смены ENCRYPTION_KEY
+    assert Keyring("k2", old=("k1",)).decrypt(legacy) == '[{"role": "user"}]'
+
+
+def test_rotation_reencrypts_only_stale_values():
+    old = Keyring("k1")
+    ring = Keyring("k2", old=("k1",))
+    stale = old.encrypt("prompt")
+    fresh = ring.reencrypt(stale)
+    assert fresh and ring.decrypt(fresh) == "prompt"
+    assert ring.reencrypt(fresh) is None and ring.reencrypt(None) is None
+    with pytest.raises(ValueError):
+        Keyring("k2").decrypt(stale)
+
+
+def test_tampered_ciphertext_is_rejected():
+    ring = Keyring("k1")
+    ct = ring.encrypt("secret")
+    body = ct[:-4] + ("AAAA" if not ct.endswith("AAAA") else "BBBB")
+    with pytest.raises(InvalidTag):
+        ring.decrypt(body)
+
+
+def test_cbc_mode_writes_legacy_format():
+    ring = Keyring("k1", cipher="cbc")
+    ct = ring.encrypt("rollback")
+    assert not ct.startswith(GCM_PREFIX)
+    assert StringEncryptedType(Text, "k1").process_result_value(ct, DIALECT) == "rollback"
+    assert ring.reencrypt(ct) is None
+
+
+def test_heavy_encrypted_columns_are_deferred():
+    deferred = {
+        (m.class_.__name__, p.key)
+        for m in (inspect(Project), inspect(Mode), inspect(Session))
+        for p in m.column_attrs
+        if p.deferred
+    }
+    assert deferred == {
+        ("Project", "system_prompt"), ("Project", "backlog"),
+        ("Mode", "system_prompt"), ("Mode", "tools_config"),
+        ("Session", "message_history"),
+    }
+
+
+def test_load_deferred_reads_plain_objects():
+    assert asyncio.run(load_deferred(SimpleNamespace(system_prompt="p"), "system_prompt")) == "p"
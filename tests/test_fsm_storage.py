@@ -0,0 +1,71 @@
+# Файл: C:\desk_top\tests\test_fsm_storage.py
+import asyncio
+import sys
+from pathlib import Path
+
+import pytest
+from aiogram.fsm.storage.base import StorageKey
+from sqlalchemy.dialects import postgresql
+
+# Добавляем корень проекта в sys.path для импорта src.*
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from src.db.repository import UserRepository
+from src.services.fsm_storage import PostgresFSMStorage, build_fsm_storage
+
+
+class RecordingSession:
+    """AsyncSession, которая только запоминает выполненные выражения (SQL для Postgres)."""
+
+    def __init__(self):
+        self.statements = []
+
+    async def execute(self, stmt):
+        self.statements.append(stmt.compile(dialect=postgresql.dialect()))
+
+    async def commit(self):
+        pass
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+async def run_case_postgres_storage_records_owner():
+    session = RecordingSession()
+    storage = PostgresFSMStorage(lambda: session)
+    key = StorageKey(bot_id=1, chat_id=42, user_id=42)
+    await storage.set_state(key, "Questionnaire:goal")
+    await storage.set_data(key, {"goal": "ответ анкеты"})
+    for compiled in session.statements:
+        assert str(compiled).startswith("INSERT INTO fsm_states")
+        assert compiled.params["user_id"] == 42
+        # Строки, созданные до появления колонки, получают владельца при следующем изменении
+        assert "DO UPDATE SET user_id = " in str(compiled)
+
+
+async def run_case_delete_all_user_data_removes_fsm_states():
+    session = RecordingSession()
+    await UserRepository(session).delete_all_user_data(42)
+    fsm = [c for c in session.statements if str(c).startswith("DELETE FROM fsm_states")]
+    assert len(fsm) == 1
+    assert "fsm_states.user_id = " in str(fsm[0]) and 42 in fsm[0].params.values()
+
+
+def test_postgres_storage_records_owner():
+    asyncio.run(run_case_postgres_storage_records_owner())
+
+
+def test_delete_all_user_data_removes_fsm_states():
+    asyncio.run(run_case_delete_all_user_data_removes_fsm_states())
+
+
+def test_only_backends_covered_by_data_deletion_are_offered():
+    assert isinstance(build_fsm_storage("postgres", session_maker=RecordingSession), PostgresFSMStorage)
+    # Состояния в Redis не удалялись бы через /delete_my_data
+    with pytest.raises(ValueError):
+        build_fsm_storage("redis")
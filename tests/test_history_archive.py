@@ -0,0 +1,32 @@
+# Файл: C:\desk_top\tests\test_history_archive.py
+import importlib.util
+import sys
+from pathlib import Path
+
+import pytest
+
+# Добавляем корень проекта в sys.path для импорта src.*
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from src.services.history_archive import pack_history, unpack_history
+
+
+def test_pack_roundtrip_compresses_history():
+    history = [{"role": "user", "content": f"Вопрос {i}: как настроить деплой?"} for i in range(50)]
+    archived = pack_history(history, "gzip")
+    assert archived.message_count == 50
+    assert archived.stored_size < archived.raw_size / 4
+    assert unpack_history(archived.codec, archived.payload) == history
+
+
+def test_unknown_codec_is_rejected():
+    with pytest.raises(ValueError):
+        pack_history([], "lz4")
+
+
+@pytest.mark.skipif(importlib.util.find_spec("zstandard") is not None, reason="zstandard установлен")
+def test_zstd_without_package_fails_loudly():
+    with pytest.raises(RuntimeError, match="zstandard"):
+        pack_history([{"role": "user", "content": "x"}], "zstd")
@@ -0,0 +1,64 @@
+# Файл: C:\desk_top\tests\test_history_codec.py
+import json
+import sys
+from pathlib import Path
+
+import pytest
+
+# Добавляем корень проекта в sys.path для импорта src.*
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from src.services.history_codec import append_history, decode_history, encode_history, is_compact
+
+HISTORY = [
+    {"role": "system", "content": "Ты — ассистент"},
+    {"role": "user", "content": "Привет! Как настроить \"деплой\"?\n```yaml\nx: 1\n```"},
+    {"role": "assistant", "content": "Так: …"},
+    {"role": "tool", "content": "ok", "tool_call_id": "c1"},
+    {"role": "user", "content": ""},
+]
+
+
+def test_compact_roundtrip_is_smaller_than_json():
+    blob = encode_history(HISTORY, "compact", "none")
+    assert is_compact(blob)
+    assert decode_history(blob) == HISTORY
+    assert len(blob) < len(json.dumps(HISTORY, ensure_ascii=False).encode("utf-8"))
+
+
+def test_tail_reads_last_messages():
+    blob = encode_history(HISTORY, "compact", "none")
+    assert decode_history(blob, tail=2) == HISTORY[-2:]
+    assert decode_history(blob, tail=100) == HISTORY
+
+
+def test_reads_existing_json_rows():
+    legacy = json.dumps(HISTORY, ensure_ascii=False)
+    assert decode_history(legacy) == HISTORY
+    assert decode_history(legacy.encode("utf-8"), tail=1) == HISTORY[-1:]
+    assert decode_history(None) == [] and decode_history("") == []
+
+
+def test_append_without_reparse_matches_full_encode():
+    blob = encode_history(HISTORY[:2], "compact", "none")
+    appended = append_history(blob, HISTORY[2:], "compact", "none")
+    assert appended == encode_history(HISTORY, "compact", "none")
+    # JSON-строка при дописывании переводится в компактный формат
+    migrated = append_history(json.dumps(HISTORY[:2]), HISTORY[2:], "compact", "none")
+    assert is_compact(migrated) and decode_history(migrated) == HISTORY
+
+
+def test_zlib_compression_and_json_fallback_format():
+    big = HISTORY * 50
+    packed = encode_history(big, "compact", "zlib")
+    assert len(packed) < len(encode_history(big, "compact", "none")) / 4
+    assert decode_history(append_history(packed, HISTORY[:1], "compact", "zlib"), tail=1) == HISTORY[:1]
+    assert json.loads(encode_history(HISTORY, "json")) == HISTORY
+
+
+def test_corrupted_blob_raises_value_error():
+    blob = encode_history(HISTORY, "compact", "none")
+    with pytest.raises(ValueError):
+        decode_history(blob[:-3])
@@ -0,0 +1,122 @@
+# Файл: C:\desk_top\tests\test_hybrid_retrieval.py
+import asyncio
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+
+# Добавляем корень проекта в sys.path для импорта src.*
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from src.services.chunking import chunk_vector_id
+from src.services.lexical_index import build_tsquery
+from src.services.rag_client import RAGClient
+from src.services.rag_selection import RAGMatch, reciprocal_rank_fusion
+from src.services.retrieval_cache import RetrievalCache
+
+
+def test_build_tsquery_keeps_identifiers():
+    assert build_tsquery("Почему падает get_user в ProjectX? и в get_user") == "почему | падает | get_user | projectx"
+    assert build_tsquery("a b !!") is None
+
+
+def test_rrf_rewards_agreement_between_rankings():
+    a, b, c = (RAGMatch(text=t, score=0.0, vector_id=t) for t in "abc")
+    fused = reciprocal_rank_fusion([[a, b], [b, c]], k=60)
+    assert [m.text for m in fused] == ["b", "a", "c"]
+    assert fused[0].score == round(1 / 62 + 1 / 61, 6)
+
+
+class _FakeLexicalIndex:
+    """In-memory замена LexicalSummaryIndex: совпадение по словам запроса."""
+
+    def __init__(self, chunks: dict[tuple[int, int], str]):
+        self.chunks = chunks
+        self.indexed = []
+
+    async def index_session(self, user_id, session_id, project_id, chunks):
+        self.indexed.append((session_id, [c.text for c in chunks]))
+
+    async def search(self, user_id, query_text, project_id=None, project_ids=None, limit=20):
+        terms = set(query_text.lower().split())
+        hits = []
+        for (sid, idx), text in self.chunks.items():
+            overlap = len(terms & set(text.lower().split()))
+            if overlap:
+                hits.append(RAGMatch(text=text, score=float(overlap), vector_id=chunk_vector_id(sid, idx),
+                                     session_id=sid, chunk_index=idx, chunk_count=1))
+        return sorted(hits, key=lambda m: -m.score)[:limit]
+
+    async def fetch_chunks(self, keys):
+        return {}
+
+
+class _FakeIndex:
+    def __init__(self, matches):
+        self.matches = matches
+        self.queried = False
+
+    def query(self, **kwargs):
+        self.queried = True
+        return {"matches": self.matches}
+
+
+def _client(index, lexical) -> RAGClient:
+    client = RAGClient.__new__(RAGClient)
+    client.encoding = SimpleNamespace(encode=lambda text: text.split(), decode=lambda ids: " ".join(ids))
+    client.index = index
+    client.lexical_index = lexical
+    client.retrieval_cache = RetrievalCache(ttl_seconds=0)
+    client.RAG_TOKEN_BUDGET = 1000
+    client.MAX_CANDIDATES = 20
+    client.MIN_TOP_K = 3
+    client.CHUNK_NEIGHBORS = 0
+    client.EMBEDDING_TIMEOUT = 0.05
+    return client
+
+
+async def run_case_hybrid_fuses_rankings():
+    lexical = _FakeLexicalIndex({(1, 0): "deploy get_user fix", (2, 0): "unrelated get_user"})
+    index = _FakeIndex([
+        {"id": chunk_vector_id(3, 0), "score": 0.9, "metadata": {"summary": "semantic hit", "session_id": 3, "chunk_index": 0}},
+        {"id": chunk_vector_id(1, 0), "score": 0.85, "metadata": {"summary": "deploy get_user fix", "session_id": 1, "chunk_index": 0}},
+    ])
+    client = _client(index, lexical)
+    found = await client.find_relevant_summaries(1, "get_user deploy", query_embedding=[1.0])
+    # Фрагмент, найденный обоими способами, — первым
+    assert [m.session_id for m in found] == [1, 3, 2]
+
+
+async def run_case_lexical_fast_path_when_embedding_is_slow():
+    lexical = _FakeLexicalIndex({(1, 0): "ProjectX deploy notes"})
+    index = _FakeIndex([])
+    client = _client(index, lexical)
+
+    async def slow_embedding(text):
+        await asyncio.sleep(1)
+        return [1.0]
+
+    client.get_embedding = slow_embedding
+    found = await client.find_relevant_summaries(1, "projectx")
+    assert [m.text for m in found] == ["ProjectX deploy notes"]
+    assert index.queried is False
+
+
+async def run_case_save_summary_indexes_lexically_without_vectors():
+    lexical = _FakeLexicalIndex({})
+    client = _client(None, lexical)
+    await client.save_summary(5, 1, "first paragraph\n\nsecond paragraph", project_id=2)
+    assert lexical.indexed == [(5, ["first paragraph\n\nsecond paragraph"])]
+
+
+def test_hybrid_fuses_rankings():
+    asyncio.run(run_case_hybrid_fuses_rankings())
+
+
+def test_lexical_fast_path_when_embedding_is_slow():
+    asyncio.run(run_case_lexical_fast_path_when_embedding_is_slow())
+
+
+def test_save_summary_indexes_lexically_without_vectors():
+    asyncio.run(run_case_save_summary_indexes_lexically_without_vectors())
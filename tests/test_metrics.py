@@ -0,0 +1,44 @@
+# Файл: C:\desk_top\tests\test_metrics.py
+import asyncio
+import sys
+from pathlib import Path
+
+# Добавляем корень проекта в sys.path для импорта src.*
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from src.services import metrics
+
+
+async def run_case_stage_histogram_around_await():
+    before = metrics.STAGE_SECONDS.count(stage="test_stage", model="")
+    with metrics.observe_stage("test_stage"):
+        await asyncio.sleep(0.01)
+    assert metrics.STAGE_SECONDS.count(stage="test_stage", model="") == before + 1
+    text = metrics.REGISTRY.render()
+    assert '# TYPE desk_top_stage_seconds histogram' in text
+    assert 'desk_top_stage_seconds_bucket{stage="test_stage",model="",le="+Inf"}' in text
+    assert 'desk_top_stage_seconds_count{stage="test_stage",model=""}' in text
+
+
+def run_case_tokens_use_turn_labels():
+    token = metrics.set_turn_labels(user_id=5, project_id=7, mode_id=None)
+    try:
+        metrics.record_tokens("gpt-test", prompt_tokens=100, completion_tokens=20, cached_tokens=64)
+    finally:
+        metrics.reset_turn_labels(token)
+    labels = dict(user="5", project="7", mode="", model="gpt-test")
+    assert metrics.LLM_TOKENS.value(kind="prompt", **labels) == 100
+    assert metrics.LLM_TOKENS.value(kind="completion", **labels) == 20
+    assert metrics.LLM_TOKENS.value(kind="cached", **labels) == 64
+    # После сброса меток счётчики пишутся без user/project
+    assert metrics.turn_labels() == {"user": "", "project": "", "mode": ""}
+
+
+def test_metrics_stage_histogram_around_await():
+    asyncio.run(run_case_stage_histogram_around_await())
+
+
+def test_metrics_tokens_use_turn_labels():
+    run_case_tokens_use_turn_labels()
@@ -0,0 +1,74 @@
+# Файл: C:\desk_top\tests\test_model_router.py
+import sys
+from pathlib import Path
+
+# Добавляем корень проекта в sys.path для импорта src.*
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from src.services.model_router import ModelRouter, get_model_spec
+
+
+def _router() -> ModelRouter:
+    return ModelRouter(
+        default_model="gpt-4o",
+        fast_model="gpt-4o-mini",
+        fallback_models=["gpt-4o-mini"],
+        summary_model="gpt-3.5-turbo",
+        policy="balanced",
+        chitchat_max_tokens=10,
+    )
+
+
+def test_chitchat_goes_to_fast_model():
+    decision = _router().route("привет!", user_tokens=3, prompt_tokens=500)
+    assert decision.primary.name == "gpt-4o-mini"
+    assert decision.reason == "chitchat"
+    # Основная модель остаётся в цепочке как фолбэк
+    assert [s.name for s in decision.chain] == ["gpt-4o-mini", "gpt-4o"]
+
+
+def test_short_followup_in_long_session_goes_to_default_model():
+    # «ок, теперь добавь тесты» после 8k токенов обсуждения кода — не болтовня
+    decision = _router().route("ок, теперь добавь тесты", user_tokens=5, prompt_tokens=8_500, history_tokens=8_000)
+    assert decision.primary.name == "gpt-4o"
+    assert decision.reason == "default"
+    assert not _router().is_chitchat(3, "а второй?", has_context=False, history_tokens=1)
+
+
+def test_question_with_context_goes_to_default_model():
+    decision = _router().route("что мы решили по API?", user_tokens=8, prompt_tokens=5_000, has_context=True)
+    assert decision.primary.name == "gpt-4o"
+    assert [s.name for s in decision.chain] == ["gpt-4o", "gpt-4o-mini"]
+
+
+def test_tools_config_overrides_model_and_fallbacks():
+    cfg = {"model": "gpt-4-turbo", "fallback_models": ["gpt-3.5-turbo"]}
+    decision = _router().route("hi", user_tokens=1, prompt_tokens=1_000, tools_config=cfg)
+    assert decision.primary.name == "gpt-4-turbo"
+    assert decision.reason == "mode_override"
+    assert [s.name for s in decision.chain] == ["gpt-4-turbo", "gpt-3.5-turbo", "gpt-4o"]
+
+
+def test_policy_from_tools_config():
+    decision = _router().route("длинный вопрос " * 20, user_tokens=60, prompt_tokens=1_000, tools_config={"routing": "fast"})
+    assert decision.primary.name == "gpt-4o-mini"
+    assert decision.policy == "fast"
+
+
+def test_small_context_models_are_skipped_for_large_prompts():
+    decision = _router().route_summary(prompt_tokens=40_000)
+    # gpt-3.5-turbo (16k) не вмещает историю — берём следующую подходящую модель
+    assert decision.primary.name == "gpt-4o-mini"
+    assert "gpt-3.5-turbo" in decision.skipped
+
+
+def test_cost_uses_cached_input_price():
+    spec = get_model_spec("gpt-4o")
+    # 1M промпт-токенов, половина из кэша провайдера, + 100k completion
+    cost = spec.cost_usd(1_000_000, 100_000, cached_tokens=500_000)
+    assert abs(cost - (0.5 * 2.50 + 0.5 * 1.25 + 0.1 * 10.00)) < 1e-9
+    # Для моделей без скидки на кэш кэшированные токены стоят как обычные
+    turbo = get_model_spec("gpt-4-turbo")
+    assert turbo.cost_usd(1000, 0, cached_tokens=1000) == turbo.cost_usd(1000, 0)
@@ -0,0 +1,87 @@
+# Файл: C:\desk_top\tests\test_project_index.py
+import asyncio
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+
+# Добавляем корень проекта в sys.path для импорта src.*
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from src.db.models import Project
+from src.services.acl_engine import ACLEngine
+from src.services.name_normalization import normalize_name
+from src.services.project_index import ProjectMentionIndex, extract_mentions
+
+
+class CountingProjectRepo:
+    def __init__(self, projects):
+        self.projects = projects
+        self.calls = 0
+
+    async def list_projects(self, user_id: int):
+        self.calls += 1
+        return list(self.projects)
+
+
+class CountingAccessRepo:
+    def __init__(self, pairs):
+        self.pairs = set(pairs)
+        self.calls = 0
+
+    async def list_user_edges(self, user_id: int):
+        self.calls += 1
+        return [(o, a, "read") for o, a in self.pairs]
+
+
+def _p(pid, name):
+    return SimpleNamespace(id=pid, name=name)
+
+
+def test_extract_mentions_deduplicates():
+    assert extract_mentions("@[A] и @[ B ] и снова @[A], @[]") == ["A", "B"]
+
+
+async def run_case_resolves_batch_with_two_queries():
+    projects = CountingProjectRepo([_p(1, "Main"), _p(2, "Backend"), _p(3, "Design")])
+    acl = CountingAccessRepo({(1, 2)})
+    acl_graph = ACLEngine(ttl_seconds=60, max_depth=1)
+    index = ProjectMentionIndex(ttl_seconds=60, acl=acl_graph)
+
+    # «Bасkеnd» набран с кириллическими а/с/е — находится по нормализованному имени
+    res = await index.resolve_mentions(projects, acl, 7, 1, ["Bасkеnd", "Design", "Nope", "Main"])
+    assert res.project_ids == [2]
+    assert res.denied == ["Design"] and res.missing == ["Nope"]
+    await index.resolve_mentions(projects, acl, 7, 1, ["Backend"])
+    assert (projects.calls, acl.calls) == (1, 1)
+
+    # grant -> сброс ACL-графа пользователя
+    acl.pairs.add((1, 3))
+    acl_graph.invalidate_user(7)
+    res = await index.resolve_mentions(projects, acl, 7, 1, ["Design"])
+    assert res.project_ids == [3] and acl.calls == 2
+
+    # rename -> сброс индекса имён пользователя
+    projects.projects[2] = _p(3, "UX")
+    index.invalidate_user(7)
+    res = await index.resolve_mentions(projects, acl, 7, 1, ["UX", "Design"])
+    assert res.project_ids == [3] and res.missing == ["Design"] and projects.calls == 2
+
+
+def test_resolves_batch_with_two_queries():
+    asyncio.run(run_case_resolves_batch_with_two_queries())
+
+
+def test_normalize_name_folds_confusables_and_memoizes():
+    normalize_name.cache_clear()
+    assert normalize_name("  Проeкт Α ") == normalize_name("проект a") == "пroekt a"
+    normalize_name("проект a")
+    assert normalize_name.cache_info().hits >= 1
+
+
+def test_project_name_norm_follows_name():
+    p = Project(user_id=1, name="Backend")
+    assert p.name_norm == "backend"
+    p.name = "Вackend"  # кириллическая В
+    assert p.name_norm == "vackend"
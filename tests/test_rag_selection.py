@@ -0,0 +1,90 @@
+# Файл: C:\desk_top\tests\test_rag_selection.py
+import asyncio
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+
+# Добавляем корень проекта в sys.path для импорта src.*
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from src.services.rag_client import RAGClient
+from src.services.rag_selection import (
+    RAGMatch,
+    apply_score_gap,
+    mmr_rerank,
+    project_quota_for,
+    select_matches,
+)
+from src.services.retrieval_cache import RetrievalCache
+
+
+def _m(text, score, project_id=None, values=None):
+    return RAGMatch(text=text, score=score, project_id=project_id, values=values)
+
+
+def test_min_score_and_gap_cut_tail():
+    matches = [_m("a", 0.9), _m("b", 0.85), _m("c", 0.5), _m("d", 0.45), _m("e", 0.1)]
+    picked = select_matches(matches, min_score=0.2, max_gap=0.15, mmr_lambda=1.0)
+    # e — ниже порога; между b и c провал 0.35 > 0.15 — хвост отброшен
+    assert [m.text for m in picked] == ["a", "b"]
+    assert apply_score_gap(matches, 0) == matches
+
+
+def test_mmr_prefers_diverse_candidates():
+    dup = (1.0, 0.0)
+    matches = [_m("a", 0.90, values=dup), _m("a-copy", 0.89, values=dup), _m("other", 0.80, values=(0.0, 1.0))]
+    assert [m.text for m in mmr_rerank(matches, 0.5)] == ["a", "other", "a-copy"]
+    # lambda=1 — порядок по релевантности
+    assert [m.text for m in mmr_rerank(matches, 1.0)] == ["a", "a-copy", "other"]
+
+
+def test_project_quota_for_multi_project_queries():
+    assert project_quota_for(None, 10) == 0
+    assert project_quota_for([1], 10) == 0
+    assert project_quota_for([1, 2, 3], 10, configured=0) == 4
+    assert project_quota_for([1, 2], 10, configured=2) == 2
+
+    matches = [_m(f"p1-{i}", 0.9 - i * 0.01, project_id=1) for i in range(4)] + [_m("p2", 0.8, project_id=2)]
+    picked = select_matches(matches, min_score=0, max_gap=0, mmr_lambda=1.0, project_quota=2)
+    assert [m.text for m in picked] == ["p1-0", "p1-1", "p2"]
+
+
+class _FakeIndex:
+    def __init__(self, matches):
+        self.matches = matches
+        self.calls = []
+
+    def query(self, **kwargs):
+        self.calls.append(kwargs)
+        return {"matches": self.matches}
+
+
+async def run_case_find_returns_scored_matches():
+    client = RAGClient.__new__(RAGClient)
+    client.encoding = SimpleNamespace(encode=lambda text: text.split())
+    client.RAG_TOKEN_BUDGET = 1000
+    client.MAX_CANDIDATES = 20
+    client.MIN_TOP_K = 3
+    client.lexical_index = None
+    client.retrieval_cache = RetrievalCache(ttl_seconds=0)
+    client.index = _FakeIndex([
+        {"id": "session-2", "score": 0.75, "values": [0.0, 1.0], "metadata": {"summary": "low", "project_id": 2}},
+        {"id": "session-1", "score": 0.9, "values": [1.0, 0.0], "metadata": {"summary": "long " * 50, "project_id": 1}},
+        {"id": "session-3", "score": 0.85, "values": [0.7, 0.7], "metadata": {"summary": "short", "project_id": 1}},
+        {"id": "session-4", "score": 0.05, "metadata": {"summary": "noise"}},
+    ])
+    found = await client.find_relevant_summaries(1, "q", top_k=10, project_ids=[1, 2], query_embedding=[1.0, 0.0], token_budget=20)
+    assert client.index.calls[0]["include_values"] is True
+    # «long» не влезает в бюджет, но не мешает взять следующие; noise ниже порога;
+    # «low» из другого проекта MMR поднимает выше похожего на «long» «short»
+    assert [m.text for m in found] == ["low", "short"]
+    assert [m.score for m in found] == [0.75, 0.85]
+    assert found[1].vector_id == "session-3" and found[1].project_id == 1
+    # Совместимость со строковым RAG-контекстом
+    assert str(found[1]) == "short"
+
+
+def test_find_returns_scored_matches():
+    asyncio.run(run_case_find_returns_scored_matches())
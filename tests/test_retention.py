@@ -0,0 +1,158 @@
+# Файл: C:\desk_top\tests\test_retention.py
+import asyncio
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+
+# Добавляем корень проекта в sys.path для импорта src.*
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from src.services import retention as retention_module
+from src.services.history_archive import unpack_history
+from src.services.retention import RetentionWorker
+
+
+class FakeDB:
+    """Общее состояние «БД»: просроченные сессии и advisory lock."""
+
+    def __init__(self, expired: list[int]):
+        self.expired = list(expired)
+        self.archivable: dict[int, list] = {}
+        self.archives: dict = {}
+        self.lock_held = False
+        self.rollbacks = 0
+
+
+class _Result:
+    def __init__(self, value):
+        self.value = value
+
+    def scalar(self):
+        return self.value
+
+
+class FakeSession:
+    def __init__(self, db: FakeDB):
+        self.db = db
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def execute(self, stmt):
+        sql = str(stmt)
+        if "pg_try_advisory_lock" in sql:
+            acquired = not self.db.lock_held
+            self.db.lock_held = True
+            return _Result(acquired)
+        if "pg_advisory_unlock" in sql:
+            self.db.lock_held = False
+            return _Result(True)
+        raise AssertionError(sql)
+
+    async def commit(self):
+        pass
+
+    async def rollback(self):
+        self.db.rollbacks += 1
+
+
+class FakeSessionRepository:
+    def __init__(self, session: FakeSession):
+        self.db = session.db
+
+    async def lock_expired_batch(self, default_days: int, batch_size: int) -> list[tuple[int, int]]:
+        # Владелец сессии: 100 — чётные id, 101 — нечётные
+        return [(sid, 100 + sid % 2) for sid in self.db.expired[:batch_size]]
+
+    async def summary_chunk_counts(self, session_ids: list[int]) -> dict[int, int]:
+        return {sid: 2 for sid in session_ids}
+
+    async def delete_sessions(self, session_ids: list[int]) -> int:
+        self.db.expired = [sid for sid in self.db.expired if sid not in session_ids]
+        return len(session_ids)
+
+    async def lock_archivable_batch(self, after_hours: float, batch_size: int):
+        return [(SimpleNamespace(id=sid), history) for sid, history in list(self.db.archivable.items())[:batch_size]]
+
+    async def archive_sessions(self, entries) -> int:
+        for s, archived in entries:
+            self.db.archives[s.id] = archived
+            del self.db.archivable[s.id]
+        return len(entries)
+
+
+class FakeRAG:
+    def __init__(self, ok: bool = True):
+        self.ok = ok
+        self.deleted: list[list[int]] = []
+        self.owners: list[set[int]] = []
+
+    async def delete_session_vectors(self, session_ids, user_ids=(), chunk_counts=None):
+        if self.ok:
+            self.deleted.append(list(session_ids))
+            self.owners.append(set(user_ids))
+        return self.ok
+
+
+def _worker(db: FakeDB, rag: FakeRAG) -> RetentionWorker:
+    retention_module.SessionRepository = FakeSessionRepository
+    return RetentionWorker(
+        lambda: FakeSession(db), rag, default_days=30, batch_size=3, pause_seconds=0,
+        archive_after_hours=24, archive_codec="gzip",
+    )
+
+
+async def run_case_deletes_in_batches_with_vectors():
+    db, rag = FakeDB(range(1, 8)), FakeRAG()
+    report = await _worker(db, rag).run()
+    assert (report.sessions, report.batches, report.interrupted) == (7, 3, False)
+    assert rag.deleted == [[1, 2, 3], [4, 5, 6], [7]]
+    # Владельцы передаются для сброса их кэша выдачи
+    assert rag.owners == [{100, 101}, {100, 101}, {101}]
+    assert db.expired == [] and db.lock_held is False
+
+
+async def run_case_archives_closed_histories_after_deletes():
+    db = FakeDB([1])
+    history = [{"role": "user", "content": "привет " * 200}, {"role": "assistant", "content": "ok"}]
+    db.archivable = {10: history, 11: [], 12: history, 13: history}
+    report = await _worker(db, FakeRAG()).run()
+    assert (report.sessions, report.archived, report.batches) == (1, 4, 3)
+    assert report.archived_stored_bytes < report.archived_raw_bytes
+    archived = db.archives[12]
+    assert archived.codec == "gzip" and unpack_history(archived.codec, archived.payload) == history
+
+
+async def run_case_vector_failure_keeps_rows():
+    db = FakeDB([1, 2])
+    report = await _worker(db, FakeRAG(ok=False)).run()
+    assert report.interrupted and report.sessions == 0
+    assert db.expired == [1, 2] and db.rollbacks == 1
+
+
+async def run_case_skips_when_other_instance_holds_lock():
+    db = FakeDB([1])
+    db.lock_held = True
+    report = await _worker(db, FakeRAG()).run()
+    assert report.skipped and db.expired == [1]
+
+
+def test_deletes_in_batches_with_vectors():
+    asyncio.run(run_case_deletes_in_batches_with_vectors())
+
+
+def test_archives_closed_histories_after_deletes():
+    asyncio.run(run_case_archives_closed_histories_after_deletes())
+
+
+def test_vector_failure_keeps_rows():
+    asyncio.run(run_case_vector_failure_keeps_rows())
+
+
+def test_skips_when_other_instance_holds_lock():
+    asyncio.run(run_case_skips_when_other_instance_holds_lock())
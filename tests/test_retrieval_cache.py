@@ -0,0 +1,162 @@
+# Файл: C:\desk_top\tests\test_retrieval_cache.py
+import asyncio
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+
+# Добавляем корень проекта в sys.path для импорта src.*
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from src.services.rag_client import RAGClient
+from src.services.retrieval_cache import RetrievalCache, quantize_embedding
+
+
+def test_quantized_key_tolerates_tiny_differences():
+    a = [0.30, 0.50, 0.81]
+    assert quantize_embedding(a, 0.01) == quantize_embedding([x * 2 + 1e-5 for x in a], 0.01)
+    assert quantize_embedding(a, 0.01) != quantize_embedding([0.50, 0.30, 0.81], 0.01)
+
+
+def test_invalidation_matches_project_filters():
+    cache = RetrievalCache(ttl_seconds=60, max_entries=10)
+    emb = [1.0, 0.0]
+    keys = {
+        "all": cache.key(1, emb, 5),
+        "p1": cache.key(1, emb, 5, project_id=1),
+        "p2": cache.key(1, emb, 5, project_id=2),
+        "p12": cache.key(1, emb, 5, project_ids=[2, 1]),
+        "other_user": cache.key(2, emb, 5),
+    }
+    for k in keys.values():
+        cache.put(k, [])
+    assert cache.invalidate(1, project_id=1) == 3
+    assert cache.get(keys["p2"]) == [] and cache.get(keys["other_user"]) == []
+    assert cache.get(keys["p1"]) is None and cache.get(keys["all"]) is None and cache.get(keys["p12"]) is None
+
+
+def test_ttl_and_lru_eviction():
+    cache = RetrievalCache(ttl_seconds=60, max_entries=2)
+    k1, k2, k3 = (cache.key(1, [float(i), 1.0], 5) for i in range(3))
+    cache.put(k1, [])
+    cache.put(k2, [])
+    cache.get(k1)
+    cache.put(k3, [])
+    assert cache.get(k2) is None and cache.get(k1) == []
+    expired = RetrievalCache(ttl_seconds=0.000001, max_entries=2)
+    expired.put(k1, [])
+    assert expired.get(k1) is None
+
+
+class _CountingIndex:
+    def __init__(self):
+        self.queries = 0
+        self.vectors = []
+
+    def query(self, **kwargs):
+        self.queries += 1
+        return {"matches": [{"id": "session-1", "score": 0.9, "metadata": {"summary": "alpha beta gamma", "project_id": 3}}]}
+
+    def upsert(self, vectors):
+        self.vectors.extend(vectors)
+
+    def fetch(self, ids):
+        return {"vectors": {}}
+
+    def delete(self, ids=None, filter=None):
+        pass
+
+
+class _LexicalIndex:
+    def __init__(self):
+        self.queries: list[str] = []
+
+    async def search(self, user_id, query_text, project_id=None, project_ids=None, limit=10):
+        self.queries.append(query_text)
+        return []
+
+    async def fetch_chunks(self, keys):
+        return {}
+
+    async def index_session(self, user_id, session_id, project_id, chunks):
+        pass
+
+
+class _Embeddings:
+    async def create(self, model, input):
+        return SimpleNamespace(data=[SimpleNamespace(index=i, embedding=[1.0, 0.0]) for i, _ in enumerate(input)])
+
+
+def _client(encoded: list, lexical_index=None) -> RAGClient:
+    client = RAGClient.__new__(RAGClient)
+    client.encoding = SimpleNamespace(encode=lambda text: encoded.append(text) or text.split())
+    client.openai_client = SimpleNamespace(embeddings=_Embeddings())
+    client.index = _CountingIndex()
+    client.lexical_index = lexical_index
+    client.retrieval_cache = RetrievalCache(ttl_seconds=60, max_entries=10)
+    client.RAG_TOKEN_BUDGET = 1000
+    client.MAX_CANDIDATES = 20
+    client.MIN_TOP_K = 3
+    client.CHUNK_NEIGHBORS = 1
+    client.EMBEDDING_TIMEOUT = 1.0
+    return client
+
+
+async def run_case_cache_hit_skips_store_and_tokenizer():
+    encoded = []
+    client = _client(encoded)
+
+    first = await client.find_relevant_summaries(1, "q", project_id=3, query_embedding=[0.6, 0.8])
+    encoded.clear()
+    second = await client.find_relevant_summaries(1, "q again", project_id=3, query_embedding=[0.6, 0.8001])
+    assert [m.text for m in second] == [m.text for m in first] == ["alpha beta gamma"]
+    assert client.index.queries == 1
+    assert "alpha beta gamma" not in encoded
+    # Бюджет применяется к закэшированной выдаче
+    assert await client.find_relevant_summaries(1, "q", project_id=3, query_embedding=[0.6, 0.8], token_budget=2) == []
+
+    # Новые итоги проекта сбрасывают кэш
+    await client.save_summary(9, 1, "new summary", project_id=3)
+    await client.find_relevant_summaries(1, "q", project_id=3, query_embedding=[0.6, 0.8])
+    assert client.index.queries == 2
+
+
+async def run_case_deleted_summaries_drop_user_entries():
+    client = _client([])
+    await client.find_relevant_summaries(1, "q", query_embedding=[0.6, 0.8])
+    await client.find_relevant_summaries(2, "q", query_embedding=[0.6, 0.8])
+    # Очистка по сроку хранения удаляет итоги пользователя 1 — его выдача больше не берётся из кэша
+    assert await client.delete_session_vectors([5], user_ids={1})
+    await client.find_relevant_summaries(1, "q", query_embedding=[0.6, 0.8])
+    await client.find_relevant_summaries(2, "q", query_embedding=[0.6, 0.8])
+    assert client.index.queries == 3
+    # /delete_my_data сбрасывает все записи пользователя, какие бы проекты они ни покрывали
+    await client.find_relevant_summaries(2, "q", project_id=7, query_embedding=[0.6, 0.8])
+    assert client.retrieval_cache.invalidate_user(2) == 2
+    assert client.retrieval_cache.stats()["entries"] == 1
+
+
+async def run_case_hybrid_key_includes_query_words():
+    lexical = _LexicalIndex()
+    client = _client([], lexical_index=lexical)
+    await client.find_relevant_summaries(1, "deploy ProjectX", query_embedding=[0.6, 0.8])
+    # Тот же эмбеддинг, другие слова — лексическая половина другая, кэш не используется
+    await client.find_relevant_summaries(1, "rollback ProjectX", query_embedding=[0.6, 0.8])
+    assert client.index.queries == 2
+    # Регистр и пунктуация на лексический запрос не влияют
+    await client.find_relevant_summaries(1, "Deploy,  projectx!", query_embedding=[0.6, 0.8])
+    assert client.index.queries == 2
+    assert client.retrieval_cache.hits == 1
+
+
+def test_cache_hit_skips_store_and_tokenizer():
+    asyncio.run(run_case_cache_hit_skips_store_and_tokenizer())
+
+
+def test_deleted_summaries_drop_user_entries():
+    asyncio.run(run_case_deleted_summaries_drop_user_entries())
+
+
+def test_hybrid_key_includes_query_words():
+    asyncio.run(run_case_hybrid_key_includes_query_words())
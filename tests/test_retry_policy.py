@@ -0,0 +1,129 @@
+# Файл: C:\desk_top\tests\test_retry_policy.py
+import asyncio
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+
+# Добавляем корень проекта в sys.path для импорта src.*
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from openai import APIConnectionError, BadRequestError, InternalServerError, RateLimitError
+
+from src.services import retry_policy as rp
+
+
+# ---- Хелперы ----
+def _status_error(cls, status: int, headers: dict | None = None, body=None):
+    response = SimpleNamespace(status_code=status, headers=headers or {}, request=None)
+    return cls("error", response=response, body=body)
+
+
+class FlakyCall:
+    """Падает заданными ошибками по очереди, затем возвращает 'ok'."""
+
+    def __init__(self, errors):
+        self.errors = list(errors)
+        self.calls = 0
+
+    async def __call__(self):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return "ok"
+
+
+# ---- Тест-кейсы ----
+async def run_case_bad_request_fails_fast():
+    call = FlakyCall([_status_error(BadRequestError, 400)])
+    wrapped = rp.openai_retry("test_bad_request")(call)
+    try:
+        await wrapped()
+        assert False, "BadRequestError должен пробрасываться"
+    except BadRequestError:
+        pass
+    assert call.calls == 1, f"400 не должен повторяться, вызовов: {call.calls}"
+    assert rp.RETRY_COUNTERS[("test_bad_request", "non_retryable")] == 1
+
+
+async def run_case_retry_after_is_honored():
+    call = FlakyCall([_status_error(RateLimitError, 429, headers={"retry-after-ms": "10"})])
+    wrapped = rp.openai_retry("test_retry_after")(call)
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    assert await wrapped() == "ok"
+    elapsed = loop.time() - started
+    assert call.calls == 2
+    # Подсказка сервера (10 мс) важнее экспоненциальной паузы (2 с)
+    assert elapsed < 1.0, f"Ожидали короткую паузу по Retry-After, прошло {elapsed:.2f}s"
+    assert rp.RETRY_COUNTERS[("test_retry_after", "retry")] == 1
+
+
+async def run_case_insufficient_quota_not_retried():
+    err = _status_error(RateLimitError, 429, body={"error": {"code": "insufficient_quota"}})
+    call = FlakyCall([err])
+    wrapped = rp.openai_retry("test_quota")(call)
+    try:
+        await wrapped()
+        assert False, "insufficient_quota должен пробрасываться"
+    except RateLimitError:
+        pass
+    assert call.calls == 1
+
+
+async def run_case_deadline_stops_retries():
+    call = FlakyCall([_status_error(InternalServerError, 500)] * 3)
+    wrapped = rp.openai_retry("test_deadline")(call)
+    # Экспоненциальная пауза (>=2 с) не помещается в дедлайн хода (0.5 с)
+    with rp.turn_deadline(0.5):
+        try:
+            await wrapped()
+            assert False, "Ожидали ошибку после дедлайна"
+        except InternalServerError:
+            pass
+    assert call.calls == 1
+    assert rp.RETRY_COUNTERS[("test_deadline", "deadline")] == 1
+    assert rp.remaining_time() is None, "Дедлайн должен сбрасываться после выхода из контекста"
+
+
+def run_case_classification():
+    assert rp.is_retryable(APIConnectionError(request=None))
+    assert rp.is_retryable(_status_error(InternalServerError, 503))
+    assert not rp.is_retryable(_status_error(BadRequestError, 400))
+    assert not rp.is_retryable(ValueError("boom"))
+    assert rp.retry_after_seconds(_status_error(RateLimitError, 429, headers={"retry-after": "3"})) == 3.0
+
+
+async def main():
+    run_case_classification()
+    await run_case_bad_request_fails_fast()
+    await run_case_retry_after_is_honored()
+    await run_case_insufficient_quota_not_retried()
+    await run_case_deadline_stops_retries()
+    print("OK: retry_policy tests passed")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
+
+
+# ---- PyTest wrappers ----
+def test_retry_policy_classification():
+    run_case_classification()
+
+
+def test_retry_policy_bad_request_fails_fast():
+    asyncio.run(run_case_bad_request_fails_fast())
+
+
+def test_retry_policy_retry_after_is_honored():
+    asyncio.run(run_case_retry_after_is_honored())
+
+
+def test_retry_policy_insufficient_quota_not_retried():
+    asyncio.run(run_case_insufficient_quota_not_retried())
+
+
+def test_retry_policy_deadline_stops_retries():
+    asyncio.run(run_case_deadline_stops_retries())
@@ -0,0 +1,63 @@
+# Файл: C:\desk_top\tests\test_semantic_cache.py
+import sys
+from pathlib import Path
+
+# Добавляем корень проекта в sys.path для импорта src.*
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from src.services.semantic_cache import SemanticResponseCache
+
+KEY = (1, 10, None)
+
+
+def _cache(**kwargs) -> SemanticResponseCache:
+    params = dict(enabled=True, threshold=0.95, ttl_seconds=60, max_entries_per_key=2, max_keys=2)
+    params.update(kwargs)
+    return SemanticResponseCache(**params)
+
+
+def test_near_duplicate_question_hits():
+    cache = _cache()
+    fp = cache.fingerprint("SYSTEM", ["summary"])
+    cache.store(KEY, [1.0, 0.0, 0.0], fp, "answer")
+    assert cache.lookup(KEY, [0.99, 0.05, 0.0], fp) == "answer"
+    assert cache.stats()["hits"] == 1
+
+
+def test_different_question_or_context_misses():
+    cache = _cache()
+    fp = cache.fingerprint("SYSTEM", ["summary"])
+    cache.store(KEY, [1.0, 0.0, 0.0], fp, "answer")
+    # Вопрос о другом
+    assert cache.lookup(KEY, [0.0, 1.0, 0.0], fp) is None
+    # Тот же вопрос, но RAG-контекст изменился
+    assert cache.lookup(KEY, [1.0, 0.0, 0.0], cache.fingerprint("SYSTEM", ["new summary"])) is None
+    # Другой проект
+    assert cache.lookup((1, 11, None), [1.0, 0.0, 0.0], fp) is None
+    assert cache.stats()["misses"] == 3
+
+
+def test_ttl_and_size_eviction():
+    cache = _cache(ttl_seconds=0)
+    fp = cache.fingerprint("SYSTEM", [])
+    cache.store(KEY, [1.0, 0.0], fp, "stale")
+    assert cache.lookup(KEY, [1.0, 0.0], fp) is None
+
+    cache = _cache()
+    for i in range(3):
+        cache.store(KEY, [1.0, float(i)], fp, f"a{i}")
+    assert cache.stats()["entries"] == 2
+    for user in (2, 3):
+        cache.store((user, None, None), [1.0], fp, "x")
+    # LRU по ключам: самый старый ключ вытеснен
+    assert cache.stats()["keys"] == 2
+    assert cache.lookup(KEY, [1.0, 2.0], fp) is None
+
+
+def test_opt_in_per_mode():
+    cache = _cache(enabled=False)
+    assert not cache.enabled_for({})
+    assert cache.enabled_for({"semantic_cache": True})
+    assert not _cache().enabled_for({"semantic_cache": False})
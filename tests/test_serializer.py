@@ -0,0 +1,51 @@
+# Файл: C:\desk_top\tests\test_serializer.py
+import sys
+from pathlib import Path
+
+import pytest
+
+# Добавляем корень проекта в sys.path для импорта src.*
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from src.services import serializer
+from src.services.history_codec import decode_history, encode_history
+
+BACKENDS = [None] + ([serializer._orjson] if serializer._orjson else [])
+DATA = {"history": [{"role": "user", "content": "Привет, \"мир\" 🙂\n```x```"}], "n": 3, "ok": True, "none": None}
+
+
+@pytest.fixture(params=BACKENDS, ids=lambda b: "orjson" if b else "json")
+def backend(request, monkeypatch):
+    monkeypatch.setattr(serializer, "_orjson", request.param)
+    return request.param
+
+
+def test_roundtrip_keeps_unicode_unescaped(backend):
+    text = serializer.dumps(DATA)
+    assert "Привет" in text and "\\u" not in text
+    assert serializer.loads(text) == DATA
+    raw = serializer.dumps_bytes(DATA)
+    assert serializer.loads(raw) == DATA and serializer.loads(memoryview(raw)) == DATA
+
+
+def test_indent_is_two_spaces(backend):
+    assert serializer.dumps({"a": [1]}, indent=True) == '{\n  "a": [\n    1\n  ]\n}'
+
+
+def test_invalid_json_raises_value_error(backend):
+    with pytest.raises(ValueError):
+        serializer.loads("{bad")
+
+
+def test_history_codec_json_frames_with_both_backends(backend):
+    history = [{"role": "tool", "content": "ok", "tool_call_id": "c1"}, {"role": "user", "content": "x"}]
+    assert decode_history(encode_history(history, "compact", "none")) == history
+    assert decode_history(encode_history(history, "json")) == history
+
+
+def test_unknown_backend_is_rejected():
+    with pytest.raises(ValueError):
+        serializer._load_backend("simdjson")
+    assert serializer._load_backend("json") is None
@@ -0,0 +1,78 @@
+# Файл: C:\desk_top\tests\test_session_export.py
+import asyncio
+import datetime
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+
+from sqlalchemy import event, inspect
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import make_transient_to_detached
+
+# Добавляем корень проекта в sys.path для импорта src.*
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from src.db.models import Session, SessionArchive
+from src.db.repository import SessionRepository
+from src.services.history_archive import pack_history
+from src.services.history_codec import encode_history
+
+
+class _Result:
+    def __init__(self, rows):
+        self._rows = rows
+
+    def scalars(self):
+        return SimpleNamespace(all=lambda: self._rows)
+
+
+class ScriptedSession(AsyncSession):
+    """Настоящая AsyncSession (identity map, unit of work) без БД: execute отдаёт заготовленные строки."""
+
+    def __init__(self, results):
+        super().__init__()
+        self._results = list(results)
+
+    async def execute(self, statement, *args, **kwargs):
+        # Как настоящий запрос: сначала autoflush накопленных изменений
+        await self.flush()
+        return _Result(self._results.pop(0))
+
+
+def _persistent(session: AsyncSession, obj):
+    """Строка «как из БД»: все колонки загружены, объект в identity map без изменений."""
+    for attr in inspect(obj).mapper.column_attrs:
+        if attr.key not in obj.__dict__:
+            setattr(obj, attr.key, None)
+    make_transient_to_detached(obj)
+    session.add(obj)
+    return obj
+
+
+async def run_case_list_sessions_does_not_dirty_archived_rows():
+    history = [{"role": "user", "content": "вопрос"}, {"role": "assistant", "content": "ответ"}]
+    db = ScriptedSession([])
+    live = _persistent(db, Session(id=1, user_id=7, status="active", message_history=encode_history(history)))
+    archived = _persistent(db, Session(id=2, user_id=7, status="closed", message_history=None,
+                                       archived_at=datetime.datetime(2026, 1, 1)))
+    packed = pack_history(history, "gzip")
+    db._results = [[live, archived], [SimpleNamespace(session_id=2, codec=packed.codec, payload=packed.payload)]]
+
+    flushed = []
+    event.listen(db.sync_session, "before_flush", lambda s, ctx, inst: flushed.extend(s.dirty))
+
+    sessions = await SessionRepository(db).list_sessions(7)
+    assert [s.message_history for s in sessions] == [history, history]
+
+    # Следующий запрос (в /export_data — get_prompt) не должен выпускать UPDATE sessions:
+    # сессия не привязана к БД, так что попытка UPDATE упала бы с UnboundExecutionError
+    db._results = [[]]
+    await db.execute(SessionArchive.__table__.select())
+    assert flushed == []
+    assert not db.is_modified(archived) and not db.is_modified(live)
+
+
+def test_list_sessions_does_not_dirty_archived_rows():
+    asyncio.run(run_case_list_sessions_does_not_dirty_archived_rows())
@@ -0,0 +1,191 @@
+# Файл: C:\desk_top\tests\test_token_quota.py
+import asyncio
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+
+# Добавляем корень проекта в sys.path для импорта src.*
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from sqlalchemy.dialects import postgresql
+
+import src.handlers.session as session_handler
+from src.db.repository import UserRepository
+from src.services.llm_client import LLMClient, LLMResult, track_usage
+
+
+class FakeQuotaRepo:
+    """Квота в памяти с той же семантикой, что UPDATE ... RETURNING в UserRepository."""
+
+    def __init__(self, limit: int, used: int = 0):
+        self.limit = limit
+        self.used = used
+        self.calls: list = []
+
+    async def reserve_tokens(self, telegram_id: int, tokens: int) -> int | None:
+        self.calls.append(("reserve", tokens))
+        if self.used + tokens > self.limit:
+            return None
+        self.used += tokens
+        return self.used
+
+    async def settle_tokens(self, telegram_id: int, reserved: int, actual: int) -> int | None:
+        self.calls.append(("settle", reserved, actual))
+        self.used = max(self.used + actual - reserved, 0)
+        return self.used
+
+
+class FakeUsageRepo:
+    def __init__(self):
+        self.rows: list = []
+
+    async def record(self, user_id, records, project_id=None, session_id=None, mode_id=None, day=None):
+        self.rows.extend((user_id, project_id, session_id, r) for r in records)
+
+
+class FakeLLM:
+    """LLM, который сообщает usage тем же путём, что LLMClient (через _record_usage)."""
+
+    def __init__(self, usage=(700, 50), fail: bool = False):
+        self.usage = usage
+        self.fail = fail
+        self.calls = 0
+        self._recorder = LLMClient.__new__(LLMClient)
+        self._recorder.prompt_cache_stats = {"prompt_tokens": 0, "cached_tokens": 0}
+
+    def estimate_tokens(self, system_prompt, history, user_message, rag_context=None, tools_config=None) -> int:
+        return 1000
+
+    async def get_response(self, system_prompt, history, user_message, rag_context=None, temperature=None, tools_config=None):
+        self.calls += 1
+        prompt, completion = self.usage
+        usage = SimpleNamespace(prompt_tokens=prompt, completion_tokens=completion, total_tokens=prompt + completion, prompt_tokens_details=None)
+        self._recorder._record_usage("get_response", "gpt-test", usage)
+        if self.fail:
+            raise RuntimeError("boom")
+        return LLMResult(text="ok", model="gpt-test", usage=None)
+
+
+async def run_case_reserve_then_settle_actual_usage():
+    repo = FakeQuotaRepo(limit=5000)
+    usage_repo = FakeUsageRepo()
+    llm = FakeLLM(usage=(700, 50))
+    result = await session_handler._get_response_within_quota(
+        repo, usage_repo, llm, 1, "SYS", [], "hi", None, project_id=3, session_id=9
+    )
+    assert result.text == "ok"
+    assert repo.calls == [("reserve", 1000), ("settle", 1000, 750)]
+    assert repo.used == 750
+    # Каждый вызов модели попадает в журнал расходов с проектом и сессией
+    [(user_id, project_id, session_id, record)] = usage_repo.rows
+    assert (user_id, project_id, session_id) == (1, 3, 9)
+    assert (record.model, record.prompt_tokens, record.completion_tokens) == ("gpt-test", 700, 50)
+
+
+async def run_case_reservation_refused():
+    repo = FakeQuotaRepo(limit=5000, used=4500)
+    llm = FakeLLM()
+    usage_repo = FakeUsageRepo()
+    result = await session_handler._get_response_within_quota(repo, usage_repo, llm, 1, "SYS", [], "hi", None)
+    assert result is None
+    assert usage_repo.rows == []
+    assert llm.calls == 0
+    assert repo.used == 4500
+
+
+async def run_case_failed_call_is_settled():
+    repo = FakeQuotaRepo(limit=5000)
+    llm = FakeLLM(usage=(300, 0), fail=True)
+    try:
+        await session_handler._get_response_within_quota(repo, FakeUsageRepo(), llm, 1, "SYS", [], "hi", None)
+    except RuntimeError:
+        pass
+    else:
+        raise AssertionError("error must propagate")
+    # Списано только фактически потраченное до ошибки
+    assert repo.used == 300
+
+
+class FailingQuotaRepo(FakeQuotaRepo):
+    """Сбой БД при расчёте квоты после вызова LLM."""
+
+    async def settle_tokens(self, telegram_id: int, reserved: int, actual: int) -> int | None:
+        raise ConnectionError("db is gone")
+
+
+async def run_case_settle_failure_keeps_llm_outcome():
+    usage_repo = FakeUsageRepo()
+    llm = FakeLLM(usage=(300, 0), fail=True)
+    try:
+        await session_handler._get_response_within_quota(FailingQuotaRepo(5000), usage_repo, llm, 1, "SYS", [], "hi", None)
+    except RuntimeError as e:
+        # Пользователь видит ошибку LLM, а не ошибку учёта
+        assert str(e) == "boom"
+    else:
+        raise AssertionError("LLM error must propagate")
+    assert len(usage_repo.rows) == 1
+    # Успешный ответ не теряется из-за сбоя учёта
+    result = await session_handler._get_response_within_quota(
+        FailingQuotaRepo(5000), FakeUsageRepo(), FakeLLM(), 1, "SYS", [], "hi", None
+    )
+    assert result.text == "ok"
+
+
+def run_case_track_usage_is_scoped():
+    llm = FakeLLM(usage=(10, 5))
+    with track_usage() as totals:
+        asyncio.run(llm.get_response("s", [], "u"))
+        asyncio.run(llm.get_response("s", [], "u"))
+    asyncio.run(llm.get_response("s", [], "u"))
+    assert (totals.prompt_tokens, totals.completion_tokens, totals.calls) == (20, 10, 2)
+    assert totals.total_tokens == 30
+
+
+def run_case_reserve_is_single_conditional_update():
+    captured = {}
+
+    class _Result:
+        def first(self):
+            return (42,)
+
+    class _Session:
+        async def execute(self, stmt):
+            captured["sql"] = str(stmt.compile(dialect=postgresql.dialect()))
+            return _Result()
+
+        async def commit(self):
+            captured["committed"] = True
+
+    used = asyncio.run(UserRepository(_Session()).reserve_tokens(1, 100))
+    sql = captured["sql"]
+    assert used == 42 and captured["committed"]
+    assert sql.startswith("UPDATE users SET tokens_used_today=")
+    assert "CASE WHEN" in sql and "RETURNING users.tokens_used_today" in sql
+    # Условие лимита — в WHERE того же выражения (без предварительного SELECT)
+    assert "<=" in sql.split("WHERE", 1)[1]
+
+
+def test_quota_reserve_then_settle_actual_usage():
+    asyncio.run(run_case_reserve_then_settle_actual_usage())
+
+
+def test_quota_reservation_refused():
+    asyncio.run(run_case_reservation_refused())
+
+
+def test_quota_failed_call_is_settled():
+    asyncio.run(run_case_failed_call_is_settled())
+
+
+def test_quota_settle_failure_keeps_llm_outcome():
+    asyncio.run(run_case_settle_failure_keeps_llm_outcome())
+
+
+def test_track_usage_is_scoped():
+    run_case_track_usage_is_scoped()
+
+
+def test_reserve_is_single_conditional_update():
+    run_case_reserve_is_single_conditional_update()
@@ -0,0 +1,133 @@
+# Файл: C:\desk_top\tests\test_turn_serializer.py
+import asyncio
+import sys
+from pathlib import Path
+
+# Добавляем корень проекта в sys.path для импорта src.*
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+import aiohttp
+from aiogram import Bot, Dispatcher, F, Router
+from aiogram.types import Message, Update
+
+from src.services.turn_serializer import UserTurnSerializer
+from src.webhook import WebhookServer
+from telegram_fakes import FakeTelegramSender, free_port
+
+
+def _setup(serializer: UserTurnSerializer, calls: list, delay: float = 0.02):
+    router = Router()
+    active: dict[int, int] = {}
+
+    @router.message(flags={"coalesce": True})
+    async def _turn(message: Message, coalesced_text: str | None = None):
+        uid = message.from_user.id
+        active[uid] = active.get(uid, 0) + 1
+        # Один ход пользователя одновременно
+        assert active[uid] == 1
+        calls.append((uid, coalesced_text or message.text))
+        await asyncio.sleep(delay)
+        active[uid] -= 1
+
+    router.message.middleware(serializer)
+    dp = Dispatcher()
+    dp.include_router(router)
+    return dp
+
+
+def _update(sender: FakeTelegramSender, bot: Bot, user_id: int, text: str) -> Update:
+    return Update.model_validate(sender.build_text_update(user_id, text), context={"bot": bot})
+
+
+async def run_case_turns_of_one_user_are_serialized():
+    calls: list = []
+    serializer = UserTurnSerializer(coalesce_window=0, max_pending=10)
+    dp = _setup(serializer, calls)
+    bot = Bot(token="42:TEST")
+    sender = FakeTelegramSender("unused")
+    try:
+        updates = [_update(sender, bot, uid, f"{uid}-{i}") for i in range(3) for uid in (1, 2)]
+        feeding = [asyncio.create_task(dp.feed_update(bot, u)) for u in updates]
+        await asyncio.sleep(0.01)
+        # Пока идёт первый ход, остальные сообщения ждут в очереди пользователя
+        assert serializer.queue_depth(1) == 3
+        assert serializer.stats()["waiting"] == 4
+        await asyncio.gather(*feeding)
+    finally:
+        await bot.session.close()
+    assert [t for u, t in calls if u == 1] == ["1-0", "1-1", "1-2"]
+    assert [t for u, t in calls if u == 2] == ["2-0", "2-1", "2-2"]
+    stats = serializer.stats()
+    assert stats["users"] == 0 and stats["waiting"] == 0 and stats["turns"] == 6
+
+
+async def run_case_burst_is_coalesced():
+    calls: list = []
+    serializer = UserTurnSerializer(coalesce_window=0.05, max_pending=10)
+    dp = _setup(serializer, calls)
+    bot = Bot(token="42:TEST")
+    sender = FakeTelegramSender("unused")
+    try:
+        feeding = []
+        for text in ("привет", "вопрос про проект", "и ещё деталь"):
+            feeding.append(asyncio.create_task(dp.feed_update(bot, _update(sender, bot, 5, text))))
+            await asyncio.sleep(0.01)
+        await asyncio.gather(*feeding)
+        # Сообщение после паузы — отдельный ход
+        await dp.feed_update(bot, _update(sender, bot, 5, "спасибо"))
+    finally:
+        await bot.session.close()
+    assert calls == [(5, "привет\n\nвопрос про проект\n\nи ещё деталь"), (5, "спасибо")]
+    assert serializer.stats()["coalesced"] == 2
+
+
+async def run_case_burst_is_coalesced_behind_webhook_server():
+    calls: list = []
+    router = Router()
+
+    @router.message(F.text.startswith("/"))
+    async def _command(message: Message):
+        calls.append((message.from_user.id, message.text))
+
+    @router.message(flags={"coalesce": True})
+    async def _turn(message: Message, coalesced_text: str | None = None):
+        calls.append((message.from_user.id, coalesced_text or message.text))
+
+    serializer = UserTurnSerializer(coalesce_window=0.1, max_pending=10)
+    router.message.middleware(serializer)
+    dp = Dispatcher()
+    dp.include_router(router)
+    bot = Bot(token="42:TEST")
+    port = free_port()
+    server = WebhookServer(dp, bot, path="/wh", queue_size=100, max_in_flight=4)
+    await server.start("127.0.0.1", port)
+    sender = FakeTelegramSender(f"http://127.0.0.1:{port}/wh")
+    try:
+        async with aiohttp.ClientSession() as http:
+            for text in ("привет", "вопрос про проект", "и ещё деталь", "/help", "после команды"):
+                assert await sender.send_text(http, 5, text) == 200
+            assert await sender.send_text(http, 6, "другой пользователь") == 200
+        await server.shutdown(drain_timeout=5)
+    finally:
+        await bot.session.close()
+    # Серия до команды — один ход; команда не склеивается и идёт своим ходом
+    assert [t for u, t in calls if u == 5] == [
+        "привет\n\nвопрос про проект\n\nи ещё деталь", "/help", "после команды",
+    ]
+    assert [t for u, t in calls if u == 6] == ["другой пользователь"]
+    assert serializer.stats()["coalesced"] == 2
+    assert server.stats["coalesced"] == 2
+
+
+def test_turns_of_one_user_are_serialized():
+    asyncio.run(run_case_turns_of_one_user_are_serialized())
+
+
+def test_burst_is_coalesced():
+    asyncio.run(run_case_burst_is_coalesced())
+
+
+def test_burst_is_coalesced_behind_webhook_server():
+    asyncio.run(run_case_burst_is_coalesced_behind_webhook_server())
@@ -10,6 +10,7 @@ if str(ROOT) not in sys.path:
     sys.path.insert(0, str(ROOT))
 
 from src.handlers import projects as hp
+from src.services.name_normalization import normalize_name, suggest_names
 
 
 # ---- Моки сущностей ----
@@ -62,6 +63,15 @@ class FakeProjectRepo:
                 return p
         return None
 
+    async def get_project_by_norm_name(self, user_id: int, name: str):
+        for p in self._by_user.get(user_id, []):
+            if normalize_name(p.name) == normalize_name(name):
+                return p
+        return None
+
+    async def suggest_project_names(self, user_id: int, name: str, limit: int = 5):
+        return suggest_names(name, [(p.name, normalize_name(p.name)) for p in self._by_user.get(user_id, [])], limit)
+
     async def list_projects(self, user_id: int):
         return list(self._by_user.get(user_id, []))
 
@@ -159,8 +169,9 @@ async def run_case_suggestions_when_not_found():
     assert msg._answers, "Ожидался ответ"
     last = msg._answers[-1]
     assert "Проект не найден" in last
-    # Должны быть подсказки по подстроке после нормализации ("data" найдёт "My Data")
-    assert "Возможные совпадения" in last
+    # Опечатка: "dataa" похожа на "My Data" по триграммам, "Daily Notes" — нет
+    assert "Возможные совпадения: My Data" in last
+    assert "Daily Notes" not in last
 
 
 async def main():
@@ -190,3 +201,11 @@ def test_use_project_select_by_normalized_name():
 
 def test_use_project_suggestions_when_not_found():
     asyncio.run(run_case_suggestions_when_not_found())
+
+
+def test_suggest_names_tolerates_typos_and_ranks_substring_first():
+    candidates = [("Daily Notes", None), ("My Data", None), ("Data Lake", None)]
+    assert suggest_names("data", candidates) == ["My Data", "Data Lake"]
+    assert suggest_names("dataa", candidates)[:2] == ["My Data", "Data Lake"]
+    assert suggest_names("zzz", candidates) == []
+    assert suggest_names("  ", candidates) == []
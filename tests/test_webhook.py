@@ -0,0 +1,245 @@
+# Файл: C:\desk_top\tests\test_webhook.py
+import asyncio
+import random
+import sys
+from pathlib import Path
+
+# Добавляем корень проекта в sys.path для импорта src.*
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+import aiohttp
+from aiogram import Bot, Dispatcher, Router
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.storage.base import StorageKey
+from aiogram.types import Message
+
+from src.services.fsm_storage import LocalSharedStorage
+from src.webhook import WebhookServer, WebhookGateway, partition_for, payload_user_id
+from telegram_fakes import FakeTelegramSender, free_port
+
+SECRET = "test-secret"
+
+
+def _make_dispatcher(received: list, gate: asyncio.Event | None = None) -> Dispatcher:
+    router = Router()
+
+    @router.message()
+    async def _record(message: Message):
+        if gate is not None:
+            await gate.wait()
+        received.append((message.from_user.id, message.text))
+
+    dp = Dispatcher()
+    dp.include_router(router)
+    return dp
+
+
+async def run_case_updates_are_processed():
+    received: list = []
+    bot = Bot(token="42:TEST")
+    server = WebhookServer(_make_dispatcher(received), bot, path="/wh", secret=SECRET, queue_size=10, max_in_flight=2)
+    port = free_port()
+    await server.start("127.0.0.1", port)
+    sender = FakeTelegramSender(f"http://127.0.0.1:{port}/wh", secret=SECRET)
+    try:
+        async with aiohttp.ClientSession() as http:
+            statuses = [await sender.send_text(http, 1, f"msg {i}") for i in range(3)]
+            bad = FakeTelegramSender(sender.url, secret="wrong")
+            bad_status = await bad.send_text(http, 1, "intruder")
+    finally:
+        await server.shutdown(drain_timeout=5)
+        await bot.session.close()
+    assert statuses == [200, 200, 200]
+    assert bad_status == 401
+    assert sorted(t for _, t in received) == ["msg 0", "msg 1", "msg 2"]
+    assert server.stats["processed"] == 3
+    assert server.stats["rejected_auth"] == 1
+
+
+async def run_case_full_queue_and_drain():
+    received: list = []
+    gate = asyncio.Event()
+    bot = Bot(token="42:TEST")
+    server = WebhookServer(_make_dispatcher(received, gate), bot, path="/wh", secret=SECRET, queue_size=2, max_in_flight=1)
+    port = free_port()
+    await server.start("127.0.0.1", port)
+    sender = FakeTelegramSender(f"http://127.0.0.1:{port}/wh", secret=SECRET)
+    try:
+        async with aiohttp.ClientSession() as http:
+            # Первый апдейт забирает воркер и блокируется на gate
+            assert await sender.send_text(http, 1, "first") == 200
+            for _ in range(50):
+                if server.queue_depth == 0:
+                    break
+                await asyncio.sleep(0.01)
+            # Ещё два помещаются в очередь, третий — 503
+            statuses = [await sender.send_text(http, 1, f"queued {i}") for i in range(3)]
+        assert statuses == [200, 200, 503]
+        assert server.stats["rejected_full"] == 1
+        # При остановке принятые апдейты дообрабатываются
+        gate.set()
+        await server.shutdown(drain_timeout=5)
+    finally:
+        await bot.session.close()
+    assert [t for _, t in received] == ["first", "queued 0", "queued 1"]
+
+
+async def run_case_per_user_order():
+    received: list = []
+    router = Router()
+
+    @router.message()
+    async def _slow(message: Message):
+        # Случайные задержки: без очереди пользователя порядок его сообщений ломался бы
+        await asyncio.sleep(random.uniform(0, 0.02))
+        received.append((message.from_user.id, message.text))
+
+    dp = Dispatcher()
+    dp.include_router(router)
+    bot = Bot(token="42:TEST")
+    server = WebhookServer(dp, bot, path="/wh", secret=SECRET, queue_size=100, max_in_flight=4)
+    port = free_port()
+    await server.start("127.0.0.1", port)
+    sender = FakeTelegramSender(f"http://127.0.0.1:{port}/wh", secret=SECRET)
+    try:
+        async with aiohttp.ClientSession() as http:
+            for i in range(5):
+                for user_id in (10, 11, 12, 13, 14, 15):
+                    assert await sender.send_text(http, user_id, str(i)) == 200
+        await server.shutdown(drain_timeout=5)
+    finally:
+        await bot.session.close()
+    for user_id in (10, 11, 12, 13, 14, 15):
+        assert [t for u, t in received if u == user_id] == ["0", "1", "2", "3", "4"]
+
+
+async def run_case_slow_turn_does_not_block_other_users():
+    received: list = []
+    running: list = []
+    peak = 0
+    gate = asyncio.Event()
+    router = Router()
+
+    @router.message()
+    async def _turn(message: Message):
+        nonlocal peak
+        running.append(message.from_user.id)
+        peak = max(peak, len(running))
+        # Ходы пользователя 1 «висят», как долгий ответ LLM
+        if message.from_user.id == 1:
+            await gate.wait()
+        await asyncio.sleep(0.01)
+        running.remove(message.from_user.id)
+        received.append((message.from_user.id, message.text))
+
+    dp = Dispatcher()
+    dp.include_router(router)
+    bot = Bot(token="42:TEST")
+    server = WebhookServer(dp, bot, path="/wh", secret=SECRET, queue_size=100, max_in_flight=3)
+    port = free_port()
+    await server.start("127.0.0.1", port)
+    sender = FakeTelegramSender(f"http://127.0.0.1:{port}/wh", secret=SECRET)
+    try:
+        async with aiohttp.ClientSession() as http:
+            for i in range(2):
+                assert await sender.send_text(http, 1, f"slow {i}") == 200
+            # При партициях user_id % 8 эти пользователи ждали бы за пользователем 1
+            for user_id in (9, 17, 25, 33):
+                for i in range(2):
+                    assert await sender.send_text(http, user_id, str(i)) == 200
+            for _ in range(200):
+                if len(received) == 8:
+                    break
+                await asyncio.sleep(0.01)
+        # Все остальные обслужены, пока первый ход пользователя 1 ещё идёт
+        assert sorted(received) == sorted((u, str(i)) for u in (9, 17, 25, 33) for i in range(2))
+        assert running == [1]
+        # Одновременно — не больше max_in_flight ходов
+        assert peak <= 3
+        gate.set()
+        await server.shutdown(drain_timeout=5)
+    finally:
+        await bot.session.close()
+    assert [t for u, t in received if u == 1] == ["slow 0", "slow 1"]
+
+
+async def run_case_gateway_pins_user_to_worker():
+    seen: dict[str, list] = {"a": [], "b": []}
+    bot = Bot(token="42:TEST")
+    servers = []
+    urls = []
+    for name in ("a", "b"):
+        router = Router()
+
+        @router.message()
+        async def _record(message: Message, _name=name):
+            seen[_name].append(message.from_user.id)
+
+        dp = Dispatcher()
+        dp.include_router(router)
+        server = WebhookServer(dp, bot, path="/wh", secret=SECRET, max_in_flight=2)
+        port = free_port()
+        await server.start("127.0.0.1", port)
+        servers.append(server)
+        urls.append(f"http://127.0.0.1:{port}/wh")
+
+    gateway = WebhookGateway(urls, path="/tg", secret=SECRET)
+    gw_port = free_port()
+    await gateway.start("127.0.0.1", gw_port)
+    sender = FakeTelegramSender(f"http://127.0.0.1:{gw_port}/tg", secret=SECRET)
+    try:
+        async with aiohttp.ClientSession() as http:
+            for _ in range(3):
+                for user_id in (100, 101, 102, 103):
+                    assert await sender.send_text(http, user_id, "hi") == 200
+        for server in servers:
+            await server.shutdown(drain_timeout=5)
+    finally:
+        await gateway.shutdown()
+        await bot.session.close()
+    # Каждый пользователь обслуживается ровно одним воркером
+    assert set(seen["a"]).isdisjoint(seen["b"])
+    assert sorted(seen["a"] + seen["b"]) == sorted([100, 101, 102, 103] * 3)
+    assert partition_for(payload_user_id(sender.build_text_update(101, "x")), 2) == 1
+
+
+async def run_case_shared_fsm_storage():
+    LocalSharedStorage.reset("test")
+    key = StorageKey(bot_id=42, chat_id=7, user_id=7)
+    # Два воркера со своими экземплярами стора видят одно состояние
+    worker_a = FSMContext(storage=LocalSharedStorage("test"), key=key)
+    worker_b = FSMContext(storage=LocalSharedStorage("test"), key=key)
+    await worker_a.set_state("NewMode:entering_name")
+    await worker_a.update_data(name="coder")
+    assert await worker_b.get_state() == "NewMode:entering_name"
+    assert await worker_b.get_data() == {"name": "coder"}
+    await worker_b.clear()
+    assert await worker_a.get_state() is None
+    assert await worker_a.get_data() == {}
+    LocalSharedStorage.reset("test")
+
+
+def test_webhook_updates_are_processed():
+    asyncio.run(run_case_updates_are_processed())
+
+
+def test_webhook_full_queue_and_drain():
+    asyncio.run(run_case_full_queue_and_drain())
+
+
+def test_webhook_per_user_order():
+    asyncio.run(run_case_per_user_order())
+
+
+def test_webhook_slow_turn_does_not_block_other_users():
+    asyncio.run(run_case_slow_turn_does_not_block_other_users())
+
+
+def test_webhook_gateway_pins_user_to_worker():
+    asyncio.run(run_case_gateway_pins_user_to_worker())
+
+
+def test_webhook_shared_fsm_storage():
+    asyncio.run(run_case_shared_fsm_storage())